@@ -1,8 +1,13 @@
 from types import NoneType
 import base64
+import errno
+import httplib
 import locale
 import logging
 import os
+import socket
+import threading
+import time
 import urllib
 try:
     import oauth2 as oauth
@@ -19,6 +24,36 @@ from pulp.common.constants import DEFAULT_CA_PATH
 from pulp.common.util import ensure_utf_8, encode_unicode
 
 
+# number of idle keep-alive connections kept open to the server
+DEFAULT_POOL_SIZE = 4
+
+# seconds an idle connection is kept before it is considered stale; this is lower than the
+# KeepAliveTimeout of 5 seconds Apache uses by default, so connections are normally dropped
+# here before the server closes them
+KEEPALIVE_TIMEOUT = 4
+
+# methods whose requests can be sent again when an idle connection fails while they are read
+IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+# errno values of a write or read on a connection the server has already closed
+CONNECTION_CLOSED_ERRNOS = (errno.ECONNRESET, errno.EPIPE)
+
+
+def _connection_closed(err):
+    """
+    :param err: error raised while a request was sent or its status line was read
+    :type  err: Exception
+    :return: True if the error shows the server closed the connection without replying anything
+    :rtype:  bool
+    """
+    if isinstance(err, httplib.BadStatusLine):
+        # httplib reports an empty status line as '' or repr('') depending on the version
+        return err.line in ('', "''") or err.line.startswith('No status line received')
+    if isinstance(err, socket.error):
+        return err.errno in CONNECTION_CLOSED_ERRNOS
+    return False
+
+
 class PulpConnection(object):
     """
     Stub for invoking methods against the Pulp server. By default, the
@@ -44,7 +79,8 @@ class PulpConnection(object):
                  cert_filename=None,
                  server_wrapper=None,
                  verify_ssl=True,
-                 ca_path=DEFAULT_CA_PATH):
+                 ca_path=DEFAULT_CA_PATH,
+                 pool_size=DEFAULT_POOL_SIZE):
 
         self.host = host
         self.port = port
@@ -62,6 +98,9 @@ class PulpConnection(object):
         self.oauth_secret = oauth_secret
         self.oauth_user = oauth_user
 
+        # number of idle connections kept open between requests
+        self.pool_size = pool_size
+
         # Locale
         default_locale = locale.getdefaultlocale()[0]
         if default_locale:
@@ -78,7 +117,7 @@ class PulpConnection(object):
         if server_wrapper:
             self.server_wrapper = server_wrapper
         else:
-            self.server_wrapper = HTTPSServerWrapper(self)
+            self.server_wrapper = HTTPSServerWrapper(self, pool_size)
 
         # SSL validation settings
         self.verify_ssl = verify_ssl
@@ -248,26 +287,97 @@ class PulpConnection(object):
         return path
 
 
+class ConnectionPool(object):
+    """
+    Thread safe pool of idle connections. Connections that have been idle for longer than
+    KEEPALIVE_TIMEOUT are closed instead of being handed out, since the server has most likely
+    closed its end already.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE):
+        """
+        :param size: maximum number of idle connections kept open
+        :type  size: int
+        """
+        self.size = size
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def get(self):
+        """
+        :return: the most recently used idle connection or None if there is none
+        :rtype:  httplib.HTTPConnection
+        """
+        stale = []
+        connection = None
+        with self._lock:
+            now = time.time()
+            while self._idle:
+                _connection, released = self._idle.pop()
+                if now - released < KEEPALIVE_TIMEOUT:
+                    connection = _connection
+                    break
+                stale.append(_connection)
+        for _connection in stale:
+            _connection.close()
+        return connection
+
+    def put(self, connection):
+        """
+        Return a connection to the pool. The connection is closed when the pool is full.
+
+        :param connection: a connection whose last response has been read
+        :type  connection: httplib.HTTPConnection
+        """
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((connection, time.time()))
+                return
+        connection.close()
+
+    def clear(self):
+        """
+        Close all idle connections.
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for connection, released in idle:
+            connection.close()
+
+
 class HTTPSServerWrapper(object):
     """
     Used by the PulpConnection class to make an invocation against the server.
     This abstraction is used to simplify mocking. In this implementation, the
     intricacies (read: ugliness) of invoking and getting the response from
     the HTTPConnection class are hidden in favor of a simpler API to mock.
+
+    The SSL context is built once for the settings of the pulp connection and connections are
+    kept alive in a pool between requests, so a client making many calls does not pay for a TCP
+    and SSL handshake on each of them. The wrapper may be shared by threads.
     """
 
-    def __init__(self, pulp_connection):
+    def __init__(self, pulp_connection, pool_size=DEFAULT_POOL_SIZE):
         """
         :param pulp_connection: A pulp connection object.
         :type pulp_connection: PulpConnection
+        :param pool_size: maximum number of idle connections kept open
+        :type  pool_size: int
         """
         self.pulp_connection = pulp_connection
+        self.pool = ConnectionPool(pool_size)
+        self._lock = threading.Lock()
+        self._ssl_context = None
+        self._ssl_settings = None
 
     def request(self, method, url, body):
         """
         Make the request against the Pulp server, returning a tuple of (status_code, respose_body).
-        This method creates a new connection each time since HTTPSConnection has problems
-        reusing a connection for multiple calls (as claimed by a prior comment in this module).
+        An idle connection from the pool is used when there is one. If the server closed it in
+        the meantime, the request is sent again once on a new connection, but only when it is a
+        GET or HEAD or the connection was closed before the server replied anything to it; other
+        failures are raised so a POST or DELETE never runs twice.
 
         :param method: The HTTP method to be used for the request (GET, POST, etc.)
         :type  method: str
@@ -283,34 +393,12 @@ class HTTPSServerWrapper(object):
         """
         headers = dict(self.pulp_connection.headers)  # copy so we don't affect the calling method
 
-        # Despite the confusing name, 'sslv23' configures m2crypto to use any available protocol in
-        # the underlying openssl implementation.
-        ssl_context = SSL.Context('sslv23')
-        # This restricts the protocols we are willing to do by configuring m2 not to do SSLv2.0 or
-        # SSLv3.0. EL 5 does not have support for TLS > v1.0, so we have to leave support for
-        # TLSv1.0 enabled.
-        ssl_context.set_options(m2.SSL_OP_NO_SSLv2 | m2.SSL_OP_NO_SSLv3)
-
-        if self.pulp_connection.verify_ssl:
-            ssl_context.set_verify(SSL.verify_peer, depth=100)
-            # We need to stat the ca_path to see if it exists (error if it doesn't), and if so
-            # whether it is a file or a directory. m2crypto has different directives depending on
-            # which type it is.
-            if os.path.isfile(self.pulp_connection.ca_path):
-                ssl_context.load_verify_locations(cafile=self.pulp_connection.ca_path)
-            elif os.path.isdir(self.pulp_connection.ca_path):
-                ssl_context.load_verify_locations(capath=self.pulp_connection.ca_path)
-            else:
-                # If it's not a file and it's not a directory, it's not a valid setting
-                raise exceptions.MissingCAPathException(self.pulp_connection.ca_path)
-        ssl_context.set_session_timeout(self.pulp_connection.timeout)
+        ssl_context = self.ssl_context()
 
         if self.pulp_connection.username and self.pulp_connection.password:
             raw = ':'.join((self.pulp_connection.username, self.pulp_connection.password))
             encoded = base64.encodestring(raw)[:-1]
             headers['Authorization'] = 'Basic ' + encoded
-        elif self.pulp_connection.cert_filename:
-            ssl_context.load_cert(self.pulp_connection.cert_filename)
 
         # oauth configuration. This block is only True if oauth is not None, so it won't run on RHEL
         # 5.
@@ -331,13 +419,17 @@ class HTTPSServerWrapper(object):
             headers.update(oauth_header)
             headers['pulp-user'] = self.pulp_connection.oauth_user
 
-        connection = httpslib.HTTPSConnection(
-            self.pulp_connection.host, self.pulp_connection.port, ssl_context=ssl_context)
-
         try:
-            # Request against the server
-            connection.request(method, url, body=body, headers=headers)
-            response = connection.getresponse()
+            connection = self.pool.get()
+            if connection is not None:
+                result = self._send_idle(connection, method, url, body, headers)
+                if result is not None:
+                    return result
+
+            connection = httpslib.HTTPSConnection(
+                self.pulp_connection.host, self.pulp_connection.port, ssl_context=ssl_context)
+            response = self._send(connection, method, url, body, headers)
+            return self._receive(connection, response)
         except SSL.SSLError, err:
             # Translate stale login certificate to an auth exception
             if 'sslv3 alert certificate expired' == str(err):
@@ -348,11 +440,146 @@ class HTTPSServerWrapper(object):
             else:
                 raise exceptions.ConnectionException(None, str(err), None)
 
-        # Attempt to deserialize the body (should pass unless the server is busted)
-        response_body = response.read()
+    def _send_idle(self, connection, method, url, body, headers):
+        """
+        Send a request on an idle connection from the pool and read its response.
+
+        :param connection: idle connection to the server
+        :type  connection: M2Crypto.httpslib.HTTPSConnection
+        :return:           A 2-tuple of the status_code and response_body, or None if the server
+                           closed the connection and the request should be sent again on a new one
+        :rtype:            tuple or None
+        """
+        try:
+            response = self._send(connection, method, url, body, headers)
+        except (httplib.HTTPException, socket.error, SSL.SSLError), err:
+            if method.upper() not in IDEMPOTENT_METHODS and not _connection_closed(err):
+                raise
+        else:
+            try:
+                return self._receive(connection, response)
+            except (httplib.HTTPException, socket.error, SSL.SSLError), err:
+                # part of a response was read, so the server did handle the request
+                if method.upper() not in IDEMPOTENT_METHODS:
+                    raise
+        self.pulp_connection.log.debug('retrying on a new connection: %s' % err)
+        return None
+
+    def _send(self, connection, method, url, body, headers):
+        """
+        Send a request on a connection and read the status line and headers of its response.
+        The connection is closed if this fails.
+
+        :param connection: connection to the server
+        :type  connection: M2Crypto.httpslib.HTTPSConnection
+        :return:           the response, whose body has not been read
+        :rtype:            httplib.HTTPResponse
+        """
+        try:
+            # Request against the server
+            connection.request(method, url, body=body, headers=headers)
+            return connection.getresponse()
+        except Exception:
+            connection.close()
+            raise
+
+    def _receive(self, connection, response):
+        """
+        Read the body of a response. The connection is returned to the pool unless the server is
+        closing it or the read failed.
+
+        :param connection: connection the request was sent on
+        :type  connection: M2Crypto.httpslib.HTTPSConnection
+        :param response:   response returned by _send
+        :type  response:   httplib.HTTPResponse
+        :return:           A 2-tuple of the status_code and response_body.
+        :rtype:            tuple
+        """
+        try:
+            # Attempt to deserialize the body (should pass unless the server is busted)
+            response_body = response.read()
+        except Exception:
+            connection.close()
+            raise
+
+        if getattr(response, 'will_close', True):
+            connection.close()
+        else:
+            self.pool.put(connection)
 
         try:
             response_body = json.loads(response_body)
-        except:
+        except Exception:
             pass
         return response.status, response_body
+
+    def ssl_context(self):
+        """
+        Get the SSL context for the current settings of the pulp connection. The context is only
+        built again when the settings, or the client certificate file, change. Idle connections
+        made with a previous context are closed.
+
+        :return: SSL context
+        :rtype:  M2Crypto.SSL.Context
+
+        :raises exceptions.MissingCAPathException: if the CA path is neither a file nor a
+                                                   directory
+        """
+        settings = self._ssl_settings_key()
+        with self._lock:
+            if self._ssl_context is None or settings != self._ssl_settings:
+                self.pool.clear()
+                self._ssl_context = None
+                self._ssl_context = self._build_ssl_context()
+                self._ssl_settings = settings
+            return self._ssl_context
+
+    def _ssl_settings_key(self):
+        """
+        :return: the settings of the pulp connection an SSL context is built from
+        :rtype:  tuple
+        """
+        conn = self.pulp_connection
+        cert_filename = None
+        cert_mtime = None
+        if conn.cert_filename and not (conn.username and conn.password):
+            cert_filename = conn.cert_filename
+            try:
+                cert_mtime = os.path.getmtime(cert_filename)
+            except OSError:
+                pass
+        return (conn.host, conn.port, conn.verify_ssl, conn.ca_path, conn.timeout, cert_filename,
+                cert_mtime)
+
+    def _build_ssl_context(self):
+        """
+        :return: a new SSL context for the settings of the pulp connection
+        :rtype:  M2Crypto.SSL.Context
+        """
+        # Despite the confusing name, 'sslv23' configures m2crypto to use any available protocol in
+        # the underlying openssl implementation.
+        ssl_context = SSL.Context('sslv23')
+        # This restricts the protocols we are willing to do by configuring m2 not to do SSLv2.0 or
+        # SSLv3.0. EL 5 does not have support for TLS > v1.0, so we have to leave support for
+        # TLSv1.0 enabled.
+        ssl_context.set_options(m2.SSL_OP_NO_SSLv2 | m2.SSL_OP_NO_SSLv3)
+
+        if self.pulp_connection.verify_ssl:
+            ssl_context.set_verify(SSL.verify_peer, depth=100)
+            # We need to stat the ca_path to see if it exists (error if it doesn't), and if so
+            # whether it is a file or a directory. m2crypto has different directives depending on
+            # which type it is.
+            if os.path.isfile(self.pulp_connection.ca_path):
+                ssl_context.load_verify_locations(cafile=self.pulp_connection.ca_path)
+            elif os.path.isdir(self.pulp_connection.ca_path):
+                ssl_context.load_verify_locations(capath=self.pulp_connection.ca_path)
+            else:
+                # If it's not a file and it's not a directory, it's not a valid setting
+                raise exceptions.MissingCAPathException(self.pulp_connection.ca_path)
+        ssl_context.set_session_timeout(self.pulp_connection.timeout)
+
+        if not (self.pulp_connection.username and self.pulp_connection.password) and \
+                self.pulp_connection.cert_filename:
+            ssl_context.load_cert(self.pulp_connection.cert_filename)
+
+        return ssl_context
@@ -1,8 +1,11 @@
 """
 This module contains tests for the pulp.bindings.server module.
 """
+import errno
+import httplib
 import locale
 import logging
+import socket
 import unittest
 
 from M2Crypto import m2, SSL
@@ -171,6 +174,256 @@ class TestHTTPSServerWrapper(unittest.TestCase):
         set_verify.assert_called_once_with(SSL.verify_peer, depth=100)
         load_verify_locations.assert_called_once_with(cafile=ca_path)
 
+    @mock.patch('pulp.bindings.server.httpslib.HTTPSConnection')
+    def test_request_reuses_connection(self, HTTPSConnection):
+        """
+        Test that a kept alive connection is used for the next request.
+        """
+        conn = server.PulpConnection('host', verify_ssl=False)
+        wrapper = server.HTTPSServerWrapper(conn)
+        response = HTTPSConnection.return_value.getresponse.return_value
+        response.will_close = False
+        response.read.return_value = '{}'
+        response.status = 200
+
+        self.assertEqual(wrapper.request('GET', '/awesome/api/', ''), (200, {}))
+        self.assertEqual(wrapper.request('GET', '/awesome/api/', ''), (200, {}))
+
+        self.assertEqual(HTTPSConnection.call_count, 1)
+        self.assertEqual(HTTPSConnection.return_value.request.call_count, 2)
+        self.assertEqual(HTTPSConnection.return_value.close.call_count, 0)
+
+    @mock.patch('pulp.bindings.server.httpslib.HTTPSConnection')
+    def test_request_will_close(self, HTTPSConnection):
+        """
+        Test that a connection the server is closing is not kept.
+        """
+        conn = server.PulpConnection('host', verify_ssl=False)
+        wrapper = server.HTTPSServerWrapper(conn)
+        response = HTTPSConnection.return_value.getresponse.return_value
+        response.will_close = True
+        response.read.return_value = '{}'
+
+        wrapper.request('GET', '/awesome/api/', '')
+        wrapper.request('GET', '/awesome/api/', '')
+
+        self.assertEqual(HTTPSConnection.call_count, 2)
+        self.assertEqual(HTTPSConnection.return_value.close.call_count, 2)
+
+    @mock.patch('pulp.bindings.server.httpslib.HTTPSConnection')
+    def test_request_stale_connection(self, HTTPSConnection):
+        """
+        Test that the request is sent again on a new connection when the server closed the
+        connection from the pool.
+        """
+        conn = server.PulpConnection('host', verify_ssl=False)
+        wrapper = server.HTTPSServerWrapper(conn)
+        # build the SSL context first, so the pool is not cleared by the request
+        wrapper.ssl_context()
+        stale = mock.MagicMock()
+        stale.request.side_effect = httplib.BadStatusLine('')
+        wrapper.pool.put(stale)
+        response = HTTPSConnection.return_value.getresponse.return_value
+        response.will_close = False
+        response.read.return_value = '{}'
+        response.status = 200
+
+        status, body = wrapper.request('GET', '/awesome/api/', '')
+
+        self.assertEqual(status, 200)
+        stale.close.assert_called_once_with()
+        self.assertEqual(HTTPSConnection.call_count, 1)
+        self.assertEqual(wrapper.pool.get(), HTTPSConnection.return_value)
+
+    @mock.patch('pulp.bindings.server.httpslib.HTTPSConnection')
+    def test_request_stale_connection_post_unanswered(self, HTTPSConnection):
+        """
+        Test that a POST is sent again when the server closed the connection from the pool
+        without replying anything to it.
+        """
+        conn = server.PulpConnection('host', verify_ssl=False)
+        wrapper = server.HTTPSServerWrapper(conn)
+        # build the SSL context first, so the pool is not cleared by the request
+        wrapper.ssl_context()
+        stale = mock.MagicMock()
+        stale.getresponse.side_effect = socket.error(errno.ECONNRESET, 'reset')
+        wrapper.pool.put(stale)
+        response = HTTPSConnection.return_value.getresponse.return_value
+        response.read.return_value = '{}'
+        response.status = 201
+
+        self.assertEqual(wrapper.request('POST', '/awesome/api/', '{}'), (201, {}))
+
+        self.assertEqual(stale.request.call_count, 1)
+        self.assertEqual(HTTPSConnection.return_value.request.call_count, 1)
+
+    @mock.patch('pulp.bindings.server.httpslib.HTTPSConnection')
+    def test_request_stale_connection_post_not_replayed(self, HTTPSConnection):
+        """
+        Test that a POST is not sent again when the connection from the pool failed after the
+        server started to reply, since the server already handled it.
+        """
+        conn = server.PulpConnection('host', verify_ssl=False)
+        wrapper = server.HTTPSServerWrapper(conn)
+        # build the SSL context first, so the pool is not cleared by the request
+        wrapper.ssl_context()
+        stale = mock.MagicMock()
+        stale.getresponse.return_value.read.side_effect = httplib.IncompleteRead('')
+        wrapper.pool.put(stale)
+
+        self.assertRaises(httplib.IncompleteRead, wrapper.request, 'POST', '/awesome/api/', '{}')
+
+        self.assertEqual(stale.request.call_count, 1)
+        stale.close.assert_called_once_with()
+        self.assertEqual(HTTPSConnection.call_count, 0)
+
+    @mock.patch('pulp.bindings.server.httpslib.HTTPSConnection')
+    def test_request_stale_connection_post_bad_status(self, HTTPSConnection):
+        """
+        Test that a POST is not sent again when the server replied with an invalid status line.
+        """
+        conn = server.PulpConnection('host', verify_ssl=False)
+        wrapper = server.HTTPSServerWrapper(conn)
+        # build the SSL context first, so the pool is not cleared by the request
+        wrapper.ssl_context()
+        stale = mock.MagicMock()
+        stale.getresponse.side_effect = httplib.BadStatusLine('garbage')
+        wrapper.pool.put(stale)
+
+        self.assertRaises(httplib.BadStatusLine, wrapper.request, 'POST', '/awesome/api/', '{}')
+
+        self.assertEqual(stale.request.call_count, 1)
+        self.assertEqual(HTTPSConnection.call_count, 0)
+
+    @mock.patch('pulp.bindings.server.httpslib.HTTPSConnection')
+    def test_request_stale_connection_get_read_failed(self, HTTPSConnection):
+        """
+        Test that a GET is sent again when reading its response from a connection from the pool
+        failed.
+        """
+        conn = server.PulpConnection('host', verify_ssl=False)
+        wrapper = server.HTTPSServerWrapper(conn)
+        # build the SSL context first, so the pool is not cleared by the request
+        wrapper.ssl_context()
+        stale = mock.MagicMock()
+        stale.getresponse.return_value.read.side_effect = httplib.IncompleteRead('')
+        wrapper.pool.put(stale)
+        response = HTTPSConnection.return_value.getresponse.return_value
+        response.read.return_value = '{}'
+        response.status = 200
+
+        self.assertEqual(wrapper.request('GET', '/awesome/api/', ''), (200, {}))
+
+        stale.close.assert_called_once_with()
+        self.assertEqual(HTTPSConnection.call_count, 1)
+
+    @mock.patch('pulp.bindings.server.httpslib.HTTPSConnection')
+    def test_request_failed_connection(self, HTTPSConnection):
+        """
+        Test that a connection a request failed on is closed and not retried when it is new.
+        """
+        conn = server.PulpConnection('host', verify_ssl=False)
+        wrapper = server.HTTPSServerWrapper(conn)
+        HTTPSConnection.return_value.getresponse.side_effect = httplib.BadStatusLine('')
+
+        self.assertRaises(httplib.BadStatusLine, wrapper.request, 'GET', '/awesome/api/', '')
+
+        self.assertEqual(HTTPSConnection.call_count, 1)
+        HTTPSConnection.return_value.close.assert_called_once_with()
+        self.assertEqual(wrapper.pool.get(), None)
+
+    @mock.patch('pulp.bindings.server.SSL.Context')
+    def test_ssl_context_cached(self, Context):
+        """
+        Test that the SSL context is only built again when the settings change.
+        """
+        conn = server.PulpConnection('host', verify_ssl=False)
+        wrapper = server.HTTPSServerWrapper(conn)
+        idle = mock.MagicMock()
+
+        self.assertEqual(wrapper.ssl_context(), Context.return_value)
+        wrapper.pool.put(idle)
+        wrapper.ssl_context()
+        self.assertEqual(Context.call_count, 1)
+
+        conn.timeout = 10
+        wrapper.ssl_context()
+
+        self.assertEqual(Context.call_count, 2)
+        # connections made with the previous context are closed
+        idle.close.assert_called_once_with()
+        self.assertEqual(wrapper.pool.get(), None)
+
+    @mock.patch('pulp.bindings.server.SSL.Context')
+    def test_ssl_context_cert(self, Context):
+        """
+        Test that the client certificate is loaded into the SSL context.
+        """
+        conn = server.PulpConnection('host', verify_ssl=False, cert_filename='/no/cert.pem')
+        wrapper = server.HTTPSServerWrapper(conn)
+
+        wrapper.ssl_context()
+
+        Context.return_value.load_cert.assert_called_once_with('/no/cert.pem')
+
+
+class TestConnectionPool(unittest.TestCase):
+    """
+    This class contains tests for the ConnectionPool class.
+    """
+    def test_get(self):
+        """
+        Test that the most recently returned connection is handed out first.
+        """
+        pool = server.ConnectionPool(2)
+        connections = [mock.MagicMock(), mock.MagicMock()]
+        for connection in connections:
+            pool.put(connection)
+
+        self.assertEqual(pool.get(), connections[1])
+        self.assertEqual(pool.get(), connections[0])
+        self.assertEqual(pool.get(), None)
+
+    def test_put_full(self):
+        """
+        Test that connections beyond the size of the pool are closed.
+        """
+        pool = server.ConnectionPool(1)
+        connections = [mock.MagicMock(), mock.MagicMock()]
+        for connection in connections:
+            pool.put(connection)
+
+        self.assertEqual(connections[0].close.call_count, 0)
+        connections[1].close.assert_called_once_with()
+
+    @mock.patch('pulp.bindings.server.time.time')
+    def test_get_stale(self, time):
+        """
+        Test that connections idle for longer than the keep alive timeout are closed.
+        """
+        pool = server.ConnectionPool(2)
+        connection = mock.MagicMock()
+        time.return_value = 100
+        pool.put(connection)
+
+        time.return_value = 100 + server.KEEPALIVE_TIMEOUT
+
+        self.assertEqual(pool.get(), None)
+        connection.close.assert_called_once_with()
+
+    def test_clear(self):
+        """
+        Test that clearing the pool closes the idle connections.
+        """
+        pool = server.ConnectionPool(2)
+        connection = mock.MagicMock()
+        pool.put(connection)
+
+        pool.clear()
+
+        connection.close.assert_called_once_with()
+        self.assertEqual(pool.get(), None)
+
 
 class TestPulpConnection(unittest.TestCase):
     """
@@ -209,6 +462,8 @@ class TestPulpConnection(unittest.TestCase):
         self.assertEqual(connection.headers, expected_headers)
         self.assertTrue(isinstance(connection.server_wrapper, server.HTTPSServerWrapper))
         self.assertEqual(connection.server_wrapper.pulp_connection, connection)
+        self.assertEqual(connection.pool_size, server.DEFAULT_POOL_SIZE)
+        self.assertEqual(connection.server_wrapper.pool.size, server.DEFAULT_POOL_SIZE)
         self.assertEqual(connection.verify_ssl, True)
         self.assertEqual(connection.ca_path, server.DEFAULT_CA_PATH)
         # 1142376 - verify default path points to a known valid file
@@ -0,0 +1,85 @@
+"""
+In-memory caches shared by the server and the web server plugins.
+"""
+
+from collections import OrderedDict
+import os
+import threading
+import time
+
+
+def file_stamp(filename):
+    """
+    :param filename: path to a file
+    :type  filename: basestring
+    :return: a value that changes whenever the file is written, or None if the file does not
+             exist
+    :rtype:  tuple or None
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+class TTLCache(object):
+    """
+    A thread safe mapping that holds at most max_size entries. Once it is full, the least
+    recently used entries are dropped. If a ttl is given, entries also expire that many seconds
+    after they were set.
+    """
+
+    def __init__(self, max_size, ttl=None):
+        """
+        :param max_size: maximum number of entries
+        :type  max_size: int
+        :param ttl:      number of seconds an entry is kept, or None to keep it until it is dropped
+        :type  ttl:      int or None
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        :param key:     key of the entry
+        :param default: returned if there is no entry for the key
+        :return: the value of the entry, or default
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            expiration, value = entry
+            if expiration is not None and expiration < time.time():
+                return default
+            # reinsert the entry to mark it as the most recently used
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value):
+        """
+        :param key:   key of the entry
+        :param value: value of the entry
+        """
+        expiration = None
+        if self.ttl is not None:
+            expiration = time.time() + self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expiration, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove all of the entries.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
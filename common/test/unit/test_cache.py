@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from pulp.common import cache
+
+
+class TestFileStamp(unittest.TestCase):
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.working_dir)
+
+    def test_file_stamp(self):
+        filename = os.path.join(self.working_dir, 'file')
+        with open(filename, 'w') as f:
+            f.write('content')
+
+        stamp = cache.file_stamp(filename)
+
+        self.assertEqual(stamp, (os.stat(filename).st_mtime, 7))
+
+    def test_file_stamp_missing_file(self):
+        self.assertEqual(cache.file_stamp(os.path.join(self.working_dir, 'missing')), None)
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_get_default(self):
+        ttl_cache = cache.TTLCache(2)
+
+        self.assertEqual(ttl_cache.get('a'), None)
+        self.assertEqual(ttl_cache.get('a', False), False)
+
+    @mock.patch('time.time')
+    def test_expiration(self, mock_time):
+        ttl_cache = cache.TTLCache(2, ttl=10)
+        mock_time.return_value = 100
+        ttl_cache.set('a', False)
+        self.assertEqual(ttl_cache.get('a'), False)
+        mock_time.return_value = 111
+        self.assertEqual(ttl_cache.get('a'), None)
+        self.assertEqual(len(ttl_cache), 0)
+
+    def test_no_expiration(self):
+        ttl_cache = cache.TTLCache(2)
+        ttl_cache.set('a', 1)
+
+        with mock.patch('time.time', return_value=2 ** 40):
+            self.assertEqual(ttl_cache.get('a'), 1)
+
+    def test_max_size(self):
+        ttl_cache = cache.TTLCache(2, ttl=10)
+        for key in ['a', 'b', 'c']:
+            ttl_cache.set(key, True)
+
+        self.assertEqual([ttl_cache.get(key) for key in ['a', 'b', 'c']], [None, True, True])
+
+    def test_least_recently_used_dropped(self):
+        ttl_cache = cache.TTLCache(2)
+        ttl_cache.set('a', 1)
+        ttl_cache.set('b', 2)
+        ttl_cache.get('a')
+        ttl_cache.set('c', 3)
+
+        self.assertEqual([ttl_cache.get(key) for key in ['a', 'b', 'c']], [1, None, 3])
+
+    def test_clear(self):
+        ttl_cache = cache.TTLCache(2)
+        ttl_cache.set('a', 1)
+        ttl_cache.clear()
+
+        self.assertEqual(len(ttl_cache), 0)
+        self.assertEqual(ttl_cache.get('a'), None)
@@ -269,6 +269,21 @@ class Repository(Entity):
         """
         bindings = resources.pulp_bindings()
         poller = TaskPoller(bindings)
+        task = self.start_synchronization(options)
+        result = poller.join(task.task_id, progress, cancelled)
+        if cancelled():
+            self.cancel_synchronization(task)
+        return result
+
+    def start_synchronization(self, options):
+        """
+        Start a repo_sync() on this repository.
+        :param options: node synchronization options.
+        :type options: dict
+        :return: The running sync task.
+        :rtype: pulp.bindings.responses.Task
+        """
+        bindings = resources.pulp_bindings()
         max_download = options.get(
             constants.MAX_DOWNLOAD_CONCURRENCY_KEYWORD,
             constants.DEFAULT_DOWNLOAD_CONCURRENCY)
@@ -285,13 +300,9 @@ class Repository(Entity):
         if http.response_code != httplib.ACCEPTED:
             raise RepoSyncRestError(self.repo_id, http.response_code)
         # The repo sync is returned with a single sync task in the Call Report
-        task = http.response_body.spawned_tasks[0]
-        result = poller.join(task.task_id, progress, cancelled)
-        if cancelled():
-            self._cancel_synchronization(task)
-        return result
+        return http.response_body.spawned_tasks[0]
 
-    def _cancel_synchronization(self, task):
+    def cancel_synchronization(self, task):
         """
         Cancel a task associated with a repository synchronization.
         :param task: A running task.
@@ -1,3 +1,5 @@
+from threading import RLock
+
 from pulp_node.error import ErrorList
 from pulp_node.reports import RepositoryReport, RepositoryProgress
 
@@ -85,6 +87,7 @@ class HandlerProgress(object):
         self.conduit = conduit
         self.state = self.PENDING
         self.progress = []
+        self._lock = RLock()
 
     def started(self, bindings):
         """
@@ -137,9 +140,11 @@ class HandlerProgress(object):
     def _updated(self):
         """
         Notification that the report has been updated.
-        Reported using the conduit.
+        Reported using the conduit.  Repositories may be synchronized
+        concurrently so reports are serialized.
         """
-        self.conduit.update_progress(self.dict())
+        with self._lock:
+            self.conduit.update_progress(self.dict())
 
     def dict(self):
         return dict(
@@ -1,12 +1,16 @@
+from collections import deque
 from gettext import gettext as _
 from logging import getLogger
+from multiprocessing.pool import ThreadPool
 from operator import itemgetter
 
 from pulp_node import constants
+from pulp_node import resources
 from pulp_node.error import NodeError, CaughtException
 from pulp_node.handlers import model
 from pulp_node.handlers.validation import Validator
 from pulp_node.handlers.reports import RepositoryReport
+from pulp_node.poller import PolledTask, TaskPoller
 
 
 log = getLogger(__name__)
@@ -128,54 +132,141 @@ class HandlerStrategy(object):
         Add or update repositories based on bindings.
           - Merge repositories found in BOTH parent and child.
           - Add repositories found in the parent but NOT in the child.
+        Up to the max_concurrent_repositories option, repositories are merged
+        and their synchronization started on a pool of threads.  All of the
+        running synchronization tasks are polled in a single loop.
         :param request: A synchronization request.
         :type request: SyncRequest
         """
-        for bind in request.bindings:
-            try:
-                repo_id = bind['repo_id']
-                details = bind['details']
+        max_concurrent = request.options.get(constants.MAX_CONCURRENT_REPOSITORIES_KEYWORD)
+        max_concurrent = max(1, max_concurrent or constants.DEFAULT_CONCURRENT_REPOSITORIES)
+        pending = deque(request.bindings)
+        merging = []
+        syncing = {}
+        pool = ThreadPool(max_concurrent)
+        poller = None
+        try:
+            while pending or merging or syncing:
+                # merge repositories and start synchronization
+                while pending and len(merging) + len(syncing) < max_concurrent:
+                    bind = pending.popleft()
+                    repo_id = bind['repo_id']
+                    if request.cancelled():
+                        request.summary[repo_id].action = RepositoryReport.CANCELLED
+                        continue
+                    result = pool.apply_async(self._merge_repository, (request, bind))
+                    merging.append((repo_id, result))
+                if merging and not syncing:
+                    merging[0][1].wait(TaskPoller.DELAY)
+                for repo_id, result in [m for m in merging if m[1].ready()]:
+                    merging.remove((repo_id, result))
+                    try:
+                        started = result.get()
+                        if started:
+                            repository, task, polled = started
+                            syncing[polled] = (repository, task)
+                    except NodeError, ne:
+                        request.summary.errors.append(ne)
+                    except Exception, e:
+                        log.exception(repo_id)
+                        error = CaughtException(e, repo_id)
+                        request.summary.errors.append(error)
                 if request.cancelled():
-                    request.summary[repo_id].action = RepositoryReport.CANCELLED
+                    self._cancel_synchronization(request, syncing.values())
+                    syncing.clear()
                     continue
-                parent = model.Repository(repo_id, details)
-                child = model.Repository.fetch(repo_id)
-                progress = request.progress.find_report(repo_id)
-                progress.begin_merging()
-                if child:
-                    request.summary[repo_id].action = RepositoryReport.MERGED
-                    child.merge(parent)
-                else:
-                    child = model.Repository(repo_id, parent.details)
-                    request.summary[repo_id].action = RepositoryReport.ADDED
-                    child.add()
-                self._synchronize_repository(request, repo_id)
-            except NodeError, ne:
-                request.summary.errors.append(ne)
-            except Exception, e:
-                log.exception(repo_id)
-                error = CaughtException(e, repo_id)
-                request.summary.errors.append(error)
+                if not syncing:
+                    continue
+                # poll all of the running synchronization tasks
+                if poller is None:
+                    poller = TaskPoller(resources.pulp_bindings())
+                for polled in poller.poll(syncing.keys()):
+                    repository, task = syncing.pop(polled)
+                    self._synchronization_finished(request, repository.repo_id, polled)
+        finally:
+            pool.close()
+            pool.join()
 
-    def _synchronize_repository(self, request, repo_id):
+    def _merge_repository(self, request, bind):
+        """
+        Add or merge a repository based on its binding and start
+        synchronization of the repository.
+        :param request: A synchronization request.
+        :type request: SyncRequest
+        :param bind: A consumer binding payload.
+        :type bind: dict
+        :return: The synchronization as: (repository, task, polled_task)
+            or None when not synchronized.
+        :rtype: tuple
+        """
+        repo_id = bind['repo_id']
+        details = bind['details']
+        parent = model.Repository(repo_id, details)
+        child = model.Repository.fetch(repo_id)
+        progress = request.progress.find_report(repo_id)
+        progress.begin_merging()
+        if child:
+            request.summary[repo_id].action = RepositoryReport.MERGED
+            child.merge(parent)
+        else:
+            child = model.Repository(repo_id, parent.details)
+            request.summary[repo_id].action = RepositoryReport.ADDED
+            child.add()
+        return self._start_synchronization(request, repo_id)
+
+    def _start_synchronization(self, request, repo_id):
         """
-        Run synchronization on a repository by ID.
+        Start synchronization of a repository by ID.
         :param request: A synchronization request.
         :type request: SyncRequest
         :param repo_id: A repository ID.
         :type repo_id: str
+        :return: The synchronization as: (repository, task, polled_task)
+            or None when not synchronized.
+        :rtype: tuple
         """
         progress = request.progress.find_report(repo_id)
         skip = request.options.get(constants.SKIP_CONTENT_UPDATE_KEYWORD, False)
         if skip:
             progress.finished()
-            return
+            return None
         repo = model.Repository(repo_id)
-        importer_report = repo.run_synchronization(progress, request.cancelled, request.options)
-        if request.cancelled():
-            request.summary[repo_id].action = RepositoryReport.CANCELLED
+        task = repo.start_synchronization(request.options)
+        return repo, task, PolledTask(task.task_id, progress)
+
+    def _cancel_synchronization(self, request, syncing):
+        """
+        Cancel the running synchronization of repositories.
+        :param request: A synchronization request.
+        :type request: SyncRequest
+        :param syncing: The running synchronization as: (repository, task).
+        :type syncing: list
+        """
+        for repository, task in syncing:
+            request.summary[repository.repo_id].action = RepositoryReport.CANCELLED
+            try:
+                repository.cancel_synchronization(task)
+            except Exception:
+                log.exception(repository.repo_id)
+
+    def _synchronization_finished(self, request, repo_id, polled):
+        """
+        Update the summary using the result of a completed repository
+        synchronization task.
+        :param request: A synchronization request.
+        :type request: SyncRequest
+        :param repo_id: A repository ID.
+        :type repo_id: str
+        :param polled: The completed synchronization task.
+        :type polled: PolledTask
+        """
+        if polled.error:
+            log.error('%s: %s', repo_id, polled.error)
+            error = CaughtException(polled.error, repo_id)
+            request.summary.errors.append(error)
             return
-        progress.finished()
+        polled.progress.finished()
+        importer_report = polled.result
         details = importer_report['details']
         for _dict in details['errors']:
             ne = NodeError(None)
@@ -1,4 +1,26 @@
+import cPickle as pickle
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import tempfile
+
+from operator import itemgetter
+
+from pulp.plugins.util.misc import paginate
+
 from pulp_node import constants
+from pulp_node.manifest import (UnitsFile, DELTA, DELTA_ADDED, DELTA_UPDATED,
+                                DELTA_REMOVED)
+
+
+# The number of units held in memory by each sort run and inventory result
+# before they are spilled to a temporary file.
+SPILL_THRESHOLD = 10000
+
+# The number of units written to (and read back from) a temporary file at a time.
+SPILL_PAGE_SIZE = 100
 
 
 class UniqueKey(object):
@@ -27,61 +49,304 @@ class UniqueKey(object):
     def __ne__(self, other):
         return self.uid != other.uid
 
+    def digest(self):
+        """
+        Get a digest of the unit key used to sort units.
+        :return: The hex digest.
+        :rtype: str
+        """
+        return hashlib.sha1(json.dumps(self.uid)).hexdigest()
+
+
+class Spool(object):
+    """
+    A sequence of records that is appended and then iterated in order.
+    Records are held in memory until the threshold is reached and are then
+    spilled to a temporary file, a page at a time, so that the memory used
+    stays bounded no matter how many records are appended.  Units files
+    referenced by the records are not written but shared with the records
+    read back.
+    :ivar tmp_dir: The directory in which the temporary file is created.
+    :type tmp_dir: str
+    :ivar threshold: The number of records held in memory.
+    :type threshold: int
+    """
+
+    def __init__(self, tmp_dir=None, threshold=SPILL_THRESHOLD):
+        """
+        :param tmp_dir: The directory in which the temporary file is created.
+        :type tmp_dir: str
+        :param threshold: The number of records held in memory.
+        :type threshold: int
+        """
+        self.tmp_dir = tmp_dir
+        self.threshold = threshold
+        self.records = []
+        self.length = 0
+        self.fp = None
+        self.shared = {}
+
+    def append(self, record):
+        """
+        Append a record.
+        :param record: A picklable record.
+        :raise IOError: on I/O errors.
+        """
+        self.records.append(record)
+        self.length += 1
+        if len(self.records) >= self.threshold:
+            self._spill()
+
+    def _persistent_id(self, thing):
+        if isinstance(thing, UnitsFile):
+            self.shared[id(thing)] = thing
+            return id(thing)
+        return None
+
+    def _spill(self):
+        if self.fp is None:
+            self.fp = tempfile.TemporaryFile(dir=self.tmp_dir)
+        self.fp.seek(0, os.SEEK_END)
+        pickler = pickle.Pickler(self.fp, pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = self._persistent_id
+        for page in paginate(self.records, SPILL_PAGE_SIZE):
+            pickler.dump(page)
+            pickler.clear_memo()
+        self.records = []
+
+    def _spilled(self):
+        if self.fp is None:
+            return
+        offset = 0
+        while True:
+            self.fp.seek(offset)
+            unpickler = pickle.Unpickler(self.fp)
+            unpickler.persistent_load = self.shared.__getitem__
+            try:
+                page = unpickler.load()
+            except EOFError:
+                break
+            offset = self.fp.tell()
+            for record in page:
+                yield record
+
+    def __iter__(self):
+        return itertools.chain(self._spilled(), iter(self.records))
+
+    def __len__(self):
+        return self.length
+
+    def close(self):
+        """
+        Close the temporary file.  This method is idempotent.
+        """
+        if self.fp is not None:
+            self.fp.close()
+
+
+def sort_units(units, key, tmp_dir=None, threshold=SPILL_THRESHOLD):
+    """
+    Sort units by the digest of their unit key using an external merge sort.
+    Runs of units no longer than the threshold are sorted in memory and
+    spooled, and the runs are merged as they are read.  When more than one
+    unit has the same key, only the last is kept.
+    :param units: The units to sort.
+    :type units: iterable
+    :param key: Called with each item to get its unit.
+    :type key: callable
+    :param tmp_dir: The directory in which temporary files are created.
+    :type tmp_dir: str
+    :param threshold: The number of units sorted in memory.
+    :type threshold: int
+    :return: A generator of (digest, item) sorted by digest.
+    :rtype: generator
+    """
+    runs = []
+    records = []
+    for n, item in enumerate(units):
+        unit = key(item)
+        unit.pop('metadata', None)
+        records.append((UniqueKey(unit).digest(), n, item))
+        if len(records) >= threshold:
+            runs.append(_spooled_run(records, tmp_dir, threshold))
+            records = []
+    runs.append(_spooled_run(records, tmp_dir, threshold))
+    merged = heapq.merge(*runs)
+    for digest, records in itertools.groupby(merged, itemgetter(0)):
+        for record in records:
+            item = record[2]
+        yield digest, item
+
+
+def _spooled_run(records, tmp_dir, threshold):
+    records.sort()
+    run = Spool(tmp_dir, threshold)
+    for record in records:
+        run.append(record)
+    return run
+
 
 class UnitInventory(object):
     """
     The unit inventory contains both the parent and child inventory
-    of content units associated with a specific repository.  Each is contained
-    within a dictionary keyed by {UnitKey} to ensure uniqueness.
+    of content units associated with a specific repository.  Both are
+    sorted by the digest of the unit key and compared in a single merge
+    pass that spools the units on the parent only, the units on the
+    child only and the updated units.  Units are spilled to temporary
+    files past a threshold so memory used stays bounded.
     """
 
-    @staticmethod
-    def _import_parent_units(units):
-        _units = {}
-        for unit, ref in units:
-            unit.pop('metadata', None)
-            key = UniqueKey(unit)
-            _units[key] = (unit, ref)
-        return _units
+    def __init__(self, base_URL, parent_units, child_units, tmp_dir=None,
+                 threshold=SPILL_THRESHOLD):
+        """
+        :param base_URL: The base URL for downloading parent units.
+        :param parent_units: The content units in the parent node.
+            They are closed when the inventory is closed.
+        :type parent_units: pulp_node.manifest.UnitIterator
+        :param child_units: The content units in the child node.
+        :type child_units: iterable
+        :param tmp_dir: The directory in which temporary files are created.
+        :type tmp_dir: str
+        :param threshold: The number of units held in memory by each
+            sort run and result.
+        :type threshold: int
+        """
+        self.base_URL = base_URL
+        self.parent_units = parent_units
+        self.parent_only = Spool(tmp_dir, threshold)
+        self.child_only = Spool(tmp_dir, threshold)
+        self.updated = Spool(tmp_dir, threshold)
+        parent_units = sort_units(parent_units, itemgetter(0), tmp_dir, threshold)
+        child_units = sort_units(child_units, lambda unit: unit, tmp_dir, threshold)
+        self._merge(parent_units, child_units)
+
+    def _merge(self, parent_units, child_units):
+        parent = next(parent_units, None)
+        child = next(child_units, None)
+        while parent or child:
+            if child is None or (parent and parent[0] < child[0]):
+                self.parent_only.append(parent[1])
+                parent = next(parent_units, None)
+                continue
+            if parent is None or child[0] < parent[0]:
+                self.child_only.append(child[1])
+                child = next(child_units, None)
+                continue
+            unit, ref = parent[1]
+            child_unit = child[1]
+            parent_last_updated = unit.get(constants.LAST_UPDATED, 0)
+            child_last_updated = child_unit.get(constants.LAST_UPDATED, 0)
+            if parent_last_updated > child_last_updated:
+                self.updated.append((unit, ref))
+            parent = next(parent_units, None)
+            child = next(child_units, None)
+
+    def units_on_parent_only(self):
+        """
+        Units contained in the parent inventory
+        but not contained in the child inventory.
+        :return: Spool of (unit, ref).
+        :rtype: Spool
+        """
+        return self.parent_only
+
+    def units_on_child_only(self):
+        """
+        Units contained in the child inventory
+        but not contained in the parent inventory.
+        :return: Spool of units that need to be purged.
+        :rtype: Spool
+        """
+        return self.child_only
+
+    def updated_units(self):
+        """
+        Units updated on the parent.
+        :return: Spool of (unit, ref).
+        :rtype: Spool
+        """
+        return self.updated
+
+    def close(self):
+        """
+        Close the parent units, whose references can no longer be fetched,
+        and the temporary files.  This method is idempotent.
+        """
+        self.parent_units.close()
+        self.parent_only.close()
+        self.child_only.close()
+        self.updated.close()
+
+
+class DeltaInventory(object):
+    """
+    The delta inventory contains the changes made to the parent inventory
+    of content units associated with a specific repository since a manifest
+    processed by the child.  It is used in place of the full inventory so
+    that only the units that changed are considered.
+    """
 
     @staticmethod
-    def _import_child_units(units):
-        _units = {}
-        for unit in units:
+    def _import_changes(deltas):
+        _changes = {}
+        for unit, ref in deltas:
+            change = unit.pop(DELTA)
             unit.pop('metadata', None)
             key = UniqueKey(unit)
-            _units[key] = unit
-        return _units
+            previous = _changes.get(key)
+            if previous and previous[0] == DELTA_ADDED:
+                if change == DELTA_REMOVED:
+                    # never known to the child
+                    del _changes[key]
+                    continue
+                if change == DELTA_UPDATED:
+                    # still new to the child
+                    change = DELTA_ADDED
+            if previous and previous[0] == DELTA_REMOVED and change == DELTA_ADDED:
+                # still known to the child
+                change = DELTA_UPDATED
+            _changes[key] = (change, unit, ref)
+        return _changes
 
-    def __init__(self, base_URL, parent_units, child_units):
+    def __init__(self, base_URL, deltas, find_child_unit):
         """
         :param base_URL: The base URL for downloading parent units.
-        :param parent_units: The content units in the parent node.
-        :type parent_units: iterable
-        :param child_units: The content units in the child node.
-        :type child_units: iterable
+        :param deltas: The units in the deltas to be applied, in order.
+            They are closed when the inventory is closed.
+        :type deltas: pulp_node.manifest.IndexedUnitIterator
+        :param find_child_unit: Called with the type_id and unit_key of a unit
+            removed from the parent to find the unit in the child inventory.
+        :type find_child_unit: callable
         """
         self.base_URL = base_URL
-        self.parent_units = self._import_parent_units(parent_units)
-        self.child_units = self._import_child_units(child_units)
+        self.deltas = deltas
+        self.changes = self._import_changes(deltas)
+        self.find_child_unit = find_child_unit
+
+    def _changed(self, change):
+        return [(unit, ref) for _change, unit, ref in self.changes.values() if _change == change]
 
     def units_on_parent_only(self):
         """
-        Listing of units contained in the parent inventory
-        but not contained in the child inventory.
+        Listing of units added to the parent inventory.
         :return: List of (unit, ref).
         :rtype: list
         """
-        return [r for k, r in self.parent_units.items() if k not in self.child_units]
+        return self._changed(DELTA_ADDED)
 
     def units_on_child_only(self):
         """
-        Listing of units contained in the child inventory
-        but not contained in the parent inventory.
+        Listing of units removed from the parent inventory that are
+        contained in the child inventory.
         :return: List of units that need to be purged.
         :rtype: list
         """
-        return [u for k, u in self.child_units.items() if k not in self.parent_units]
+        units = []
+        for unit, ref in self._changed(DELTA_REMOVED):
+            child_unit = self.find_child_unit(unit['type_id'], unit['unit_key'])
+            if child_unit is not None:
+                units.append(child_unit)
+        return units
 
     def updated_units(self):
         """
@@ -89,13 +354,11 @@ class UnitInventory(object):
         :return: List of (unit, ref).
         :rtype: list
         """
-        updated = []
-        for key, (unit, ref) in self.parent_units.items():
-            child_unit = self.child_units.get(key)
-            if child_unit is None:
-                continue
-            parent_last_updated = unit.get(constants.LAST_UPDATED, 0)
-            child_last_updated = child_unit.get(constants.LAST_UPDATED, 0)
-            if parent_last_updated > child_last_updated:
-                updated.append((unit, ref))
-        return updated
+        return self._changed(DELTA_UPDATED)
+
+    def close(self):
+        """
+        Close the units in the deltas, whose references can no longer be
+        fetched.  This method is idempotent.
+        """
+        self.deltas.close()
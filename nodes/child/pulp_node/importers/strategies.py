@@ -7,18 +7,20 @@ the strategies provided here.
 import os
 import errno
 
+from functools import partial
 from gettext import gettext as _
 from logging import getLogger
 
 from pulp.plugins.model import Unit, AssociatedUnit
+from pulp.plugins.util.misc import paginate
 from pulp.server.config import config as pulp_conf
 from pulp.server.content.sources.container import ContentContainer
 
 from pulp_node import constants
 from pulp_node import pathlib
 from pulp_node.conduit import NodesConduit
-from pulp_node.manifest import Manifest, RemoteManifest
-from pulp_node.importers.inventory import UnitInventory
+from pulp_node.manifest import Manifest, RemoteManifest, fetch_units
+from pulp_node.importers.inventory import UnitInventory, DeltaInventory
 from pulp_node.importers.download import ContentDownloadListener
 from pulp_node.error import (NodeError, GetChildUnitsError, GetParentUnitsError, AddUnitError,
                              DeleteUnitError, InvalidManifestError, CaughtException)
@@ -28,6 +30,17 @@ _log = getLogger(__name__)
 
 
 STRATEGY_UNSUPPORTED = _('Importer strategy "%(s)s" not supported')
+CHILD_UNITS_CHANGED = _('Units were added to or removed from repository [%(r)s] since it was '
+                        'last synchronized, synchronizing the full inventory')
+
+# The number of published units fetched from the units file at a time.
+FETCH_PAGE_SIZE = 1000
+
+# Scratchpad keys used to record the last parent manifest processed, and when
+# units were last added to and removed from the child repository after it was.
+PROCESSED_MANIFEST_ID = 'processed_manifest_id'
+PROCESSED_STRATEGY = 'processed_strategy'
+PROCESSED_UNITS_CHANGED = 'processed_units_changed'
 
 
 class Request(object):
@@ -49,6 +62,8 @@ class Request(object):
     :type repo_id: str
     :ivar working_dir: The absolute path to a directory to be used as temporary storage.
     :type working_dir: str
+    :ivar manifest_id: The ID of the parent manifest being processed.
+    :type manifest_id: str
     """
 
     def __init__(self, cancel_event, conduit, config, downloader, progress, summary, repo):
@@ -77,6 +92,7 @@ class Request(object):
         self.summary = summary
         self.repo_id = repo.id
         self.working_dir = repo.working_dir
+        self.manifest_id = None
 
     def started(self):
         """
@@ -112,6 +128,7 @@ class ImporterStrategy(object):
 
         try:
             self._synchronize(request)
+            self._manifest_processed(request)
         except NodeError, ne:
             request.summary.errors.append(ne)
         except Exception, e:
@@ -150,14 +167,111 @@ class ImporterStrategy(object):
 
     # --- protected ---------------------------------------------------------------------
 
+    def _processed_manifest_id(self, request):
+        """
+        Get the ID of the last parent manifest completely processed by this strategy.
+        :param request: A synchronization request.
+        :type request: SyncRequest
+        :return: The manifest ID or None.
+        :rtype: str
+        """
+        scratchpad = request.conduit.get_scratchpad() or {}
+        if scratchpad.get(PROCESSED_STRATEGY) != self.__class__.__name__:
+            return None
+        return scratchpad.get(PROCESSED_MANIFEST_ID)
+
+    def _manifest_processed(self, request):
+        """
+        Record that the parent manifest has been completely processed so that
+        the next synchronization only needs to apply the changes made since.
+        When units were last added to and removed from the child repository is
+        recorded along with it, so that later changes made to the child can be
+        detected.  Nothing is recorded when the synchronization failed or was
+        cancelled.
+        :param request: A synchronization request.
+        :type request: SyncRequest
+        """
+        if not request.manifest_id or request.summary.errors or request.cancelled():
+            return
+        scratchpad = request.conduit.get_scratchpad() or {}
+        scratchpad[PROCESSED_MANIFEST_ID] = request.manifest_id
+        scratchpad[PROCESSED_STRATEGY] = self.__class__.__name__
+        scratchpad[PROCESSED_UNITS_CHANGED] = NodesConduit().units_changed(request.repo_id)
+        request.conduit.set_scratchpad(scratchpad)
+
+    def _deltas_applicable(self, request, manifest, inventory):
+        """
+        Get whether applying the deltas brings the child inventory in line
+        with the parent manifest as required by the strategy.
+        :param request: A synchronization request.
+        :type request: SyncRequest
+        :param manifest: The parent manifest.
+        :type manifest: Manifest
+        :param inventory: The changes listed in the deltas.
+        :type inventory: DeltaInventory
+        :return: True if the deltas can be used in place of the full inventory.
+        :rtype: bool
+        """
+        return True
+
+    def _find_child_unit(self, request, type_id, unit_key):
+        """
+        Find a unit in the child inventory.
+        :param request: A synchronization request.
+        :type request: SyncRequest
+        :param type_id: The unit type ID.
+        :type type_id: str
+        :param unit_key: The unit key.
+        :type unit_key: dict
+        :return: The unit or None when not found.
+        :rtype: dict
+        """
+        unit = request.conduit.find_unit_by_unit_key(type_id, unit_key)
+        if unit is None:
+            return None
+        return dict(unit_id=unit.id, type_id=type_id, unit_key=unit_key)
+
     def _unit_inventory(self, request):
         """
         Build the unit inventory.
+        When the parent manifest lists the deltas made since the last manifest
+        processed by the child and the strategy can apply them, only the deltas
+        are fetched and the inventory contains the changes.  Otherwise, all of
+        the parent and child units are fetched to build the complete inventory.
+        The inventory must be closed once it is no longer used.
         :param request: A synchronization request.
         :type request: SyncRequest
         :return: The built inventory.
-        :rtype: UnitInventory
+        :rtype: UnitInventory or DeltaInventory
         """
+        # fetch the parent manifest
+        try:
+            request.progress.begin_manifest_download()
+            url = request.config.get(constants.MANIFEST_URL_KEYWORD)
+            fetched_manifest = RemoteManifest(url, request.downloader, request.working_dir)
+            fetched_manifest.fetch()
+            deltas = fetched_manifest.deltas_since(self._processed_manifest_id(request))
+            if deltas is not None:
+                delta_units = fetched_manifest.fetch_deltas(deltas)
+                try:
+                    base_URL = fetched_manifest.publishing_details[constants.BASE_URL]
+                    find_child_unit = partial(self._find_child_unit, request)
+                    inventory = DeltaInventory(base_URL, delta_units, find_child_unit)
+                    applicable = self._deltas_applicable(
+                        request, fetched_manifest, inventory)
+                except Exception:
+                    delta_units.close()
+                    raise
+                if applicable:
+                    request.manifest_id = fetched_manifest.id
+                    return inventory
+                inventory.close()
+        except NodeError:
+            raise
+        except Exception:
+            _log.exception(request.repo_id)
+            raise GetParentUnitsError(request.repo_id)
+
         # fetch child units
         try:
             conduit = NodesConduit()
@@ -170,8 +284,6 @@ class ImporterStrategy(object):
 
         # fetch parent units
         try:
-            request.progress.begin_manifest_download()
-            url = request.config.get(constants.MANIFEST_URL_KEYWORD)
             manifest = Manifest(request.working_dir)
             try:
                 manifest.read()
@@ -181,8 +293,6 @@ class ImporterStrategy(object):
             except ValueError:
                 # json decoding failed
                 pass
-            fetched_manifest = RemoteManifest(url, request.downloader, request.working_dir)
-            fetched_manifest.fetch()
             if manifest != fetched_manifest or \
                     not manifest.is_valid() or not manifest.has_valid_units():
                 fetched_manifest.write()
@@ -198,8 +308,13 @@ class ImporterStrategy(object):
 
         # build the inventory
         parent_units = manifest.get_units()
-        base_URL = manifest.publishing_details[constants.BASE_URL]
-        inventory = UnitInventory(base_URL, parent_units, child_units)
+        try:
+            base_URL = manifest.publishing_details[constants.BASE_URL]
+            inventory = UnitInventory(base_URL, parent_units, child_units, request.working_dir)
+        except Exception:
+            parent_units.close()
+            raise
+        request.manifest_id = manifest.id
         return inventory
 
     def _reset_storage_path(self, unit):
@@ -237,29 +352,66 @@ class ImporterStrategy(object):
         :param unit_inventory: The inventory of both parent and child content units.
         :type unit_inventory: UnitInventory
         """
-        download_list = []
         units = unit_inventory.units_on_parent_only()
         request.progress.begin_adding_units(len(units))
-        listener = ContentDownloadListener(self, request)
+        fetch_list = []
         for unit, unit_ref in units:
             if request.cancelled():
                 return
             self._reset_storage_path(unit)
-            if not self._needs_download(unit):
-                # unit has no file associated
-                self.add_unit(request, unit_ref.fetch())
+            if self._needs_download(unit):
                 continue
-            unit_path, destination = self._path_and_destination(unit)
-            unit_URL = pathlib.url_join(unit_inventory.base_URL, unit_path)
-            _request = listener.create_request(unit_URL, destination, unit, unit_ref)
-            download_list.append(_request)
+            # unit has no file associated
+            fetch_list.append(unit_ref)
+            if len(fetch_list) >= FETCH_PAGE_SIZE:
+                self._fetch_and_add(request, fetch_list)
+                fetch_list = []
+        self._fetch_and_add(request, fetch_list)
         if request.cancelled():
             return
+        listener = ContentDownloadListener(self, request)
+        download_list = self._download_requests(request, unit_inventory, units, listener)
         container = ContentContainer()
         request.summary.sources = \
             container.download(request.cancel_event, request.downloader, download_list, listener)
         request.summary.errors.extend(listener.error_list)
 
+    def _download_requests(self, request, unit_inventory, units, listener):
+        """
+        Create download requests for the units with files that need to be downloaded.
+        The units are read as the requests are consumed.
+        :param request: A synchronization request.
+        :type request: SyncRequest
+        :param unit_inventory: The inventory of both parent and child content units.
+        :type unit_inventory: UnitInventory
+        :param units: The units being added as: (unit, ref).
+        :type units: iterable
+        :param listener: The download listener.
+        :type listener: ContentDownloadListener
+        :return: A generator of download requests.
+        :rtype: generator
+        """
+        for unit, unit_ref in units:
+            if request.cancelled():
+                return
+            self._reset_storage_path(unit)
+            if not self._needs_download(unit):
+                continue
+            unit_path, destination = self._path_and_destination(unit)
+            unit_URL = pathlib.url_join(unit_inventory.base_URL, unit_path)
+            yield listener.create_request(unit_URL, destination, unit, unit_ref)
+
+    def _fetch_and_add(self, request, refs):
+        """
+        Fetch referenced units from the units file and add them.
+        :param request: A synchronization request.
+        :type request: SyncRequest
+        :param refs: A page of unit references.
+        :type refs: list
+        """
+        for unit in fetch_units(refs):
+            self.add_unit(request, unit)
+
     def _update_units(self, request, unit_inventory):
         """
         Update units that have been updated on the parent since
@@ -269,9 +421,9 @@ class ImporterStrategy(object):
         :param unit_inventory: The inventory of both parent and child content units.
         :type unit_inventory: UnitInventory
         """
-        for unit, ref in unit_inventory.updated_units():
-            unit = ref.fetch()
-            self.add_unit(request, unit)
+        refs = (ref for unit, ref in unit_inventory.updated_units())
+        for page in paginate(refs, FETCH_PAGE_SIZE):
+            self._fetch_and_add(request, page)
 
     def _path_and_destination(self, unit):
         """
@@ -351,9 +503,35 @@ class Mirror(ImporterStrategy):
         :type request: SyncRequest
         """
         unit_inventory = self._unit_inventory(request)
-        self._add_units(request, unit_inventory)
-        self._update_units(request, unit_inventory)
-        self._delete_units(request, unit_inventory)
+        try:
+            self._add_units(request, unit_inventory)
+            self._update_units(request, unit_inventory)
+            self._delete_units(request, unit_inventory)
+        finally:
+            unit_inventory.close()
+
+    def _deltas_applicable(self, request, manifest, inventory):
+        """
+        Units added to or removed from the child repository since the last
+        manifest was processed are not listed in the deltas, so the deltas
+        are only applied when no units were added to or removed from the
+        child since.  Otherwise, the full inventory is used to restore the
+        mirror.
+        :param request: A synchronization request.
+        :type request: SyncRequest
+        :param manifest: The parent manifest.
+        :type manifest: Manifest
+        :param inventory: The changes listed in the deltas.
+        :type inventory: DeltaInventory
+        :return: True if the deltas can be used in place of the full inventory.
+        :rtype: bool
+        """
+        scratchpad = request.conduit.get_scratchpad() or {}
+        units_changed = NodesConduit().units_changed(request.repo_id)
+        if scratchpad.get(PROCESSED_UNITS_CHANGED) != units_changed:
+            _log.info(CHILD_UNITS_CHANGED % {'r': request.repo_id})
+            return False
+        return True
 
 
 class Additive(ImporterStrategy):
@@ -362,6 +540,9 @@ class Additive(ImporterStrategy):
     with a child repository contains all of the units associated with the same
     repository in the parent.  However, any units contained in the child inventory
     that are not contained in the parent inventory are permitted to remain.
+    When the deltas since the last synchronization are applied, only the units
+    that changed on the parent are added, so units removed from the child are
+    not restored until the full inventory is used again.
     """
 
     def _synchronize(self, request):
@@ -374,8 +555,11 @@ class Additive(ImporterStrategy):
         :type request: SyncRequest
         """
         unit_inventory = self._unit_inventory(request)
-        self._add_units(request, unit_inventory)
-        self._update_units(request, unit_inventory)
+        try:
+            self._add_units(request, unit_inventory)
+            self._update_units(request, unit_inventory)
+        finally:
+            unit_inventory.close()
 
 
 STRATEGIES = {
@@ -1,8 +1,15 @@
+from pulp.common import dateutils
 from pulp.plugins.types import database as types_db
+from pulp.plugins.util.misc import paginate
+from pulp.server.db import model
 from pulp.server.db.model.repository import RepoContentUnit
 from pulp.server.config import config as pulp_conf
 
 
+# The number of unit associations for which units are queried at a time.
+QUERY_PAGE_SIZE = 1000
+
+
 class NodesConduit(object):
 
     def get_units(self, repo_id):
@@ -10,19 +17,28 @@ class NodesConduit(object):
         Get all units associated with a repository.
         :param repo_id: The repository ID used to query the units.
         :type repo_id: str
+        The associations are read a page at a time so that memory used is
+        bounded by the page size rather than the number of units.
         :return: unit iterator
         :rtype: UnitsIterator
         """
-        units = {}
-        types = {}
         collection = RepoContentUnit.get_collection()
-        for unit in collection.find({'repo_id': repo_id}):
-            unit_id = unit['unit_id']
-            type_id = unit['unit_type_id']
-            units[unit_id] = unit
-            unit_list = types.setdefault(type_id, [])
-            unit_list.append(unit['unit_id'])
-        return UnitsIterator(units, types)
+        fields = ['unit_id', 'unit_type_id']
+        associations = collection.find({'repo_id': repo_id}, fields=fields)
+        return UnitsIterator(associations.count(), associations)
+
+    def units_changed(self, repo_id):
+        """
+        Get when units were last added to and removed from a repository.
+        :param repo_id: The repository ID.
+        :type repo_id: str
+        :return: [last_unit_added, last_unit_removed] as ISO 8601 strings,
+            None for those that never happened.
+        :rtype: list
+        """
+        repo = model.Repository.objects.get_repo_or_missing_resource(repo_id)
+        changed = [repo.last_unit_added, repo.last_unit_removed]
+        return [dateutils.format_iso8601_datetime(d) if d else None for d in changed]
 
 
 class Typedef(object):
@@ -71,19 +87,34 @@ class UnitsIterator:
             yield cursor
 
     @staticmethod
-    def get_units(units, types):
+    def get_units(associations):
         typedefs = Typedef()
-        for cursor in UnitsIterator.open_cursors(types):
-            for metadata in cursor:
-                unit_id = metadata['_id']
-                unit = units[unit_id]
+        for page in paginate(associations, QUERY_PAGE_SIZE):
+            units = {}
+            types = {}
+            for unit in page:
+                unit_id = unit['unit_id']
                 type_id = unit['unit_type_id']
-                typedef = typedefs.get(type_id)
-                yield UnitsIterator.associated_unit(typedef, unit, metadata)
-
-    def __init__(self, units, types):
-        self.length = len(units)
-        self.unit_generator = UnitsIterator.get_units(units, types)
+                units[unit_id] = unit
+                unit_list = types.setdefault(type_id, [])
+                unit_list.append(unit_id)
+            for cursor in UnitsIterator.open_cursors(types):
+                for metadata in cursor:
+                    unit_id = metadata['_id']
+                    unit = units[unit_id]
+                    type_id = unit['unit_type_id']
+                    typedef = typedefs.get(type_id)
+                    yield UnitsIterator.associated_unit(typedef, unit, metadata)
+
+    def __init__(self, length, associations):
+        """
+        :param length: The number of associated units.
+        :type length: int
+        :param associations: The repository unit associations.
+        :type associations: iterable
+        """
+        self.length = length
+        self.unit_generator = UnitsIterator.get_units(associations)
 
     def next(self):
         return self.unit_generator.next()
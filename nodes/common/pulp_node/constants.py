@@ -41,6 +41,7 @@ PURGE_ORPHANS_KEYWORD = 'purge_orphans'
 
 MAX_DOWNLOAD_BANDWIDTH_KEYWORD = 'max_download_bandwidth'
 MAX_DOWNLOAD_CONCURRENCY_KEYWORD = 'max_download_concurrency'
+MAX_CONCURRENT_REPOSITORIES_KEYWORD = 'max_concurrent_repositories'
 
 SKIP_CONTENT_UPDATE_KEYWORD = 'skip_content_update'
 
@@ -66,6 +67,7 @@ STRATEGY_NOTE_KEY = '_node-update-strategy'
 # --- settings ---------------------------------------------------------------
 
 DEFAULT_DOWNLOAD_CONCURRENCY = 20
+DEFAULT_CONCURRENT_REPOSITORIES = 1
 
 
 # --- profiling --------------------------------------------------------------
@@ -14,11 +14,26 @@ Provides classes for managing the content unit manifest.
 The manifest is a json encoded file that defines content units
 associated with repository.  The units themselves are stored in a separate
 json encoded file.  For performance reasons, the unit files are compressed.
+
+The units file is compressed in blocks.  Each block is a complete gzip member
+so the file as a whole is still a plain gzip file of json encoded units, one per
+line.  The offset and length of each block is listed in the manifest so that units
+can be read from the compressed file directly, one block at a time.
+
+The manifest also lists a short chain of deltas.  Each delta is a units file
+containing the units added, updated and removed between two publishes so that
+a child that processed one of the previous manifests only needs to download
+and apply the changes made since.
 """
 
 import os
 import gzip
 import errno
+import hashlib
+import shutil
+import mmap
+import threading
+import zlib
 
 from logging import getLogger
 
@@ -48,6 +63,23 @@ UNITS = 'units'
 UNITS_PATH = 'path'
 UNITS_TOTAL = 'total'
 UNITS_SIZE = 'size'
+UNITS_BLOCKS = 'blocks'
+DELTAS = 'deltas'
+DELTAS_DIR = 'deltas'
+DELTA_FROM = 'from'
+DELTA_TO = 'to'
+
+# The key added to the units in a delta to tell how they changed.
+DELTA = '_delta'
+DELTA_ADDED = 'added'
+DELTA_UPDATED = 'updated'
+DELTA_REMOVED = 'removed'
+
+# The maximum number of deltas listed in a manifest.
+DELTA_CHAIN_LENGTH = 5
+
+# The number of (uncompressed) bytes of json encoded units compressed into each block.
+BLOCK_SIZE = 65536
 
 
 # --- utils -----------------------------------------------------------------------------
@@ -76,6 +108,64 @@ def unzip(path, destination, bfrlen=65535):
         fp_in.close()
 
 
+def gzip_block(data):
+    """
+    Compress data into a complete gzip member.
+    :param data: The data to be compressed.
+    :type data: str
+    :return: The compressed data.
+    :rtype: str
+    """
+    # a window size of 16 + MAX_WBITS makes zlib write the gzip header and trailer
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def unit_key_id(unit):
+    """
+    Get a string that identifies a unit by its type and unit key.
+    :param unit: A content unit.
+    :type unit: dict
+    :return: The unit key ID.
+    :rtype: str
+    """
+    return json.dumps([unit['type_id'], unit['unit_key']], sort_keys=True)
+
+
+def unit_digest(unit):
+    """
+    Get a digest of everything published about a unit.
+    :param unit: A content unit.
+    :type unit: dict
+    :return: The hex digest.
+    :rtype: str
+    """
+    return hashlib.sha1(json.dumps(unit, sort_keys=True)).hexdigest()
+
+
+def fetch_units(refs):
+    """
+    Fetch many referenced content units in one pass.
+    The units are read in the order they are stored so that each units
+    file is opened and each block is decompressed only once.
+    :param refs: A list of unit references.
+    :type refs: list
+    :return: The json decoded units in the same order as the references.
+    :rtype: list
+    :raise IOError: on I/O errors.
+    :raise ValueError: json decoding errors
+    """
+    units = [None] * len(refs)
+    files = {}
+    try:
+        for index in sorted(range(len(refs)), key=lambda i: refs[i].position()):
+            units[index] = refs[index].fetch(files)
+    finally:
+        for fp in files.values():
+            fp.close()
+    return units
+
+
 # --- manifest --------------------------------------------------------------------------
 
 
@@ -90,6 +180,8 @@ class Manifest(object):
     :type total_units: int
     :param publishing_details: Details of how units have been published.
     :type publishing_details: dict
+    :ivar deltas: The chain of deltas leading to this manifest, oldest first.
+    :type deltas: list
     """
 
     def __init__(self, path, manifest_id=None):
@@ -104,6 +196,7 @@ class Manifest(object):
         self.version = MANIFEST_VERSION
         self.units = {UNITS_PATH: None, UNITS_TOTAL: 0, UNITS_SIZE: 0}
         self.publishing_details = {}
+        self.deltas = []
         if os.path.isdir(path):
             path = pathlib.join(path, MANIFEST_FILE_NAME)
         self.path = path
@@ -118,7 +211,8 @@ class Manifest(object):
             ID: self.id,
             VERSION: self.version,
             UNITS: self.units,
-            PUBLISHING_DETAILS: self.publishing_details
+            PUBLISHING_DETAILS: self.publishing_details,
+            DELTAS: self.deltas,
         }
         with open(self.path, 'w+') as fp:
             json.dump(state, fp, indent=2)
@@ -138,10 +232,14 @@ class Manifest(object):
         self.version = d.get(VERSION, 0)
         self.units = d.get(UNITS, {UNITS_PATH: None, UNITS_TOTAL: 0, UNITS_SIZE: 0})
         self.publishing_details = d.get(PUBLISHING_DETAILS, {})
+        self.deltas = d.get(DELTAS, [])
 
     def get_units(self):
         """
         Get the content units referenced in the manifest.
+        Units files compressed in blocks are read in place.  Others are
+        uncompressed first.  The iterator must be closed once the units
+        and their references are no longer used.
         :return: An iterator used to read downloaded content units.
         :rtype: iterable
         :raise IOError: on I/O errors.
@@ -150,10 +248,13 @@ class Manifest(object):
         total = self.units[UNITS_TOTAL]
         if total:
             path = self.units_path()
+            blocks = self.units.get(UNITS_BLOCKS)
+            if blocks is not None and path.endswith('.gz') and self.has_valid_units():
+                return IndexedUnitIterator([UnitsFile(path, blocks)], total)
             path = self.unzip_units(path)
             return UnitIterator(path, total)
         else:
-            return []
+            return IndexedUnitIterator([], 0)
 
     def units_published(self, unit_writer):
         """
@@ -163,6 +264,7 @@ class Manifest(object):
         """
         self.units[UNITS_TOTAL] = unit_writer.total_units
         self.units[UNITS_SIZE] = unit_writer.bytes_written
+        self.units[UNITS_BLOCKS] = unit_writer.blocks
 
     def published(self, details):
         """
@@ -172,6 +274,31 @@ class Manifest(object):
         """
         self.publishing_details.update(details)
 
+    def deltas_since(self, manifest_id):
+        """
+        Get the chain of deltas between the specified manifest and this one.
+        :param manifest_id: The ID of a previous manifest.
+        :type manifest_id: str
+        :return: The deltas to be applied in order, or None when this manifest
+            does not list an unbroken chain of deltas since the specified manifest.
+        :rtype: list
+        """
+        if not manifest_id or not self.is_valid():
+            return None
+        if manifest_id == self.id:
+            return []
+        for index, delta in enumerate(self.deltas):
+            if delta[DELTA_FROM] != manifest_id:
+                continue
+            chain = self.deltas[index:]
+            for delta, next_delta in zip(chain, chain[1:]):
+                if delta[DELTA_TO] != next_delta[DELTA_FROM]:
+                    return None
+            if chain[-1][DELTA_TO] != self.id:
+                return None
+            return chain
+        return None
+
     def is_valid(self):
         """
         Get whether the manifest is valid.
@@ -292,11 +419,50 @@ class RemoteManifest(Manifest):
             report = listener.failed_reports[0]
             raise ManifestDownloadError(self.url, report.error_msg)
 
+    def fetch_deltas(self, deltas):
+        """
+        Fetch the delta files referenced in the manifest.
+        The iterator must be closed once the units and their references
+        are no longer used.
+        :param deltas: The deltas to fetch.
+        :type deltas: list
+        :return: The units in the deltas, in the order the deltas are listed.
+        :rtype: IndexedUnitIterator
+        :raise ManifestDownloadError: on downloading errors.
+        :raise ValueError: when a downloaded delta is not complete.
+        """
+        base_url = self.url.rsplit('/', 1)[0]
+        requests = []
+        for delta in deltas:
+            url = pathlib.join(base_url, delta[UNITS_PATH])
+            destination = pathlib.join(os.path.dirname(self.path), delta[UNITS_PATH])
+            pathlib.mkdir(os.path.dirname(destination))
+            requests.append(DownloadRequest(str(url), destination))
+        listener = AggregatingEventListener()
+        self.downloader.event_listener = listener
+        self.downloader.download(requests)
+        if listener.failed_reports:
+            report = listener.failed_reports[0]
+            raise ManifestDownloadError(self.url, report.error_msg)
+        for delta, request in zip(deltas, requests):
+            if os.path.getsize(request.destination) != delta[UNITS_SIZE]:
+                raise ValueError(request.destination)
+        units_files = []
+        try:
+            for delta, request in zip(deltas, requests):
+                units_files.append(UnitsFile(request.destination, delta[UNITS_BLOCKS]))
+        except Exception:
+            for units_file in units_files:
+                units_file.close()
+            raise
+        return IndexedUnitIterator(units_files, sum(delta[UNITS_TOTAL] for delta in deltas))
+
 
 class UnitWriter(object):
     """
     Writes json encoded content units to a file.
     This approach is 30x faster than opening, appending, and closing for each unit.
+    Units are compressed in blocks of about block_size bytes.
     :ivar path:  The absolute path to a file or directory.  When a directory is specified,
         the standard file name is appended.
     :type path: str
@@ -306,36 +472,38 @@ class UnitWriter(object):
     :type total_units: int
     :ivar bytes_written: The total number of bytes written.
     :type bytes_written: int
+    :ivar blocks: The [offset, length] of each compressed block written.
+    :type blocks: list
     """
 
-    def __init__(self, path):
+    def __init__(self, path, block_size=BLOCK_SIZE):
         """
         :param path: The absolute path to a file or directory.
             When a directory is specified, the standard file name is appended.
         :type path: str
+        :param block_size: The number of uncompressed bytes in each block.
+        :type block_size: int
         :raise IOError: on I/O errors
         """
         if os.path.isdir(path):
             path = pathlib.join(path, UNITS_FILE_NAME)
         self.path = path
-        self.fp = gzip.open(path, 'wb')
+        self.fp = open(path, 'wb')
+        self.block_size = block_size
         self.total_units = 0
         self.bytes_written = 0
+        self.blocks = []
+        self._block = []
+        self._block_length = 0
 
     @property
     def closed(self):
         """
-        Determines if the file is closed or not. This exists because
-        the gzip API changed drastically from python 2.6 to 2.7.
+        Determines if the file is closed or not.
         :return: True if the file is closed.
         :rtype: bool
         """
-        try:
-            # python 2.7
-            return self.fp.closed
-        except AttributeError:
-            # python 2.6
-            return self.fp.fileobj.closed
+        return self.fp.closed
 
     def add(self, unit):
         """
@@ -347,8 +515,25 @@ class UnitWriter(object):
         """
         self.total_units += 1
         json_unit = json.dumps(unit)
-        self.fp.write(json_unit)
-        self.fp.write('\n')
+        self._block.append(json_unit)
+        self._block.append('\n')
+        self._block_length += len(json_unit) + 1
+        if self._block_length >= self.block_size:
+            self._write_block()
+
+    def _write_block(self):
+        """
+        Compress the units added since the last block was written and write them.
+        :raise IOError: on I/O errors.
+        """
+        if not self._block:
+            return
+        compressed = gzip_block(''.join(self._block))
+        self.fp.write(compressed)
+        self.blocks.append([self.bytes_written, len(compressed)])
+        self.bytes_written += len(compressed)
+        self._block = []
+        self._block_length = 0
 
     def close(self):
         """
@@ -357,6 +542,7 @@ class UnitWriter(object):
         :rtype: int
         """
         if not self.closed:
+            self._write_block()
             self.fp.close()
             self.bytes_written = os.path.getsize(self.path)
         return self.total_units
@@ -369,6 +555,187 @@ class UnitWriter(object):
         return False
 
 
+class DeltaWriter(object):
+    """
+    Writes the delta between the units of a previous manifest and the units
+    being published.  Units are added to the delta only when they are new or
+    anything published about them changed.  The units of the previous manifest
+    that are not published again are added as removed when the writer is closed.
+    :ivar writer: The writer of the delta units file.
+    :type writer: UnitWriter
+    :ivar previous: The digest of each unit of the previous manifest that has
+        not been published again, keyed by unit key ID.
+    :type previous: dict
+    """
+
+    def __init__(self, path, previous_units):
+        """
+        :param path: The absolute path to the delta file.
+        :type path: str
+        :param previous_units: The units of the previous manifest.
+        :type previous_units: iterable of (unit, ref)
+        :raise IOError: on I/O errors
+        """
+        self.previous = {}
+        for unit, ref in previous_units:
+            self.previous[unit_key_id(unit)] = unit_digest(unit)
+        pathlib.mkdir(os.path.dirname(path))
+        self.writer = UnitWriter(path)
+
+    def add(self, unit):
+        """
+        Add the specified unit being published.
+        :param unit: A content unit.
+        :type unit: dict
+        :raise IOError: on I/O errors.
+        """
+        digest = self.previous.pop(unit_key_id(unit), None)
+        if digest is None:
+            change = DELTA_ADDED
+        elif digest != unit_digest(unit):
+            change = DELTA_UPDATED
+        else:
+            return
+        unit = dict(unit)
+        unit[DELTA] = change
+        self.writer.add(unit)
+
+    def close(self):
+        """
+        Add the units that were removed and close the delta file.
+        This method is idempotent.
+        """
+        for key in sorted(self.previous):
+            type_id, unit_key = json.loads(key)
+            self.writer.add({DELTA: DELTA_REMOVED, 'type_id': type_id, 'unit_key': unit_key})
+        self.previous = {}
+        self.writer.close()
+
+    def delta(self, from_id, to_id, path):
+        """
+        Get the description of the delta listed in the manifest.
+        :param from_id: The ID of the previous manifest.
+        :type from_id: str
+        :param to_id: The ID of the manifest being published.
+        :type to_id: str
+        :param path: The path to the delta file relative to the manifest.
+        :type path: str
+        :return: The delta.
+        :rtype: dict
+        """
+        return {
+            DELTA_FROM: from_id,
+            DELTA_TO: to_id,
+            UNITS_PATH: path,
+            UNITS_TOTAL: self.writer.total_units,
+            UNITS_SIZE: self.writer.bytes_written,
+            UNITS_BLOCKS: self.writer.blocks,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *unused):
+        self.close()
+        return False
+
+
+def link_deltas(deltas, source_dir, destination_dir):
+    """
+    Link (or copy) the delta files of previously published deltas into
+    the directory being published.
+    :param deltas: The deltas.
+    :type deltas: list
+    :param source_dir: The directory the deltas were published in.
+    :type source_dir: str
+    :param destination_dir: The directory being published.
+    :type destination_dir: str
+    :raise IOError: on I/O errors.
+    """
+    for delta in deltas:
+        source = pathlib.join(source_dir, delta[UNITS_PATH])
+        destination = pathlib.join(destination_dir, delta[UNITS_PATH])
+        pathlib.mkdir(os.path.dirname(destination))
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copy(source, destination)
+
+
+class UnitsFile(object):
+    """
+    Provides random access to the units in a units file compressed in blocks,
+    without uncompressing it to disk.  The file is opened and memory mapped
+    once and shared by all of the references to its units.  The most recently
+    read block is kept uncompressed so that units stored together are
+    read with a single decompression.
+    :ivar path: The absolute path to the units file.
+    :type path: str
+    :ivar blocks: The [offset, length] of each compressed block.
+    :type blocks: list
+    """
+
+    def __init__(self, path, blocks):
+        """
+        :param path: The absolute path to the units file.
+        :type path: str
+        :param blocks: The [offset, length] of each compressed block.
+        :type blocks: list
+        :raise IOError: on I/O errors.
+        """
+        self.path = path
+        self.blocks = blocks
+        self.fp = open(path, 'rb')
+        if blocks:
+            self.map = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.map = ''
+        self._lock = threading.Lock()
+        self._cached = (None, None)
+
+    def read_block(self, block):
+        """
+        Read and uncompress a block.
+        :param block: The index of the block.
+        :type block: int
+        :return: The json encoded units in the block, one per line.
+        :rtype: str
+        :raise zlib.error: when the block is corrupt.
+        """
+        with self._lock:
+            cached_block, data = self._cached
+            if cached_block != block:
+                offset, length = self.blocks[block]
+                data = zlib.decompress(self.map[offset:offset + length], 16 + zlib.MAX_WBITS)
+                self._cached = (block, data)
+            return data
+
+    def get_units(self):
+        """
+        Read all of the units in the file.
+        :return: A generator of (unit, ref).
+        :rtype: generator
+        """
+        for block in range(len(self.blocks)):
+            data = self.read_block(block)
+            begin = 0
+            while begin < len(data):
+                end = data.index('\n', begin) + 1
+                unit = json.loads(data[begin:end])
+                yield (unit, IndexedUnitRef(self, block, begin, end - begin))
+                begin = end
+
+    def close(self):
+        """
+        Close the file.  This method is idempotent.
+        """
+        if self.fp.closed:
+            return
+        if self.blocks:
+            self.map.close()
+        self.fp.close()
+
+
 class UnitIterator:
     """
     Used to iterate content units inventory file associated with a manifest.
@@ -404,6 +771,12 @@ class UnitIterator:
     def next(self):
         return self.unit_generator.next()
 
+    def close(self):
+        """
+        Close the units file.  This method is idempotent.
+        """
+        self.unit_generator.close()
+
     def __iter__(self):
         return self
 
@@ -411,6 +784,38 @@ class UnitIterator:
         return self.total_units
 
 
+class IndexedUnitIterator(UnitIterator):
+    """
+    Used to iterate the content units in units files compressed in blocks.
+    The references to the units read the units files, so they can only be
+    fetched until the iterator is closed.
+    """
+
+    def __init__(self, units_files, total_units):
+        """
+        :param units_files: The units files to be iterated, in order.
+        :type units_files: list of UnitsFile
+        :param total_units: The number of units contained in the units files.
+        :type total_units: int
+        """
+        self.units_files = units_files
+        self.unit_generator = self._get_units()
+        self.total_units = total_units
+
+    def _get_units(self):
+        for units_file in self.units_files:
+            for unit in units_file.get_units():
+                yield unit
+
+    def close(self):
+        """
+        Close the units files.  This method is idempotent.
+        """
+        UnitIterator.close(self)
+        for units_file in self.units_files:
+            units_file.close()
+
+
 class UnitRef(object):
     """
     Reference to a unit within the downloaded units file.
@@ -435,15 +840,87 @@ class UnitRef(object):
         self.offset = offset
         self.length = length
 
-    def fetch(self):
+    def position(self):
+        """
+        Get the position of the unit used to read many units in storage order.
+        Plain units files are not split into blocks, so the block is always 0.
+        :return: (path, block, offset)
+        :rtype: tuple
+        """
+        return (self.path, 0, self.offset)
+
+    def fetch(self, files=None):
+        """
+        Fetch referenced content unit from the units file.
+        :param files: Optional files already opened, keyed by path.  The
+            units file is added when it is opened, and is left open.
+        :type files: dict
+        :return: The json decoded unit.
+        :rtype: dict
+        :raise IOError: on I/O errors.
+        :raise ValueError: json decoding errors
+        """
+        if files is None:
+            with open(self.path) as fp:
+                return self._read(fp)
+        fp = files.get(self.path)
+        if fp is None:
+            fp = open(self.path)
+            files[self.path] = fp
+        return self._read(fp)
+
+    def _read(self, fp):
+        fp.seek(self.offset)
+        json_unit = fp.read(self.length)
+        return json.loads(json_unit)
+
+
+class IndexedUnitRef(object):
+    """
+    Reference to a unit within a units file compressed in blocks.
+    :ivar units_file: The units file.
+    :type units_file: UnitsFile
+    :ivar block: The index of the block containing the unit.
+    :type block: int
+    :ivar offset: The offset for a specific unit within the uncompressed block.
+    :type offset: int
+    :ivar length: The length of a specific unit within the uncompressed block.
+    :type length: int
+    """
+
+    def __init__(self, units_file, block, offset, length):
+        """
+        :param units_file: The units file.
+        :type units_file: UnitsFile
+        :param block: The index of the block containing the unit.
+        :type block: int
+        :param offset: The offset for a specific unit within the uncompressed block.
+        :type offset: int
+        :param length: The length of a specific unit within the uncompressed block.
+        :type length: int
+        """
+        self.units_file = units_file
+        self.block = block
+        self.offset = offset
+        self.length = length
+
+    def position(self):
+        """
+        Get the position of the unit used to read many units in storage order.
+        :return: (path, block, offset)
+        :rtype: tuple
+        """
+        return (self.units_file.path, self.block, self.offset)
+
+    def fetch(self, files=None):
         """
         Fetch referenced content unit from the units file.
+        :param files: Not used.  The units file is already open.
+        :type files: dict
         :return: The json decoded unit.
         :rtype: dict
         :raise IOError: on I/O errors.
         :raise ValueError: json decoding errors
         """
-        with open(self.path) as fp:
-            fp.seek(self.offset)
-            json_unit = fp.read(self.length)
-            return json.loads(json_unit)
+        data = self.units_file.read_block(self.block)
+        return json.loads(data[self.offset:self.offset + self.length])
@@ -17,6 +17,44 @@ class PollingFailed(Exception):
     pass
 
 
+class PolledTask(object):
+    """
+    A task being polled.
+    :ivar task_id: A task ID.
+    :type task_id: str
+    :ivar progress: A progress reporting object.
+    :type progress: pulp_node.progress.RepositoryProgress
+    :ivar last_hash: The hash of the last reported progress.
+    :type last_hash: int
+    :ivar result: The task result.
+    :ivar error: The error raised by polling the task.
+    :type error: Exception
+    """
+
+    def __init__(self, task_id, progress):
+        """
+        :param task_id: A task ID.
+        :type task_id: str
+        :param progress: A progress reporting object.
+        :type progress: pulp_node.progress.RepositoryProgress
+        """
+        self.task_id = task_id
+        self.progress = progress
+        self.last_hash = 0
+        self.result = None
+        self.error = None
+
+    def completed(self, result=None, error=None):
+        """
+        The task has completed.
+        :param result: The task result.
+        :param error: The error raised by polling the task.
+        :type error: Exception
+        """
+        self.result = result
+        self.error = error
+
+
 class TaskPoller(object):
     """
     The task poller is used to poll a running task by ID.
@@ -52,35 +90,58 @@ class TaskPoller(object):
         :raise PollingFailed: On failure to fetch the task.
         :raise TaskFailed: On indication that the task being polled has failed.
         """
-        poll = True
-        task_result = None
-        last_hash = 0
+        polled = PolledTask(task_id, progress)
+        while not cancelled():
+            for completed in self.poll([polled]):
+                if completed.error:
+                    raise completed.error
+                return completed.result
+
+    def poll(self, polled_tasks):
+        """
+        Poll each of the specified tasks once, after the delay.
+        Progress is reported for each task.  A task that has failed, or
+        could not be fetched, is completed with the error so that the
+        other tasks are still polled.
+        :param polled_tasks: The tasks being polled.
+        :type polled_tasks: list of PolledTask
+        :return: The tasks that have completed.
+        :rtype: list of PolledTask
+        """
+        completed = []
 
-        while poll:
-            if cancelled():
-                poll = False
-                continue
+        sleep(self.delay)
 
-            sleep(self.delay)
+        for polled in polled_tasks:
+            task_id = polled.task_id
 
-            http = self.binding.tasks.get_task(task_id)
+            try:
+                http = self.binding.tasks.get_task(task_id)
+            except Exception, e:
+                polled.completed(error=e)
+                completed.append(polled)
+                continue
             if http.response_code != httplib.OK:
                 msg = FETCH_TASK_FAILED % {'t': task_id, 'c': http.response_code}
-                raise PollingFailed(msg)
+                polled.completed(error=PollingFailed(msg))
+                completed.append(polled)
+                continue
 
             task = http.response_body
 
             if task.state == CALL_ERROR_STATE:
                 msg = TASK_FAILED % {'t': task_id, 's': task.state}
-                raise TaskFailed(msg, task.exception, task.traceback)
+                polled.completed(error=TaskFailed(msg, task.exception, task.traceback))
+                completed.append(polled)
+                continue
 
-            last_hash = self._report_progress(progress, task, last_hash)
+            polled.last_hash = self._report_progress(polled.progress, task, polled.last_hash)
 
             if task.state in CALL_COMPLETE_STATES:
-                task_result = task.result
-                poll = False
+                polled.completed(result=task.result)
+                completed.append(polled)
 
-        return task_result
+        return completed
 
     def _report_progress(self, progress, task, last_hash):
         """
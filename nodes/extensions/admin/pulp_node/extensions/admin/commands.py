@@ -16,7 +16,7 @@ from pulp_node.extension import (missing_resources, node_activated, repository_e
                                  ensure_node_section)
 from pulp_node.extensions.admin import sync_schedules
 from pulp_node.extensions.admin.options import (NODE_ID_OPTION, MAX_BANDWIDTH_OPTION,
-                                                MAX_CONCURRENCY_OPTION)
+                                                MAX_CONCURRENCY_OPTION, MAX_REPOSITORIES_OPTION)
 from pulp_node.extensions.admin.rendering import ProgressTracker, UpdateRenderer
 
 
@@ -475,16 +475,19 @@ class NodeUpdateCommand(PollingCommand):
         self.add_option(NODE_ID_OPTION)
         self.add_option(MAX_CONCURRENCY_OPTION)
         self.add_option(MAX_BANDWIDTH_OPTION)
+        self.add_option(MAX_REPOSITORIES_OPTION)
         self.tracker = ProgressTracker(self.context.prompt)
 
     def run(self, **kwargs):
         node_id = kwargs[NODE_ID_OPTION.keyword]
         max_bandwidth = kwargs[MAX_BANDWIDTH_OPTION.keyword]
         max_concurrency = kwargs[MAX_CONCURRENCY_OPTION.keyword]
+        max_repositories = kwargs[MAX_REPOSITORIES_OPTION.keyword]
         units = [dict(type_id='node', unit_key=None)]
         options = {
             constants.MAX_DOWNLOAD_BANDWIDTH_KEYWORD: max_bandwidth,
             constants.MAX_DOWNLOAD_CONCURRENCY_KEYWORD: max_concurrency,
+            constants.MAX_CONCURRENT_REPOSITORIES_KEYWORD: max_repositories,
         }
 
         if not node_activated(self.context, node_id):
@@ -6,7 +6,7 @@ from pulp.client.commands.schedule import (
 
 from pulp_node import constants
 from pulp_node.extensions.admin.options import (NODE_ID_OPTION, MAX_BANDWIDTH_OPTION,
-                                                MAX_CONCURRENCY_OPTION)
+                                                MAX_CONCURRENCY_OPTION, MAX_REPOSITORIES_OPTION)
 
 
 DESC_LIST = _('list scheduled sync operations')
@@ -33,6 +33,7 @@ class NodeCreateScheduleCommand(CreateScheduleCommand):
         self.add_option(NODE_ID_OPTION)
         self.add_option(MAX_BANDWIDTH_OPTION)
         self.add_option(MAX_CONCURRENCY_OPTION)
+        self.add_option(MAX_REPOSITORIES_OPTION)
 
 
 class NodeDeleteScheduleCommand(DeleteScheduleCommand):
@@ -69,10 +70,12 @@ class NodeSyncScheduleStrategy(ScheduleStrategy):
         node_id = kwargs[NODE_ID_OPTION.keyword]
         max_bandwidth = kwargs[MAX_BANDWIDTH_OPTION.keyword]
         max_concurrency = kwargs[MAX_CONCURRENCY_OPTION.keyword]
+        max_repositories = kwargs[MAX_REPOSITORIES_OPTION.keyword]
         units = [dict(type_id='node', unit_key=None)]
         options = {
             constants.MAX_DOWNLOAD_BANDWIDTH_KEYWORD: max_bandwidth,
             constants.MAX_DOWNLOAD_CONCURRENCY_KEYWORD: max_concurrency,
+            constants.MAX_CONCURRENT_REPOSITORIES_KEYWORD: max_repositories,
         }
         return self.api.add_schedule(
             SYNC_OPERATION,
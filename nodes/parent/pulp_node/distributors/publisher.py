@@ -12,13 +12,16 @@
 import os
 import tarfile
 
+from gettext import gettext as _
 from uuid import uuid4
 from tempfile import mkdtemp
 from logging import getLogger
 
 from pulp_node import constants
 from pulp_node import pathlib
-from pulp_node.manifest import Manifest, UnitWriter
+from pulp_node.manifest import (Manifest, UnitWriter, DeltaWriter, link_deltas,
+                                MANIFEST_FILE_NAME, UNITS_TOTAL, UNITS_BLOCKS, DELTAS_DIR,
+                                DELTA_CHAIN_LENGTH)
 
 
 log = getLogger(__name__)
@@ -111,6 +114,8 @@ class FilePublisher(Publisher):
         Writes the units.json file and symlinks each of the files associated
         to the unit.storage_path.  Publishing is staged in a temporary directory and
         must use commit() to make the publishing permanent.
+        When the previous publish can be read, the units that changed since are
+        written to a delta which is added to the chain of deltas in the manifest.
         :param units: A list of units to publish.
         :type units: iterable
         :return: The absolute path to the manifest.
@@ -121,17 +126,62 @@ class FilePublisher(Publisher):
         pathlib.mkdir(parent_path)
         self.tmp_dir = mkdtemp(dir=parent_path)
 
+        manifest_id = str(uuid4())
+        previous = self.previous_manifest()
+        if previous is not None:
+            delta_path = pathlib.join(DELTAS_DIR, '%s.json.gz' % previous.id)
+            previous_units = previous.get_units()
+            try:
+                delta_writer = DeltaWriter(pathlib.join(self.tmp_dir, delta_path),
+                                           previous_units)
+            finally:
+                previous_units.close()
+        else:
+            delta_writer = None
+
         with UnitWriter(self.tmp_dir) as writer:
             for unit in units:
                 self.publish_unit(unit)
                 writer.add(unit)
-        manifest_id = str(uuid4())
+                if delta_writer is not None:
+                    delta_writer.add(unit)
         manifest = Manifest(self.tmp_dir, manifest_id)
         manifest.units_published(writer)
+        if delta_writer is not None:
+            delta_writer.close()
+            deltas = previous.deltas[-(DELTA_CHAIN_LENGTH - 1):]
+            link_deltas(deltas, self.publish_dir, self.tmp_dir)
+            deltas.append(delta_writer.delta(previous.id, manifest_id, delta_path))
+            manifest.deltas = deltas
         manifest.write()
         self.staged = True
         return manifest.path
 
+    def previous_manifest(self):
+        """
+        Get the manifest of the previous publish when deltas from it can be published.
+        Deltas can only be published when the units file of the previous publish
+        can be read in place.
+        :return: The previous manifest or None.
+        :rtype: Manifest
+        """
+        path = pathlib.join(self.publish_dir, MANIFEST_FILE_NAME)
+        if not os.path.exists(path):
+            return None
+        manifest = Manifest(path)
+        try:
+            manifest.read()
+        except ValueError:
+            log.warn(_('Previous manifest %(p)s is not valid json') % {'p': path})
+            return None
+        if not manifest.is_valid() or not manifest.id:
+            return None
+        if manifest.units[UNITS_TOTAL] and manifest.units.get(UNITS_BLOCKS) is None:
+            return None
+        if manifest.units[UNITS_TOTAL] and not manifest.has_valid_units():
+            return None
+        return manifest
+
     def publish_unit(self, unit):
         """
         Publish the file associated with the unit into the publish directory.
@@ -16,6 +16,7 @@ NODE_ID = 'test.redhat.com'
 REPOSITORY_ID = 'test_repository'
 MAX_BANDWIDTH = 12345
 MAX_CONCURRENCY = 54321
+MAX_REPOSITORIES = 3
 
 REPO_ENABLED_CHECK = 'pulp_node.extensions.admin.commands.repository_enabled'
 NODE_ACTIVATED_CHECK = 'pulp_node.extensions.admin.commands.node_activated'
@@ -404,7 +405,8 @@ class TestUpdateCommands(ClientTests):
         keywords = {
             NODE_ID_OPTION.keyword: NODE_ID,
             MAX_BANDWIDTH_OPTION.keyword: MAX_BANDWIDTH,
-            MAX_CONCURRENCY_OPTION.keyword: MAX_CONCURRENCY
+            MAX_CONCURRENCY_OPTION.keyword: MAX_CONCURRENCY,
+            MAX_REPOSITORIES_OPTION.keyword: MAX_REPOSITORIES,
         }
         command.run(**keywords)
         # Verify
@@ -412,10 +414,12 @@ class TestUpdateCommands(ClientTests):
         options = {
             constants.MAX_DOWNLOAD_BANDWIDTH_KEYWORD: MAX_BANDWIDTH,
             constants.MAX_DOWNLOAD_CONCURRENCY_KEYWORD: MAX_CONCURRENCY,
+            constants.MAX_CONCURRENT_REPOSITORIES_KEYWORD: MAX_REPOSITORIES,
         }
         self.assertTrue(NODE_ID_OPTION in command.options)
         self.assertTrue(MAX_BANDWIDTH_OPTION in command.options)
         self.assertTrue(MAX_CONCURRENCY_OPTION in command.options)
+        self.assertTrue(MAX_REPOSITORIES_OPTION in command.options)
         mock_update.assert_called_with(NODE_ID, units=units, options=options)
         mock_activated.assert_called_with(self.context, NODE_ID)
 
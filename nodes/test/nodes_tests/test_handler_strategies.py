@@ -13,11 +13,15 @@
 from unittest import TestCase
 from mock import Mock, patch
 
+from pulp.bindings.exceptions import ConnectionException
+from pulp.common.constants import CALL_FINISHED_STATE, CALL_RUNNING_STATE
+
 from base import Task as TestTask, TaskResult as TestReport
 from pulp_node.handlers.strategies import *
 from pulp_node.error import *
 from pulp_node.handlers.model import Repository
 from pulp_node.handlers.reports import SummaryReport, HandlerProgress
+from pulp_node.poller import PolledTask, TaskPoller
 
 
 class TestConduit:
@@ -69,7 +73,7 @@ PARENT_SETTINGS = {
 
 class TestBase(TestCase):
 
-    def request(self, cancel_on=0):
+    def request(self, cancel_on=0, repo_ids=(REPO_ID,), max_concurrent=None):
         conduit = TestConduit(cancel_on)
         progress = HandlerProgress(conduit)
         summary = SummaryReport()
@@ -77,9 +81,12 @@ class TestBase(TestCase):
             conduit=conduit,
             progress=progress,
             summary=summary,
-            bindings=[dict(repo_id=REPO_ID, details={})],
+            bindings=[dict(repo_id=repo_id, details={}) for repo_id in repo_ids],
             scope=constants.NODE_SCOPE,
-            options={constants.PARENT_SETTINGS: PARENT_SETTINGS}
+            options={
+                constants.PARENT_SETTINGS: PARENT_SETTINGS,
+                constants.MAX_CONCURRENT_REPOSITORIES_KEYWORD: max_concurrent,
+            }
         )
         return request
 
@@ -219,6 +226,171 @@ class TestBase(TestCase):
         # Verify
         mock_cancel.assert_called_with(TASK_ID)
 
+    @patch('pulp_node.handlers.strategies.resources.pulp_bindings')
+    @patch('pulp_node.poller.sleep')
+    @patch('pulp_node.handlers.model.Repository.start_synchronization')
+    @patch('pulp_node.handlers.model.Repository.add')
+    @patch('pulp_node.handlers.model.Repository.fetch', return_value=None)
+    def test_merge_repositories_concurrent(self, mock_fetch, mock_add, mock_start, mock_sleep,
+                                           mock_bindings):
+        # Setup
+        repo_ids = ['repo_%d' % n for n in range(5)]
+        request = self.request(repo_ids=repo_ids, max_concurrent=2)
+        request.started()
+        running = []
+        polled = []
+        report = dict(added_count=1, updated_count=2, removed_count=3,
+                      details=dict(errors=[], sources={}))
+
+        def start(options):
+            task = TestTask('task_%d' % mock_start.call_count)
+            running.append(task.task_id)
+            self.assertTrue(len(running) <= 2)
+            return task
+
+        def get_task(task_id):
+            polled.append(task_id)
+            running.remove(task_id)
+            task = Mock(state=CALL_FINISHED_STATE, result=report, progress_report={})
+            return TestResponse(200, task)
+
+        mock_start.side_effect = start
+        mock_bindings.return_value.tasks.get_task.side_effect = get_task
+        # Test
+        strategy = HandlerStrategy()
+        strategy._merge_repositories(request)
+        # Verify
+        self.assertEqual(len(request.summary.errors), 0)
+        self.assertEqual(mock_start.call_count, 5)
+        self.assertEqual(sorted(polled), ['task_%d' % n for n in range(1, 6)])
+        for repo_id in repo_ids:
+            repository = request.summary.repository[repo_id]
+            self.assertEqual(repository.action, RepositoryReport.ADDED)
+            self.assertEqual(repository.units.added, 1)
+            self.assertEqual(repository.units.updated, 2)
+            self.assertEqual(repository.units.removed, 3)
+
+    @patch('pulp_node.handlers.strategies.resources.pulp_bindings')
+    @patch('pulp_node.poller.sleep')
+    @patch('pulp_node.handlers.model.Repository.start_synchronization',
+           return_value=TestTask(TASK_ID))
+    @patch('pulp_node.handlers.model.Repository.add')
+    @patch('pulp_node.handlers.model.Repository.fetch', return_value=None)
+    def test_merge_repositories_polling_failed(self, mock_fetch, mock_add, mock_start,
+                                               mock_sleep, mock_bindings):
+        # Setup
+        request = self.request(max_concurrent=2)
+        request.started()
+        mock_bindings.return_value.tasks.get_task.return_value = TestResponse(500)
+        # Test
+        strategy = HandlerStrategy()
+        strategy._merge_repositories(request)
+        # Verify
+        self.assertEqual(len(request.summary.errors), 1)
+        self.assertEqual(request.summary.errors[0].error_id, CaughtException.ERROR_ID)
+        self.assertEqual(request.summary.errors[0].details['repo_id'], REPO_ID)
+
+    @patch('pulp_node.handlers.strategies.resources.pulp_bindings')
+    @patch('pulp_node.poller.sleep')
+    @patch('pulp_node.handlers.model.Repository.start_synchronization')
+    @patch('pulp_node.handlers.model.Repository.add')
+    @patch('pulp_node.handlers.model.Repository.fetch', return_value=None)
+    def test_merge_repositories_get_task_raised(self, mock_fetch, mock_add, mock_start,
+                                                mock_sleep, mock_bindings):
+        # Setup
+        repo_ids = ['repo_%d' % n for n in range(3)]
+        request = self.request(repo_ids=repo_ids, max_concurrent=2)
+        request.started()
+        report = dict(added_count=1, updated_count=2, removed_count=3,
+                      details=dict(errors=[], sources={}))
+
+        def get_task(task_id):
+            if task_id == 'task_1':
+                raise ConnectionException(None, 'connection refused', None)
+            task = Mock(state=CALL_FINISHED_STATE, result=report, progress_report={})
+            return TestResponse(200, task)
+
+        mock_start.side_effect = lambda options: TestTask('task_%d' % mock_start.call_count)
+        mock_bindings.return_value.tasks.get_task.side_effect = get_task
+        # Test
+        strategy = HandlerStrategy()
+        strategy._merge_repositories(request)
+        # Verify
+        self.assertEqual(mock_start.call_count, 3)
+        self.assertEqual(len(request.summary.errors), 1)
+        self.assertEqual(request.summary.errors[0].error_id, CaughtException.ERROR_ID)
+        self.assertEqual(request.summary.errors[0].details['repo_id'], 'repo_0')
+        # the other repositories are still synchronized
+        for repo_id in repo_ids[1:]:
+            self.assertEqual(request.summary.repository[repo_id].units.added, 1)
+
+    @patch('pulp_node.handlers.strategies.resources.pulp_bindings')
+    @patch('pulp_node.poller.sleep')
+    @patch('pulp_node.handlers.model.Repository.cancel_synchronization')
+    @patch('pulp_node.handlers.model.Repository.start_synchronization',
+           return_value=TestTask(TASK_ID))
+    @patch('pulp_node.handlers.model.Repository.add')
+    @patch('pulp_node.handlers.model.Repository.fetch', return_value=None)
+    def test_merge_repositories_sync_cancelled(self, mock_fetch, mock_add, mock_start,
+                                               mock_cancel, mock_sleep, mock_bindings):
+        # Setup
+        request = self.request(cancel_on=3, max_concurrent=2)
+        request.started()
+        task = Mock(state=CALL_RUNNING_STATE, progress_report={})
+        mock_bindings.return_value.tasks.get_task.return_value = TestResponse(200, task)
+        # Test
+        strategy = HandlerStrategy()
+        strategy._merge_repositories(request)
+        # Verify
+        self.assertEqual(len(request.summary.errors), 0)
+        mock_cancel.assert_called_with(mock_start.return_value)
+        repository = request.summary.repository[REPO_ID]
+        self.assertEqual(repository.action, RepositoryReport.CANCELLED)
+
+    @patch('pulp_node.poller.sleep')
+    def test_poll_tasks(self, mock_sleep):
+        # Setup
+        binding = Mock()
+        tasks = {
+            'a': Mock(state=CALL_FINISHED_STATE, result='A', progress_report={}),
+            'b': Mock(state=CALL_RUNNING_STATE, progress_report={}),
+            'c': Mock(state=CALL_FINISHED_STATE, result='C', progress_report={}),
+        }
+        binding.tasks.get_task.side_effect = lambda task_id: TestResponse(200, tasks[task_id])
+        polled_tasks = [PolledTask(task_id, Mock()) for task_id in sorted(tasks)]
+        # Test
+        poller = TaskPoller(binding)
+        completed = poller.poll(polled_tasks)
+        # Verify
+        mock_sleep.assert_called_once_with(TaskPoller.DELAY)
+        self.assertEqual([p.task_id for p in completed], ['a', 'c'])
+        self.assertEqual([p.result for p in completed], ['A', 'C'])
+
+    @patch('pulp_node.poller.sleep')
+    def test_poll_tasks_get_task_raised(self, mock_sleep):
+        # Setup
+        binding = Mock()
+        error = ConnectionException(None, 'connection refused', None)
+        tasks = {
+            'a': error,
+            'b': Mock(state=CALL_FINISHED_STATE, result='B', progress_report={}),
+        }
+
+        def get_task(task_id):
+            if tasks[task_id] is error:
+                raise error
+            return TestResponse(200, tasks[task_id])
+
+        binding.tasks.get_task.side_effect = get_task
+        polled_tasks = [PolledTask(task_id, Mock()) for task_id in sorted(tasks)]
+        # Test
+        poller = TaskPoller(binding)
+        completed = poller.poll(polled_tasks)
+        # Verify
+        self.assertEqual([p.task_id for p in completed], ['a', 'b'])
+        self.assertEqual(completed[0].error, error)
+        self.assertEqual(completed[1].result, 'B')
+
     def test_strategy_factory(self):
         for name, strategy in STRATEGIES.items():
             self.assertEqual(find_strategy(name), strategy)
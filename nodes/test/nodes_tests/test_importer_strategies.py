@@ -1,5 +1,6 @@
 import os
 import shutil
+from functools import partial
 from tempfile import mkdtemp
 from unittest import TestCase
 from uuid import uuid4
@@ -9,7 +10,9 @@ from pulp.plugins.model import Unit
 from pulp.server.config import config as pulp_conf
 
 from pulp_node.importers.strategies import *
-from pulp_node.importers.inventory import UnitInventory
+from pulp_node.importers.inventory import UnitInventory, DeltaInventory, Spool
+from pulp_node.manifest import (UnitWriter, UnitsFile, DELTA, DELTA_ADDED, DELTA_UPDATED,
+                                DELTA_REMOVED)
 from pulp_node.importers.reports import SummaryReport, ProgressListener
 from pulp_node.reports import RepositoryProgress
 from pulp_node.error import *
@@ -24,6 +27,18 @@ class TestConduit:
             Unit('T', {1:3}, {2:2}, 'path_3'),
         ]
 
+    def find_unit_by_unit_key(self, type_id, unit_key):
+        if unit_key[1] > 3:
+            return None
+        return Unit(type_id, unit_key, {2: 2}, 'path_%d' % unit_key[1])
+
+    def get_scratchpad(self):
+        return self.scratchpad
+
+    def set_scratchpad(self, value):
+        self.scratchpad = value
+
+    scratchpad = None
     save_unit = Mock()
     remove_unit = Mock()
     set_progress = Mock()
@@ -47,10 +62,18 @@ class TestRepo(object):
         self.working_dir = working_dir
 
 
+class TestUnits(list):
+
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
 class TestManifest:
 
     def __init__(self, units):
-        self.units = [(u, TestUnitRef(u)) for u in units]
+        self.units = TestUnits((u, TestUnitRef(u)) for u in units)
         self.publishing_details = {constants.BASE_URL: BASE_URL}
 
     def get_units(self):
@@ -68,7 +91,10 @@ class TestUnitRef:
     def __init__(self, unit):
         self.unit = unit
 
-    def fetch(self):
+    def position(self):
+        return ()
+
+    def fetch(self, files=None):
         return self.unit
 
 
@@ -167,6 +193,7 @@ class TestBase(TestCase):
         self.assertEqual(request.summary.errors[0].error_id, DeleteUnitError.ERROR_ID)
 
     @patch('pulp_node.conduit.NodesConduit.get_units', side_effect=ValueError())
+    @patch('pulp_node.manifest.RemoteManifest.fetch')
     def test_get_child_units_exception(self, *unused):
         # Setup
         request = self.request()
@@ -241,6 +268,180 @@ class TestBase(TestCase):
         self.assertEqual(request.cancel_event.call_count, 2)
         self.assertFalse(mock_download.called)
 
+    @patch('pulp_node.importers.strategies.ImporterStrategy.add_unit')
+    def test_update_units(self, mock_add_unit):
+        # Setup
+        request = self.request()
+        units = [dict(unit_id=i, type_id='T', unit_key={'n': i}, metadata={},
+                      last_updated=2) for i in range(3)]
+        child_units = [dict(unit_id=i, type_id='T', unit_key={'n': i}, metadata={},
+                            last_updated=1) for i in range(2)]
+        manifest = TestManifest(units)
+        inventory = UnitInventory(BASE_URL, manifest.get_units(), child_units)
+        # Test
+        strategy = ImporterStrategy()
+        strategy._update_units(request, inventory)
+        # Verify
+        updated = sorted(c[0][1]['unit_id'] for c in mock_add_unit.call_args_list)
+        self.assertEqual(updated, [0, 1])
+
+    @patch('pulp_node.conduit.NodesConduit.get_units')
+    @patch('pulp_node.manifest.RemoteManifest.fetch_deltas', return_value=[])
+    @patch('pulp_node.manifest.RemoteManifest.deltas_since', return_value=[{}])
+    @patch('pulp_node.manifest.RemoteManifest.fetch', autospec=True)
+    def test_delta_inventory(self, mock_fetch, mock_deltas_since, mock_fetch_deltas,
+                             mock_get_units):
+        # Setup
+        def fetch(manifest):
+            manifest.id = 'def'
+            manifest.publishing_details = {constants.BASE_URL: BASE_URL}
+        mock_fetch.side_effect = fetch
+        request = self.request()
+        request.conduit.scratchpad = {
+            PROCESSED_MANIFEST_ID: 'abc', PROCESSED_STRATEGY: 'ImporterStrategy'}
+        # Test
+        strategy = ImporterStrategy()
+        inventory = strategy._unit_inventory(request)
+        # Verify
+        self.assertTrue(isinstance(inventory, DeltaInventory))
+        self.assertEqual(request.manifest_id, 'def')
+        mock_deltas_since.assert_called_with('abc')
+        mock_fetch_deltas.assert_called_with([{}])
+        self.assertFalse(mock_get_units.called)
+
+    @patch('pulp_node.conduit.NodesConduit.get_units', side_effect=ValueError())
+    @patch('pulp_node.importers.strategies.ImporterStrategy._deltas_applicable',
+           return_value=False)
+    @patch('pulp_node.manifest.RemoteManifest.fetch_deltas')
+    @patch('pulp_node.manifest.RemoteManifest.deltas_since', return_value=[{}])
+    @patch('pulp_node.manifest.RemoteManifest.fetch', autospec=True)
+    def test_delta_inventory_not_applicable(self, mock_fetch, mock_deltas_since,
+                                            mock_fetch_deltas, mock_applicable, mock_get_units):
+        # Setup
+        def fetch(manifest):
+            manifest.id = 'def'
+            manifest.publishing_details = {constants.BASE_URL: BASE_URL}
+        mock_fetch.side_effect = fetch
+        mock_fetch_deltas.return_value = TestUnits()
+        request = self.request()
+        # Test
+        strategy = ImporterStrategy()
+        self.assertRaises(GetChildUnitsError, strategy._unit_inventory, request)
+        # Verify
+        self.assertTrue(mock_fetch_deltas.return_value.closed)
+        # the full inventory is built instead
+        self.assertTrue(mock_get_units.called)
+        self.assertEqual(request.manifest_id, None)
+
+    @patch('pulp_node.conduit.NodesConduit.units_changed')
+    def test_mirror_deltas_applicable(self, mock_units_changed):
+        # Setup
+        processed = ['2015-01-01T00:00:00Z', None]
+        inventory = DeltaInventory(BASE_URL, [], None)
+        manifest = Mock()
+        request = self.request()
+        request.conduit.scratchpad = {PROCESSED_UNITS_CHANGED: processed}
+        strategy = Mirror()
+        # Test and Verify
+        mock_units_changed.return_value = list(processed)
+        self.assertTrue(strategy._deltas_applicable(request, manifest, inventory))
+        mock_units_changed.assert_called_with(REPO_ID)
+        # units were added to or removed from the child, even if as many as were removed
+        for changed in (['2015-01-02T00:00:00Z', None],
+                        ['2015-01-01T00:00:00Z', '2015-01-02T00:00:00Z']):
+            mock_units_changed.return_value = changed
+            self.assertFalse(strategy._deltas_applicable(request, manifest, inventory))
+        # not recorded by an earlier version
+        request.conduit.scratchpad = {}
+        mock_units_changed.return_value = list(processed)
+        self.assertFalse(strategy._deltas_applicable(request, manifest, inventory))
+        # additive synchronization does not need to restore the child
+        self.assertTrue(Additive()._deltas_applicable(request, manifest, inventory))
+
+    def test_delta_inventory_changes(self):
+        # Setup
+        def delta(change, n):
+            unit = dict(type_id='T', unit_key={1: n})
+            if change != DELTA_REMOVED:
+                unit['metadata'] = {}
+            unit[DELTA] = change
+            return unit, TestUnitRef(unit)
+        deltas = [
+            delta(DELTA_ADDED, 4),
+            delta(DELTA_UPDATED, 1),
+            delta(DELTA_UPDATED, 4),
+            delta(DELTA_REMOVED, 2),
+            delta(DELTA_REMOVED, 5),
+            delta(DELTA_ADDED, 6),
+            delta(DELTA_REMOVED, 6),
+            delta(DELTA_REMOVED, 3),
+            delta(DELTA_ADDED, 3),
+        ]
+        request = self.request()
+        strategy = ImporterStrategy()
+        find_child_unit = partial(strategy._find_child_unit, request)
+        # Test
+        inventory = DeltaInventory(BASE_URL, deltas, find_child_unit)
+        # Verify
+        added = [u['unit_key'] for u, r in inventory.units_on_parent_only()]
+        updated = [u['unit_key'] for u, r in inventory.updated_units()]
+        removed = inventory.units_on_child_only()
+        self.assertEqual(added, [{1: 4}])
+        self.assertEqual(sorted(updated), [{1: 1}, {1: 3}])
+        self.assertEqual(len(removed), 1)
+        self.assertEqual(removed[0]['unit_key'], {1: 2})
+
+    def test_delta_inventory_close(self):
+        # Setup
+        deltas = TestUnits()
+        inventory = DeltaInventory(BASE_URL, deltas, None)
+        # Test
+        inventory.close()
+        # Verify
+        self.assertTrue(deltas.closed)
+
+    @patch('pulp_node.importers.strategies.ImporterStrategy._delete_units')
+    @patch('pulp_node.importers.strategies.ImporterStrategy._update_units')
+    @patch('pulp_node.importers.strategies.ImporterStrategy._add_units', side_effect=ValueError())
+    @patch('pulp_node.importers.strategies.ImporterStrategy._unit_inventory')
+    def test_inventory_closed(self, mock_inventory, *unused):
+        # Setup
+        request = self.request()
+        for strategy in (Mirror(), Additive()):
+            mock_inventory.return_value.close.reset_mock()
+            # Test
+            self.assertRaises(ValueError, strategy._synchronize, request)
+            # Verify
+            mock_inventory.return_value.close.assert_called_once_with()
+
+    @patch('pulp_node.conduit.NodesConduit.units_changed', return_value=[None, None])
+    def test_manifest_processed(self, mock_units_changed):
+        # Setup
+        request = self.request()
+        request.manifest_id = 'abc'
+        strategy = ImporterStrategy()
+        # Test
+        strategy._manifest_processed(request)
+        # Verify
+        mock_units_changed.assert_called_once_with(REPO_ID)
+        self.assertEqual(request.conduit.scratchpad, {
+            PROCESSED_MANIFEST_ID: 'abc', PROCESSED_STRATEGY: 'ImporterStrategy',
+            PROCESSED_UNITS_CHANGED: [None, None]})
+        self.assertEqual(strategy._processed_manifest_id(request), 'abc')
+        self.assertEqual(Mirror()._processed_manifest_id(request), None)
+
+    def test_manifest_processed_errors(self):
+        # Setup
+        request = self.request()
+        request.manifest_id = 'abc'
+        request.summary.errors.append(UNIT_ERROR)
+        strategy = ImporterStrategy()
+        # Test
+        strategy._manifest_processed(request)
+        # Verify
+        self.assertEqual(request.conduit.scratchpad, None)
+        self.assertEqual(strategy._processed_manifest_id(request), None)
+
     def test_needs_update(self):
         # Setup
         path = os.path.join(self.tmp_dir, 'unit_1')
@@ -260,3 +461,64 @@ class TestBase(TestCase):
         for name, strategy in STRATEGIES.items():
             self.assertEqual(find_strategy(name), strategy)
         self.assertRaises(StrategyUnsupported, find_strategy, '---')
+
+
+class TestUnitInventory(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_inventory(self):
+        # Setup
+        parent_units = [dict(unit_id=n, type_id='T', unit_key={'n': n}, metadata={},
+                             last_updated=2) for n in range(10)]
+        child_units = [dict(unit_id=n, type_id='T', unit_key={'n': n}, metadata={},
+                            last_updated=n % 3) for n in range(5, 15)]
+        manifest = TestManifest(parent_units)
+        # Test
+        inventory = UnitInventory(BASE_URL, manifest.get_units(), child_units, self.tmp_dir, 3)
+        # Verify
+        self.assertEqual(len(inventory.units_on_parent_only()), 5)
+        self.assertEqual(len(inventory.units_on_child_only()), 5)
+        added = sorted(u['unit_id'] for u, r in inventory.units_on_parent_only())
+        removed = sorted(u['unit_id'] for u in inventory.units_on_child_only())
+        updated = sorted(r.fetch()['unit_id'] for u, r in inventory.updated_units())
+        self.assertEqual(added, range(5))
+        self.assertEqual(removed, range(10, 15))
+        self.assertEqual(updated, [6, 7, 9])
+        self.assertFalse('metadata' in inventory.units_on_parent_only().records[0][0])
+        inventory.close()
+        self.assertTrue(manifest.units.closed)
+        self.assertTrue(inventory.units_on_child_only().fp.closed)
+
+    def test_duplicates(self):
+        # Setup
+        child_units = [dict(unit_id=n, type_id='T', unit_key={}) for n in range(5)]
+        # Test
+        inventory = UnitInventory(BASE_URL, [], child_units, self.tmp_dir, 2)
+        # Verify
+        self.assertEqual([u['unit_id'] for u in inventory.units_on_child_only()], [4])
+
+    def test_spool(self):
+        # Setup
+        path = os.path.join(self.tmp_dir, 'units.json.gz')
+        with UnitWriter(path, block_size=100) as writer:
+            for n in range(10):
+                writer.add(dict(unit_id=n, type_id='T', unit_key={}))
+        units_file = UnitsFile(path, writer.blocks)
+        spool = Spool(self.tmp_dir, 4)
+        # Test
+        for unit, ref in units_file.get_units():
+            spool.append((unit, ref))
+        # Verify
+        self.assertEqual(len(spool), 10)
+        self.assertEqual(len(spool.records), 2)
+        for n, (unit, ref) in enumerate(spool):
+            self.assertEqual(unit['unit_id'], n)
+            self.assertTrue(ref.units_file is units_file)
+            self.assertEqual(ref.fetch(), unit)
+        self.assertEqual(len(list(spool)), 10)
+        units_file.close()
@@ -14,9 +14,12 @@ import tempfile
 import shutil
 import gzip
 import json
+import zlib
 
 from unittest import TestCase
 
+from mock import patch
+
 from nectar.downloaders.local import LocalFileDownloader
 from nectar.config import DownloaderConfig
 
@@ -122,13 +125,152 @@ class TestManifest(TestCase):
             _unit = ref.fetch()
             self.assertEqual(unit, _unit)
         self.verify(units, units_in)
-        # should already be unzipped
+        # read in place
         self.assertTrue(manifest.is_valid())
         self.assertTrue(manifest.has_valid_units())
-        self.assertFalse(manifest.units_path().endswith('.gz'))
+        self.assertTrue(manifest.units_path().endswith('.gz'))
         units_in = []
         for unit, ref in manifest.get_units():
             units_in.append(unit)
             _unit = ref.fetch()
             self.assertEqual(unit, _unit)
-        self.verify(units, units_in)
\ No newline at end of file
+        self.verify(units, units_in)
+
+    def test_round_trip_unindexed(self):
+        """
+        Units files published without an index of blocks are uncompressed and read.
+        """
+        # Setup
+        units = []
+        for i in range(0, self.NUM_UNITS):
+            unit = dict(unit_id=i, type_id='T', unit_key={})
+            units.append(unit)
+        units_path = os.path.join(self.tmp_dir, UNITS_FILE_NAME)
+        fp = gzip.open(units_path, 'wb')
+        for u in units:
+            fp.write(json.dumps(u) + '\n')
+        fp.close()
+        manifest = Manifest(self.tmp_dir, self.MANIFEST_ID)
+        manifest.units[UNITS_TOTAL] = self.NUM_UNITS
+        manifest.units[UNITS_SIZE] = os.path.getsize(units_path)
+        manifest.write()
+        # Test
+        manifest = Manifest(self.tmp_dir)
+        manifest.read()
+        units_in = []
+        for unit, ref in manifest.get_units():
+            units_in.append(unit)
+            self.assertEqual(unit, ref.fetch())
+        # Verify
+        self.verify(units, units_in)
+        self.assertFalse(manifest.units_path().endswith('.gz'))
+        refs = [ref for unit, ref in manifest.get_units()]
+        self.assertEqual(fetch_units(refs[::-1]), units[::-1])
+
+    def test_blocks(self):
+        # Setup
+        units = []
+        for i in range(0, self.NUM_UNITS):
+            unit = dict(unit_id=i, type_id='T', unit_key={}, metadata={'x': 'y' * i})
+            units.append(unit)
+        units_path = os.path.join(self.tmp_dir, UNITS_FILE_NAME)
+        # Test
+        with UnitWriter(units_path, block_size=100) as writer:
+            for u in units:
+                writer.add(u)
+        manifest = Manifest(self.tmp_dir, self.MANIFEST_ID)
+        manifest.units_published(writer)
+        # Verify
+        self.assertTrue(len(writer.blocks) > 1)
+        self.assertEqual(manifest.units[UNITS_BLOCKS], writer.blocks)
+        self.assertEqual(sum(length for offset, length in writer.blocks), writer.bytes_written)
+        # still a plain gzip file
+        fp = gzip.open(units_path)
+        units_in = [json.loads(line) for line in fp]
+        fp.close()
+        self.verify(units, units_in)
+        # read in place
+        units_iterator = manifest.get_units()
+        self.assertEqual(len(units_iterator), self.NUM_UNITS)
+        units_read = list(units_iterator)
+        self.verify(units, [u for u, ref in units_read])
+        refs = [ref for u, ref in units_read]
+        with patch('zlib.decompress', wraps=zlib.decompress) as mock_decompress:
+            fetched = fetch_units(refs[::-1])
+        self.assertEqual(fetched, units[::-1])
+        # each block is uncompressed once
+        self.assertEqual(mock_decompress.call_count, len(writer.blocks))
+        units_file = units_iterator.units_files[0]
+        units_iterator.close()
+        self.assertTrue(units_file.fp.closed)
+        # closing again is harmless
+        units_iterator.close()
+
+    def test_no_units(self):
+        manifest = Manifest(self.tmp_dir, self.MANIFEST_ID)
+        units_iterator = manifest.get_units()
+        self.assertEqual(len(units_iterator), 0)
+        self.assertEqual(list(units_iterator), [])
+        units_iterator.close()
+
+    def test_deltas_since(self):
+        manifest = Manifest(self.tmp_dir, 'c')
+        manifest.deltas = [
+            {DELTA_FROM: 'x', DELTA_TO: 'a'},
+            {DELTA_FROM: 'a', DELTA_TO: 'b'},
+            {DELTA_FROM: 'b', DELTA_TO: 'c'},
+        ]
+        self.assertEqual(manifest.deltas_since('a'), manifest.deltas[1:])
+        self.assertEqual(manifest.deltas_since('c'), [])
+        self.assertEqual(manifest.deltas_since('z'), None)
+        self.assertEqual(manifest.deltas_since(None), None)
+        # broken chain
+        manifest.deltas[1][DELTA_TO] = 'z'
+        self.assertEqual(manifest.deltas_since('x'), None)
+        self.assertEqual(manifest.deltas_since('b'), manifest.deltas[2:])
+        # not valid
+        manifest.version += 1
+        self.assertEqual(manifest.deltas_since('b'), None)
+
+    def test_delta_writer(self):
+        # Setup
+        previous = [dict(type_id='T', unit_key={'n': n}, metadata={'v': 1}) for n in range(3)]
+        units = [dict(type_id='T', unit_key={'n': 0}, metadata={'v': 1}),
+                 dict(type_id='T', unit_key={'n': 1}, metadata={'v': 2}),
+                 dict(type_id='T', unit_key={'n': 3}, metadata={'v': 1})]
+        path = os.path.join(self.tmp_dir, DELTAS_DIR, 'a.json.gz')
+        # Test
+        with DeltaWriter(path, [(u, None) for u in previous]) as writer:
+            for unit in units:
+                writer.add(unit)
+        delta = writer.delta('a', 'b', 'deltas/a.json.gz')
+        # Verify
+        self.assertEqual(delta[DELTA_FROM], 'a')
+        self.assertEqual(delta[DELTA_TO], 'b')
+        self.assertEqual(delta[UNITS_TOTAL], 3)
+        self.assertEqual(delta[UNITS_SIZE], os.path.getsize(path))
+        units_file = UnitsFile(path, delta[UNITS_BLOCKS])
+        changes = [(u[DELTA], u['unit_key']['n']) for u, ref in units_file.get_units()]
+        units_file.close()
+        self.assertEqual(changes, [(DELTA_UPDATED, 1), (DELTA_ADDED, 3), (DELTA_REMOVED, 2)])
+        self.assertFalse(DELTA in units[1])
+
+    def test_link_deltas(self):
+        source_dir = os.path.join(self.tmp_dir, 'source')
+        destination_dir = os.path.join(self.tmp_dir, 'destination')
+        os.makedirs(os.path.join(source_dir, DELTAS_DIR))
+        with open(os.path.join(source_dir, DELTAS_DIR, 'a.json.gz'), 'w') as fp:
+            fp.write('delta')
+        # Test
+        link_deltas([{UNITS_PATH: 'deltas/a.json.gz'}], source_dir, destination_dir)
+        # Verify
+        with open(os.path.join(destination_dir, DELTAS_DIR, 'a.json.gz')) as fp:
+            self.assertEqual(fp.read(), 'delta')
+
+    def test_read_write_deltas(self):
+        manifest = Manifest(self.tmp_dir, 'b')
+        manifest.deltas = [{DELTA_FROM: 'a', DELTA_TO: 'b'}]
+        manifest.write()
+        manifest = Manifest(self.tmp_dir)
+        manifest.read()
+        self.assertEqual(manifest.deltas, [{DELTA_FROM: 'a', DELTA_TO: 'b'}])
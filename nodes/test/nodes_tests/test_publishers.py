@@ -21,7 +21,8 @@ from nectar.config import DownloaderConfig
 from pulp_node import constants
 from pulp_node import pathlib
 from pulp_node.distributors.http.publisher import HttpPublisher
-from pulp_node.manifest import RemoteManifest
+from pulp_node.manifest import (RemoteManifest, DELTA, DELTA_ADDED, DELTA_FROM,
+                                DELTA_REMOVED, DELTA_UPDATED, UNITS_TOTAL)
 
 
 class TestHttp(TestCase):
@@ -157,3 +158,45 @@ class TestHttp(TestCase):
             p.publish(units)
         # verify
         self.assertFalse(os.path.exists(p.tmp_dir))
+
+    def test_deltas(self):
+        # setup
+        repo_id = 'test_repo'
+        base_url = 'file://'
+        publish_dir = os.path.join(self.tmpdir, 'nodes/repos')
+        repo_publish_dir = os.path.join(publish_dir, repo_id)
+        virtual_host = (publish_dir, publish_dir)
+        units = self.populate()
+        # test
+        # publish all, then change the units and publish again
+        with HttpPublisher(base_url, virtual_host, repo_id, repo_publish_dir) as p:
+            p.publish([dict(u) for u in units])
+            p.commit()
+        with open(units[1]['storage_path'], 'a') as fp:
+            fp.write('updated')
+        units = [units[0], units[1], dict(units[0], unit_key={'n': 3})]
+        with HttpPublisher(base_url, virtual_host, repo_id, repo_publish_dir) as p:
+            p.publish([dict(u) for u in units])
+            p.commit()
+        with HttpPublisher(base_url, virtual_host, repo_id, repo_publish_dir) as p:
+            p.publish([dict(u) for u in units])
+            p.commit()
+        # verify
+        conf = DownloaderConfig()
+        downloader = LocalFileDownloader(conf)
+        working_dir = os.path.join(self.tmpdir, 'working_dir')
+        os.makedirs(working_dir)
+        url = pathlib.url_join(base_url, p.manifest_path())
+        manifest = RemoteManifest(url, downloader, working_dir)
+        manifest.fetch()
+        self.assertEqual(len(manifest.deltas), 2)
+        first_id = manifest.deltas[0][DELTA_FROM]
+        deltas = manifest.deltas_since(first_id)
+        self.assertEqual(deltas, manifest.deltas)
+        changes = [(unit[DELTA], unit['unit_key']['n'])
+                   for unit, ref in manifest.fetch_deltas(deltas)]
+        self.assertEqual(changes, [(DELTA_UPDATED, 1), (DELTA_ADDED, 3), (DELTA_REMOVED, 2)])
+        # nothing changed in the last publish
+        self.assertEqual(manifest.deltas[1][UNITS_TOTAL], 0)
+        self.assertEqual(manifest.deltas_since(manifest.id), [])
+        self.assertEqual(manifest.deltas_since('unknown'), None)
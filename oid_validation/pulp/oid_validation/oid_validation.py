@@ -11,12 +11,21 @@ The OID structure follows the Red Hat model. Download URLs are found at:
   1.3.6.1.4.1.2312.9.2.*.1.6
 
 The * represents the product ID and is not used as part of this calculation.
+
+Unless a config is passed to it, the authenticate method uses a single validator for the whole
+process. The validator keeps the protected repo listings and the CA bundles in memory, and reads
+them again only when their files change. It also remembers for a short time whether a client
+certificate was verified against a CA bundle, since yum clients make many requests in a row
+with the same certificate.
 '''
 
 from ConfigParser import NoOptionError, SafeConfigParser
+import hashlib
+import threading
 
 from rhsm import certificate
 
+from pulp.common.cache import TTLCache, file_stamp
 from pulp.repoauth.protected_repo_utils import ProtectedRepoUtils
 from pulp.repoauth.repo_cert_utils import RepoCertUtils
 
@@ -24,6 +33,18 @@ from pulp.repoauth.repo_cert_utils import RepoCertUtils
 # separate config file for repo auth purposes is used.
 CONFIG_FILENAME = '/etc/pulp/repo_auth.conf'
 
+# number of seconds certificate verifications and parsed certificates are remembered
+CACHE_TTL = 60
+# maximum number of certificate verifications and parsed certificates remembered
+CACHE_SIZE = 1024
+
+# stands for a file whose contents were never loaded
+_NOT_LOADED = object()
+
+_validator = None
+_validator_stamp = _NOT_LOADED
+_validator_lock = threading.Lock()
+
 
 def authenticate(environ, config=None):
     '''
@@ -32,9 +53,10 @@ def authenticate(environ, config=None):
     cert_pem = environ["mod_ssl.var_lookup"]("SSL_CLIENT_CERT")
 
     if config is None:
-        config = _config()
+        validator = _process_validator()
+    else:
+        validator = OidValidator(config)
 
-    validator = OidValidator(config)
     valid = validator.is_valid(environ["REQUEST_URI"], cert_pem,
                                environ["wsgi.errors"].write)
     return valid
@@ -46,12 +68,76 @@ def _config():
     return config
 
 
+def _process_validator():
+    '''
+    Returns the validator shared by the whole process, replacing it with a new one if the config
+    file changed since it was created.
+    '''
+    global _validator, _validator_stamp
+    stamp = file_stamp(CONFIG_FILENAME)
+    with _validator_lock:
+        if _validator is None or stamp != _validator_stamp:
+            _validator = OidValidator(_config())
+            _validator_stamp = stamp
+        return _validator
+
+
+class _ProtectedRepoIndex(object):
+    '''
+    Finds the protected repo a request is made against. The relative paths of the protected
+    repos are held in a trie of their path segments.
+    '''
+
+    def __init__(self, listings):
+        '''
+        @param listings: mapping of relative path URL to repo ID
+        @type  listings: dict {str, str}
+        '''
+        # each node is a list of its child nodes keyed by path segment, and the ID of the repo
+        # whose relative path ends at the node
+        self._root = [{}, None]
+        for relative_repo_url, repo_id in listings.items():
+            node = self._root
+            for segment in _segments(relative_repo_url):
+                node = node[0].setdefault(segment, [{}, None])
+            node[1] = repo_id
+
+    def find(self, repo_url):
+        '''
+        Returns the ID of a protected repo whose relative path appears in the given URL, or None.
+
+        Relative URL is inconsistent in Pulp, so the relative paths are matched starting at any
+        segment of the URL. This handles a leading / that is missing, present, or duplicated.
+        '''
+        segments = _segments(repo_url)
+        for start in range(len(segments) + 1):
+            node = self._root
+            for segment in segments[start:]:
+                if node[1] is not None:
+                    break
+                node = node[0].get(segment)
+                if node is None:
+                    break
+            if node is not None and node[1] is not None:
+                return node[1]
+        return None
+
+
+def _segments(url):
+    return [segment for segment in url.split('/') if segment]
+
+
 class OidValidator:
     def __init__(self, config):
         self.config = config
         self.repo_cert_utils = RepoCertUtils(config)
         self.protected_repo_utils = ProtectedRepoUtils(config)
         self.repo_url_prefixes = self._get_repo_url_prefixes_from_config(config)
+        # mapping of a file key to the stamp of the file and the data loaded from it
+        self._loaded = {}
+        self._loaded_lock = threading.Lock()
+        self._verifications = TTLCache(CACHE_SIZE, CACHE_TTL)
+        self._certificates = TTLCache(CACHE_SIZE, CACHE_TTL)
 
     def is_valid(self, dest, cert_pem, log_func):
         '''
@@ -73,8 +159,7 @@ class OidValidator:
         repo_bundle = self._matching_repo_bundle(dest, self.repo_url_prefixes)
         # Load the global repo auth cert bundle and check it's CA against the client cert
         # if it didn't already pass the individual auth check
-        global_bundle = self.repo_cert_utils.read_global_cert_bundle(log_func=log_func,
-                                                                     pieces=['ca'])
+        global_bundle = self._global_bundle(log_func)
         # If there were neither global nor repo auth credentials, auth passes.
         if global_bundle is None and repo_bundle is None:
             if self.repo_cert_utils.log_failed_cert_verbose:
@@ -91,8 +176,7 @@ class OidValidator:
                     return False
 
                 # Make sure the client cert is signed by the correct CA
-                is_valid = self.repo_cert_utils.validate_certificate_pem(
-                    cert_pem, repo_bundle['ca'], log_func=log_func)
+                is_valid = self._validate_certificate_pem(cert_pem, repo_bundle['ca'], log_func)
                 if not is_valid:
                     log_func('Client certificate did not match the repo consumer CA certificate')
                     return False
@@ -108,8 +192,7 @@ class OidValidator:
                     return False
 
                 # Make sure the client cert is signed by the correct CA
-                is_valid = self.repo_cert_utils.validate_certificate_pem(
-                    cert_pem, global_bundle['ca'], log_func=log_func)
+                is_valid = self._validate_certificate_pem(cert_pem, global_bundle['ca'], log_func)
                 if not is_valid:
                     log_func('Client certificate did not match the global repo auth CA certificate')
                     return False
@@ -125,7 +208,9 @@ class OidValidator:
     def _matching_repo_bundle(self, dest, repo_url_prefixes):
 
         # Load the path -> repo ID mappings
-        prot_repos = self.protected_repo_utils.read_protected_repo_listings()
+        listing_file = self.config.get('repos', 'protected_repo_listing_file')
+        index = self._load('listings', listing_file, lambda: _ProtectedRepoIndex(
+            self.protected_repo_utils.read_protected_repo_listings()))
 
         repo_id = None
         for prefix in repo_url_prefixes:
@@ -134,16 +219,9 @@ class OidValidator:
             #   Repo Portion: /my-repo/pulp/fedora-13/i386/repodata/repomd.xml
             repo_url = dest[dest.find(prefix) + len(prefix):]
 
-            # If the repo portion of the URL starts with any of the protected relative URLs,
+            # If the repo portion of the URL contains any of the protected relative URLs,
             # it is considered to be a request against that protected repo
-            for relative_repo_url in prot_repos.keys():
-
-                # Relative URL is inconsistent in Pulp, so a simple "startswith" tends to
-                # break. Changing this to a find helps remove issues where the leading /
-                # is missing, present, or duplicated.
-                if repo_url.find(relative_repo_url) != -1:
-                    repo_id = prot_repos[relative_repo_url]
-                    break
+            repo_id = index.find(repo_url)
 
             # break out of checking URLs once we find a matching repo id
             if repo_id:
@@ -152,9 +230,66 @@ class OidValidator:
         # if we did not find a repo, return None
         if not repo_id:
             return None
-        bundle = self.repo_cert_utils.read_consumer_cert_bundle(repo_id, ['ca'])
+        filenames = self.repo_cert_utils.consumer_cert_bundle_filenames(repo_id, ['ca']) or {}
+        bundle = self._load(('consumer', repo_id), filenames.get('ca'),
+                            lambda: self.repo_cert_utils.read_consumer_cert_bundle(repo_id, ['ca']))
         return bundle
 
+    def _global_bundle(self, log_func):
+        '''
+        Returns the CA of the global repo auth cert bundle, or None if there is none.
+        '''
+        filenames = self.repo_cert_utils.global_cert_bundle_filenames(['ca']) or {}
+        return self._load('global', filenames.get('ca'),
+                          lambda: self.repo_cert_utils.read_global_cert_bundle(log_func=log_func,
+                                                                               pieces=['ca']))
+
+    def _load(self, key, filename, loader):
+        '''
+        Returns the data loaded from a file by the given loader. The data is kept in memory, and
+        loaded again only when the file changes.
+
+        @param key: identifies the data
+        @param filename: the file the data is loaded from, or None if it does not exist
+        @type  filename: str or None
+        @param loader: callable that loads the data
+        @type  loader: callable taking no arguments
+        '''
+        stamp = None
+        if filename is not None:
+            stamp = file_stamp(filename)
+        with self._loaded_lock:
+            loaded_stamp, data = self._loaded.get(key, (_NOT_LOADED, None))
+        if loaded_stamp != stamp:
+            data = loader()
+            with self._loaded_lock:
+                self._loaded[key] = (stamp, data)
+        return data
+
+    def _validate_certificate_pem(self, cert_pem, ca_pem, log_func):
+        '''
+        Validates a certificate against CA certificates, remembering the result for a short
+        time.
+        '''
+        key = (hashlib.sha256(cert_pem).digest(), hashlib.sha256(ca_pem).digest())
+        is_valid = self._verifications.get(key)
+        if is_valid is None:
+            is_valid = self.repo_cert_utils.validate_certificate_pem(cert_pem, ca_pem,
+                                                                     log_func=log_func)
+            self._verifications.set(key, is_valid)
+        return is_valid
+
+    def _entitlement_certificate(self, cert_pem):
+        '''
+        Parses a client certificate, remembering the result for a short time.
+        '''
+        key = hashlib.sha256(cert_pem).digest()
+        cert = self._certificates.get(key)
+        if cert is None:
+            cert = certificate.create_from_pem(cert_pem)
+            self._certificates.set(key, cert)
+        return cert
+
     def _check_extensions(self, cert_pem, dest, log_func, repo_url_prefixes):
         """
         Checks the requested destination path against the entitlement cert.
@@ -170,7 +305,7 @@ class OidValidator:
         :return: True iff request is authorized, else False
         :rtype:  bool
         """
-        cert = certificate.create_from_pem(cert_pem)
+        cert = self._entitlement_certificate(cert_pem)
 
         valid = False
         for prefix in repo_url_prefixes:
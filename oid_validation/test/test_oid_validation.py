@@ -695,6 +695,97 @@ class TestOidValidation(unittest.TestCase):
         self.assertEquals(result, ["/pulp/repos", "/pulp/ostree/web"])
 
 
+class TestProtectedRepoIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = oid_validation._ProtectedRepoIndex({
+            '/pulp/pulp/fedora-14/x86_64': 'repo-x',
+            'pulp/fedora-13/x86_64/': 'repo-y'})
+
+    def test_find_leading_slash(self):
+        self.assertEqual(self.index.find('/pulp/pulp/fedora-14/x86_64/repodata/'), 'repo-x')
+        self.assertEqual(self.index.find('pulp/pulp/fedora-14/x86_64/repodata/'), 'repo-x')
+        self.assertEqual(self.index.find('//pulp/fedora-13/x86_64/Packages/a.rpm'), 'repo-y')
+
+    def test_find_inside_url(self):
+        self.assertEqual(self.index.find('/repos/pulp/pulp/fedora-14/x86_64/'), 'repo-x')
+
+    def test_find_no_match(self):
+        self.assertEqual(self.index.find('/pulp/pulp/fedora-14/'), None)
+        self.assertEqual(self.index.find('/pulp/pulp/fedora-15/x86_64/'), None)
+        self.assertEqual(self.index.find(''), None)
+
+
+class TestOidValidatorCaching(unittest.TestCase):
+
+    def setUp(self):
+        self.config = SafeConfigParser()
+        self.config.read(CONFIG_FILENAME)
+        self.validator = oid_validation.OidValidator(self.config)
+
+    @mock.patch('pulp.oid_validation.oid_validation.file_stamp')
+    def test_load(self, mock_stamp):
+        loader = mock.Mock(side_effect=['first', 'second'])
+        mock_stamp.side_effect = [(1, 10), (1, 10), (2, 10)]
+
+        results = [self.validator._load('key', 'file', loader) for i in range(3)]
+
+        self.assertEqual(results, ['first', 'first', 'second'])
+        self.assertEqual(loader.call_count, 2)
+
+    @mock.patch('pulp.oid_validation.oid_validation.file_stamp')
+    def test_load_missing_file(self, mock_stamp):
+        loader = mock.Mock(return_value=None)
+
+        self.assertEqual(self.validator._load('key', None, loader), None)
+        self.assertEqual(self.validator._load('key', None, loader), None)
+
+        self.assertEqual(loader.call_count, 1)
+        self.assertEqual(mock_stamp.call_count, 0)
+
+    @mock.patch('pulp.oid_validation.oid_validation.RepoCertUtils.validate_certificate_pem',
+                return_value=True)
+    def test_validate_certificate_pem_cached(self, validate_certificate_pem):
+        log_func = mock.Mock()
+
+        for i in range(2):
+            self.assertTrue(self.validator._validate_certificate_pem(FULL_CLIENT_CERT,
+                                                                     VALID_CA, log_func))
+        self.validator._validate_certificate_pem(FULL_CLIENT_CERT, INVALID_CA, log_func)
+
+        self.assertEqual(validate_certificate_pem.call_args_list, [
+            mock.call(FULL_CLIENT_CERT, VALID_CA, log_func=log_func),
+            mock.call(FULL_CLIENT_CERT, INVALID_CA, log_func=log_func)])
+
+    @mock.patch('pulp.oid_validation.oid_validation.certificate.create_from_pem')
+    def test_entitlement_certificate_cached(self, create_from_pem):
+        create_from_pem.return_value.check_path.return_value = True
+        log_func = mock.Mock()
+
+        for i in range(2):
+            self.assertTrue(self.validator._check_extensions(
+                FULL_CLIENT_CERT, '/pulp/repos/repos/pulp/pulp/fedora-14/x86_64/', log_func,
+                ['/pulp/repos']))
+        cert = self.validator._entitlement_certificate(FULL_CLIENT_CERT)
+
+        # the certificate is parsed once
+        create_from_pem.assert_called_once_with(FULL_CLIENT_CERT)
+        self.assertTrue(cert is create_from_pem.return_value)
+
+    @mock.patch('pulp.oid_validation.oid_validation._validator', None)
+    @mock.patch('pulp.oid_validation.oid_validation._config')
+    @mock.patch('pulp.oid_validation.oid_validation.file_stamp')
+    def test_process_validator(self, mock_stamp, mock_config):
+        mock_config.return_value = self.config
+        mock_stamp.side_effect = [(1, 10), (1, 10), (2, 10)]
+
+        validators = [oid_validation._process_validator() for i in range(3)]
+
+        self.assertTrue(validators[0] is validators[1])
+        self.assertFalse(validators[1] is validators[2])
+        self.assertEqual(mock_config.call_count, 2)
+
+
 # -- test data ---------------------------------------------------------------------
 
 ANYCERT = """
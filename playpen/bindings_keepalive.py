@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+#
+# Measures the latency of bindings calls against a Pulp server, with and without keeping
+# connections alive between requests.
+#
+# ./bindings_keepalive.py -H localhost -u admin -p admin -n 100
+#
+
+from optparse import OptionParser
+from time import time
+
+from pulp.bindings.server import PulpConnection, DEFAULT_POOL_SIZE
+
+
+def measure(options, pool_size):
+    connection = PulpConnection(
+        options.host,
+        username=options.user,
+        password=options.password,
+        verify_ssl=options.verify_ssl,
+        pool_size=pool_size)
+    started = time()
+    for n in range(options.count):
+        connection.GET('/v2/status/')
+    elapsed = time() - started
+    return elapsed, elapsed / options.count * 1000
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-H', '--host', default='localhost', help='pulp server')
+    parser.add_option('-u', '--user', default='admin', help='user name')
+    parser.add_option('-p', '--password', default='admin', help='password')
+    parser.add_option('-n', '--count', type='int', default=100, help='number of requests')
+    parser.add_option('-k', '--insecure', dest='verify_ssl', action='store_false', default=True,
+                      help='do not verify the server certificate')
+    options, args = parser.parse_args()
+    for label, pool_size in (('new connection per request', 0),
+                             ('keep-alive pool', DEFAULT_POOL_SIZE)):
+        elapsed, latency = measure(options, pool_size)
+        print '%-30s %8.2f s total %8.2f ms/request' % (label, elapsed, latency)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,11 +6,19 @@ doesn't care at all about repo authentication.
 '''
 
 from ConfigParser import SafeConfigParser
+import threading
+
+from pulp.common.cache import file_stamp
 
 # This needs to be accessible on both Pulp and the CDS instances, so a
 # separate config file for repo auth purposes is used.
 CONFIG_FILENAME = '/etc/pulp/repo_auth.conf'
 
+# The config is read once per process and again only when the file changes
+_cached_config = None
+_cached_config_stamp = None
+_cached_config_lock = threading.Lock()
+
 
 # -- framework------------------------------------------------------------------
 
@@ -18,7 +26,7 @@ def authenticate(environ):
     '''
     Framework hook method.
     '''
-    config = _config()
+    config = cached_config()
     is_enabled = config.getboolean('main', 'enabled')
     is_verbose = config.getboolean('main', 'log_failed_cert_verbose')
     if not is_enabled and is_verbose:
@@ -33,3 +41,18 @@ def _config():
     config = SafeConfigParser()
     config.read(CONFIG_FILENAME)
     return config
+
+
+def cached_config():
+    '''
+    Returns the repo auth config shared by the whole process, reading the file again only if it
+    changed since it was last read.
+    '''
+    global _cached_config, _cached_config_stamp
+    stamp = file_stamp(CONFIG_FILENAME)
+    with _cached_config_lock:
+        if _cached_config is None or stamp != _cached_config_stamp:
+            _cached_config = _config()
+            _cached_config_stamp = stamp
+        return _cached_config
+
@@ -1,4 +1,5 @@
-from ConfigParser import SafeConfigParser
+import threading
+
 from pkg_resources import iter_entry_points
 
 from pulp.repoauth import auth_enabled_validation
@@ -6,6 +7,12 @@ from pulp.repoauth import auth_enabled_validation
 AUTH_ENTRY_POINT = 'pulp_content_authenticators'
 CONFIG_FILENAME = '/etc/pulp/repo_auth.conf'
 
+# Entry points are resolved once per process. The enabled authenticators are worked out again
+# only when the repo auth config is reloaded, and are stored with the config they came from.
+_authenticators = None
+_enabled_authenticators = None
+_authenticators_lock = threading.Lock()
+
 
 def allow_access(environ, host):
     """
@@ -28,29 +35,50 @@ def allow_access(environ, host):
     if auth_enabled_validation.authenticate(environ):
         return True
 
-    # find all of the authenticator methods we need to try
-    authenticators = {}
-    for ep in iter_entry_points(group=AUTH_ENTRY_POINT):
-        authenticators.update({ep.name: ep.load()})
-
-    # load our list of disabled authenticators
-    disabled_authenticators = _get_disabled_authenticators()
-
     # loop through authenticators. If any return False, kick the user out.
-    for auth_method in authenticators:
-        if auth_method in disabled_authenticators:
-            continue
-        if not authenticators[auth_method](environ):
+    for authenticator in _get_enabled_authenticators():
+        if not authenticator(environ):
             return False
 
     # if we get this far then the user is authorized
     return True
 
 
-def _get_disabled_authenticators():
+def _get_enabled_authenticators():
+    """
+    Returns the authenticators that are not disabled in the repo auth config, ordered by name.
+
+    :return: list of authenticator functions
+    :rtype:  list
+    """
+    global _authenticators, _enabled_authenticators
+    config = auth_enabled_validation.cached_config()
+    with _authenticators_lock:
+        if _authenticators is None:
+            # find all of the authenticator methods we need to try
+            authenticators = {}
+            for ep in iter_entry_points(group=AUTH_ENTRY_POINT):
+                authenticators[ep.name] = ep.load()
+            _authenticators = sorted(authenticators.items())
+
+        if _enabled_authenticators is None or _enabled_authenticators[0] is not config:
+            disabled_authenticators = _get_disabled_authenticators(config)
+            enabled = [authenticator for name, authenticator in _authenticators
+                       if name not in disabled_authenticators]
+            _enabled_authenticators = (config, enabled)
+
+        return _enabled_authenticators[1]
+
+
+def _get_disabled_authenticators(config):
+    """
+    :param config: the repo auth config
+    :type  config: ConfigParser.SafeConfigParser
+
+    :return: names of the authenticators disabled in the config
+    :rtype:  list
+    """
     disabled_authenticators = []
-    config = SafeConfigParser()
-    config.read(CONFIG_FILENAME)
 
     if config.has_option('main', 'disabled_authenticators'):
         disabled_authenticators = config.get('main', 'disabled_authenticators').split(',')
@@ -6,6 +6,12 @@ import pulp.repoauth.auth_enabled_validation as auth_enabled_validation
 
 class TestAuthEnabledValiation(unittest.TestCase):
 
+    def setUp(self):
+        # every test starts without a cached config
+        patcher = mock.patch.object(auth_enabled_validation, '_cached_config', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @mock.patch("pulp.repoauth.auth_enabled_validation.SafeConfigParser")
     def test_config_read(self, mock_parser):
         mock_parser_instance = mock.Mock()
@@ -55,3 +61,28 @@ class TestAuthEnabledValiation(unittest.TestCase):
 
         logged_str = 'Repo authentication is not enabled. Skipping all checks.'
         environ["wsgi.errors"].write.assert_called_once_with(logged_str)
+
+    @mock.patch("pulp.repoauth.auth_enabled_validation.file_stamp")
+    @mock.patch("pulp.repoauth.auth_enabled_validation._config")
+    def test_cached_config(self, mock_config, mock_file_stamp):
+        mock_file_stamp.return_value = (1.0, 100)
+        mock_config.side_effect = [mock.Mock(), mock.Mock()]
+
+        first = auth_enabled_validation.cached_config()
+        second = auth_enabled_validation.cached_config()
+
+        self.assertTrue(first is second)
+        self.assertEqual(mock_config.call_count, 1)
+        mock_file_stamp.assert_called_with('/etc/pulp/repo_auth.conf')
+
+    @mock.patch("pulp.repoauth.auth_enabled_validation.file_stamp")
+    @mock.patch("pulp.repoauth.auth_enabled_validation._config")
+    def test_cached_config_file_changed(self, mock_config, mock_file_stamp):
+        mock_file_stamp.side_effect = [(1.0, 100), (2.0, 100)]
+        mock_config.side_effect = [mock.Mock(), mock.Mock()]
+
+        first = auth_enabled_validation.cached_config()
+        second = auth_enabled_validation.cached_config()
+
+        self.assertFalse(first is second)
+        self.assertEqual(mock_config.call_count, 2)
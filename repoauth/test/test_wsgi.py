@@ -1,6 +1,12 @@
+import os
+import shutil
+import tempfile
+import time
 import unittest
+
 import mock
 
+from pulp.repoauth import auth_enabled_validation, wsgi
 from pulp.repoauth.wsgi import allow_access, _get_disabled_authenticators
 
 
@@ -23,6 +29,15 @@ class TestWsgi(unittest.TestCase):
 
         self.entrypoint_list = [entrypoint_one, entrypoint_two]
 
+        # every test starts without resolved authenticators or a cached config
+        for name in ('_authenticators', '_enabled_authenticators'):
+            patcher = mock.patch.object(wsgi, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('pulp.repoauth.auth_enabled_validation._cached_config', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @mock.patch('pulp.repoauth.auth_enabled_validation.authenticate')
     def test_auth_disabled(self, auth_enabled):
         """
@@ -120,16 +135,114 @@ class TestWsgi(unittest.TestCase):
 
         self.assertTrue(allow_access(environ, 'fake.host.name'))
 
-    @mock.patch("pulp.repoauth.wsgi.SafeConfigParser")
-    def test_config_read(self, mock_parser):
+    @mock.patch('pulp.repoauth.auth_enabled_validation.authenticate')
+    @mock.patch('pulp.repoauth.wsgi.iter_entry_points')
+    def test_entry_points_loaded_once(self, iter_ep, auth_enabled):
+        """
+        Test that entry points are resolved on the first request only
+        """
+        auth_enabled.return_value = False
+        environ = mock.Mock()
+        iter_ep.return_value = self.entrypoint_list
+
+        self.assertTrue(allow_access(environ, 'fake.host.name'))
+        self.assertTrue(allow_access(environ, 'fake.host.name'))
+
+        self.assertEqual(iter_ep.call_count, 1)
+        for entrypoint in self.entrypoint_list:
+            self.assertEqual(entrypoint.load.call_count, 1)
+        self.assertEqual(self.auth_one.call_count, 2)
+        self.assertEqual(self.auth_two.call_count, 2)
+
+    @mock.patch('pulp.repoauth.auth_enabled_validation.cached_config')
+    @mock.patch('pulp.repoauth.auth_enabled_validation.authenticate')
+    @mock.patch('pulp.repoauth.wsgi.iter_entry_points')
+    @mock.patch('pulp.repoauth.wsgi._get_disabled_authenticators')
+    def test_disabled_authenticators_follow_config(self, disabled_authenticators, iter_ep,
+                                                   auth_enabled, cached_config):
+        """
+        Test that the disabled authenticators are worked out again only when the config is
+        reloaded
+        """
+        auth_enabled.return_value = False
+        environ = mock.Mock()
+        iter_ep.return_value = self.entrypoint_list
+        self.auth_one.return_value = False
+        self.auth_two.return_value = True
+        first_config = mock.Mock()
+        second_config = mock.Mock()
+        cached_config.side_effect = [first_config, first_config, second_config]
+        disabled_authenticators.side_effect = [['auth_one'], []]
+
+        self.assertTrue(allow_access(environ, 'fake.host.name'))
+        self.assertTrue(allow_access(environ, 'fake.host.name'))
+        self.assertFalse(allow_access(environ, 'fake.host.name'))
+
+        self.assertEqual(disabled_authenticators.call_args_list,
+                         [mock.call(first_config), mock.call(second_config)])
+        self.assertEqual(iter_ep.call_count, 1)
+
+    def test_config_read(self):
         """
-        Test that we are reading the file we think we are reading
+        Test that the disabled authenticators are read from the config
         """
-        mock_parser_instance = mock.Mock()
-        mock_parser_instance.get.return_value = "foo,bar,baz"
-        mock_parser.return_value = mock_parser_instance
+        mock_config = mock.Mock()
+        mock_config.get.return_value = "foo,bar,baz"
 
-        self.assertEquals(_get_disabled_authenticators(), ['foo', 'bar', 'baz'])
+        self.assertEquals(_get_disabled_authenticators(mock_config), ['foo', 'bar', 'baz'])
 
-        mock_parser_instance.read.assert_called_once_with('/etc/pulp/repo_auth.conf')
-        mock_parser_instance.has_option.assert_called_once_with('main', 'disabled_authenticators')
+        mock_config.has_option.assert_called_once_with('main', 'disabled_authenticators')
+        mock_config.get.assert_called_once_with('main', 'disabled_authenticators')
+
+    def test_config_no_disabled_authenticators(self):
+        """
+        Test that nothing is disabled if the config does not say so
+        """
+        mock_config = mock.Mock()
+        mock_config.has_option.return_value = False
+
+        self.assertEquals(_get_disabled_authenticators(mock_config), [])
+
+    # NOTE this test is disabled for normal test runs
+    @mock.patch('pulp.repoauth.wsgi.iter_entry_points')
+    def _test_allow_access_performance(self, iter_ep):
+        """
+        Benchmark the per request overhead of allow_access by driving it with synthetic
+        environs against a set of trivial authenticators. The real auth enabled check runs
+        against a temporary config, once with the cached config and once reading the config
+        on every request.
+        """
+        working_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, working_dir)
+        config_filename = os.path.join(working_dir, 'repo_auth.conf')
+        with open(config_filename, 'w') as f:
+            f.write('[main]\nenabled: true\nlog_failed_cert_verbose: false\n')
+        patcher = mock.patch.object(auth_enabled_validation, 'CONFIG_FILENAME', config_filename)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        entrypoints = []
+        for i in range(10):
+            entrypoint = mock.Mock()
+            entrypoint.name = 'auth_%d' % i
+            entrypoint.load.return_value = lambda environ: True
+            entrypoints.append(entrypoint)
+        iter_ep.return_value = entrypoints
+
+        num_requests = 100000
+        environs = [{'REQUEST_URI': '/pulp/repos/repo-%d/Packages/p.rpm' % (i % 100),
+                     'wsgi.errors': mock.Mock()} for i in range(num_requests)]
+
+        def run(label):
+            start = time.time()
+            for environ in environs:
+                self.assertTrue(allow_access(environ, 'fake.host.name'))
+            elapsed = time.time() - start
+            print '%s, %d requests: %.3fs, %.1fus per request' % (
+                label, num_requests, elapsed, elapsed * 1000000 / num_requests)
+
+        run('cached config')
+        with mock.patch.object(auth_enabled_validation, 'cached_config',
+                               auth_enabled_validation._config):
+            run('config read per request')
+        self.assertEqual(iter_ep.call_count, 1)
@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from gettext import gettext as _
 import logging
 import sys
@@ -5,6 +6,7 @@ import sys
 from pymongo.errors import DuplicateKeyError
 
 from pulp.plugins.model import Unit, PublishReport
+from pulp.plugins.util.misc import paginate
 from pulp.server.async.tasks import get_current_task_id
 from pulp.server.controllers import units as units_controller
 from pulp.server.db import model
@@ -16,6 +18,9 @@ import pulp.server.managers.factory as manager_factory
 
 _logger = logging.getLogger(__name__)
 
+# Number of units saved together by AddUnitMixin.save_units
+SAVE_UNITS_PAGE_SIZE = 1000
+
 
 class ImporterConduitException(Exception):
     """
@@ -163,9 +168,14 @@ class SingleRepoUnitsMixin(object):
         Units returned from this call will have the id field populated and are
         usable in any calls in this conduit that require the id field.
 
+        Without a sort in the criteria, a list is ordered by unit type and then by unit
+        key, while a generator is ordered by unit type and then by unit id.
+
         :param criteria: used to scope the returned results or the data within;
                the Criteria class can be imported from this module
         :type  criteria: UnitAssociationCriteria
+        :param as_generator: if true, return a generator; if false, a list
+        :type  as_generator: bool
 
         :return: list of unit instances
         :rtype:  list or generator of AssociatedUnit
@@ -186,9 +196,14 @@ class MultipleRepoUnitsMixin(object):
         Units returned from this call will have the id field populated and are
         usable in any calls in this conduit that require the id field.
 
+        Without a sort in the criteria, a list is ordered by unit type and then by unit
+        key, while a generator is ordered by unit type and then by unit id.
+
         :param criteria: used to scope the returned results or the data within;
                the Criteria class can be imported from this module
         :type  criteria: UnitAssociationCriteria
+        :param as_generator: if true, return a generator; if false, a list
+        :type  as_generator: bool
 
         :return: list of unit instances
         :rtype:  list or generator of AssociatedUnit
@@ -515,6 +530,80 @@ class AddUnitMixin(object):
             _logger.exception(_('Content unit association failed [%s]' % str(unit)))
             raise ImporterConduitException(e), None, sys.exc_info()[2]
 
+    def save_units(self, units):
+        """
+        Performs the same steps as save_unit for many units, a page at a time. For each type
+        of unit in a page, the units that already exist are looked up with a single query,
+        the new ones are added with one bulk insert, the ones that changed are updated with
+        one bulk update, and all of them are associated with the repository with one bulk
+        upsert.
+
+        This call populates the id field of each unit with the UUID for the unit.
+
+        :param units: unit objects returned from the init_unit call
+        :type  units: iterable of Unit
+        """
+        try:
+            association_manager = manager_factory.repo_unit_association_manager()
+            for page in paginate(units, SAVE_UNITS_PAGE_SIZE):
+                units_by_type = OrderedDict()
+                for unit in page:
+                    units_by_type.setdefault(unit.type_id, []).append(unit)
+
+                for type_id, type_units in units_by_type.iteritems():
+                    self._save_units_of_type(type_id, type_units)
+                    association_manager.associate_all_by_ids(
+                        self.repo_id, type_id, [unit.id for unit in type_units])
+        except Exception, e:
+            _logger.exception(_('Content unit association failed'))
+            raise ImporterConduitException(e), None, sys.exc_info()[2]
+
+    def _save_units_of_type(self, type_id, units):
+        """
+        Add the units that do not exist yet and update the ones that do.
+
+        :param type_id: the type of every unit
+        :type  type_id: str
+        :param units:   the units to be saved
+        :type  units:   list of pulp.plugins.model.Unit
+        """
+        content_query_manager = manager_factory.content_query_manager()
+        content_manager = manager_factory.content_manager()
+
+        key_fields = sorted(units[0].unit_key)
+        existing_units = {}
+        for unit_dict in content_query_manager.get_multiple_units_by_keys_dicts(
+                type_id, [unit.unit_key for unit in units], page_size=len(units)):
+            existing_units[tuple(unit_dict.get(field) for field in key_fields)] = unit_dict
+
+        new_units = []
+        unit_metadata_deltas = {}
+        for unit in units:
+            pulp_unit = common_utils.to_pulp_unit(unit)
+            existing_unit = existing_units.get(tuple(unit.unit_key[f] for f in key_fields))
+            if existing_unit is None:
+                new_units.append((unit, pulp_unit))
+                continue
+            unit.id = existing_unit['_id']
+            delta = dict((key, value) for key, value in pulp_unit.iteritems()
+                         if existing_unit.get(key) != value)
+            if delta:
+                unit_metadata_deltas.setdefault(unit.id, {}).update(delta)
+            self._updated_count += 1
+        content_manager.update_content_units(type_id, unit_metadata_deltas)
+
+        unit_ids = content_manager.add_content_units(
+            type_id, [new_pulp_unit for new_unit, new_pulp_unit in new_units])
+        for (unit, pulp_unit), unit_id in zip(new_units, unit_ids):
+            if unit_id is None:
+                # Another workflow added the same unit after it was looked up, or it appeared
+                # twice in this page. Either way it exists now.
+                _logger.debug(_('cannot add unit; already exists. updating instead.'))
+                unit.id = self._update_unit(unit, pulp_unit)
+            else:
+                unit.id = unit_id
+                self._added_count += 1
+
     def _update_unit(self, unit, pulp_unit):
         """
         Update a unit. If it is not found, add it.
@@ -629,15 +718,54 @@ class StatusMixin(object):
             TaskStatus.objects(task_id=self.task_id).update_one(
                 set__progress_report=self.progress_report)
         except Exception, e:
-            _logger.exception(
-                'Exception from server setting progress for report [%s]' % self.report_id)
-            try:
-                _logger.error('Progress value: %s' % str(status))
-            except Exception:
-                # Best effort to print this, but if its that grossly unserializable
-                # the log will tank and we don't want that exception to bubble up
-                pass
-            raise self.exception_class(e), None, sys.exc_info()[2]
+            self._raise_progress_exception(e, status)
+
+    def update_progress(self, status, changes):
+        """
+        Informs the server of the current state of the operation, like set_progress, but only
+        writes the parts of the status that changed since it was last written. The status must
+        have been written with set_progress before.
+
+        @param status: the complete current status
+        @type  status: any serializable
+
+        @param changes: maps the dotted path of every value that changed within the status
+               to its new value
+        @type  changes: dict
+        """
+
+        if self.task_id is None:
+            # not running within a task
+            return
+
+        try:
+            self.progress_report[self.report_id] = status
+            prefix = 'progress_report.%s.' % self.report_id
+            update = dict((prefix + path, value) for path, value in changes.iteritems())
+            if update:
+                TaskStatus._get_collection().update({'task_id': self.task_id}, {'$set': update})
+        except Exception, e:
+            self._raise_progress_exception(e, status)
+
+    def _raise_progress_exception(self, e, status):
+        """
+        Logs a failure to write the progress and raises it as this conduit's exception class.
+
+        @param e: the exception raised while writing the progress
+        @type  e: Exception
+
+        @param status: the status that could not be written
+        @type  status: any serializable
+        """
+        _logger.exception(
+            'Exception from server setting progress for report [%s]' % self.report_id)
+        try:
+            _logger.error('Progress value: %s' % str(status))
+        except Exception:
+            # Best effort to print this, but if its that grossly unserializable
+            # the log will tank and we don't want that exception to bubble up
+            pass
+        raise self.exception_class(e), None, sys.exc_info()[2]
 
 
 class PublishReportMixin(object):
@@ -696,8 +824,10 @@ def do_get_repo_units(repo_id, criteria, exception_class, as_generator=False):
     """
     try:
         association_query_manager = manager_factory.repo_unit_association_query_manager()
-        # Use a get_units as_generator here and cast to a list later, if necessary.
-        units = association_query_manager.get_units(repo_id, criteria=criteria, as_generator=True)
+        # A list is only built when asked for, so that lists keep the unit key order of
+        # unsorted queries and generators stream the units a page at a time.
+        units = association_query_manager.get_units(repo_id, criteria=criteria,
+                                                    as_generator=as_generator)
 
         # Transfer object generator.
         def _transfer_object_generator():
@@ -241,3 +241,35 @@ class Profiler(object):
         :rtype:               list of str
         """
         raise NotImplementedError()
+
+    def calculate_applicable_units_incremental(self, unit_profile, bound_repo_id, changed_units,
+                                               config, conduit):
+        """
+        Calculate and return which of the given content units are applicable to consumers with
+        the given unit_profile. The changed units are the units that were added to or updated in
+        the bound repository since its applicability was last calculated.
+
+        Profilers opt into incremental applicability regeneration by implementing this method.
+        Pulp then drops any units that were removed from the repository or that changed from the
+        stored applicability data, and adds the units returned by this method, instead of
+        calling calculate_applicable_units for the whole repository. Only implement this method
+        if the applicability of a unit depends solely on that unit and the profile, and not on
+        the other units in the repository.
+
+        :param unit_profile:  a consumer unit profile
+        :type  unit_profile:  object
+        :param bound_repo_id: repo id of a repository to be used to calculate applicability
+                              against the given consumer profile
+        :type  bound_repo_id: str
+        :param changed_units: a dictionary mapping content type ids to lists of ids of content
+                              units that changed in the repository
+        :type  changed_units: dict
+        :param config:        plugin configuration
+        :type  config:        pulp.server.plugins.config.PluginCallConfiguration
+        :param conduit:       provides access to relevant Pulp functionality
+        :type  conduit:       pulp.plugins.conduits.profile.ProfilerConduit
+        :return:              a dictionary mapping content type ids to lists of ids of the
+                              changed content units that are applicable
+        :rtype:               dict
+        """
+        raise NotImplementedError()
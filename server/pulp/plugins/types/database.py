@@ -8,6 +8,7 @@ import logging
 
 from pymongo import ASCENDING
 
+from pulp.server import constants
 from pulp.server.db import connection
 from pulp.server.db.model.content import ContentType
 
@@ -103,6 +104,7 @@ def update_database(definitions, error_on_missing_definitions=False, drop_indice
 
         try:
             _update_unit_key(type_def)
+            _update_unit_key_digest_index(type_def)
         except Exception:
             _logger.exception('Exception updating unit key for type [%s]' % type_def.id)
             error_defs.append(type_def)
@@ -311,6 +313,12 @@ def _update_unit_key(type_def):
     _update_indexes(type_def, True)
 
 
+def _update_unit_key_digest_index(type_def):
+    collection_name = unit_collection_name(type_def.id)
+    collection = connection.get_collection(collection_name, create=False)
+    collection.ensure_index(constants.UNIT_KEY_DIGEST_FIELDNAME, drop_dups=False)
+
+
 def _update_search_indexes(type_def):
     _update_indexes(type_def, False)
 
@@ -0,0 +1,248 @@
+"""
+Streaming creation of tar archives.
+
+Archives are written straight to a temporary file beside their destination, which is renamed to
+the destination once the archive is complete, so an archive is never read back or copied and a
+partial archive is never published.
+
+Compressed archives are compressed in blocks. Each block is compressed into a complete gzip
+member or xz stream; readers of either format treat the concatenation of members or streams as
+a single file. This allows blocks to be compressed by several threads at a time, which is worth
+it because zlib and lzma release the GIL while they compress.
+"""
+from collections import deque
+from gettext import gettext as _
+from multiprocessing.pool import ThreadPool
+import logging
+import os
+import tarfile
+import tempfile
+import zlib
+
+from pulp.plugins.util import misc
+from pulp.server.compat import lzma
+
+
+_logger = logging.getLogger(__name__)
+
+COMPRESSION_GZIP = 'gz'
+COMPRESSION_XZ = 'xz'
+
+# number of bytes of the archive compressed into each block
+BLOCK_SIZE = 1024 * 1024
+
+# mode of published archives
+ARCHIVE_MODE = 0644
+
+
+def _gzip_compress(data):
+    """
+    :param data: block of data
+    :type  data: str
+    :return: the block compressed into a complete gzip member
+    :rtype:  str
+    """
+    # a window size of 16 + MAX_WBITS makes zlib write a gzip header and trailer
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _xz_compress(data):
+    """
+    :param data: block of data
+    :type  data: str
+    :return: the block compressed into a complete xz stream
+    :rtype:  str
+    """
+    return lzma.compress(data)
+
+
+COMPRESSORS = {
+    COMPRESSION_GZIP: _gzip_compress,
+    COMPRESSION_XZ: _xz_compress,
+}
+
+
+class ProgressFile(object):
+    """
+    A write only file object that counts the bytes written to the file it wraps.
+
+    :ivar bytes_written: number of bytes written so far
+    :type bytes_written: int
+    """
+
+    def __init__(self, fileobj, listener=None):
+        """
+        :param fileobj: file object to write to
+        :type  fileobj: file
+        :param listener: called with the number of bytes written so far after each write
+        :type  listener: callable
+        """
+        self.fileobj = fileobj
+        self.listener = listener
+        self.bytes_written = 0
+
+    def write(self, data):
+        """
+        :param data: data to write
+        :type  data: str
+        """
+        self.fileobj.write(data)
+        self.bytes_written += len(data)
+        if self.listener is not None:
+            self.listener(self.bytes_written)
+
+    def close(self):
+        """
+        Nothing is buffered, and the wrapped file is left open.
+        """
+        pass
+
+
+class BlockCompressor(object):
+    """
+    A write only file object that compresses what is written to it in blocks, and writes the
+    compressed blocks in order to the file object it wraps.
+
+    With more than one thread, blocks are compressed by a pool of threads. At most two blocks
+    per thread are held in memory at a time.
+    """
+
+    def __init__(self, fileobj, compression, threads=1, block_size=BLOCK_SIZE):
+        """
+        :param fileobj: file object the compressed blocks are written to
+        :type  fileobj: file
+        :param compression: one of the COMPRESSORS keys
+        :type  compression: str
+        :param threads: number of threads compressing blocks
+        :type  threads: int
+        :param block_size: number of bytes compressed into each block
+        :type  block_size: int
+
+        :raises ValueError: if the compression is not supported
+        """
+        if compression not in COMPRESSORS:
+            raise ValueError(_('Unsupported compression: %(c)s') % {'c': compression})
+        if compression == COMPRESSION_XZ and lzma is None:
+            raise ValueError(_('xz compression requires the lzma module'))
+        self.fileobj = fileobj
+        self.compress = COMPRESSORS[compression]
+        self.threads = threads
+        self.block_size = block_size
+        self._buffer = []
+        self._buffered = 0
+        self._pending = deque()
+        self._pool = ThreadPool(threads) if threads > 1 else None
+
+    def write(self, data):
+        """
+        :param data: data to write
+        :type  data: str
+        """
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.block_size:
+            block = ''.join(self._buffer)
+            self._buffer = []
+            self._buffered = 0
+            for offset in xrange(0, len(block) - self.block_size + 1, self.block_size):
+                self._compress_block(block[offset:offset + self.block_size])
+            remainder = len(block) % self.block_size
+            if remainder:
+                self._buffer.append(block[-remainder:])
+                self._buffered = remainder
+
+    def _compress_block(self, block):
+        """
+        Compress a block, or queue it to be compressed, and write the compressed blocks that
+        are done.
+
+        :param block: block of data
+        :type  block: str
+        """
+        if self._pool is None:
+            self.fileobj.write(self.compress(block))
+            return
+        self._pending.append(self._pool.apply_async(self.compress, (block,)))
+        while len(self._pending) >= 2 * self.threads:
+            self.fileobj.write(self._pending.popleft().get())
+
+    def close(self):
+        """
+        Compress the data that is left and write all of the compressed blocks. The wrapped
+        file is left open.
+        """
+        try:
+            if self._buffered:
+                self._compress_block(''.join(self._buffer))
+                self._buffer = []
+                self._buffered = 0
+            while self._pending:
+                self.fileobj.write(self._pending.popleft().get())
+        finally:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+
+
+def write_tar(source_dir, destination, arcname='', compression=None, threads=1, listener=None):
+    """
+    Write a tar archive of a directory to a file. Symbolic links in the directory are followed.
+
+    The archive is written to a temporary file in the directory of the destination, which is
+    renamed to the destination once the archive is complete.
+
+    :param source_dir: path of the directory to archive
+    :type  source_dir: str
+    :param destination: path of the archive
+    :type  destination: str
+    :param arcname: name of the directory in the archive
+    :type  arcname: str
+    :param compression: None, or one of the COMPRESSORS keys
+    :type  compression: str
+    :param threads: number of threads compressing the archive
+    :type  threads: int
+    :param listener: called with the number of bytes written so far after each write
+    :type  listener: callable
+
+    :return: size of the archive in bytes
+    :rtype:  int
+    """
+    destination_dir = os.path.dirname(destination)
+    misc.mkdir(destination_dir)
+    fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % os.path.basename(destination),
+                                    dir=destination_dir)
+
+    # the temporary file must not be archived if it is in the archived directory
+    source_dir = os.path.abspath(source_dir)
+    tmp_arcname = None
+    if tmp_path.startswith(os.path.join(source_dir, '')):
+        tmp_arcname = os.path.normpath(os.path.join(arcname, os.path.relpath(tmp_path,
+                                                                             source_dir)))
+
+    def exclude_tmp(tarinfo):
+        if tmp_arcname and os.path.normpath(tarinfo.name) == tmp_arcname:
+            return None
+        return tarinfo
+
+    try:
+        with os.fdopen(fd, 'wb') as fileobj:
+            progress_file = ProgressFile(fileobj, listener)
+            if compression:
+                stream = BlockCompressor(progress_file, compression, threads)
+            else:
+                stream = progress_file
+            tar_file = tarfile.open(fileobj=stream, mode='w|', dereference=True)
+            try:
+                tar_file.add(source_dir, arcname=arcname, filter=exclude_tmp)
+            finally:
+                tar_file.close()
+                stream.close()
+        os.chmod(tmp_path, ARCHIVE_MODE)
+        os.rename(tmp_path, destination)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    _logger.debug('Wrote %d bytes to %s' % (progress_file.bytes_written, destination))
+    return progress_file.bytes_written
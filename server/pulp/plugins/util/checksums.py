@@ -0,0 +1,265 @@
+"""
+Calculation of file checksums.
+
+Files are hashed on a pool of threads, which is worth it because hashlib releases the GIL while
+it hashes. The checksums can be kept in a ChecksumCache that is saved between runs, so that files
+that did not change since their checksum was calculated are not read again.
+"""
+from functools import partial
+from gettext import gettext as _
+from itertools import izip
+from multiprocessing.pool import ThreadPool
+import json
+import logging
+import os
+import tempfile
+
+from pulp.plugins.util import misc, verification
+
+
+_logger = logging.getLogger(__name__)
+
+# number of bytes read into RAM at a time when hashing a file
+CHUNK_SIZE = 1024 * 1024
+
+# number of threads hashing files
+DEFAULT_THREADS = 4
+
+
+def file_checksum(file_object, checksum_type=verification.TYPE_SHA256):
+    """
+    Calculate the checksum of the contents of a file-like object, from its current position.
+
+    :param file_object: file-like object to hash
+    :param checksum_type: type of checksum to calculate; must be one of the TYPE_* constants in
+                          the verification module
+    :type  checksum_type: str
+
+    :return: hex digest of the checksum
+    :rtype:  str
+
+    :raises verification.InvalidChecksumType: if the checksum_type isn't supported
+    """
+    if checksum_type not in verification.CHECKSUM_FUNCTIONS:
+        raise verification.InvalidChecksumType('Unknown checksum type [%s]' % checksum_type)
+    hasher = verification.CHECKSUM_FUNCTIONS[checksum_type]()
+    bits = file_object.read(CHUNK_SIZE)
+    while bits:
+        hasher.update(bits)
+        bits = file_object.read(CHUNK_SIZE)
+    return hasher.hexdigest()
+
+
+def path_checksum(path, checksum_type=verification.TYPE_SHA256):
+    """
+    Calculate the checksum of a file.
+
+    :param path: full path to the file
+    :type  path: basestring
+    :param checksum_type: type of checksum to calculate
+    :type  checksum_type: str
+
+    :return: hex digest of the checksum
+    :rtype:  str
+    """
+    with open(path, 'rb') as file_object:
+        return file_checksum(file_object, checksum_type)
+
+
+def verify_path_checksum(path, checksum_type, checksum_value, cache=None):
+    """
+    Verify the checksum of a file on disk. With a cache, a file that did not change since its
+    checksum was cached, judging by its inode, size and mtime, is not read again. Use
+    verification.verify_checksum to verify a file-like object instead.
+
+    :param path: full path to the file
+    :type  path: basestring
+    :param checksum_type: type of checksum to calculate
+    :type  checksum_type: str
+    :param checksum_value: expected checksum to verify against
+    :type  checksum_value: str
+    :param cache: checksums already known; it is not saved
+    :type  cache: ChecksumCache
+
+    :raises verification.InvalidChecksumType: if the checksum_type isn't supported
+    :raises verification.VerificationException: if the checksum does not match; the actual
+                                                checksum is its argument
+    """
+    checksum = ChecksumService(checksum_type, threads=1, cache=cache).checksum(path)
+    if checksum != checksum_value:
+        raise verification.VerificationException(checksum)
+
+
+class ChecksumCache(object):
+    """
+    Checksums of files, saved as JSON in a sidecar file.
+
+    An entry is keyed by the checksum type and the path of the file relative to the base
+    directory, and is only valid while the inode, size and mtime of the file are the ones it was
+    stored with. Files are stat'ed through symbolic links, so a published symbolic link to a
+    content unit keeps its entry for as long as the unit does not change.
+
+    Only the entries that were looked up or stored since the cache was loaded are saved, so
+    entries of files that are gone are dropped.
+    """
+
+    def __init__(self, path, base_dir):
+        """
+        :param path: full path to the sidecar file
+        :type  path: basestring
+        :param base_dir: full path to the directory cached paths are relative to
+        :type  base_dir: basestring
+        """
+        self.path = path
+        self.base_dir = base_dir
+        self._loaded = {}
+        self._used = {}
+        self.hits = 0
+        self._load()
+
+    def _load(self):
+        """
+        Load the entries of the sidecar file. A missing or unreadable file is an empty cache.
+        """
+        try:
+            with open(self.path) as sidecar:
+                self._loaded = json.load(sidecar)
+        except IOError:
+            pass
+        except ValueError:
+            _logger.warning(_('Ignoring corrupt checksum cache %(p)s') % {'p': self.path})
+
+    def _key(self, path, checksum_type):
+        return '%s:%s' % (checksum_type, os.path.relpath(path, self.base_dir))
+
+    def get(self, path, stat, checksum_type):
+        """
+        :param path: full path to a file
+        :type  path: basestring
+        :param stat: stat of the file
+        :type  stat: posix.stat_result
+        :param checksum_type: type of checksum
+        :type  checksum_type: str
+
+        :return: the cached checksum of the file, or None if there is no valid entry for it
+        :rtype:  str
+        """
+        key = self._key(path, checksum_type)
+        entry = self._used.get(key) or self._loaded.get(key)
+        if entry is None or entry[:3] != [stat.st_ino, stat.st_size, stat.st_mtime]:
+            return None
+        self._used[key] = entry
+        self.hits += 1
+        return entry[3]
+
+    def set(self, path, stat, checksum_type, checksum):
+        """
+        :param path: full path to a file
+        :type  path: basestring
+        :param stat: stat of the file, taken before it was hashed
+        :type  stat: posix.stat_result
+        :param checksum_type: type of checksum
+        :type  checksum_type: str
+        :param checksum: checksum of the file
+        :type  checksum: str
+        """
+        self._used[self._key(path, checksum_type)] = [stat.st_ino, stat.st_size, stat.st_mtime,
+                                                      checksum]
+
+    def save(self):
+        """
+        Write the entries that were used to the sidecar file, replacing it atomically. Nothing is
+        written if they are the entries that were loaded.
+        """
+        if self._used == self._loaded:
+            return
+        directory = os.path.dirname(self.path)
+        misc.mkdir(directory)
+        fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % os.path.basename(self.path),
+                                        dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as sidecar:
+                json.dump(self._used, sidecar)
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+class ChecksumService(object):
+    """
+    Calculates the checksums of files on a pool of threads, looking them up in a ChecksumCache
+    first if it has one.
+    """
+
+    def __init__(self, checksum_type=verification.TYPE_SHA256, threads=DEFAULT_THREADS,
+                 cache=None):
+        """
+        :param checksum_type: type of checksum to calculate
+        :type  checksum_type: str
+        :param threads: number of threads hashing files
+        :type  threads: int
+        :param cache: checksums already known
+        :type  cache: ChecksumCache
+
+        :raises verification.InvalidChecksumType: if the checksum_type isn't supported
+        """
+        if checksum_type not in verification.CHECKSUM_FUNCTIONS:
+            raise verification.InvalidChecksumType('Unknown checksum type [%s]' % checksum_type)
+        self.checksum_type = checksum_type
+        self.threads = threads
+        self.cache = cache
+
+    def checksum(self, path):
+        """
+        :param path: full path to a file
+        :type  path: basestring
+
+        :return: hex digest of the checksum of the file
+        :rtype:  str
+        """
+        return self.checksums([path])[path]
+
+    def checksums(self, paths):
+        """
+        :param paths: full paths to files
+        :type  paths: iterable
+
+        :return: maps each path to the hex digest of the checksum of its file
+        :rtype:  dict
+        """
+        found = {}
+        missing = []
+        for path in paths:
+            stat = os.stat(path)
+            checksum = None
+            if self.cache is not None:
+                checksum = self.cache.get(path, stat, self.checksum_type)
+            if checksum is None:
+                missing.append((path, stat))
+            else:
+                found[path] = checksum
+
+        hashed = self._hash([missing_path for missing_path, missing_stat in missing])
+        for (path, stat), checksum in izip(missing, hashed):
+            found[path] = checksum
+            if self.cache is not None:
+                self.cache.set(path, stat, self.checksum_type, checksum)
+        return found
+
+    def _hash(self, paths):
+        """
+        :param paths: full paths to files
+        :type  paths: list
+
+        :return: checksums of the files, in the same order
+        :rtype:  list
+        """
+        hash_path = partial(path_checksum, checksum_type=self.checksum_type)
+        if self.threads <= 1 or len(paths) <= 1:
+            return map(hash_path, paths)
+        pool = ThreadPool(min(self.threads, len(paths)))
+        try:
+            return pool.map(hash_path, paths, chunksize=1)
+        finally:
+            pool.terminate()
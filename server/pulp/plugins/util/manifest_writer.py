@@ -1,15 +1,15 @@
 import csv
-import hashlib
 import os
 
 from pulp.common.plugins.distributor_constants import MANIFEST_FILENAME
+from pulp.plugins.util import checksums, verification
 
 
-# not much science behind this
-CHUNK_SIZE = 2 ** 16
+# name of the file in the manifest's directory the checksums are cached in by default
+CHECKSUM_CACHE_FILENAME = '.PULP_MANIFEST.checksums'
 
 
-def make_manifest_for_dir(path):
+def make_manifest_for_dir(path, checksum_cache_path=None, threads=checksums.DEFAULT_THREADS):
     """
     creates a PULP_MANIFEST file in the specified directory
 
@@ -17,19 +17,32 @@ def make_manifest_for_dir(path):
 
     :param path:    full path to the directory where the manifest should be created
     :type  path:    basestring
+    :param checksum_cache_path: full path to a file the checksums are cached in between calls,
+                                so that files that did not change are not hashed again. Defaults
+                                to CHECKSUM_CACHE_FILENAME in the directory, which is left out of
+                                the manifest.
+    :type  checksum_cache_path: basestring
+    :param threads: number of threads hashing the files
+    :type  threads: int
     """
+    if not checksum_cache_path:
+        checksum_cache_path = os.path.join(path, CHECKSUM_CACHE_FILENAME)
     file_paths = [os.path.join(path, filename) for filename in os.listdir(path)
-                  if filename != MANIFEST_FILENAME]
+                  if filename not in (MANIFEST_FILENAME, CHECKSUM_CACHE_FILENAME)]
+    file_paths = filter(os.path.isfile, file_paths)
+
+    cache = checksums.ChecksumCache(checksum_cache_path, path)
+    service = checksums.ChecksumService(verification.TYPE_SHA256, threads, cache)
+    file_checksums = service.checksums(file_paths)
+
     with open(os.path.join(path, MANIFEST_FILENAME), 'w') as open_file:
-        print dir(open_file)
-        print open_file.closed
         writer = csv.writer(open_file)
-        for fullpath in filter(os.path.isfile, file_paths):
+        for fullpath in file_paths:
             size = os.path.getsize(fullpath)
             filename = os.path.basename(fullpath)
-            checksum = get_sha256_checksum(fullpath)
+            writer.writerow([filename, file_checksums[fullpath], size])
 
-            writer.writerow([filename, checksum, size])
+    cache.save()
 
 
 def get_sha256_checksum(path):
@@ -42,10 +55,4 @@ def get_sha256_checksum(path):
     :return:    sha256 checksum
     :rtype:     basestring
     """
-    hasher = hashlib.sha256()
-    with open(path) as open_file:
-        chunk = open_file.read(CHUNK_SIZE)
-        while chunk:
-            hasher.update(chunk)
-            chunk = open_file.read(CHUNK_SIZE)
-    return hasher.hexdigest()
+    return checksums.path_checksum(path, verification.TYPE_SHA256)
@@ -1,13 +1,20 @@
+import csv
 import errno
+import filecmp
 from gettext import gettext as _
 import itertools
 import logging
 import os
 import shutil
 
+from pulp.common.plugins.distributor_constants import MANIFEST_FILENAME
+
 
 DEFAULT_PAGE_SIZE = 1000
 
+# errors that mean a hard link cannot be made, so the file has to be copied instead
+HARD_LINK_ERRORS = (errno.EXDEV, errno.EMLINK, errno.EPERM)
+
 _log = logging.getLogger(__name__)
 
 
@@ -146,3 +153,144 @@ def clear_directory(path, skip_list=()):
 
         elif os.path.isfile(entry_path):
             os.unlink(entry_path)
+
+
+def copytree_linking_unchanged(source_dir, destination_dir, previous_dir):
+    """
+    Copy a directory tree the same way shutil.copytree(symlinks=True) does, except that files
+    that are unchanged from the file at the same relative path in a previous copy of the tree
+    are hard linked from the previous copy instead of being copied.
+
+    A file is unchanged if it has the same size and mode as the previous file, and either the
+    same modification time or the same contents. Freshly generated files never have the same
+    modification time, so when both directories have a PULP_MANIFEST that lists the file, the
+    checksums in the manifests are compared instead of reading the files. If a hard link cannot
+    be made, for example because the previous copy is on another file system, the file is
+    copied.
+
+    :param source_dir: path of the directory tree to copy
+    :type  source_dir: str
+    :param destination_dir: path of the copy to create; it must not exist
+    :type  destination_dir: str
+    :param previous_dir: path of a previous copy of the directory tree
+    :type  previous_dir: str
+
+    :return: number of files that were hard linked and number of files that were copied
+    :rtype:  tuple
+    """
+    linked = 0
+    copied = 0
+    directories = []
+    os.makedirs(destination_dir)
+    for root, dir_names, file_names in os.walk(source_dir):
+        relative_root = os.path.relpath(root, source_dir)
+        destination_root = os.path.normpath(os.path.join(destination_dir, relative_root))
+        previous_root = os.path.normpath(os.path.join(previous_dir, relative_root))
+        directories.append((root, destination_root))
+        source_checksums = _manifest_checksums(root)
+        previous_checksums = _manifest_checksums(previous_root)
+
+        # os.walk() lists symbolic links to directories with the directories, but does not
+        # descend into them
+        for name in dir_names:
+            source_path = os.path.join(root, name)
+            if os.path.islink(source_path):
+                os.symlink(os.readlink(source_path), os.path.join(destination_root, name))
+            else:
+                os.mkdir(os.path.join(destination_root, name))
+
+        for name in file_names:
+            source_path = os.path.join(root, name)
+            destination_path = os.path.join(destination_root, name)
+            if os.path.islink(source_path):
+                os.symlink(os.readlink(source_path), destination_path)
+                continue
+            previous_path = os.path.join(previous_root, name)
+            if _is_unchanged(source_path, previous_path, source_checksums.get(name),
+                             previous_checksums.get(name)) and \
+                    _hard_link(previous_path, destination_path):
+                linked += 1
+            else:
+                shutil.copy2(source_path, destination_path)
+                copied += 1
+
+    # adding entries to a directory changes its modification time, so the directory stats are
+    # copied once all of the entries are in place
+    for source_path, destination_path in reversed(directories):
+        shutil.copystat(source_path, destination_path)
+
+    return linked, copied
+
+
+def _manifest_checksums(path):
+    """
+    :param path: path of a directory
+    :type  path: str
+
+    :return: dict of the names of the files listed in the PULP_MANIFEST of the directory to
+             (checksum, size) tuples; empty if the directory has no readable manifest
+    :rtype:  dict
+    """
+    manifest_path = os.path.join(path, MANIFEST_FILENAME)
+    checksums = {}
+    try:
+        with open(manifest_path) as manifest:
+            for row in csv.reader(manifest):
+                name, checksum, size = row
+                checksums[name] = (checksum, int(size))
+    except (IOError, ValueError, csv.Error):
+        return {}
+    return checksums
+
+
+def _is_unchanged(source_path, previous_path, source_checksum=None, previous_checksum=None):
+    """
+    :param source_path: path of a regular file
+    :type  source_path: str
+    :param previous_path: path of the previous version of the file
+    :type  previous_path: str
+    :param source_checksum: (checksum, size) of the file listed in its directory's manifest
+    :type  source_checksum: tuple or None
+    :param previous_checksum: (checksum, size) of the previous version listed in its
+                              directory's manifest
+    :type  previous_checksum: tuple or None
+
+    :return: True if the previous version is a regular file with the same size, mode, and either
+             the same modification time, the same checksum in both manifests or the same
+             contents
+    :rtype:  bool
+    """
+    if os.path.islink(previous_path) or not os.path.isfile(previous_path):
+        return False
+    source_stat = os.stat(source_path)
+    previous_stat = os.stat(previous_path)
+    if source_stat.st_size != previous_stat.st_size or \
+            source_stat.st_mode != previous_stat.st_mode:
+        return False
+    if source_stat.st_mtime == previous_stat.st_mtime:
+        return True
+    if source_checksum is not None and previous_checksum is not None and \
+            source_checksum[1] == source_stat.st_size and \
+            previous_checksum[1] == previous_stat.st_size:
+        # the manifests were written from the files, so the files need not be read again
+        return source_checksum == previous_checksum
+    return filecmp.cmp(source_path, previous_path, shallow=False)
+
+
+def _hard_link(source_path, link_path):
+    """
+    :param source_path: path of the file to link to
+    :type  source_path: str
+    :param link_path: path of the link to create
+    :type  link_path: str
+
+    :return: True if the link was created, False if the file system does not allow it
+    :rtype:  bool
+    """
+    try:
+        os.link(source_path, link_path)
+    except OSError, e:
+        if e.errno not in HARD_LINK_ERRORS:
+            raise
+        return False
+    return True
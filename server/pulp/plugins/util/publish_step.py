@@ -5,7 +5,6 @@ import logging
 import os
 import shutil
 import sys
-import tarfile
 import time
 import traceback
 import uuid
@@ -13,7 +12,7 @@ import uuid
 from pulp.common import error_codes
 from pulp.common.plugins import reporting_constants, importer_constants
 from pulp.common.util import encode_unicode
-from pulp.plugins.util import manifest_writer, misc
+from pulp.plugins.util import archive, checksums, manifest_writer, misc
 from pulp.plugins.util.nectar_config import importer_config_to_nectar_config
 from pulp.server.controllers import repository as repo_controller
 from pulp.server.db.model.criteria import Criteria, UnitAssociationCriteria
@@ -28,6 +27,9 @@ from pulp.server.managers.repo import _common as common_utils
 
 _logger = logging.getLogger(__name__)
 
+# Minimum number of seconds between two progress writes that are not forced
+PROGRESS_REPORT_INTERVAL = 1
+
 
 def _post_order(step):
     """
@@ -42,12 +44,101 @@ def _post_order(step):
     yield step
 
 
+def _flatten_progress_report(reports, path=''):
+    """
+    Create a generator over the reports of every step in a progress report, without their sub
+    step reports.
+
+    :param reports: a progress report, as returned by Step.get_progress_report()
+    :type  reports: list
+    :param path: dotted path of the report list within the whole progress report
+    :type  path: str
+    :returns: generator of (path, report) tuples
+    """
+    for index, report in enumerate(reports):
+        report_path = '%s%d' % (path, index)
+        yield report_path, dict((key, value) for key, value in report.iteritems()
+                                if key != reporting_constants.PROGRESS_SUB_STEPS_KEY)
+        sub_steps = report.get(reporting_constants.PROGRESS_SUB_STEPS_KEY)
+        if sub_steps:
+            sub_steps_path = '%s.%s.' % (report_path, reporting_constants.PROGRESS_SUB_STEPS_KEY)
+            for sub_report in _flatten_progress_report(sub_steps, sub_steps_path):
+                yield sub_report
+
+
+class ProgressReporter(object):
+    """
+    Coalesces the progress reports of a step tree into as few database writes as possible.
+
+    Unless forced, the progress is written at most once every interval seconds. The reporter
+    remembers what it last wrote for each step, and once the whole report has been written only
+    the values that changed since are sent to the status conduit.
+    """
+
+    def __init__(self, interval=PROGRESS_REPORT_INTERVAL):
+        """
+        :param interval: minimum number of seconds between two writes that are not forced
+        :type  interval: int or float
+        """
+        self.interval = interval
+        self.last_report_time = 0
+        self._written = None
+
+    def report(self, step, force=False):
+        """
+        Write the progress of a step tree if it is due.
+
+        :param step: the root of the step tree
+        :type  step: Step
+        :param force: write even if the interval has not elapsed since the last write
+        :type  force: bool
+        """
+        current_time = time.time()
+        if not force and current_time - self.last_report_time < self.interval:
+            return
+
+        status_conduit = step.get_status_conduit()
+        progress_report = step.get_progress_report()
+        reports = copy.deepcopy(list(_flatten_progress_report(progress_report)))
+        changes = self._changes(reports)
+        if changes is None or not hasattr(status_conduit, 'update_progress'):
+            status_conduit.set_progress(progress_report)
+        elif changes:
+            status_conduit.update_progress(progress_report, changes)
+        self._written = reports
+        self.last_report_time = current_time
+
+    def _changes(self, reports):
+        """
+        :param reports: the flattened progress report about to be written
+        :type  reports: list of (path, report) tuples
+        :return: maps the dotted path of every value that changed since the last write to the
+                 new value, or None if the whole report has to be written
+        :rtype:  dict or None
+        """
+        if self._written is None or len(reports) != len(self._written):
+            return None
+        changes = {}
+        uuid_key = reporting_constants.PROGRESS_STEP_UUID
+        for (path, report), (written_path, written) in zip(reports, self._written):
+            if path != written_path or report.get(uuid_key) != written.get(uuid_key):
+                # the steps were rearranged
+                return None
+            for key, value in report.iteritems():
+                if key not in written or written[key] != value:
+                    changes['%s.%s' % (path, key)] = value
+        return changes
+
+
 class Step(object):
     """
     Base class for step processing. The only tie to the platform is an assumption of
     the use of a conduit that extends StatusMixin for reporting status along the way.
     """
 
+    # Minimum number of seconds between two progress writes of the step tree rooted here
+    progress_report_interval = PROGRESS_REPORT_INTERVAL
+
     def __init__(self, step_type, status_conduit=None, non_halting_exceptions=None,
                  disable_reporting=False):
         """
@@ -73,7 +164,7 @@ class Step(object):
         self.error_details = []
         self.total_units = 1
         self.children = []
-        self.last_report_time = 0
+        self.progress_reporter = None
         self.last_reported_state = self.state
         self.timestamp = str(time.time())
         self.non_halting_exceptions = non_halting_exceptions or []
@@ -291,14 +382,9 @@ class Step(object):
         if self.parent:
             self.parent.report_progress(force)
         else:
-            if force:
-                self.get_status_conduit().set_progress(self.get_progress_report())
-            else:
-                current_time = time.time()
-                if current_time != self.last_report_time:
-                    # Update at most once a second
-                    self.get_status_conduit().set_progress(self.get_progress_report())
-                    self.last_report_time = current_time
+            if self.progress_reporter is None:
+                self.progress_reporter = ProgressReporter(self.progress_report_interval)
+            self.progress_reporter.report(self, force)
 
     def get_progress_report(self):
         """
@@ -650,6 +736,8 @@ class UnitPublishStep(PublishStep):
         """
         This method returns a generator for the unit_type specified on the PublishStep.
         The units created by this generator will be iterated over by the process_unit method.
+        They are ordered by unit type and then by unit id, not by unit key, so that they can be
+        read from the database a page at a time.
 
         :return: generator of units
         :rtype:  GeneratorTyp of Units
@@ -750,9 +838,12 @@ class AtomicDirectoryPublishStep(PluginStep):
             link each file in the source directory to a file with the same name in the target
             directory
     :type only_publish_directory_contents: bool
+    :param incremental: If true, files that are unchanged since the previous publish are hard
+            linked from the previous master directory instead of being copied
+    :type incremental: bool
     """
     def __init__(self, source_dir, publish_locations, master_publish_dir, step_type=None,
-                 only_publish_directory_contents=False):
+                 only_publish_directory_contents=False, incremental=False):
         step_type = step_type if step_type else reporting_constants.PUBLISH_STEP_DIRECTORY
         super(AtomicDirectoryPublishStep, self).__init__(step_type)
         self.context = None
@@ -760,6 +851,7 @@ class AtomicDirectoryPublishStep(PluginStep):
         self.publish_locations = publish_locations
         self.master_publish_dir = master_publish_dir
         self.only_publish_directory_contents = only_publish_directory_contents
+        self.incremental = incremental
 
     def process_main(self, item=None):
         """
@@ -775,8 +867,16 @@ class AtomicDirectoryPublishStep(PluginStep):
         # Given that it is timestamped for this publish/repo we could skip the copytree
         # for items where http & https are published to a separate directory
 
-        _logger.debug('Copying tree from %s to %s' % (self.source_dir, timestamp_master_dir))
-        shutil.copytree(self.source_dir, timestamp_master_dir, symlinks=True)
+        previous_master_dir = self._find_previous_master_dir()
+        if self.incremental and previous_master_dir:
+            _logger.debug('Copying tree from %s to %s, linking files unchanged in %s' %
+                          (self.source_dir, timestamp_master_dir, previous_master_dir))
+            linked, copied = misc.copytree_linking_unchanged(
+                self.source_dir, timestamp_master_dir, previous_master_dir)
+            _logger.debug('Linked %d unchanged files, copied %d files' % (linked, copied))
+        else:
+            _logger.debug('Copying tree from %s to %s' % (self.source_dir, timestamp_master_dir))
+            shutil.copytree(self.source_dir, timestamp_master_dir, symlinks=True)
 
         for source_relative_location, publish_location in self.publish_locations:
             if source_relative_location.startswith('/'):
@@ -817,6 +917,29 @@ class AtomicDirectoryPublishStep(PluginStep):
         # Clear out any previously published masters
         misc.clear_directory(self.master_publish_dir, skip_list=[self.parent.timestamp])
 
+    def _find_previous_master_dir(self):
+        """
+        Find the master directory created by the previous publish. Master directories are named
+        after the timestamp of the publish that created them.
+
+        :return: path of the latest master directory, or None if there is none
+        :rtype:  str
+        """
+        if not os.path.isdir(self.master_publish_dir):
+            return None
+        master_dirs = []
+        for name in os.listdir(self.master_publish_dir):
+            path = os.path.join(self.master_publish_dir, name)
+            if name == self.parent.timestamp or os.path.islink(path) or not os.path.isdir(path):
+                continue
+            try:
+                master_dirs.append((float(name), path))
+            except ValueError:
+                continue
+        if not master_dirs:
+            return None
+        return max(master_dirs)[1]
+
 
 class SaveTarFilePublishStep(PublishStep):
     """
@@ -827,31 +950,38 @@ class SaveTarFilePublishStep(PublishStep):
     :type publish_file: str
     :param step_id: The id of the step, so that this step can be used with custom names.
     :type step_id: str
+    :param compression: None, or the compression of the tar file, 'gz' or 'xz'
+    :type compression: str
+    :param compression_threads: The number of threads compressing the tar file
+    :type compression_threads: int
     """
-    def __init__(self, source_dir, publish_file, step_type=None):
+    def __init__(self, source_dir, publish_file, step_type=None, compression=None,
+                 compression_threads=1):
         step_type = step_type if step_type else reporting_constants.PUBLISH_STEP_TAR
         super(SaveTarFilePublishStep, self).__init__(step_type)
         self.source_dir = source_dir
         self.publish_file = publish_file
+        self.compression = compression
+        self.compression_threads = compression_threads
         self.description = _('Saving tar file.')
 
     def process_main(self):
         """
         Publish a directory from to a tar file
         """
-        # Generate the tar file in the working directory
-        tar_file_name = os.path.join(self.source_dir, os.path.basename(self.publish_file))
-        tar_file = tarfile.TarFile(name=tar_file_name, mode='w', dereference=True)
-        try:
-            tar_file.add(name=self.source_dir, arcname='')
-        finally:
-            tar_file.close()
+        # The tar file is written straight to the final location
+        archive.write_tar(self.source_dir, self.publish_file, compression=self.compression,
+                          threads=self.compression_threads, listener=self._bytes_written)
 
-        # Move the tar file to the final location
-        publish_dir_parent = os.path.dirname(self.publish_file)
-        if not os.path.exists(publish_dir_parent):
-            os.makedirs(publish_dir_parent, 0750)
-        shutil.copy(os.path.join(self.source_dir, tar_file_name), self.publish_file)
+    def _bytes_written(self, bytes_written):
+        """
+        Report how much of the tar file has been written.
+
+        :param bytes_written: number of bytes written so far
+        :type  bytes_written: int
+        """
+        self.progress_details = _('%(b)d bytes written') % {'b': bytes_written}
+        self.report_progress()
 
 
 class CreatePulpManifestStep(Step):
@@ -863,14 +993,24 @@ class CreatePulpManifestStep(Step):
     If you already know the SHA256 checksums of the files going in the manifest, see an example
     in the FileDistributor that creates this file in a different way.
     """
-    def __init__(self, target_dir):
+    def __init__(self, target_dir, checksum_cache_path=None,
+                 threads=checksums.DEFAULT_THREADS):
         """
         :param target_dir:  full path to the directory where the PULP_MANIFEST file should
                             be created
         :type  target_dir:  basestring
+        :param checksum_cache_path: full path to a file that is kept between publishes to cache
+                                    the checksums in. Files that did not change since the last
+                                    publish are then not hashed again. Defaults to a hidden file
+                                    in the target_dir.
+        :type  checksum_cache_path: basestring
+        :param threads:     number of threads hashing the files
+        :type  threads:     int
         """
         super(CreatePulpManifestStep, self).__init__(reporting_constants.STEP_CREATE_PULP_MANIFEST)
         self.target_dir = target_dir
+        self.checksum_cache_path = checksum_cache_path
+        self.threads = threads
         self.description = _('Creating PULP_MANIFEST')
 
     def process_main(self, item=None):
@@ -879,7 +1019,8 @@ class CreatePulpManifestStep(Step):
 
         :param item:    not used
         """
-        manifest_writer.make_manifest_for_dir(self.target_dir)
+        manifest_writer.make_manifest_for_dir(self.target_dir, self.checksum_cache_path,
+                                              self.threads)
 
 
 class CopyDirectoryStep(PublishStep):
@@ -1098,11 +1239,11 @@ class GetLocalUnitsStep(SaveUnitsStep):
     which must be an iterable of unit model instances with the unit keys populated
     """
 
-    def __init__(self, importer_type, unit_pagination_size=50, **kwargs):
+    def __init__(self, importer_type, unit_pagination_size=misc.DEFAULT_PAGE_SIZE, **kwargs):
         """
         :param importer_type: unique identifier for the type of importer
         :type  importer_type: basestring
-        :param unit_pagination_size: How many units should be queried at one time (default 50)
+        :param unit_pagination_size: How many units should be queried at one time (default 1000)
         :type  importer_type: int
         """
         super(GetLocalUnitsStep, self).__init__(step_type=reporting_constants.SYNC_STEP_GET_LOCAL,
@@ -1122,6 +1263,15 @@ class GetLocalUnitsStep(SaveUnitsStep):
         :param item: The item to process or none if get_iterator is not defined
         :param item: object or None
         """
+        repo_controller.associate_units(self.get_repo(), self._find_local_units())
+
+    def _find_local_units(self):
+        """
+        Create a generator over the available units that already exist in pulp. The ones that do
+        not are added to the list of units to download instead.
+
+        :returns: generator of pulp.server.db.model.ContentUnit
+        """
         # any units that are already in pulp
         units_we_already_had = set()
 
@@ -1131,7 +1281,7 @@ class GetLocalUnitsStep(SaveUnitsStep):
 
             for found_unit in query:
                 units_we_already_had.add(hash(found_unit))
-                repo_controller.associate_single_unit(self.get_repo(), found_unit)
+                yield found_unit
 
             for unit in units_group:
                 if hash(unit) not in units_we_already_had:
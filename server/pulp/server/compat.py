@@ -10,10 +10,21 @@ if sys.version_info < (2, 5):
     import sha as digestmod
 else:
     from hashlib import sha256 as digestmod  # noqa
+try:
+    from hashlib import pbkdf2_hmac
+except ImportError:
+    pbkdf2_hmac = None
 try:
     import json
 except ImportError:
     import simplejson as json  # noqa
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma  # noqa
+    except ImportError:
+        lzma = None
 
 
 try:
@@ -1,4 +1,5 @@
 LOCAL_STORAGE = "/var/lib/pulp/"
 
 PULP_USER_METADATA_FIELDNAME = 'pulp_user_metadata'
+UNIT_KEY_DIGEST_FIELDNAME = '_unit_key_digest'
 PULP_DJANGO_SETTINGS_MODULE = 'pulp.server.webservices.settings'
@@ -7,6 +7,7 @@ from nectar.listener import DownloadEventListener
 from nectar.report import DownloadReport as NectarDownloadReport
 from nectar.request import DownloadRequest
 
+from pulp.plugins.util.misc import paginate
 from pulp.server.content.sources.model import ContentSource, PrimarySource, \
     DownloadReport, DownloadDetails, RefreshReport
 from pulp.server.managers import factory as managers
@@ -15,6 +16,11 @@ from pulp.server.managers import factory as managers
 log = getLogger(__name__)
 
 
+# The number of requests for which content sources are found with a
+# single content catalog query.
+FIND_SOURCES_WINDOW = 500
+
+
 class ContentContainer(object):
     """
     The content container represents a virtual collection of content that is
@@ -335,6 +341,22 @@ class Batch(object):
         queue.start()
         return queue
 
+    def find_sources(self, requests):
+        """
+        Find and set the list of content sources used to satisfy each of
+        the specified requests.  The content catalog entries for all of
+        the requests are found using a single query.
+        :param requests: A sequence of: pulp.server.content.sources.model.Request.
+        :type requests: tuple
+        """
+        locators = [request.locator for request in requests]
+        entries = {}
+        if self.sources:
+            catalog = managers.content_catalog_manager()
+            entries = catalog.find_all(set(locators))
+        for request, locator in zip(requests, locators):
+            request.set_sources(self.primary, self.sources, entries.get(locator, []))
+
     def download(self):
         """
         Begin processing the batch of requests.
@@ -342,7 +364,9 @@ class Batch(object):
         An attempt is made to satisfy each download request using the alternate
         content sources in the order specified by priority.  The specified
         downloader is designated as the primary source and is used in the event that
-        the request cannot be completed using alternate sources.
+        the request cannot be completed using alternate sources.  Sources are found
+        for a window of requests at a time, so downloading begins before the
+        sources for all of the requests have been found.
         :return: The download report.
         :rtype: DownloadReport
         """
@@ -351,12 +375,15 @@ class Batch(object):
         report.total_sources = len(self.sources)
 
         try:
-            for request in self.requests:
+            for requests in paginate(self.requests, FIND_SOURCES_WINDOW):
                 if self.is_canceled:
                     break
-                request.find_sources(self.primary, self.sources)
-                self.dispatch(request)
-                count += 1
+                self.find_sources(requests)
+                for request in requests:
+                    if self.is_canceled:
+                        break
+                    self.dispatch(request)
+                    count += 1
         except Exception:
             self.canceled.set()
             raise
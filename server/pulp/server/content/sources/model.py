@@ -22,6 +22,7 @@ from pulp.plugins.conduits.cataloger import CatalogerConduit
 from pulp.plugins.loader import api as plugins
 from pulp.server.content.sources import constants
 from pulp.server.content.sources.descriptor import is_valid, to_seconds, DEFAULT
+from pulp.server.db.model.content import ContentCatalog
 from pulp.server.managers import factory as managers
 
 
@@ -80,6 +81,15 @@ class Request(object):
         self.errors = []
         self.data = None
 
+    @property
+    def locator(self):
+        """
+        The content catalog locator of the requested content unit.
+        :return: The locator.
+        :rtype: str
+        """
+        return ContentCatalog.get_locator(self.type_id, self.unit_key)
+
     def find_sources(self, primary, alternates):
         """
         Find and set the list of content sources in the order they are to
@@ -90,9 +100,24 @@ class Request(object):
         :param alternates: A list of alternative sources.
         :type list of: ContentSource
         """
-        resolved = [(primary, self.url)]
         catalog = managers.content_catalog_manager()
-        for entry in catalog.find(self.type_id, self.unit_key):
+        self.set_sources(primary, alternates, catalog.find(self.type_id, self.unit_key))
+
+    def set_sources(self, primary, alternates, entries):
+        """
+        Set the list of content sources in the order they are to be used
+        to satisfy the request, using catalog entries that have already
+        been found.  The alternate sources are ordered by priority.  The
+        primary content source is always last.
+        :param primary: The primary content source.
+        :type primary: ContentSource
+        :param alternates: A list of alternative sources.
+        :type list of: ContentSource
+        :param entries: The content catalog entries matching the request.
+        :type entries: list
+        """
+        resolved = [(primary, self.url)]
+        for entry in entries:
             source_id = entry[constants.SOURCE_ID]
             source = alternates.get(source_id)
             if source is None:
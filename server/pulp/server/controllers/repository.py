@@ -1,9 +1,11 @@
+from collections import defaultdict, OrderedDict
 from datetime import datetime
 from gettext import gettext as _
 import logging
 import sys
 
 from mongoengine import NotUniqueError, OperationError, ValidationError
+from pymongo.errors import BulkWriteError
 import celery
 
 from pulp.common import dateutils, error_codes, tags
@@ -28,6 +30,12 @@ from pulp.server.managers.repo import _common as common_utils
 
 _logger = logging.getLogger(__name__)
 
+# Maximum number of associations written by a single bulk operation
+ASSOCIATION_BATCH_SIZE = 1000
+
+# Number of associations that find_repo_content_units joins with their units at a time
+REPO_CONTENT_UNITS_PAGE_SIZE = misc.DEFAULT_PAGE_SIZE
+
 
 def find_repo_content_units(
         repository, repo_content_unit_q=None,
@@ -66,41 +74,64 @@ def find_repo_content_units(
     qs = model.RepositoryContentUnit.objects(q_obj=repo_content_unit_q,
                                              repo_id=repository.repo_id)
 
-    type_map = {}
-    content_units = {}
-
     yield_count = 1
     skip_count = 0
 
-    for repo_content_unit in qs:
-        id_set = type_map.setdefault(repo_content_unit.unit_type_id, set())
-        id_set.add(repo_content_unit.unit_id)
-        content_unit_set = content_units.setdefault(repo_content_unit.unit_type_id, dict())
-        content_unit_set[repo_content_unit.unit_id] = repo_content_unit
-
-    for unit_type, unit_ids in type_map.iteritems():
-        qs = plugin_api.get_unit_model_by_id(unit_type).objects(
-            q_obj=units_q, __raw__={'_id': {'$in': list(unit_ids)}})
-        if unit_fields:
-            qs = qs.only(unit_fields)
-
-        for unit in qs:
-            if skip and skip_count < skip:
-                skip_count += 1
-                continue
-
-            if yield_content_unit:
-                yield unit
-            else:
-                cu = content_units[unit_type][unit.id]
-                cu.unit = unit
-                yield cu
+    for repo_content_unit_page in _paginate_by_id(qs, REPO_CONTENT_UNITS_PAGE_SIZE):
+        content_units = {}
+        for repo_content_unit in repo_content_unit_page:
+            content_unit_set = content_units.setdefault(repo_content_unit.unit_type_id, dict())
+            content_unit_set[repo_content_unit.unit_id] = repo_content_unit
+
+        for unit_type, content_unit_set in content_units.iteritems():
+            units_qs = plugin_api.get_unit_model_by_id(unit_type).objects(
+                q_obj=units_q, __raw__={'_id': {'$in': content_unit_set.keys()}})
+            if unit_fields:
+                units_qs = units_qs.only(unit_fields)
+
+            for unit in units_qs:
+                if skip and skip_count < skip:
+                    skip_count += 1
+                    continue
+
+                if yield_content_unit:
+                    yield unit
+                else:
+                    cu = content_unit_set[unit.id]
+                    cu.unit = unit
+                    yield cu
+
+                if limit:
+                    if yield_count >= limit:
+                        return
+
+                yield_count += 1
 
-            if limit:
-                if yield_count >= limit:
-                    return
 
-            yield_count += 1
+def _paginate_by_id(qs, page_size):
+    """
+    Read the documents of a query set a page at a time, in order of their ids. Each page is
+    read with its own query for the documents whose id is greater than the last id of the
+    previous page, so no cursor is held open while the caller works on a page, and only one
+    page is held in memory at once.
+
+    :param qs: query set to read
+    :type  qs: mongoengine.queryset.QuerySet
+    :param page_size: maximum number of documents in a page
+    :type  page_size: int
+
+    :return: pages of documents
+    :rtype:  generator of lists of mongoengine.Document
+    """
+    qs = qs.order_by('id')
+    page_qs = qs
+    while True:
+        page = list(page_qs.limit(page_size))
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        page_qs = qs.filter(id__gt=page[-1].id)
 
 
 def rebuild_content_unit_counts(repository):
@@ -147,6 +178,91 @@ def associate_single_unit(repository, unit):
         upsert=True)
 
 
+def associate_units(repository, units, batch_size=ASSOCIATION_BATCH_SIZE):
+    """
+    Associate many units to a repository, using one unordered bulk upsert per batch of units.
+
+    The content unit counts and the last unit added time of the repository are updated once, at
+    the end, if any of the units was not associated to the repository before.
+
+    :param repository: The repository to update.
+    :type repository: pulp.server.db.model.Repository
+    :param units: The units to associate to the repository.
+    :type units: iterable of pulp.server.db.model.ContentUnit
+    :param batch_size: The maximum number of units associated by each bulk upsert.
+    :type batch_size: int
+
+    :return: The number of units that were not associated to the repository before.
+    :rtype: int
+    """
+    unit_ids = ((unit.unit_type_id, unit.id) for unit in units)
+    return _associate_unit_ids(repository.repo_id, unit_ids, batch_size)
+
+
+def associate_unit_ids(repo_id, unit_type_id, unit_ids, batch_size=ASSOCIATION_BATCH_SIZE):
+    """
+    Associate many units of one type to a repository by their ids. See associate_units.
+
+    :param repo_id: identifies the repository to update
+    :type repo_id: basestring
+    :param unit_type_id: identifies the type of the units
+    :type unit_type_id: basestring
+    :param unit_ids: ids of the units to associate to the repository
+    :type unit_ids: iterable of basestring
+    :param batch_size: The maximum number of units associated by each bulk upsert.
+    :type batch_size: int
+
+    :return: The number of units that were not associated to the repository before.
+    :rtype: int
+    """
+    type_and_unit_ids = ((unit_type_id, unit_id) for unit_id in unit_ids)
+    return _associate_unit_ids(repo_id, type_and_unit_ids, batch_size)
+
+
+def _associate_unit_ids(repo_id, type_and_unit_ids, batch_size):
+    """
+    :param repo_id: identifies the repository to update
+    :type repo_id: basestring
+    :param type_and_unit_ids: (unit type id, unit id) tuples of the units to associate
+    :type type_and_unit_ids: iterable of tuple
+    :param batch_size: The maximum number of units associated by each bulk upsert.
+    :type batch_size: int
+
+    :return: The number of units that were not associated to the repository before.
+    :rtype: int
+    """
+    collection = model.RepositoryContentUnit._get_collection()
+    new_counts = defaultdict(int)
+
+    for page in misc.paginate(type_and_unit_ids, batch_size):
+        # the same unit twice in one bulk operation would be counted twice
+        page = OrderedDict.fromkeys(page).keys()
+        formatted_datetime = dateutils.format_iso8601_utc_timestamp(
+            dateutils.now_utc_timestamp())
+        bulk = collection.initialize_unordered_bulk_op()
+        for unit_type_id, unit_id in page:
+            spec = {'repo_id': repo_id, 'unit_type_id': unit_type_id, 'unit_id': unit_id}
+            bulk.find(spec).upsert().update_one({'$setOnInsert': {'created': formatted_datetime},
+                                                 '$set': {'updated': formatted_datetime}})
+        try:
+            result = bulk.execute()
+        except BulkWriteError, e:
+            # Concurrent upserts of the same association make all but one of them fail on the
+            # unique index. The association exists either way, so those are not errors.
+            result = e.details
+            duplicate = connection.MONGO_DUPLICATE_KEY_ERROR
+            if any(error['code'] != duplicate for error in result['writeErrors']):
+                raise
+        for upserted in result['upserted']:
+            new_counts[page[upserted['index']][0]] += 1
+
+    for unit_type_id, count in new_counts.iteritems():
+        update_unit_count(repo_id, unit_type_id, count)
+    if new_counts:
+        update_last_unit_added(repo_id)
+    return sum(new_counts.itervalues())
+
+
 def disassociate_units(repository, unit_iterable):
     """
     Disassociate all units in the iterable from the repository
@@ -5,41 +5,52 @@ from pulp.plugins.types import database as types_db
 from pulp.plugins.util import misc
 
 
-def find_units(units, pagination_size=50):
+def find_units(units, pagination_size=misc.DEFAULT_PAGE_SIZE):
     """
     Query for units matching the unit key fields of an iterable of ContentUnit objects.
 
     This requires that all the ContentUnit objects are of the same content type.
 
+    Units are matched by the digest of their unit key, so each page of units is looked up
+    with a single indexed query. Units that were stored without a digest are matched by their
+    unit key fields, but only if the collection has any such units.
+
     :param units: Iterable of content units with the unit key fields specified.
     :type units: iterable of pulp.server.db.model.ContentUnit
     :param pagination_size: How large a page size to use when querying units.
-    :type pagination_size: int (default 50)
+    :type pagination_size: int (default 1000)
 
     :returns: unit models that pulp already knows about.
     :rtype: Generator of pulp.server.db.model.ContentUnit
     """
     # get the class from the first unit
     model_class = None
+    has_undigested_units = None
 
     for units_group in misc.paginate(units, pagination_size):
+        digests = []
         q_object = mongoengine.Q()
-        # Build a query for the units in this group
         for unit in units_group:
             if model_class is None:
                 model_class = unit.__class__
-
+            digests.append(unit.get_unit_key_digest())
             # Build the query for all the units, the | operator here
             # creates the equivalent of a mongo $or of all the unit keys
-            unit_q_obj = mongoengine.Q(**unit.unit_key)
-            q_object = q_object | unit_q_obj
+            q_object = q_object | mongoengine.Q(**unit.unit_key)
 
         # Get this group of units
-        query = model_class.objects(q_object)
+        query = model_class.objects(unit_key_digest__in=digests)
 
         for found_unit in query:
             yield found_unit
 
+        if has_undigested_units is None:
+            has_undigested_units = model_class.objects(unit_key_digest=None).only(
+                'id').first() is not None
+        if has_undigested_units:
+            for found_unit in model_class.objects(q_object, unit_key_digest=None):
+                yield found_unit
+
 
 def get_unit_key_fields_for_type(type_id):
     """
@@ -28,6 +28,8 @@ _DEFAULT_MAX_POOL_SIZE = 10
 # see version.cpp in mongo source code for version format info.
 MONGO_MINIMUM_VERSION = semantic_version.Version("2.4.0")
 MONGO_WRITE_CONCERN_VERSION = semantic_version.Version("2.6.0")
+# error code of a write that failed because of a unique index
+MONGO_DUPLICATE_KEY_ERROR = 11000
 
 _logger = logging.getLogger(__name__)
 
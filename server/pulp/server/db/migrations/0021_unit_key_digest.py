@@ -0,0 +1,75 @@
+"""
+This migration stores the digest of its unit key in every content unit and indexes it, so that
+units can be looked up by unit key with a single $in query.
+"""
+import logging
+
+from pulp.plugins.loader.manager import PluginManager
+from pulp.plugins.types import database as types_db
+from pulp.plugins.util.misc import paginate
+from pulp.server import constants
+from pulp.server.db import connection
+from pulp.server.db.model import unit_key_digest
+
+
+_logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 1000
+
+
+def migrate(*args, **kwargs):
+    """
+    Perform the migration as described in this module's docblock.
+
+    :param args:   unused
+    :type  args:   list
+    :param kwargs: unused
+    :type  kwargs: dict
+    """
+    db = connection.get_database()
+    for collection_name, key_fields in _unit_key_fields().iteritems():
+        _logger.info('Adding unit key digests to %s' % collection_name)
+        _add_unit_key_digests(db[collection_name], key_fields)
+
+
+def _unit_key_fields():
+    """
+    Find the unit key fields of every content type, whether it is defined by a type definition
+    or by a unit model.
+
+    :return: maps the name of each unit collection to a dict of the unit key fields of its
+             units, which maps the name of each field to the name it is stored under
+    :rtype:  dict
+    """
+    unit_key_fields = {}
+    for type_def in types_db.all_type_definitions():
+        collection_name = types_db.unit_collection_name(type_def['id'])
+        unit_key_fields[collection_name] = dict((key, key) for key in type_def['unit_key'])
+    for model_class in PluginManager().unit_models.itervalues():
+        collection_name = model_class._get_collection_name()
+        unit_key_fields[collection_name] = dict((key, model_class._fields[key].db_field)
+                                                for key in model_class.unit_key_fields)
+    return unit_key_fields
+
+
+def _add_unit_key_digests(collection, key_fields):
+    """
+    Store the digest of the unit key in each unit of a collection that does not have one yet,
+    and index it.
+
+    :param collection:  collection of content units
+    :type  collection:  pymongo.collection.Collection
+    :param key_fields:  maps the name of each unit key field to the name it is stored under
+    :type  key_fields:  dict
+    """
+    spec = {constants.UNIT_KEY_DIGEST_FIELDNAME: {'$exists': False}}
+    units = collection.find(spec, fields=key_fields.values())
+    for page in paginate(units, PAGE_SIZE):
+        bulk = collection.initialize_unordered_bulk_op()
+        for unit in page:
+            unit_key = dict((key, unit.get(db_field)) for key, db_field in key_fields.iteritems())
+            digest = unit_key_digest(unit_key)
+            bulk.find({'_id': unit['_id']}).update_one(
+                {'$set': {constants.UNIT_KEY_DIGEST_FIELDNAME: digest}})
+        bulk.execute()
+    collection.ensure_index(constants.UNIT_KEY_DIGEST_FIELDNAME)
@@ -1,4 +1,6 @@
 import copy
+import hashlib
+import json
 import logging
 import os
 import uuid
@@ -10,7 +12,7 @@ from mongoengine import signals
 
 from pulp.common import constants, dateutils, error_codes
 
-from pulp.server import exceptions
+from pulp.server import constants as server_constants, exceptions
 from pulp.server.content.storage import FileStorage, SharedStorage
 from pulp.plugins.model import Repository as plugin_repo
 from pulp.server.async.emit import send as send_taskstatus_message
@@ -384,6 +386,45 @@ class TaskStatus(AutoRetryDocument, ReaperMixin):
 signals.post_save.connect(TaskStatus.post_save, sender=TaskStatus)
 
 
+def unit_key_digest(unit_key):
+    """
+    Digest a unit key, so that units can be looked up by a single indexed field rather than by
+    every field of their unit key.
+
+    Values that the database considers equal digest the same, so numbers are digested by their
+    value whatever their type, e.g. 1 and 1.0 have the same digest.
+
+    :param unit_key: the unit key fields and their values, as stored in the database
+    :type  unit_key: dict
+
+    :return: hex digest of the canonical form of the unit key
+    :rtype:  str
+    """
+    canonical = json.dumps(_canonical_value(unit_key), sort_keys=True, separators=(',', ':'),
+                           default=unicode)
+    return hashlib.sha256(canonical).hexdigest()
+
+
+def _canonical_value(value):
+    """
+    Convert a unit key value to the form it is digested in. Floats that hold a whole number
+    become integers, in dictionaries and lists as well.
+
+    :param value: unit key value
+    :type  value: object
+
+    :return: canonical form of the value
+    :rtype:  object
+    """
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, dict):
+        return dict((key, _canonical_value(item)) for key, item in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [_canonical_value(item) for item in value]
+    return value
+
+
 class ContentUnit(AutoRetryDocument):
     """
     The base class for all content units.
@@ -399,6 +440,8 @@ class ContentUnit(AutoRetryDocument):
     :type user_metadata: mongoengine.DictField
     :ivar storage_path: Location on disk where the content associated with this unit lives
     :type storage_path: mongoengine.StringField
+    :ivar unit_key_digest: digest of the unit key, maintained when the unit is saved
+    :type unit_key_digest: mongoengine.StringField
 
     :ivar _ns: (Deprecated), Contains the name of the collection this model represents
     :type _ns: mongoengine.StringField
@@ -414,6 +457,7 @@ class ContentUnit(AutoRetryDocument):
     last_updated = IntField(db_field='_last_updated', required=True)
     user_metadata = DictField(db_field='pulp_user_metadata')
     storage_path = StringField(db_field='_storage_path')
+    unit_key_digest = StringField(db_field=server_constants.UNIT_KEY_DIGEST_FIELDNAME)
 
     # For backward compatibility
     _ns = StringField(required=True)
@@ -421,6 +465,7 @@ class ContentUnit(AutoRetryDocument):
 
     meta = {
         'abstract': True,
+        'indexes': ['unit_key_digest'],
     }
 
     _NAMED_TUPLE = None
@@ -448,7 +493,7 @@ class ContentUnit(AutoRetryDocument):
         """
         The signal that is triggered before a unit is saved, this is used to
         support the legacy behavior of generating the unit id and setting
-        the last_updated timestamp
+        the last_updated timestamp, and to keep the unit key digest current
 
         :param sender: sender class
         :type sender: object
@@ -458,6 +503,7 @@ class ContentUnit(AutoRetryDocument):
         if not document.id:
             document.id = str(uuid.uuid4())
         document.last_updated = dateutils.now_utc_timestamp()
+        document.unit_key_digest = document.get_unit_key_digest()
 
     def get_repositories(self):
         """
@@ -477,6 +523,18 @@ class ContentUnit(AutoRetryDocument):
         """
         return dict((key, getattr(self, key)) for key in self.unit_key_fields)
 
+    def get_unit_key_digest(self):
+        """
+        Digest the unit key the same way it is digested when the unit is saved, so that the unit
+        can be matched with any saved unit that has the same unit key.
+
+        :return: hex digest of the unit key
+        :rtype:  str
+        """
+        unit_key = dict((key, self._fields[key].to_mongo(getattr(self, key)))
+                        for key in self.unit_key_fields)
+        return unit_key_digest(unit_key)
+
     @property
     def unit_key_str(self):
         """
@@ -11,6 +11,8 @@
 # have received a copy of GPLv2 along with this software; if not, see
 # http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
 
+from bson import ObjectId
+
 from pulp.server.db.model.base import Model
 
 # -- classes -----------------------------------------------------------------
@@ -96,3 +98,39 @@ class Permission(Model):
 
         self.resource = resource
         self.users = users or []
+
+
+class AuthorizationGeneration(Model):
+    """
+    Tracks the generation of the authorization data, which is made up of the users, roles and
+    permissions. A new generation is recorded whenever any of them is changed, so that
+    authorization decisions compiled from the data can be validated by comparing generations.
+
+    Generations are unique ObjectIds rather than counters, so that a generation is never reused
+    even if this collection is dropped.
+    """
+
+    collection_name = 'authorization_generation'
+    unique_indices = ()
+
+    # the _id of the single document in the collection
+    DOCUMENT_ID = 'generation'
+
+    @classmethod
+    def bump(cls):
+        """
+        Record a new generation of the authorization data.
+        """
+        cls.get_collection().update({'_id': cls.DOCUMENT_ID},
+                                    {'$set': {'generation': ObjectId()}}, upsert=True)
+
+    @classmethod
+    def get_generation(cls):
+        """
+        :return: the current generation, or None if the authorization data was never changed
+        :rtype:  bson.ObjectId or None
+        """
+        document = cls.get_collection().find_one({'_id': cls.DOCUMENT_ID})
+        if document is None:
+            return None
+        return document['generation']
@@ -15,6 +15,8 @@ import datetime
 import hashlib
 import json
 
+from bson import ObjectId
+
 from pulp.server.db.model.base import Model
 from pulp.server.db.model.reaper_base import ReaperMixin
 from pulp.common import dateutils
@@ -182,7 +184,8 @@ class RepoProfileApplicability(Model):
         ('profile_hash', 'repo_id'),
     )
 
-    def __init__(self, profile_hash, repo_id, profile, applicability, _id=None, **kwargs):
+    def __init__(self, profile_hash, repo_id, profile, applicability, _id=None,
+                 last_regenerated=None, **kwargs):
         """
         Construct a RepoProfileApplicability object.
 
@@ -197,6 +200,10 @@ class RepoProfileApplicability(Model):
         :type  applicability: dict
         :param _id:           The MongoDB ID for this object, if it exists in the database
         :type  _id:           bson.objectid.ObjectId
+        :param last_regenerated: UTC timestamp of when the regeneration that produced the
+                              applicability data started. None if it is not known, in which case
+                              the data can only be regenerated from scratch.
+        :type  last_regenerated: int or None
         :param kwargs:        unused, but collected to allow instantiation from Mongo query results
         :type  kwargs:        dict
         """
@@ -207,6 +214,7 @@ class RepoProfileApplicability(Model):
         self.profile = profile
         self.applicability = applicability
         self._id = _id
+        self.last_regenerated = last_regenerated
 
         # The superclass puts an unnecessary (and confusingly named) id attribute on this model.
         # Let's remove it.
@@ -217,6 +225,7 @@ class RepoProfileApplicability(Model):
         Delete this RepoProfileApplicability object from the database.
         """
         self.get_collection().remove({'_id': self._id})
+        RepoApplicabilityRevision.bump([self.repo_id])
 
     def save(self):
         """
@@ -226,12 +235,85 @@ class RepoProfileApplicability(Model):
         # If this object's _id attribute is not None, then it represents an existing DB object.
         # Else, we need to create an object with this object's attributes
         new_document = {'profile_hash': self.profile_hash, 'repo_id': self.repo_id,
-                        'profile': self.profile, 'applicability': self.applicability}
+                        'profile': self.profile, 'applicability': self.applicability,
+                        'last_regenerated': self.last_regenerated}
         if self._id is not None:
-            self.get_collection().update({'_id': self._id}, new_document)
+            self.get_collection().update(self._update_spec(), new_document)
         else:
             # Let's set the _id attribute to the newly created document
             self._id = self.get_collection().insert(new_document)
+        RepoApplicabilityRevision.bump([self.repo_id])
+
+    def save_applicability(self, content_type_ids):
+        """
+        Save the applicability data for the given content types, and the last_regenerated
+        timestamp, to the existing database document. The rest of the document, notably the
+        profile, is left untouched.
+
+        :param content_type_ids: ids of the content types whose applicability data changed
+        :type  content_type_ids: iterable
+        """
+        changes = {'last_regenerated': self.last_regenerated}
+        for content_type_id in content_type_ids:
+            changes['applicability.%s' % content_type_id] = self.applicability[content_type_id]
+        self.get_collection().update(self._update_spec(), {'$set': changes})
+        RepoApplicabilityRevision.bump([self.repo_id])
+
+    def _update_spec(self):
+        """
+        Regenerations of the same data may run concurrently, so the existing document is only
+        updated if it does not hold data from a regeneration that started later than the one
+        that produced this data.
+
+        :return: query that matches the existing document of this object
+        :rtype:  dict
+        """
+        spec = {'_id': self._id}
+        if self.last_regenerated is not None:
+            spec['last_regenerated'] = {'$not': {'$gt': self.last_regenerated}}
+        return spec
+
+
+class RepoApplicabilityRevision(Model):
+    """
+    Tracks the revision of the applicability data of each repository. A new revision is recorded
+    whenever RepoProfileApplicability data for the repository is written, so that results derived
+    from that data can be validated by comparing revisions instead of reading it again.
+
+    Revisions are unique ObjectIds rather than counters, so that a revision is never reused even
+    if this collection is dropped.
+    """
+    collection_name = 'repo_applicability_revisions'
+
+    unique_indices = ('repo_id',)
+
+    @classmethod
+    def bump(cls, repo_ids):
+        """
+        Record a new revision of the applicability data of the given repositories.
+
+        :param repo_ids: ids of the repositories whose applicability data changed
+        :type  repo_ids: iterable
+        """
+        collection = cls.get_collection()
+        for repo_id in set(repo_ids):
+            collection.update({'repo_id': repo_id}, {'$set': {'revision': ObjectId()}},
+                              upsert=True)
+
+    @classmethod
+    def get_revisions(cls, repo_ids):
+        """
+        Get the current revisions of the applicability data of the given repositories.
+
+        :param repo_ids: ids of the repositories
+        :type  repo_ids: list
+        :return: dict mapping each repo id to its revision. Repositories whose applicability data
+                 has never been written are left out.
+        :rtype:  dict
+        """
+        revisions = cls.get_collection().find({'repo_id': {'$in': repo_ids}},
+                                              fields=['repo_id', 'revision'])
+        return dict((r['repo_id'], r['revision']) for r in revisions)
 
 
 class UnitProfile(Model):
@@ -5,6 +5,7 @@ import oauth2
 
 from pulp.server.auth import ldap_connection
 from pulp.server.config import config
+from pulp.server.db.model.auth import User
 from pulp.server.db.model.consumer import Consumer
 from pulp.server.exceptions import PulpException
 from pulp.server.managers import factory
@@ -43,9 +44,16 @@ class AuthenticationManager(object):
             return None
 
         if password is not None:
-            if not factory.password_manager().check_password(user['password'], password):
+            password_manager = factory.password_manager()
+            if not password_manager.check_password(user['password'], password):
                 _logger.debug('Password for user [%s] was incorrect' % username)
                 return None
+            if password_manager.needs_rehash(user['password']):
+                # Upgrade the stored password to the current hashing scheme, unless it was
+                # changed since it was read
+                User.get_collection().update(
+                    {'login': username, 'password': user['password']},
+                    {'$set': {'password': password_manager.hash_password(password)}})
 
         return user
 
@@ -2,21 +2,106 @@
 Password Manager
 
 Functions taken from stackoverflow.com : http://tinyurl.com/2f6gx7s
+
+Password entries are stored in one of two formats:
+
+* ``$pbkdf2-sha256$<iterations>$<salt>$<hash>``, where salt and hash are base64 encoded and the
+  hash is derived with the native PBKDF2 implementation of hashlib. This is the current format.
+* ``<salt>,<hash>``, the legacy format, where the hash is derived with the pure python
+  ``pbkdf_sha256`` method. Entries in this format are upgraded to the current one the next time
+  their user logs in.
 """
 
 from hmac import HMAC
+import os
 import random
 
-from pulp.server.compat import digestmod
+from pulp.common.cache import TTLCache
+from pulp.server.compat import digestmod, pbkdf2_hmac
 
 
 NUM_ITERATIONS = 5000
 
+PBKDF2_SCHEME = 'pbkdf2-sha256'
+PBKDF2_ITERATIONS = 10000
+
+# verified credentials are remembered for this many seconds
+CREDENTIAL_CACHE_TTL = 60
+# maximum number of verified credentials remembered by each process
+CREDENTIAL_CACHE_SIZE = 1024
+
+
+class CredentialCache(object):
+    """
+    Remembers which passwords were recently verified against which password entries, so that
+    repeated requests with the same credentials skip the key derivation.
+
+    Neither passwords nor password entries are stored. Each pair is remembered as an HMAC keyed
+    with a random per-process secret, so the contents of the cache are useless outside of the
+    process. The entry is part of the digest, so changing a user's password invalidates it.
+    """
+
+    def __init__(self, ttl=CREDENTIAL_CACHE_TTL, max_size=CREDENTIAL_CACHE_SIZE):
+        """
+        :param ttl:      number of seconds a verified credential is remembered
+        :type  ttl:      int
+        :param max_size: maximum number of remembered credentials
+        :type  max_size: int
+        """
+        self._secret = os.urandom(32)
+        self._verified = TTLCache(max_size, ttl)
+
+    def _digest(self, saved_password_entry, plain_password):
+        """
+        :return: the keyed digest that the credential is remembered by
+        :rtype:  str
+        """
+        message = _encode(saved_password_entry) + '\0' + _encode(plain_password)
+        return HMAC(self._secret, message, digestmod).digest()
+
+    def __contains__(self, credential):
+        """
+        :param credential: tuple of a saved password entry and a plain text password
+        :type  credential: tuple
+        :return: True if the password was verified against the entry within the last ttl seconds
+        :rtype:  bool
+        """
+        return self._verified.get(self._digest(*credential), False)
+
+    def add(self, saved_password_entry, plain_password):
+        """
+        Remember that the password was verified against the entry.
+
+        :param saved_password_entry: the saved password entry
+        :type  saved_password_entry: basestring
+        :param plain_password:       the plain text password
+        :type  plain_password:       basestring
+        """
+        self._verified.set(self._digest(saved_password_entry, plain_password), True)
+
+    def clear(self):
+        """
+        Forget all of the verified credentials.
+        """
+        self._verified.clear()
+
+
+def _encode(value):
+    """
+    :return: the value as a utf-8 encoded str
+    :rtype:  str
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
 
 class PasswordManager(object):
     """
     Performs password related functions.
     """
+    credential_cache = CredentialCache()
+
     def random_bytes(self, num_bytes):
         return "".join(chr(random.randrange(256)) for i in xrange(num_bytes))
 
@@ -27,14 +112,45 @@ class PasswordManager(object):
         return result
 
     def hash_password(self, plain_password):
+        if pbkdf2_hmac is None:
+            return self._hash_password_legacy(plain_password)
+        salt = os.urandom(16)  # 128 bits
+        hashed_password = pbkdf2_hmac('sha256', _encode(plain_password), salt, PBKDF2_ITERATIONS)
+        return '$'.join(['', PBKDF2_SCHEME, str(PBKDF2_ITERATIONS),
+                         salt.encode("base64").strip(), hashed_password.encode("base64").strip()])
+
+    def _hash_password_legacy(self, plain_password):
         salt = self.random_bytes(8)  # 64 bits
         hashed_password = self.pbkdf_sha256(str(plain_password), salt, NUM_ITERATIONS)
         # return the salt and hashed password, encoded in base64 and split with ","
         return salt.encode("base64").strip() + "," + hashed_password.encode("base64").strip()
 
     def check_password(self, saved_password_entry, plain_password):
-        salt, hashed_password = saved_password_entry.split(",")
-        salt = salt.decode("base64")
-        hashed_password = hashed_password.decode("base64")
-        pbkdbf = self.pbkdf_sha256(plain_password, salt, NUM_ITERATIONS)
-        return hashed_password == pbkdbf
+        if (saved_password_entry, plain_password) in self.credential_cache:
+            return True
+        if saved_password_entry.startswith('$'):
+            scheme, iterations, salt, hashed_password = saved_password_entry[1:].split('$')
+            if scheme != PBKDF2_SCHEME or pbkdf2_hmac is None:
+                return False
+            derived = pbkdf2_hmac('sha256', _encode(plain_password), salt.decode("base64"),
+                                  int(iterations))
+        else:
+            salt, hashed_password = saved_password_entry.split(",")
+            salt = salt.decode("base64")
+            derived = self.pbkdf_sha256(_encode(plain_password), salt, NUM_ITERATIONS)
+        if hashed_password.decode("base64") != derived:
+            return False
+        self.credential_cache.add(saved_password_entry, plain_password)
+        return True
+
+    def needs_rehash(self, saved_password_entry):
+        """
+        :param saved_password_entry: a saved password entry
+        :type  saved_password_entry: basestring
+        :return: True if the entry is not in the format that hash_password() currently produces,
+                 and should be replaced once the plain text password is known
+        :rtype:  bool
+        """
+        if pbkdf2_hmac is None:
+            return False
+        return not saved_password_entry.startswith('$%s$%d$' % (PBKDF2_SCHEME, PBKDF2_ITERATIONS))
@@ -9,7 +9,7 @@ from celery import task
 
 from pulp.server.async.tasks import Task
 from pulp.server.auth import authorization
-from pulp.server.db.model.auth import Permission, User
+from pulp.server.db.model.auth import AuthorizationGeneration, Permission, User
 from pulp.server.exceptions import (
     DuplicateResource, InvalidValue, MissingResource, PulpDataException,
     PulpExecutionException)
@@ -41,6 +41,7 @@ class PermissionManager(object):
         # Creation
         create_me = Permission(resource=resource_uri)
         Permission.get_collection().save(create_me)
+        AuthorizationGeneration.bump()
 
         # Retrieve the permission to return the SON object
         created = Permission.get_collection().find_one({'resource': resource_uri})
@@ -76,6 +77,7 @@ class PermissionManager(object):
             raise PulpDataException(_("Update Keyword [%s] is not supported" % key))
 
         Permission.get_collection().save(found)
+        AuthorizationGeneration.bump()
 
     @staticmethod
     def delete_permission(resource_uri):
@@ -98,6 +100,7 @@ class PermissionManager(object):
             raise MissingResource(resource_uri)
 
         Permission.get_collection().remove({'resource': resource_uri})
+        AuthorizationGeneration.bump()
 
     @staticmethod
     def grant(resource, login, operations):
@@ -139,6 +142,7 @@ class PermissionManager(object):
             current_ops.append(o)
 
         Permission.get_collection().save(permission)
+        AuthorizationGeneration.bump()
 
     @staticmethod
     def revoke(resource, login, operations):
@@ -186,6 +190,7 @@ class PermissionManager(object):
             return
 
         Permission.get_collection().save(permission)
+        AuthorizationGeneration.bump()
 
     def grant_automatic_permissions_for_resource(self, resource):
         """
@@ -254,6 +259,7 @@ class PermissionManager(object):
             else:
                 # Delete entire permission if there are no more users
                 Permission.get_collection().remove({'resource': permission['resource']})
+        AuthorizationGeneration.bump()
 
     def operation_name_to_value(self, name):
         """
@@ -10,7 +10,7 @@ from celery import task
 from pulp.server.async.tasks import Task
 from pulp.server.auth.authorization import CREATE, READ, UPDATE, DELETE, EXECUTE, \
     _operations_not_granted_by_roles
-from pulp.server.db.model.auth import Role, User
+from pulp.server.db.model.auth import AuthorizationGeneration, Role, User
 from pulp.server.exceptions import (DuplicateResource, InvalidValue, MissingResource,
                                     PulpDataException)
 from pulp.server.managers import factory
@@ -55,6 +55,7 @@ class RoleManager(object):
         # Creation
         create_me = Role(id=role_id, display_name=display_name, description=description)
         Role.get_collection().save(create_me)
+        AuthorizationGeneration.bump()
 
         # Retrieve the role to return the SON object
         created = Role.get_collection().find_one({'id': role_id})
@@ -94,6 +95,7 @@ class RoleManager(object):
             raise PulpDataException(_("Update Keyword [%s] is not supported" % key))
 
         Role.get_collection().save(role)
+        AuthorizationGeneration.bump()
 
         # Retrieve the user to return the SON object
         updated = Role.get_collection().find_one({'id': role_id})
@@ -140,6 +142,7 @@ class RoleManager(object):
             factory.user_manager().update_user(user['login'], Delta(user, 'roles'))
 
         Role.get_collection().remove({'id': role_id})
+        AuthorizationGeneration.bump()
 
     @staticmethod
     def add_permissions_to_role(role_id, resource, operations):
@@ -185,6 +188,7 @@ class RoleManager(object):
             factory.permission_manager().grant(resource, user['login'], operations)
 
         Role.get_collection().save(role)
+        AuthorizationGeneration.bump()
 
     @staticmethod
     def remove_permissions_from_role(role_id, resource, operations):
@@ -234,6 +238,7 @@ class RoleManager(object):
             role['permissions'].remove(resource_permission)
 
         Role.get_collection().save(role)
+        AuthorizationGeneration.bump()
 
     @staticmethod
     def add_user_to_role(role_id, login):
@@ -261,6 +266,7 @@ class RoleManager(object):
 
         user['roles'].append(role_id)
         User.get_collection().save(user)
+        AuthorizationGeneration.bump()
 
         for item in role['permissions']:
             factory.permission_manager().grant(item['resource'], login,
@@ -297,6 +303,7 @@ class RoleManager(object):
 
         user['roles'].remove(role_id)
         User.get_collection().save(user)
+        AuthorizationGeneration.bump()
 
         for item in role['permissions']:
             other_roles = factory.role_query_manager().get_other_roles(role, user['roles'])
@@ -316,6 +323,7 @@ class RoleManager(object):
             role['permissions'] = [{'resource': '/',
                                     'permission': [CREATE, READ, UPDATE, DELETE, EXECUTE]}]
             Role.get_collection().save(role)
+            AuthorizationGeneration.bump()
 
     @staticmethod
     def get_role(role):
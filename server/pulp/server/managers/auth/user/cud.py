@@ -10,7 +10,7 @@ from celery import task
 
 from pulp.server import config
 from pulp.server.async.tasks import Task
-from pulp.server.db.model.auth import User
+from pulp.server.db.model.auth import AuthorizationGeneration, User
 from pulp.server.exceptions import (PulpDataException, DuplicateResource, InvalidValue,
                                     MissingResource)
 from pulp.server.managers import factory
@@ -74,6 +74,7 @@ class UserManager(object):
         # Creation
         create_me = User(login=login, password=hashed_password, name=name, roles=roles)
         User.get_collection().save(create_me)
+        AuthorizationGeneration.bump()
 
         # Grant permissions
         permission_manager = factory.permission_manager()
@@ -147,6 +148,7 @@ class UserManager(object):
             raise InvalidValue(delta.keys())
 
         User.get_collection().save(user)
+        AuthorizationGeneration.bump()
 
         # Retrieve the user to return the SON object
         updated = User.get_collection().find_one({'login': login})
@@ -184,6 +186,7 @@ class UserManager(object):
         permission_manager.revoke_all_permissions_from_user(login)
 
         User.get_collection().remove({'login': login})
+        AuthorizationGeneration.bump()
 
     def ensure_admin(self):
         """
@@ -3,10 +3,10 @@ Contains users query classes
 """
 
 from gettext import gettext as _
+import threading
 
-from pulp.server.db.model.auth import User, Permission, Role
+from pulp.server.db.model.auth import AuthorizationGeneration, User, Permission, Role
 from pulp.server.exceptions import PulpDataException, MissingResource
-from pulp.server.managers import factory
 from pulp.server.managers.auth.role.cud import SUPER_USER_ROLE
 
 
@@ -110,23 +110,7 @@ class UserQueryManager(object):
         @return: True if the user is authorized for the operation on the resource,
                  False otherwise
         """
-        if self.is_superuser(login):
-            return True
-
-        permission_query_manager = factory.permission_query_manager()
-
-        parts = [p for p in resource.split('/') if p]
-        while parts:
-            current_resource = '/%s/' % '/'.join(parts)
-            permission = permission_query_manager.find_by_resource(current_resource)
-            if permission is not None:
-                if operation in permission_query_manager.find_user_permission(permission, login):
-                    return True
-            parts = parts[:-1]
-
-        permission = Permission.get_collection().find_one({'resource': '/'})
-        return (permission is not None and
-                operation in permission_query_manager.find_user_permission(permission, login))
+        return _permission_tables.get(login).is_authorized(resource, operation)
 
     def is_last_super_user(self, login):
         """
@@ -166,3 +150,142 @@ class UserQueryManager(object):
         @rtype:     list
         """
         return User.get_collection().query(criteria)
+
+
+def _resource_parts(resource):
+    """
+    @type resource: str
+    @param resource: pulp resource path
+
+    @rtype: list of str
+    @return: the non-empty parts of the resource path
+    """
+    return [p for p in resource.split('/') if p]
+
+
+class UserPermissionTable(object):
+    """
+    The permissions of a single user, compiled for fast authorization checks.
+
+    Permissions are held in a trie of resource path parts. Each node is a list of the bitmask of
+    operations granted on its resource, and a dict of its child nodes keyed by path part. Role
+    grants need no special handling, as they are already recorded on the permissions of each
+    member of the role.
+    """
+
+    def __init__(self, is_superuser, permissions):
+        """
+        @type is_superuser: bool
+        @param is_superuser: True if the user is a super user
+
+        @type permissions: iterable
+        @param permissions: tuples of resource path and list of operations granted on it
+        """
+        self.is_superuser = is_superuser
+        self._root = [0, {}]
+        for resource, operations in permissions:
+            parts = _resource_parts(resource)
+            # Permissions are only looked up by their canonical resource path, so any other
+            # resource path can never grant anything
+            if resource != ('/%s/' % '/'.join(parts) if parts else '/'):
+                continue
+            node = self._root
+            for part in parts:
+                node = node[1].setdefault(part, [0, {}])
+            for operation in operations:
+                node[0] |= 1 << operation
+
+    def is_authorized(self, resource, operation):
+        """
+        @type resource: str
+        @param resource: pulp resource path
+
+        @type operation: int
+        @param operation: operation to be performed on resource
+
+        @rtype: bool
+        @return: True if the operation is granted on the resource or on any of its parents
+        """
+        if self.is_superuser:
+            return True
+        node = self._root
+        granted = node[0]
+        for part in _resource_parts(resource):
+            node = node[1].get(part)
+            if node is None:
+                break
+            granted |= node[0]
+        return bool(granted & (1 << operation))
+
+
+class UserPermissionTableCache(object):
+    """
+    Caches the compiled permission table of each user. The whole cache is dropped whenever the
+    generation of the authorization data changes, so that changes made to users, roles and
+    permissions by any process are seen by the next authorization check.
+    """
+
+    def __init__(self):
+        self._generation = None
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def get(self, login):
+        """
+        @type login: str
+        @param login: login of user to get the permission table of
+
+        @rtype: UserPermissionTable
+        @return: the compiled permission table of the user
+
+        @raise MissingResource: if the user does not exist
+        """
+        generation = AuthorizationGeneration.get_generation()
+        with self._lock:
+            if generation != self._generation:
+                self._generation = generation
+                self._tables = {}
+            table = self._tables.get(login)
+        if table is not None:
+            return table
+
+        table = self._compile(login)
+        with self._lock:
+            # Tables compiled from data older than the cached generation are not kept
+            if generation == self._generation:
+                self._tables[login] = table
+        return table
+
+    def clear(self):
+        """
+        Drop all of the cached permission tables.
+        """
+        with self._lock:
+            self._generation = None
+            self._tables = {}
+
+    @staticmethod
+    def _compile(login):
+        """
+        Read the permissions of a user from the database and compile them.
+
+        @type login: str
+        @param login: login of user
+
+        @rtype: UserPermissionTable
+        @return: the compiled permission table of the user
+
+        @raise MissingResource: if the user does not exist
+        """
+        user = User.get_collection().find_one({'login': login}, fields=['roles'])
+        if user is None:
+            raise MissingResource(login)
+        permissions = Permission.get_collection().find(
+            {'users.username': login},
+            fields={'resource': 1, 'users': {'$elemMatch': {'username': login}}})
+        return UserPermissionTable(
+            SUPER_USER_ROLE in user['roles'],
+            ((p['resource'], p['users'][0]['permissions']) for p in permissions))
+
+
+_permission_tables = UserPermissionTableCache()
@@ -6,21 +6,36 @@ from gettext import gettext as _
 from logging import getLogger
 
 from celery import task
+from pymongo.errors import BulkWriteError
+import pymongo
 
+from pulp.common import dateutils, tags
+from pulp.common.cache import TTLCache
 from pulp.plugins.conduits.profiler import ProfilerConduit
 from pulp.plugins.config import PluginCallConfiguration
 from pulp.plugins.loader import api as plugin_api, exceptions as plugin_exceptions
 from pulp.plugins.profiler import Profiler
-from pulp.server.async.tasks import Task
-from pulp.server.db import model
-from pulp.server.db.model.consumer import Bind, RepoProfileApplicability, UnitProfile
+from pulp.plugins.types import database as content_types_db
+from pulp.plugins.util import misc
+from pulp.server.async.tasks import Task, TaskResult
+from pulp.server.config import config
+from pulp.server.db import connection, model
+from pulp.server.db.model.consumer import (Bind, RepoApplicabilityRevision,
+                                           RepoProfileApplicability, UnitProfile)
 from pulp.server.db.model.criteria import Criteria
+from pulp.server.db.model.repository import RepoContentUnit
 from pulp.server.managers import factory as managers
 from pulp.server.managers.consumer.query import ConsumerQueryManager
 
 
 _logger = getLogger(__name__)
 
+# number of existing applicability documents loaded and regenerated at a time
+APPLICABILITY_PAGE_SIZE = 100
+
+# number of consumer applicability query results cached by each server process
+APPLICABILITY_QUERY_CACHE_SIZE = 128
+
 
 class ApplicabilityRegenerationManager(object):
     @staticmethod
@@ -90,19 +105,59 @@ class ApplicabilityRegenerationManager(object):
                     for unit_profile_tuple in consumer_unit_profiles_map[consumer_id]:
                         repo_profile_hashes.add((repo_id, unit_profile_tuple))
 
-        # Iterate through each tuple in repo_profile_hashes set and regenerate applicability,
-        # if it doesn't exist. These are all guaranteed to be unique tuples because of the logic
-        # used to create maps and sets above, eliminating multiple unnecessary queries
-        # to check for existing applicability for same profiles.
-        manager = managers.applicability_regeneration_manager()
+        # Find which of the (repo_id, profile_hash) pairs already have applicability data. These
+        # are all guaranteed to be unique tuples because of the logic used to create maps and
+        # sets above, so the existing pairs are looked up with one query per page of profile
+        # hashes rather than one query per pair.
+        existing_keys = ApplicabilityRegenerationManager._get_existing_applicability_keys(
+            repo_consumers_map.keys(),
+            set(profile_hash for _, (profile_hash, _) in repo_profile_hashes))
+
+        # Decide which missing pairs need their applicability calculated. The content types of
+        # each repo and the profiler of each content type are looked up only once.
+        repo_content_types = {}
+        profilers = {}
+        missing = []
         for repo_id, (profile_hash, content_type) in repo_profile_hashes:
-            # Check if applicability for given profile_hash and repo_id already exists
-            if ApplicabilityRegenerationManager._is_existing_applicability(repo_id, profile_hash):
+            if (repo_id, profile_hash) in existing_keys:
                 continue
-            # If applicability does not exist, generate applicability data for given profile
-            # and repo id.
-            profile_id = profile_hash_profile_id_map[profile_hash]
-            manager.regenerate_applicability(profile_hash, content_type, profile_id, repo_id)
+            if content_type not in profilers:
+                profilers[content_type] = ApplicabilityRegenerationManager._profiler(content_type)
+            profiler, profiler_cfg = profilers[content_type]
+            if repo_id not in repo_content_types:
+                repo_content_types[repo_id] = set(
+                    ApplicabilityRegenerationManager._get_existing_repo_content_types(repo_id))
+            if repo_content_types[repo_id] & set(profiler.metadata()['types']):
+                missing.append((repo_id, profile_hash, content_type))
+
+        # Calculate the missing applicability data a page at a time, fetching the profiles of
+        # each page in one query and saving the results with one bulk upsert
+        profiler_conduit = ProfilerConduit()
+        regeneration_time = dateutils.now_utc_timestamp()
+        for page in misc.paginate(missing, APPLICABILITY_PAGE_SIZE):
+            profile_ids = set(profile_hash_profile_id_map[profile_hash]
+                              for _, profile_hash, _ in page)
+            profiles = dict(
+                (unit_profile['id'], unit_profile['profile'])
+                for unit_profile in UnitProfile.get_collection().find(
+                    {'id': {'$in': list(profile_ids)}}, fields=['id', 'profile']))
+            new_applicabilities = []
+            for repo_id, profile_hash, content_type in page:
+                profile = profiles.get(profile_hash_profile_id_map[profile_hash])
+                if profile is None:
+                    # The profile was removed since the profile hashes were read
+                    continue
+                profiler, profiler_cfg = profilers[content_type]
+                call_config = PluginCallConfiguration(plugin_config=profiler_cfg,
+                                                      repo_plugin_config=None)
+                applicability = ApplicabilityRegenerationManager._calculate_applicability(
+                    profiler, profile, repo_id, content_type, call_config, profiler_conduit)
+                if applicability is None:
+                    continue
+                new_applicabilities.append(RepoProfileApplicability(
+                    profile_hash=profile_hash, repo_id=repo_id, profile=profile,
+                    applicability=applicability, last_regenerated=regeneration_time))
+            RepoProfileApplicability.objects.bulk_upsert(new_applicabilities)
 
     @staticmethod
     def regenerate_applicability_for_repos(repo_criteria):
@@ -119,17 +174,151 @@ class ApplicabilityRegenerationManager(object):
         repo_ids = [r.repo_id for r in model.Repository.objects.find_by_criteria(repo_criteria)]
 
         for repo_id in repo_ids:
-            # Find all existing applicabilities for given repo_id. Setting batch size of 5 ensures
-            # the MongoDB cursor does not time out. See https://pulp.plan.io/issues/998#note-6 for
-            # more details.
-            existing_applicabilities = RepoProfileApplicability.get_collection().find(
-                {'repo_id': repo_id}).batch_size(5)
+            ApplicabilityRegenerationManager._regenerate_applicability_for_repo(repo_id)
+
+    @staticmethod
+    def queue_regenerate_applicability_for_repos(repo_criteria):
+        """
+        Dispatch tasks that regenerate the applicability data affected by given updated
+        repositories.
+
+        The existing applicability data of each repository is split into shards of consecutive
+        profile hashes, and each shard is regenerated by its own task so that the work is spread
+        across all of the available workers. The size of the shards is controlled by the
+        regeneration_shard_size setting in the applicability section of the server config.
+
+        :param repo_criteria: The repo selection criteria
+        :type repo_criteria: dict
+        :return: task result whose result maps each repo id to the number of shards dispatched
+                 for it, and whose spawned tasks are the dispatched shard tasks
+        :rtype:  pulp.server.async.tasks.TaskResult
+        """
+        repo_criteria = Criteria.from_dict(repo_criteria)
+
+        # Process repo criteria
+        repo_criteria.fields = ['id']
+        repo_ids = [r.repo_id for r in model.Repository.objects.find_by_criteria(repo_criteria)]
+
+        shard_size = config.getint('applicability', 'regeneration_shard_size')
+        regeneration_tag = tags.action_tag('content_applicability_regeneration')
+        shard_counts = {}
+        spawned_tasks = []
+        # Every shard reads the associations of its repository itself, after this time, so that
+        # the task messages stay small no matter how large the repository is.
+        timestamp = dateutils.now_utc_timestamp()
+        for repo_id in repo_ids:
+            shards = ApplicabilityRegenerationManager._get_profile_hash_shards(repo_id, shard_size)
+            if not shards:
+                shard_counts[repo_id] = 0
+                continue
+            for index, (first_hash, last_hash) in enumerate(shards):
+                # Shards of the same repository get distinct resource ids so that they can be
+                # reserved by different workers at the same time. They do not conflict with
+                # consumer regeneration either, which is safe because applicability data is
+                # never replaced by data from a regeneration that started earlier.
+                async_result = regenerate_applicability_for_repo_shard.apply_async_with_reservation(
+                    tags.RESOURCE_REPOSITORY_PROFILE_APPLICABILITY_TYPE,
+                    '%s:%d' % (repo_id, index),
+                    (repo_id, first_hash, last_hash, timestamp),
+                    tags=[regeneration_tag])
+                spawned_tasks.append(async_result)
+            shard_counts[repo_id] = len(shards)
+
+        return TaskResult(result=shard_counts, spawned_tasks=spawned_tasks)
+
+    @staticmethod
+    def regenerate_applicability_for_repo_shard(repo_id, first_hash=None, last_hash=None,
+                                                timestamp=None):
+        """
+        Regenerate and save the existing applicability data for the given repository whose
+        profile hashes fall within the given range.
+
+        :param repo_id:      id of the repository
+        :type  repo_id:      str
+        :param first_hash:   the first profile hash in the shard, or None for no lower bound
+        :type  first_hash:   basestring
+        :param last_hash:    the first profile hash of the next shard, which is not included in
+                             this one, or None for no upper bound
+        :type  last_hash:    basestring
+        :param timestamp:    UTC timestamp taken before the shard was dispatched, or None to
+                             take it now
+        :type  timestamp:    int or None
+        """
+        repo_delta = RepoContentDelta(repo_id, timestamp)
+        ApplicabilityRegenerationManager._regenerate_applicability_for_repo(
+            repo_id, first_hash, last_hash, repo_delta)
+
+    @staticmethod
+    def _get_profile_hash_shards(repo_id, shard_size):
+        """
+        Split the existing applicability data of the given repository into ranges of at most
+        shard_size profile hashes.
+
+        :param repo_id:    id of the repository
+        :type  repo_id:    str
+        :param shard_size: maximum number of profile hashes in each range
+        :type  shard_size: int
+        :return: list of (first_hash, last_hash) half-open ranges, in which None stands for an
+                 unbounded end. Together the ranges cover every possible profile hash.
+        :rtype:  list
+        """
+        profile_hashes = RepoProfileApplicability.get_collection().find(
+            {'repo_id': repo_id}, fields=['profile_hash']).sort('profile_hash', pymongo.ASCENDING)
+        boundaries = [page[0]['profile_hash']
+                      for page in misc.paginate(profile_hashes, shard_size)]
+        if not boundaries:
+            return []
+        # The outer shards are left unbounded so that profiles added while the shards are being
+        # regenerated are not missed.
+        boundaries[0] = None
+        return zip(boundaries, boundaries[1:] + [None])
+
+    @staticmethod
+    def _regenerate_applicability_for_repo(repo_id, first_hash=None, last_hash=None,
+                                           repo_delta=None):
+        """
+        Regenerate and save all existing applicability data for the given repository, optionally
+        limited to a range of profile hashes.
+
+        Applicability data is regenerated incrementally from the units that changed in the
+        repository since it was last regenerated, where the profiler supports it.
+
+        :param repo_id:    id of the repository
+        :type  repo_id:    str
+        :param first_hash: the first profile hash to regenerate, or None for no lower bound
+        :type  first_hash: basestring
+        :param last_hash:  the profile hash at which to stop, exclusive, or None for no upper bound
+        :type  last_hash:  basestring
+        :param repo_delta: tracks the units that changed in the repository, or None to create one
+        :type  repo_delta: RepoContentDelta
+        """
+        spec = {'repo_id': repo_id}
+        hash_range = {}
+        if first_hash is not None:
+            hash_range['$gte'] = first_hash
+        if last_hash is not None:
+            hash_range['$lt'] = last_hash
+        if hash_range:
+            spec['profile_hash'] = hash_range
+
+        collection = RepoProfileApplicability.get_collection()
+        # Only the ids are read up front. The documents themselves are read a page at a time, so
+        # that no cursor is left open, and possibly timed out, while the profilers run. See
+        # https://pulp.plan.io/issues/998#note-6 for more details.
+        applicability_ids = [a['_id'] for a in collection.find(spec, fields=['_id'])]
+        if repo_delta is None:
+            repo_delta = RepoContentDelta(repo_id)
+
+        for id_page in misc.paginate(applicability_ids, APPLICABILITY_PAGE_SIZE):
+            existing_applicabilities = [
+                RepoProfileApplicability(**dict(a))
+                for a in collection.find({'_id': {'$in': list(id_page)}})]
+            unit_profiles = _get_unit_profiles_by_hash(
+                [a.profile_hash for a in existing_applicabilities])
+
             for existing_applicability in existing_applicabilities:
-                # Convert cursor to RepoProfileApplicability object
-                existing_applicability = RepoProfileApplicability(**dict(existing_applicability))
-                profile_hash = existing_applicability['profile_hash']
-                unit_profile = UnitProfile.get_collection().find_one({'profile_hash': profile_hash},
-                                                                     fields=['id', 'content_type'])
+                profile_hash = existing_applicability.profile_hash
+                unit_profile = unit_profiles.get(profile_hash)
                 if unit_profile is None:
                     # Unit profiles change whenever packages are installed or removed on consumers,
                     # and it is possible that existing_applicability references a UnitProfile
@@ -140,15 +329,19 @@ class ApplicabilityRegenerationManager(object):
                 # Regenerate applicability data for given unit_profile and repo id
                 ApplicabilityRegenerationManager.regenerate_applicability(
                     profile_hash, unit_profile['content_type'], unit_profile['id'], repo_id,
-                    existing_applicability)
+                    existing_applicability, repo_delta=repo_delta)
 
     @staticmethod
     def regenerate_applicability(profile_hash, content_type, profile_id,
-                                 bound_repo_id, existing_applicability=None):
+                                 bound_repo_id, existing_applicability=None, repo_delta=None):
         """
         Regenerate and save applicability data for given profile and bound repo id.
         If existing_applicability is not None, replace it with the new applicability data.
 
+        If existing_applicability and repo_delta are both given and the profiler supports it,
+        only the units that changed in the repository since existing_applicability was last
+        regenerated are passed to the profiler, and the existing data is patched with the result.
+
         :param profile_hash: hash of the unit profile
         :type profile_hash: basestring
 
@@ -164,7 +357,16 @@ class ApplicabilityRegenerationManager(object):
 
         :param existing_applicability: existing RepoProfileApplicability object to be replaced
         :type existing_applicability: pulp.server.db.model.consumer.RepoProfileApplicability
+
+        :param repo_delta: tracks the units that changed in the bound repository
+        :type repo_delta: RepoContentDelta
         """
+        # Anything that changes in the repository after this time is picked up by the next
+        # incremental regeneration
+        if repo_delta is not None:
+            regeneration_time = repo_delta.timestamp
+        else:
+            regeneration_time = dateutils.now_utc_timestamp()
         profiler_conduit = ProfilerConduit()
         # Get the profiler for content_type of given unit_profile
         profiler, profiler_cfg = ApplicabilityRegenerationManager._profiler(content_type)
@@ -190,26 +392,125 @@ class ApplicabilityRegenerationManager(object):
                 profile = unit_profile['profile']
             call_config = PluginCallConfiguration(plugin_config=profiler_cfg,
                                                   repo_plugin_config=None)
-            try:
-                applicability = profiler.calculate_applicable_units(profile,
-                                                                    bound_repo_id,
-                                                                    call_config,
-                                                                    profiler_conduit)
-            except NotImplementedError:
-                msg = "Profiler for content type [%s] does not support applicability" % content_type
-                _logger.debug(msg)
-                return
-
-            if existing_applicability:
+            # Profilers opt into incremental regeneration by overriding the base class method
+            incremental_method = getattr(profiler.calculate_applicable_units_incremental,
+                                         'im_func', None)
+            incremental = (
+                repo_delta is not None and existing_applicability is not None and
+                existing_applicability.last_regenerated is not None and
+                incremental_method is not Profiler.calculate_applicable_units_incremental.im_func)
+            changed_types = None
+            if incremental:
+                try:
+                    changed_types = ApplicabilityRegenerationManager._patch_applicability(
+                        profiler, profile, existing_applicability, repo_delta, call_config,
+                        profiler_conduit)
+                except NotImplementedError:
+                    # Fall back to calculating applicability for the whole repository
+                    pass
+            if changed_types is None:
+                applicability = ApplicabilityRegenerationManager._calculate_applicability(
+                    profiler, profile, bound_repo_id, content_type, call_config,
+                    profiler_conduit)
+                if applicability is None:
+                    return
+
+            if changed_types is not None:
+                # Only write the content types whose applicability changed
+                existing_applicability.last_regenerated = regeneration_time
+                existing_applicability.save_applicability(changed_types)
+            elif existing_applicability:
                 # Update existing applicability object
                 existing_applicability.applicability = applicability
+                existing_applicability.last_regenerated = regeneration_time
                 existing_applicability.save()
             else:
                 # Create a new RepoProfileApplicability object and save it in the db
                 RepoProfileApplicability.objects.create(profile_hash,
                                                         bound_repo_id,
                                                         unit_profile['profile'],
-                                                        applicability)
+                                                        applicability,
+                                                        last_regenerated=regeneration_time)
+
+    @staticmethod
+    def _calculate_applicability(profiler, profile, bound_repo_id, content_type, call_config,
+                                 profiler_conduit):
+        """
+        Calculate the applicability data of the given profile against the whole bound repository.
+
+        :param profiler: profiler for the content type of the profile
+        :type  profiler: pulp.plugins.profiler.Profiler
+        :param profile: the unit profile to calculate applicability against
+        :type  profile: object
+        :param bound_repo_id: repo id to be used to calculate applicability
+        :type  bound_repo_id: str
+        :param content_type: profile (unit) type ID
+        :type  content_type: str
+        :param call_config: plugin configuration
+        :type  call_config: pulp.plugins.config.PluginCallConfiguration
+        :param profiler_conduit: provides access to relevant Pulp functionality
+        :type  profiler_conduit: pulp.plugins.conduits.profiler.ProfilerConduit
+        :return: applicability data, or None if the profiler does not support applicability
+        :rtype:  dict or None
+        """
+        try:
+            return profiler.calculate_applicable_units(profile, bound_repo_id, call_config,
+                                                       profiler_conduit)
+        except NotImplementedError:
+            msg = "Profiler for content type [%s] does not support applicability" % content_type
+            _logger.debug(msg)
+
+    @staticmethod
+    def _patch_applicability(profiler, profile, existing_applicability, repo_delta, call_config,
+                             profiler_conduit):
+        """
+        Incrementally update the applicability data of existing_applicability in memory.
+
+        Units that were removed from the repository or that changed since the data was last
+        regenerated are dropped from it, then the changed units that the profiler finds to be
+        applicable are added back.
+
+        :param profiler: profiler that implements calculate_applicable_units_incremental
+        :type  profiler: pulp.plugins.profiler.Profiler
+        :param profile: the unit profile to calculate applicability against
+        :type  profile: object
+        :param existing_applicability: applicability data to update
+        :type  existing_applicability: pulp.server.db.model.consumer.RepoProfileApplicability
+        :param repo_delta: tracks the units that changed in the bound repository
+        :type  repo_delta: RepoContentDelta
+        :param call_config: plugin configuration
+        :type  call_config: pulp.plugins.config.PluginCallConfiguration
+        :param profiler_conduit: provides access to relevant Pulp functionality
+        :type  profiler_conduit: pulp.plugins.conduits.profiler.ProfilerConduit
+        :return: ids of the content types whose applicability data changed
+        :rtype:  list
+        """
+        changed_units = repo_delta.changed_units(existing_applicability.last_regenerated,
+                                                 profiler.metadata()['types'])
+        removed_units = repo_delta.removed_units(existing_applicability.applicability)
+
+        applicable_units = {}
+        if changed_units:
+            applicable_units = profiler.calculate_applicable_units_incremental(
+                profile, repo_delta.repo_id,
+                dict((type_id, list(unit_ids)) for type_id, unit_ids in changed_units.items()),
+                call_config, profiler_conduit)
+
+        applicability = existing_applicability.applicability
+        changed_types = []
+        for type_id in set(applicability) | set(applicable_units):
+            dropped = changed_units.get(type_id, set()) | removed_units.get(type_id, set())
+            old_unit_ids = applicability.get(type_id, [])
+            new_unit_ids = [unit_id for unit_id in old_unit_ids if unit_id not in dropped]
+            kept = set(new_unit_ids)
+            for unit_id in applicable_units.get(type_id, []):
+                if unit_id not in kept:
+                    new_unit_ids.append(unit_id)
+                    kept.add(unit_id)
+            if new_unit_ids != old_unit_ids:
+                applicability[type_id] = new_unit_ids
+                changed_types.append(type_id)
+        return changed_types
 
     @staticmethod
     def _get_existing_repo_content_types(repo_id):
@@ -234,21 +535,27 @@ class ApplicabilityRegenerationManager(object):
         return repo_content_types_with_non_zero_unit_count
 
     @staticmethod
-    def _is_existing_applicability(repo_id, profile_hash):
+    def _get_existing_applicability_keys(repo_ids, profile_hashes):
         """
-        Check if applicability for given repo and profle hash is already calculated.
-
-        :param repo_id:      repo id
-        :type repo_id:       basestring
-        :param profile_hash: unit profile hash
-        :type profile_hash:  basestring
-        :return:             true if applicability exists, false otherwise
-        :type:               boolean
+        Find which combinations of the given repos and profile hashes already have applicability
+        data.
+
+        :param repo_ids:       repo ids
+        :type  repo_ids:       list
+        :param profile_hashes: unit profile hashes
+        :type  profile_hashes: iterable
+        :return:               set of (repo_id, profile_hash) tuples that have applicability data
+        :rtype:                set
         """
-        query_params = {'repo_id': repo_id, 'profile_hash': profile_hash}
-        if RepoProfileApplicability.get_collection().find_one(query_params, fields=['_id']):
-            return True
-        return False
+        collection = RepoProfileApplicability.get_collection()
+        existing_keys = set()
+        if not repo_ids:
+            return existing_keys
+        for hash_page in misc.paginate(profile_hashes):
+            spec = {'repo_id': {'$in': list(repo_ids)}, 'profile_hash': {'$in': list(hash_page)}}
+            for applicability in collection.find(spec, fields=['repo_id', 'profile_hash']):
+                existing_keys.add((applicability['repo_id'], applicability['profile_hash']))
+        return existing_keys
 
     @staticmethod
     def _profiler(type_id):
@@ -270,12 +577,141 @@ class ApplicabilityRegenerationManager(object):
         return plugin, cfg
 
 
+class RepoContentDelta(object):
+    """
+    Finds the content units of a repository that changed after a point in time, for incremental
+    applicability regeneration.
+
+    A unit has changed if it was associated with the repository, or the unit itself was updated,
+    at or after that time. The updated time of an association is not used, since every sync
+    stamps it on all of the associations it touches. The associations of the repository are read
+    once per content type and the results are cached, since all of the applicability data for a
+    repository is regenerated together and usually shares the same last regeneration time.
+    """
+
+    def __init__(self, repo_id, timestamp=None):
+        """
+        :param repo_id:   id of the repository
+        :type  repo_id:   str
+        :param timestamp: UTC timestamp taken before any of the associations are read, or None
+                          to take it now
+        :type  timestamp: int or None
+        """
+        self.repo_id = repo_id
+        # changes made to the repository after this UTC timestamp may not be seen
+        if timestamp is None:
+            timestamp = dateutils.now_utc_timestamp()
+        self.timestamp = timestamp
+        # maps content type ids to dicts of unit ids to the time their association was created
+        self._associations = {}
+        # maps (timestamp, content type ids) to the changed units
+        self._changed_units = {}
+
+    def _get_associations(self, type_id):
+        """
+        :param type_id: id of a content type
+        :type  type_id: str
+        :return: dict of the ids of the associated units of the type to the iso8601 time their
+                 association was created
+        :rtype:  dict
+        """
+        if type_id not in self._associations:
+            associations = RepoContentUnit.get_collection().find(
+                {'repo_id': self.repo_id, 'unit_type_id': type_id},
+                fields=['unit_id', 'created'])
+            self._associations[type_id] = dict((a['unit_id'], a['created']) for a in associations)
+        return self._associations[type_id]
+
+    def changed_units(self, since, type_ids):
+        """
+        Return the units of the given types that changed in the repository at or after the
+        given time.
+
+        :param since: UTC timestamp
+        :type  since: int
+        :param type_ids: ids of the content types to include
+        :type  type_ids: list
+        :return: dict of content type ids to sets of changed unit ids; types with no changed
+                 units are omitted
+        :rtype:  dict
+        """
+        key = (since, tuple(sorted(type_ids)))
+        if key in self._changed_units:
+            return self._changed_units[key]
+
+        since_iso = dateutils.format_iso8601_utc_timestamp(since)
+        changed_units = {}
+        for type_id in type_ids:
+            changed = set()
+            unchanged = []
+            for unit_id, created in self._get_associations(type_id).iteritems():
+                if created >= since_iso:
+                    changed.add(unit_id)
+                else:
+                    unchanged.append(unit_id)
+
+            # Units may also be updated in place in an existing association
+            if unchanged:
+                collection = content_types_db.type_units_collection(type_id)
+                for unit_ids in misc.paginate(unchanged):
+                    spec = {'_id': {'$in': list(unit_ids)}, '_last_updated': {'$gte': since}}
+                    changed.update(u['_id'] for u in collection.find(spec, fields=['_id']))
+
+            if changed:
+                changed_units[type_id] = changed
+
+        self._changed_units[key] = changed_units
+        return changed_units
+
+    def removed_units(self, applicability):
+        """
+        Return the units in the given applicability data that are no longer in the repository.
+
+        :param applicability: dict of content type ids to lists of unit ids
+        :type  applicability: dict
+        :return: dict of content type ids to sets of removed unit ids
+        :rtype:  dict
+        """
+        removed_units = {}
+        for type_id, unit_ids in applicability.iteritems():
+            associations = self._get_associations(type_id)
+            removed = set(unit_id for unit_id in unit_ids if unit_id not in associations)
+            if removed:
+                removed_units[type_id] = removed
+        return removed_units
+
+
+def _get_unit_profiles_by_hash(profile_hashes):
+    """
+    Find one unit profile for each of the given profile hashes.
+
+    :param profile_hashes: profile hashes to look up
+    :type  profile_hashes: list
+    :return: dict of profile hashes to dicts with the 'id' and 'content_type' of a unit profile
+             that has that hash; hashes with no unit profile are omitted
+    :rtype:  dict
+    """
+    pipeline = [
+        {'$match': {'profile_hash': {'$in': profile_hashes}}},
+        {'$group': {'_id': '$profile_hash',
+                    'id': {'$first': '$id'},
+                    'content_type': {'$first': '$content_type'}}}]
+    db = connection.get_database()
+    result = db.command('aggregate', UnitProfile.collection_name, pipeline=pipeline)
+    return dict((unit_profile['_id'], unit_profile) for unit_profile in result['result'])
+
+
 regenerate_applicability_for_consumers = task(
     ApplicabilityRegenerationManager.regenerate_applicability_for_consumers, base=Task,
     ignore_result=True)
 regenerate_applicability_for_repos = task(
     ApplicabilityRegenerationManager.regenerate_applicability_for_repos, base=Task,
     ignore_result=True)
+queue_regenerate_applicability_for_repos = task(
+    ApplicabilityRegenerationManager.queue_regenerate_applicability_for_repos, base=Task)
+regenerate_applicability_for_repo_shard = task(
+    ApplicabilityRegenerationManager.regenerate_applicability_for_repo_shard, base=Task,
+    ignore_result=True)
 
 
 class DoesNotExist(Exception):
@@ -298,7 +734,7 @@ class RepoProfileApplicabilityManager(object):
     """
     This class is useful for querying for RepoProfileApplicability objects in the database.
     """
-    def create(self, profile_hash, repo_id, profile, applicability):
+    def create(self, profile_hash, repo_id, profile, applicability, last_regenerated=None):
         """
         Create and return a RepoProfileApplicability object.
 
@@ -312,15 +748,49 @@ class RepoProfileApplicabilityManager(object):
         :param applicability: A dictionary structure mapping unit type IDs to lists of applicable
                               Unit IDs.
         :type  applicability: dict
+        :param last_regenerated: UTC timestamp of when the regeneration that produced the
+                              applicability data started
+        :type  last_regenerated: int or None
         :return:              A new RepoProfileApplicability object
         :rtype:               pulp.server.db.model.consumer.RepoProfileApplicability
         """
         applicability = RepoProfileApplicability(
             profile_hash=profile_hash, repo_id=repo_id, profile=profile,
-            applicability=applicability)
+            applicability=applicability, last_regenerated=last_regenerated)
         applicability.save()
         return applicability
 
+    def bulk_upsert(self, applicabilities):
+        """
+        Save the given RepoProfileApplicability objects to the database with a single unordered
+        bulk operation. Existing documents for the same profile hash and repo are replaced, so
+        concurrent regenerations of the same data do not collide on the unique index, unless
+        they hold data from a regeneration that started later.
+
+        :param applicabilities: RepoProfileApplicability objects to save
+        :type  applicabilities: list
+        """
+        if not applicabilities:
+            return
+        bulk = RepoProfileApplicability.get_collection().initialize_unordered_bulk_op()
+        for applicability in applicabilities:
+            spec = {'profile_hash': applicability.profile_hash, 'repo_id': applicability.repo_id}
+            if applicability.last_regenerated is not None:
+                spec['last_regenerated'] = {'$not': {'$gt': applicability.last_regenerated}}
+            bulk.find(spec).upsert().update(
+                {'$set': {'profile': applicability.profile,
+                          'applicability': applicability.applicability,
+                          'last_regenerated': applicability.last_regenerated}})
+        try:
+            bulk.execute()
+        except BulkWriteError, e:
+            # The upsert of data that is older than the existing document fails on the unique
+            # index, and the newer data is kept.
+            duplicate = connection.MONGO_DUPLICATE_KEY_ERROR
+            if any(error['code'] != duplicate for error in e.details['writeErrors']):
+                raise
+        RepoApplicabilityRevision.bump(a.repo_id for a in applicabilities)
+
     def filter(self, query_params):
         """
         Get a list of RepoProfileApplicability objects with the given MongoDB query dict.
@@ -397,6 +867,81 @@ class RepoProfileApplicabilityManager(object):
 RepoProfileApplicability.objects = RepoProfileApplicabilityManager()
 
 
+class ApplicabilityQueryCache(object):
+    """
+    Caches the applicability data read by retrieve_consumer_applicability(), keyed by the profile
+    hashes, the repos and the content types that were queried. A cached entry is only used while
+    the applicability revisions of all of its repos are unchanged, which is checked with a single
+    query on the small revisions collection instead of reading the applicability data again.
+
+    The least recently used entries are evicted once the cache holds max_size entries.
+    """
+
+    def __init__(self, max_size=APPLICABILITY_QUERY_CACHE_SIZE):
+        """
+        :param max_size: maximum number of cached query results
+        :type  max_size: int
+        """
+        self._entries = TTLCache(max_size)
+
+    def get_applicability_map(self, profile_hashes, repo_ids, content_types):
+        """
+        Build an applicability map, as returned by _get_applicability_map(), limited to the given
+        repos. The map is a new copy on every call, as the caller adds consumers to it.
+
+        :param profile_hashes: profile hashes that the applicabilities should be queried with
+        :type  profile_hashes: list
+        :param repo_ids:       repo ids that the applicabilities should be queried with
+        :type  repo_ids:       set
+        :param content_types:  If not None, the content types to be included in the
+                               applicability data
+        :type  content_types:  list or None
+        :return:               The applicability map
+        :rtype:                dict
+        """
+        if not repo_ids:
+            return {}
+        if content_types is not None:
+            content_types = frozenset(content_types)
+        key = (frozenset(profile_hashes), frozenset(repo_ids), content_types)
+
+        # The revisions are read before the applicability data, so that a change written
+        # in between invalidates the entry cached below.
+        revisions = RepoApplicabilityRevision.get_revisions(list(repo_ids))
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == revisions:
+            return self._copy(entry[1])
+
+        applicability_map = _get_applicability_map(profile_hashes, content_types,
+                                                   repo_ids=list(repo_ids))
+        self._entries.set(key, (revisions, self._copy(applicability_map)))
+        return applicability_map
+
+    def clear(self):
+        """
+        Remove all of the cached query results.
+        """
+        self._entries.clear()
+
+    @staticmethod
+    def _copy(applicability_map):
+        """
+        Copy an applicability map deep enough that adding consumers to the copy, and collating
+        its applicability data, leaves the original untouched.
+
+        :param applicability_map: The applicability map to copy
+        :type  applicability_map: dict
+        :return:                  The copy
+        :rtype:                   dict
+        """
+        return dict((repo_profile, {'applicability': dict(data['applicability']),
+                                    'consumers': list(data['consumers'])})
+                    for repo_profile, data in applicability_map.iteritems())
+
+
+_applicability_query_cache = ApplicabilityQueryCache()
+
+
 def retrieve_consumer_applicability(consumer_criteria, content_types=None):
     """
     Query content applicability for consumers matched by a given consumer_criteria, optionally
@@ -435,9 +980,14 @@ def retrieve_consumer_applicability(consumer_criteria, content_types=None):
     # We don't need the list of consumer_ids anymore, so let's free a little RAM
     del consumer_ids
 
-    # Now lets get all RepoProfileApplicability objects that have the profile hashes for our
-    # consumers
-    applicability_map = _get_applicability_map(profile_hashes, content_types)
+    # Now lets get all RepoProfileApplicability objects that have the profile hashes and the
+    # repos of our consumers. Identical queries are answered from the cache while the
+    # applicability data of the repos has not changed.
+    repo_ids = set()
+    for repo_profile_data in consumer_map.values():
+        repo_ids.update(repo_profile_data['repo_ids'])
+    applicability_map = _applicability_query_cache.get_applicability_map(
+        profile_hashes, repo_ids, content_types)
     # We don't need the profile_hashes anymore, so let's free some RAM
     del profile_hashes
 
@@ -553,7 +1103,7 @@ def _format_report(consumer_applicability_map):
     return report
 
 
-def _get_applicability_map(profile_hashes, content_types):
+def _get_applicability_map(profile_hashes, content_types, repo_ids=None):
     """
     Build an "applicability_map", which is a dictionary that maps tuples of
     (profile_hash, repo_id) to a dictionary of applicability data and consumer_ids. The
@@ -570,12 +1120,17 @@ def _get_applicability_map(profile_hashes, content_types):
                            be included in the applicability data within the
                            applicability_map
     :type  content_types:  list or None
+    :param repo_ids:       If not None, only applicability data for these repo ids is included
+                           in the applicability_map
+    :type  repo_ids:       list or None
     :return:               The applicability map
     :rtype:                dict
     """
+    spec = {'profile_hash': {'$in': profile_hashes}}
+    if repo_ids is not None:
+        spec['repo_id'] = {'$in': repo_ids}
     applicabilities = RepoProfileApplicability.get_collection().find(
-        {'profile_hash': {'$in': profile_hashes}},
-        fields=['profile_hash', 'repo_id', 'applicability'])
+        spec, fields=['profile_hash', 'repo_id', 'applicability'])
     return_value = {}
     for a in applicabilities:
         if content_types is not None:
@@ -148,6 +148,29 @@ class ContentCatalogManager(object):
             newest_by_source[entry['source_id']] = entry
         return newest_by_source.values()
 
+    def find_all(self, locators):
+        """
+        Find entries in the content catalog matching any of the specified
+        locators using a single query.  As with find(), only the newest entry
+        for each source is included for each locator.
+        :param locators: A list of locators.
+        :type locators: list
+        :return: A dictionary of: list of matching entries keyed by locator.
+            Locators without matching entries are not included.
+        :rtype: dict
+        """
+        collection = ContentCatalog.get_collection()
+        query = {
+            'locator': {'$in': list(locators)},
+            'expiration': {'$gte': ContentCatalog.get_expiration(0)}
+        }
+        newest_by_locator = {}
+        for entry in collection.find(query, sort=[('_id', ASCENDING)]):
+            newest_by_source = newest_by_locator.setdefault(entry['locator'], {})
+            newest_by_source[entry['source_id']] = entry
+        return dict((locator, newest_by_source.values())
+                    for locator, newest_by_source in newest_by_locator.items())
+
     def has_entries(self, source_id):
         """
         Get whether the specified content source has entries in the catalog.
@@ -1,7 +1,11 @@
 import uuid
 
+from pymongo.errors import BulkWriteError
+
 from pulp.common import dateutils
 from pulp.plugins.types import database as content_types_db
+from pulp.server import constants
+from pulp.server.db import connection, model
 from pulp.server.exceptions import InvalidValue
 
 
@@ -32,6 +36,7 @@ class ContentManager(object):
             '_last_updated': dateutils.now_utc_timestamp()
         }
         unit_doc.update(unit_metadata)
+        _set_unit_key_digest(unit_doc, content_types_db.type_units_unit_key(content_type))
         collection.insert(unit_doc)
         return unit_id
 
@@ -49,6 +54,66 @@ class ContentManager(object):
         collection = content_types_db.type_units_collection(content_type)
         collection.update({'_id': unit_id}, {'$set': unit_metadata_delta})
 
+    def add_content_units(self, content_type, units_metadata):
+        """
+        Add many content units of the same type with a single unordered bulk
+        insert. Units that collide with a unit already in the collection are
+        not added.
+        @param content_type: unique id of content collection
+        @type content_type: str
+        @param units_metadata: metadata of each content unit to add
+        @type units_metadata: list of dict
+        @return: ids of the added units, in the same order as units_metadata;
+                 None in place of the units that already exist
+        @rtype: list
+        """
+        if not units_metadata:
+            return []
+        collection = content_types_db.type_units_collection(content_type)
+        unit_key_fields = content_types_db.type_units_unit_key(content_type)
+        last_updated = dateutils.now_utc_timestamp()
+        bulk = collection.initialize_unordered_bulk_op()
+        unit_ids = []
+        for unit_metadata in units_metadata:
+            unit_id = str(uuid.uuid4())
+            unit_doc = {
+                '_id': unit_id,
+                '_content_type_id': content_type,
+                '_last_updated': last_updated
+            }
+            unit_doc.update(unit_metadata)
+            _set_unit_key_digest(unit_doc, unit_key_fields)
+            bulk.insert(unit_doc)
+            unit_ids.append(unit_id)
+        try:
+            bulk.execute()
+        except BulkWriteError, e:
+            for error in e.details['writeErrors']:
+                if error['code'] != connection.MONGO_DUPLICATE_KEY_ERROR:
+                    raise
+                unit_ids[error['index']] = None
+        return unit_ids
+
+    def update_content_units(self, content_type, unit_metadata_deltas):
+        """
+        Update the stored metadata of many content units of the same type with
+        a single unordered bulk update.
+        @param content_type: unique id of content collection
+        @type content_type: str
+        @param unit_metadata_deltas: maps unique ids of content units to the
+                                     metadata fields of each that have changed
+        @type unit_metadata_deltas: dict
+        """
+        if not unit_metadata_deltas:
+            return
+        last_updated = dateutils.now_utc_timestamp()
+        collection = content_types_db.type_units_collection(content_type)
+        bulk = collection.initialize_unordered_bulk_op()
+        for unit_id, unit_metadata_delta in unit_metadata_deltas.iteritems():
+            unit_metadata_delta = dict(unit_metadata_delta, _last_updated=last_updated)
+            bulk.find({'_id': unit_id}).update_one({'$set': unit_metadata_delta})
+        bulk.execute()
+
     def remove_content_unit(self, content_type, unit_id):
         """
         Remove a content unit and its metadata from the corresponding pulp db
@@ -107,3 +172,19 @@ class ContentManager(object):
         children = set(parent.get(key, []))
         parent[key] = list(children.difference(to_ids))
         collection.update({'_id': from_id}, parent)
+
+
+def _set_unit_key_digest(unit_doc, unit_key_fields):
+    """
+    Store the digest of a unit's key in the unit document, so the unit can be found with
+    the other units that are looked up by key in the same query.
+    @param unit_doc: content unit document
+    @type unit_doc: dict
+    @param unit_key_fields: names of the unit key fields of the unit's type,
+                            None if the type is not defined
+    @type unit_key_fields: list of str or None
+    """
+    if not unit_key_fields:
+        return
+    unit_key = dict((key, unit_doc.get(key)) for key in unit_key_fields)
+    unit_doc[constants.UNIT_KEY_DIGEST_FIELDNAME] = model.unit_key_digest(unit_key)
@@ -1,4 +1,6 @@
 from gettext import gettext as _
+from multiprocessing.pool import ThreadPool
+import itertools
 import logging
 import os
 import re
@@ -6,19 +8,27 @@ import shutil
 
 from celery import task
 
+from pulp.common.plugins import reporting_constants
+from pulp.plugins.conduits.mixins import StatusMixin
 from pulp.plugins.types import database as content_types_db
 from pulp.plugins.loader import api as plugin_api
 from pulp.plugins.util import misc as plugin_misc
+from pulp.plugins.util.publish_step import Step
 from pulp.server import config as pulp_config, exceptions as pulp_exceptions
 from pulp.server.async.tasks import Task
 from pulp.server.controllers import units as units_controller
-from pulp.server.db.model.repository import RepoContentUnit
 from pulp.server.db import model
 from pulp.server.exceptions import MissingResource
 
 
 _logger = logging.getLogger(__name__)
 
+# number of content units whose repository associations are resolved with a single query
+ORPHAN_PAGE_SIZE = plugin_misc.DEFAULT_PAGE_SIZE
+
+# number of threads used to remove the files of orphaned content units from storage
+ORPHAN_DELETE_THREADS = 8
+
 
 class OrphanManager(object):
 
@@ -46,9 +56,11 @@ class OrphanManager(object):
         :return: count of orphaned units of the given type
         :rtype: int
         """
+        content_units_collection = content_types_db.type_units_collection(content_type_id)
+        content_units = content_units_collection.find({}, fields=['_id'])
         count = 0
-        for unit in OrphanManager.generate_orphans_by_type(content_type_id):
-            count += 1
+        for orphans in OrphanManager.generate_orphan_pages(content_units, _raw_unit_id):
+            count += len(orphans)
         return count
 
     def generate_all_orphans(self, fields=None):
@@ -100,17 +112,38 @@ class OrphanManager(object):
 
         fields = fields if fields is not None else ['_id']
         content_units_collection = content_types_db.type_units_collection(content_type_id)
-        repo_content_units_collection = RepoContentUnit.get_collection()
-
-        for content_unit in content_units_collection.find({}, fields=fields):
-
-            repo_content_units_cursor = repo_content_units_collection.find(
-                {'unit_id': content_unit['_id']})
+        content_units = content_units_collection.find({}, fields=fields)
 
-            if repo_content_units_cursor.count() > 0:
-                continue
+        for orphans in OrphanManager.generate_orphan_pages(content_units, _raw_unit_id):
+            for content_unit in orphans:
+                yield content_unit
 
-            yield content_unit
+    @staticmethod
+    def generate_orphan_pages(content_units, get_unit_id, page_size=ORPHAN_PAGE_SIZE):
+        """
+        Filter an iterable of content units down to the orphans, a page at a time.
+
+        The repository associations of each page of units are resolved with a single
+        query, so the number of queries made grows with the number of pages rather than
+        the number of units. Pages that contain no orphans are skipped.
+
+        :param content_units: content units to filter; a cursor or any other iterable
+        :type content_units: iterable
+        :param get_unit_id: callable that returns the id of a content unit in content_units
+        :type get_unit_id: callable
+        :param page_size: number of content units to resolve with each query
+        :type page_size: int
+        :return: generator of lists of orphaned content units
+        :rtype: generator
+        """
+        for page in plugin_misc.paginate(content_units, page_size):
+            unit_ids = [get_unit_id(content_unit) for content_unit in page]
+            associated_ids = set(model.RepositoryContentUnit.objects(unit_id__in=unit_ids)
+                                 .distinct('unit_id'))
+            orphans = [content_unit for content_unit in page
+                       if get_unit_id(content_unit) not in associated_ids]
+            if orphans:
+                yield orphans
 
     @staticmethod
     def generate_orphans_by_type_with_unit_keys(content_type_id):
@@ -164,12 +197,18 @@ class OrphanManager(object):
         """
         Delete all orphaned content units.
         """
+        conduit = OrphanDeletionConduit('Delete Orphans')
+        step = Step(reporting_constants.DELETE_STEP_ORPHANS, status_conduit=conduit)
 
         for content_type_id in content_types_db.all_type_ids():
-            OrphanManager.delete_orphans_by_type(content_type_id)
+            content_units_collection = content_types_db.type_units_collection(content_type_id)
+            step.add_child(DeleteOrphansStep(content_type_id, content_units_collection))
 
         for content_type_id in plugin_api.list_unit_models():
-            OrphanManager.delete_orphan_content_units_by_type(content_type_id)
+            content_model = plugin_api.get_unit_model_by_id(content_type_id)
+            step.add_child(DeleteOrphansStep(content_type_id, content_model._get_collection()))
+
+        step.process_lifecycle()
 
     @staticmethod
     def delete_orphans_by_id(content_unit_list):
@@ -213,18 +252,10 @@ class OrphanManager(object):
         """
 
         content_units_collection = content_types_db.type_units_collection(content_type_id)
-
-        for content_unit in OrphanManager.generate_orphans_by_type(content_type_id,
-                                                                   fields=['_id', '_storage_path']):
-
-            if content_unit_ids is not None and content_unit['_id'] not in content_unit_ids:
-                continue
-
-            content_units_collection.remove(content_unit['_id'], safe=False)
-
-            storage_path = content_unit.get('_storage_path', None)
-            if storage_path is not None:
-                OrphanManager.delete_orphaned_file(storage_path)
+        conduit = OrphanDeletionConduit('Delete Orphans')
+        step = DeleteOrphansStep(content_type_id, content_units_collection, content_unit_ids,
+                                 status_conduit=conduit)
+        step.process_lifecycle()
 
     @staticmethod
     def delete_orphan_content_units_by_type(type_id):
@@ -239,28 +270,10 @@ class OrphanManager(object):
         """
         # get the model matching the type
         content_model = plugin_api.get_unit_model_by_id(type_id)
-        content_units = content_model.objects().only('id', 'storage_path')
-
-        # Paginate the content units
-        for units_group in plugin_misc.paginate(content_units):
-            # Build the list of ids to search for an easier way to access units in the group by id
-            unit_dict = dict()
-            for unit in units_group:
-                unit_dict[unit.id] = unit
-
-            id_list = list(unit_dict.iterkeys())
-
-            # Clear the units that are currently associated from unit_dict
-            non_orphan = model.RepositoryContentUnit.objects(unit_id__in=id_list)\
-                .distinct('unit_id')
-            for non_orphan_id in non_orphan:
-                unit_dict.pop(non_orphan_id)
-
-            # Remove the unit and any references on disk
-            for unit_to_delete in unit_dict.itervalues():
-                unit_to_delete.delete()
-                if unit_to_delete.storage_path:
-                    OrphanManager.delete_orphaned_file(unit_to_delete.storage_path)
+        conduit = OrphanDeletionConduit('Delete Orphans')
+        step = DeleteOrphansStep(type_id, content_model._get_collection(),
+                                 status_conduit=conduit)
+        step.process_lifecycle()
 
     @staticmethod
     def delete_orphaned_file(path):
@@ -289,12 +302,17 @@ class OrphanManager(object):
             path = os.path.dirname(path)
             if root_content_regex.match(path):
                 break
-            contents = os.listdir(path)
-            if contents:
-                break
-            if not os.access(path, os.W_OK):
+            try:
+                contents = os.listdir(path)
+                if contents:
+                    break
+                if not os.access(path, os.W_OK):
+                    break
+                os.rmdir(path)
+            except OSError:
+                # files are deleted concurrently; another thread has already pruned
+                # this directory or added to it, either way it is no longer ours to remove
                 break
-            os.rmdir(path)
 
     @staticmethod
     def is_shared(storage_dir, path):
@@ -359,6 +377,168 @@ class OrphanManager(object):
             _logger.error(_('Delete path: %(p)s failed: %(m)s'), {'p': path, 'm': str(e)})
 
 
+class OrphanDeletionConduit(StatusMixin):
+    """
+    Used to report the progress of orphan deletion back into the Pulp server.
+    """
+
+    def __init__(self, report_id):
+        """
+        :param report_id: identifies the progress report in the task status
+        :type  report_id: str
+        """
+        StatusMixin.__init__(self, report_id, pulp_exceptions.PulpExecutionException)
+
+    def __str__(self):
+        return 'OrphanDeletionConduit'
+
+
+class DeleteOrphansStep(Step):
+    """
+    Delete the orphaned content units in a single content unit collection.
+
+    Orphans are processed a page at a time: the documents in each page are removed with
+    a single query, then the files backing them are removed from storage using a bounded
+    pool of threads. Progress is reported as the number of orphans deleted.
+
+    Orphans are only found on the deletion pass. The total starts as the number of units
+    that may be orphans and is lowered as associated units are skipped.
+    """
+
+    def __init__(self, content_type_id, content_units_collection, content_unit_ids=None,
+                 status_conduit=None):
+        """
+        :param content_type_id: id of the content type
+        :type content_type_id: basestring
+        :param content_units_collection: collection the content units are stored in
+        :type content_units_collection: pymongo.collection.Collection
+        :param content_unit_ids: ids of the content units to delete; None means delete them all
+        :type content_unit_ids: iterable or None
+        :param status_conduit: conduit used to report progress, if this is the root step
+        :type status_conduit: OrphanDeletionConduit
+        """
+        super(DeleteOrphansStep, self).__init__(reporting_constants.DELETE_STEP_ORPHANS,
+                                                status_conduit=status_conduit)
+        self.content_type_id = content_type_id
+        self.content_units_collection = content_units_collection
+        self.content_unit_ids = None
+        if content_unit_ids is not None:
+            self.content_unit_ids = set(content_unit_ids)
+        self.description = _('Deleting orphaned units of type %(t)s') % {'t': content_type_id}
+        self.pool = None
+        self.units_candidates = 0
+        self.units_scanned = 0
+
+    def _generate_orphan_pages(self, fields):
+        """
+        :param fields: list of fields to include in each content unit
+        :type fields: list
+        :return: generator of lists of orphaned content units
+        :rtype: generator
+        """
+        if self.content_unit_ids is None:
+            content_units = self.content_units_collection.find({}, fields=fields)
+        else:
+            content_units = itertools.chain.from_iterable(
+                self.content_units_collection.find({'_id': {'$in': list(id_page)}},
+                                                   fields=fields)
+                for id_page in plugin_misc.paginate(self.content_unit_ids, ORPHAN_PAGE_SIZE))
+        for orphans in OrphanManager.generate_orphan_pages(self._scan(content_units),
+                                                           _raw_unit_id):
+            yield orphans
+        # every unit has been scanned, so the orphans deleted are all of them
+        self.total_units = self.progress_successes
+
+    def _scan(self, content_units):
+        """
+        Count the content units read while looking for orphans.
+
+        :param content_units: content units that may be orphans
+        :type content_units: iterable
+        :return: generator of the same content units
+        :rtype: generator
+        """
+        for content_unit in content_units:
+            self.units_scanned += 1
+            yield content_unit
+
+    def get_total(self):
+        """
+        The number of units that may be orphans, found without looking up their associations.
+
+        :return: upper bound of the number of orphaned content units that will be deleted
+        :rtype: int
+        """
+        if self.content_unit_ids is None:
+            self.units_candidates = self.content_units_collection.count()
+        else:
+            self.units_candidates = len(self.content_unit_ids)
+        return self.units_candidates
+
+    def get_iterator(self):
+        """
+        :return: generator of lists of orphaned content units
+        :rtype: generator
+        """
+        return self._generate_orphan_pages(['_id', '_storage_path'])
+
+    def initialize(self):
+        """
+        Start the thread pool used to remove files from storage.
+        """
+        self.pool = ThreadPool(ORPHAN_DELETE_THREADS)
+
+    def finalize(self):
+        """
+        Stop the thread pool used to remove files from storage.
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def _process_block(self, item=None):
+        """
+        Progress is counted by orphan, not by page, so it is recorded in process_main.
+
+        :param item: page of orphaned content units
+        :type item: list
+        """
+        self.process_main(item=item)
+        self.report_progress()
+
+    def process_main(self, item=None):
+        """
+        Delete a page of orphaned content units and their files.
+
+        :param item: page of orphaned content units
+        :type item: list
+        """
+        unit_ids = [content_unit['_id'] for content_unit in item]
+        self.content_units_collection.remove({'_id': {'$in': unit_ids}})
+
+        storage_paths = [content_unit['_storage_path'] for content_unit in item
+                         if content_unit.get('_storage_path') is not None]
+        # consume the results so that any error raised in the pool is raised here
+        for _result in self.pool.imap_unordered(OrphanManager.delete_orphaned_file,
+                                                storage_paths):
+            pass
+
+        self.progress_successes += len(item)
+        # the units scanned so far that were not orphans will not be deleted
+        self.total_units = self.progress_successes + self.units_candidates - self.units_scanned
+
+
+def _raw_unit_id(content_unit):
+    """
+    :param content_unit: content unit document as returned by pymongo
+    :type content_unit: dict
+    :return: id of the content unit
+    :rtype: basestring
+    """
+    return content_unit['_id']
+
+
 delete_all_orphans = task(OrphanManager.delete_all_orphans, base=Task, ignore_result=True)
 delete_orphans_by_id = task(OrphanManager.delete_orphans_by_id, base=Task, ignore_result=True)
 delete_orphans_by_type = task(OrphanManager.delete_orphans_by_type, base=Task, ignore_result=True)
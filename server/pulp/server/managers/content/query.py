@@ -4,9 +4,10 @@ import errno
 import os
 
 from pulp.plugins.types import database as content_types_db
-from pulp.plugins.util.misc import paginate
-from pulp.server import config as pulp_config
+from pulp.plugins.util.misc import DEFAULT_PAGE_SIZE, paginate
+from pulp.server import config as pulp_config, constants
 from pulp.server.controllers import units as units_controller
+from pulp.server.db import model
 from pulp.server.exceptions import InvalidValue, MissingResource
 
 
@@ -145,7 +146,8 @@ class ContentQueryManager(object):
                                   {'i': unit_id})
         return units[0]
 
-    def get_multiple_units_by_keys_dicts(self, content_type, unit_keys_dicts, model_fields=None):
+    def get_multiple_units_by_keys_dicts(self, content_type, unit_keys_dicts, model_fields=None,
+                                         page_size=DEFAULT_PAGE_SIZE):
         """
         Look up multiple content units in the collection for the given content
         type collection that match the list of keys dictionaries.
@@ -157,17 +159,20 @@ class ContentQueryManager(object):
         :param model_fields: fields of each content unit to report,
                              None means all fields
         :type model_fields: None or list of str's
+        :param page_size: number of keys dictionaries looked up by each query
+        :type page_size: int
         :return: tuple of content units found in the content type collection
                  that match the given unit keys dictionaries
         :rtype: (possibly empty) tuple of dict's
         :raises ValueError: if any of the keys dictionaries are invalid
         """
         collection = content_types_db.type_units_collection(content_type)
-        for segment in paginate(unit_keys_dicts, page_size=50):
-            spec = _build_multi_keys_spec(content_type, segment)
-            cursor = collection.find(spec, fields=model_fields)
-            for unit_dict in cursor:
-                yield unit_dict
+        has_undigested_units = _has_undigested_units(collection)
+        for segment in paginate(unit_keys_dicts, page_size=page_size):
+            for spec in _build_multi_keys_specs(content_type, segment, has_undigested_units):
+                cursor = collection.find(spec, fields=model_fields)
+                for unit_dict in cursor:
+                    yield unit_dict
 
     def get_multiple_units_by_ids(self, content_type, unit_ids, model_fields=None):
         """
@@ -228,11 +233,12 @@ class ContentQueryManager(object):
         :rtype:     generator
         """
         collection = content_types_db.type_units_collection(content_type)
+        has_undigested_units = _has_undigested_units(collection)
         for segment in paginate(unit_keys):
-            spec = _build_multi_keys_spec(content_type, segment)
-            fields = ['_id']
-            for item in collection.find(spec, fields=fields):
-                yield str(item['_id'])
+            for spec in _build_multi_keys_specs(content_type, segment, has_undigested_units):
+                fields = ['_id']
+                for item in collection.find(spec, fields=fields):
+                    yield str(item['_id'])
 
     def get_root_content_dir(self, content_type):
         """
@@ -300,6 +306,42 @@ def _flatten_keys(flat_keys, nested_keys):
             _flatten_keys(flat_keys, key)
 
 
+def _has_undigested_units(collection):
+    """
+    Find out if any unit of a collection was stored without the digest of its unit key.
+    :param collection: collection of content units
+    :type collection: pymongo.collection.Collection
+    :return: True if any unit has no unit key digest
+    :rtype: bool
+    """
+    spec = {constants.UNIT_KEY_DIGEST_FIELDNAME: None}
+    return collection.find_one(spec, fields=['_id']) is not None
+
+
+def _build_multi_keys_specs(content_type, unit_keys_dicts, has_undigested_units):
+    """
+    Build the mongo db spec documents for the queries that find the units of the given
+    content_type collection that match multiple content unit key dictionaries.
+    Units are found by their unit key digests. Units stored without a digest are
+    found by their unit key fields, if there are any.
+    :param content_type: unique id of the content type collection
+    :type content_type: str
+    :param unit_keys_dicts: list of key dictionaries whose key, value pairs can be
+                            used as unique identifiers for a single content unit
+    :type unit_keys_dicts: list of dict
+    :param has_undigested_units: whether any unit of the collection has no unit key digest
+    :type has_undigested_units: bool
+    :return: mongo db spec documents for locating documents in a collection
+    :rtype: list of dict
+    :raises ValueError: if any of the key dictionaries do not match the unique
+            fields of the collection
+    """
+    specs = [_build_multi_keys_spec(content_type, unit_keys_dicts)]
+    if has_undigested_units:
+        specs.append({constants.UNIT_KEY_DIGEST_FIELDNAME: None, '$or': unit_keys_dicts})
+    return specs
+
+
 def _build_multi_keys_spec(content_type, unit_keys_dicts):
     """
     Build a mongo db spec document for a query on the given content_type
@@ -309,7 +351,8 @@ def _build_multi_keys_spec(content_type, unit_keys_dicts):
     :param unit_keys_dicts: list of key dictionaries whose key, value pairs can be
                             used as unique identifiers for a single content unit
     :type unit_keys_dicts: list of dict
-    :return: mongo db spec document for locating documents in a collection
+    :return: mongo db spec document for locating documents in a collection by
+             their unit key digests
     :rtype: dict
     :raises ValueError: if any of the key dictionaries do not match the unique
             fields of the collection
@@ -341,5 +384,6 @@ def _build_multi_keys_spec(content_type, unit_keys_dicts):
         value_error_msg = '\n'.join(keys_errors)
         raise ValueError(value_error_msg)
     # Build the spec
-    spec = {'$or': unit_keys_dicts}
+    digests = [model.unit_key_digest(keys_dict) for keys_dict in unit_keys_dicts]
+    spec = {constants.UNIT_KEY_DIGEST_FIELDNAME: {'$in': digests}}
     return spec
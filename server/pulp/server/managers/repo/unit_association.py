@@ -122,21 +122,7 @@ class RepoUnitAssociationManager(object):
         @raise InvalidType: if the given owner type is not of the valid enumeration
         """
 
-        # There may be a way to batch this in mongo which would be ideal for a
-        # bulk operation like this. But for deadline purposes, this call will
-        # simply loop and call the single method.
-
-        unique_count = 0
-        for unit_id in unit_id_list:
-            if not RepoUnitAssociationManager.association_exists(repo_id, unit_id, unit_type_id):
-                unique_count += 1
-            self.associate_unit_by_id(repo_id, unit_type_id, unit_id, False)
-
-        # update the count of associated units on the repo object
-        if unique_count:
-            repo_controller.update_unit_count(repo_id, unit_type_id, unique_count)
-            repo_controller.update_last_unit_added(repo_id)
-        return unique_count
+        return repo_controller.associate_unit_ids(repo_id, unit_type_id, unit_id_list)
 
     @staticmethod
     def associate_from_repo(source_repo_id, dest_repo_id, criteria=None,
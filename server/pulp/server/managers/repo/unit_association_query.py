@@ -6,6 +6,7 @@ import itertools
 import pymongo
 
 from pulp.plugins.types import database as types_db
+from pulp.plugins.util.misc import paginate
 from pulp.server.controllers import units as units_controller
 from pulp.server.db.model.criteria import UnitAssociationCriteria
 from pulp.server.db.model.repository import RepoContentUnit
@@ -23,6 +24,14 @@ SORT_DESCENDING = pymongo.DESCENDING
 
 _VALID_DIRECTIONS = (SORT_ASCENDING, SORT_DESCENDING)
 
+# Number of unit associations joined with their units at a time when streaming units
+ASSOCIATION_PAGE_SIZE = 1000
+
+# Order of the associations read a page at a time. With the repository fixed by the query, it
+# follows the unique (repo_id, unit_type_id, unit_id) index, so the database does not sort them
+# in memory.
+_PAGED_UNITS_SORT = [('unit_type_id', SORT_ASCENDING), ('unit_id', SORT_ASCENDING)]
+
 
 class RepoUnitAssociationQueryManager(object):
 
@@ -49,6 +58,10 @@ class RepoUnitAssociationQueryManager(object):
         Get the units associated with the repository based on the provided unit
         association criteria.
 
+        Without a sort in the criteria, a list is ordered by unit type and then by the unit key
+        of each type. A generator is instead ordered by unit type and then by unit id, since
+        it reads the associations and their units a page at a time rather than all at once.
+
         :param repo_id: identifies the repository
         :type  repo_id: str
 
@@ -64,6 +77,11 @@ class RepoUnitAssociationQueryManager(object):
 
         criteria = criteria or UnitAssociationCriteria()
 
+        if as_generator and not criteria.association_sort and not criteria.unit_sort:
+            # Without a sort to honor, the units can be streamed in the order of their
+            # associations, so neither have to be held in memory all at once.
+            return self._paged_units(repo_id, criteria)
+
         unit_associations_generator = self._unit_associations_cursor(repo_id, criteria)
 
         if criteria.remove_duplicates:
@@ -244,6 +262,31 @@ class RepoUnitAssociationQueryManager(object):
 
         return [t for t in cursor.distinct('unit_type_id')]
 
+    def _paged_units(self, repo_id, criteria):
+        """
+        Generate the units associated with the repository, merged with their associations like
+        get_units does, by joining pages of associations with their units. Units are generated
+        in order of unit type id and unit id, and skip and limit apply to the units.
+
+        :type repo_id: str
+        :type criteria: UnitAssociationCriteria
+        :rtype: generator
+        """
+        unit_associations = self._unit_associations_cursor(repo_id, criteria)
+        unit_associations.sort(_PAGED_UNITS_SORT)
+        if criteria.remove_duplicates:
+            unit_associations = self._unit_associations_no_adjacent_duplicates(unit_associations)
+
+        units_and_associations = self._associated_units_by_page(criteria, unit_associations)
+        units_and_associations = self._with_skip_and_limit(units_and_associations,
+                                                           criteria.skip, criteria.limit)
+
+        for unit, associations in units_and_associations:
+            for association in associations:
+                association = association.copy()
+                association['metadata'] = unit
+                yield association
+
     # -- unit association methods ----------------------------------------------
 
     @staticmethod
@@ -304,6 +347,28 @@ class RepoUnitAssociationQueryManager(object):
 
             previously_generated_association_ids.add(association_id)
 
+    @staticmethod
+    def _unit_associations_no_adjacent_duplicates(unit_associations):
+        """
+        Remove duplicate unit associations from an iterator of unit associations in which the
+        associations of the same unit are adjacent. The first of them is kept.
+
+        :type unit_associations: iterable
+        :rtype: generator
+        """
+        previous_association_id = None
+
+        for unit_association in unit_associations:
+
+            association_id = (unit_association['unit_type_id'], unit_association['unit_id'])
+
+            if association_id == previous_association_id:
+                continue
+
+            yield unit_association
+
+            previous_association_id = association_id
+
     @staticmethod
     def _with_skip_and_limit(iterator, skip, limit):
         """
@@ -381,6 +446,35 @@ class RepoUnitAssociationQueryManager(object):
 
         return cursor
 
+    @classmethod
+    def _associated_units_by_page(cls, criteria, unit_associations):
+        """
+        Join pages of unit associations with the units they associate, with one query per unit
+        type in each page. The associations must be ordered by unit type id and unit id.
+
+        :type criteria: UnitAssociationCriteria
+        :type unit_associations: iterable
+        :return: generator of (unit, list of its associations) tuples, ordered like the
+                 associations
+        :rtype: generator
+        """
+        for page in paginate(unit_associations, ASSOCIATION_PAGE_SIZE):
+
+            # unit_type_id -> unit_id -> (ordered)[association_1, association_2, ...]
+            associations_lookup = {}
+            for association in page:
+                association_type_dict = associations_lookup.setdefault(
+                    association['unit_type_id'], {})
+                association_type_dict.setdefault(association['unit_id'], []).append(association)
+
+            for unit_type_id in sorted(associations_lookup):
+                association_type_dict = associations_lookup[unit_type_id]
+                cursor = cls._associated_units_by_type_cursor(unit_type_id, criteria,
+                                                              association_type_dict.keys())
+                cursor.sort([('_id', SORT_ASCENDING)])
+                for unit in cursor:
+                    yield unit, association_type_dict[unit['_id']]
+
     @staticmethod
     def _associated_units_cursors_with_skip(units_cursors, skip):
         """
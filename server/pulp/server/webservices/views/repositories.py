@@ -11,7 +11,7 @@ from pulp.server.controllers import distributor as dist_controller
 from pulp.server.db import model
 from pulp.server.db.model.criteria import Criteria, UnitAssociationCriteria
 from pulp.server.managers import factory as manager_factory
-from pulp.server.managers.consumer.applicability import regenerate_applicability_for_repos
+from pulp.server.managers.consumer.applicability import queue_regenerate_applicability_for_repos
 from pulp.server.managers.content.upload import import_uploaded_unit
 from pulp.server.managers.repo import importer as repo_importer_manager
 from pulp.server.managers.repo.distributor import RepoDistributorManager
@@ -979,7 +979,7 @@ class ContentApplicabilityRegenerationView(View):
             raise invalid_criteria
 
         regeneration_tag = tags.action_tag('content_applicability_regeneration')
-        async_result = regenerate_applicability_for_repos.apply_async_with_reservation(
+        async_result = queue_regenerate_applicability_for_repos.apply_async_with_reservation(
             tags.RESOURCE_REPOSITORY_PROFILE_APPLICABILITY_TYPE, tags.RESOURCE_ANY_ID,
             (repo_criteria.as_dict(),), tags=[regeneration_tag])
         raise pulp_exceptions.OperationPostponed(async_result)
@@ -246,6 +246,21 @@ class SingleRepoUnitsMixinTests(unittest.TestCase):
         self.assertEqual(1, mock_query_call.call_count)
         self.assertEqual(mock_query_call.call_args[0][0], self.repo_id)
         self.assertEqual(mock_query_call.call_args[1]['criteria'], fake_criteria)
+        # lists keep the unit key order of unsorted queries
+        self.assertFalse(mock_query_call.call_args[1]['as_generator'])
+
+    @mock.patch('pulp.server.controllers.units.get_unit_key_fields_for_type', spec_set=True)
+    @mock.patch('pulp.server.managers.repo.unit_association_query.'
+                'RepoUnitAssociationQueryManager.get_units')
+    def test_get_units_as_generator(self, mock_query_call, mock_get_unit_key_fields):
+        mock_query_call.return_value = iter([
+            {'unit_type_id': 'type-1', 'metadata': {'m': 'm1', 'k1': 'v1'}}])
+        mock_get_unit_key_fields.return_value = ('k1',)
+
+        units = self.mixin.get_units(criteria='fake-criteria', as_generator=True)
+
+        self.assertEqual(len(list(units)), 1)
+        self.assertTrue(mock_query_call.call_args[1]['as_generator'])
 
     @mock.patch('pulp.server.managers.repo.unit_association_query.'
                 'RepoUnitAssociationQueryManager.get_units')
@@ -745,6 +760,104 @@ class AddUnitMixinTests(unittest.TestCase):
         # Test
         self.assertRaises(mixins.ImporterConduitException, self.mixin.save_unit, None)
 
+    @mock.patch('pulp.server.managers.content.query.ContentQueryManager.'
+                'get_multiple_units_by_keys_dicts')
+    @mock.patch('pulp.server.managers.content.cud.ContentManager.update_content_units')
+    @mock.patch('pulp.server.managers.content.cud.ContentManager.add_content_units')
+    @mock.patch('pulp.server.managers.repo.unit_association.RepoUnitAssociationManager.'
+                'associate_all_by_ids')
+    def test_save_units(self, mock_associate, mock_add, mock_update, mock_get):
+        new_unit = Unit('t', {'k': 'new'}, {'m': 'm1'}, '/new')
+        changed_unit = Unit('t', {'k': 'changed'}, {'m': 'm2'}, '/changed')
+        same_unit = Unit('t', {'k': 'same'}, {'m': 'm3'}, '/same')
+        other_unit = Unit('t2', {'k': 'other'}, {}, None)
+        user_metadata = constants.PULP_USER_METADATA_FIELDNAME
+        mock_get.side_effect = [
+            [{'_id': 'changed-id', 'k': u'changed', 'm': 'old', '_storage_path': '/changed',
+              user_metadata: {}},
+             {'_id': 'same-id', 'k': u'same', 'm': 'm3', '_storage_path': '/same',
+              user_metadata: {}}],
+            []]
+        mock_add.side_effect = [['new-id'], ['other-id']]
+
+        self.mixin.save_units(iter([new_unit, changed_unit, same_unit, other_unit]))
+
+        self.assertEqual(mock_get.call_args_list[0], mock.call(
+            't', [{'k': 'new'}, {'k': 'changed'}, {'k': 'same'}], page_size=3))
+        self.assertEqual(mock_update.call_args_list, [
+            mock.call('t', {'changed-id': {'m': 'm2'}}), mock.call('t2', {})])
+        self.assertEqual(mock_add.call_args_list, [
+            mock.call('t', [{'k': 'new', 'm': 'm1', '_storage_path': '/new', user_metadata: {}}]),
+            mock.call('t2', [{'k': 'other', '_storage_path': None, user_metadata: {}}])])
+        self.assertEqual(mock_associate.call_args_list, [
+            mock.call(self.repo_id, 't', ['new-id', 'changed-id', 'same-id']),
+            mock.call(self.repo_id, 't2', ['other-id'])])
+        self.assertEqual(new_unit.id, 'new-id')
+        self.assertEqual(changed_unit.id, 'changed-id')
+        self.assertEqual(same_unit.id, 'same-id')
+        self.assertEqual(other_unit.id, 'other-id')
+        self.assertEqual(2, self.mixin._added_count)
+        self.assertEqual(2, self.mixin._updated_count)
+
+    @mock.patch('pulp.plugins.conduits.mixins.SAVE_UNITS_PAGE_SIZE', 2)
+    @mock.patch('pulp.server.managers.content.query.ContentQueryManager.'
+                'get_multiple_units_by_keys_dicts')
+    @mock.patch('pulp.server.managers.content.cud.ContentManager.update_content_units')
+    @mock.patch('pulp.server.managers.content.cud.ContentManager.add_content_units')
+    @mock.patch('pulp.server.managers.repo.unit_association.RepoUnitAssociationManager.'
+                'associate_all_by_ids')
+    def test_save_units_pages(self, mock_associate, mock_add, mock_update, mock_get):
+        units = [Unit('t', {'k': str(i)}, {}, None) for i in range(3)]
+        mock_get.return_value = []
+        mock_add.side_effect = [['id-0', 'id-1'], ['id-2']]
+
+        self.mixin.save_units(units)
+
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(mock_associate.call_args_list, [
+            mock.call(self.repo_id, 't', ['id-0', 'id-1']),
+            mock.call(self.repo_id, 't', ['id-2'])])
+        self.assertEqual(3, self.mixin._added_count)
+
+    @mock.patch('pulp.server.managers.content.query.ContentQueryManager.'
+                'get_content_unit_by_keys_dict')
+    @mock.patch('pulp.server.managers.content.cud.ContentManager.update_content_unit')
+    @mock.patch('pulp.server.managers.content.query.ContentQueryManager.'
+                'get_multiple_units_by_keys_dicts')
+    @mock.patch('pulp.server.managers.content.cud.ContentManager.update_content_units')
+    @mock.patch('pulp.server.managers.content.cud.ContentManager.add_content_units')
+    @mock.patch('pulp.server.managers.repo.unit_association.RepoUnitAssociationManager.'
+                'associate_all_by_ids')
+    def test_save_units_race_condition(self, mock_associate, mock_add, mock_update_units,
+                                       mock_get_units, mock_update, mock_get):
+        """
+        This simulates a case where one of the units gets added by another workflow
+        between the lookup and the bulk insert. That unit is updated instead.
+        """
+        raced_unit = Unit('t', {'k': 'raced'}, {'m': 'm1'}, None)
+        new_unit = Unit('t', {'k': 'new'}, {'m': 'm2'}, None)
+        mock_get_units.return_value = []
+        mock_add.return_value = [None, 'new-id']
+        mock_get.return_value = {'_id': 'raced-id'}
+
+        self.mixin.save_units([raced_unit, new_unit])
+
+        mock_get.assert_called_once_with('t', {'k': 'raced'})
+        self.assertEqual(1, mock_update.call_count)
+        self.assertEqual(raced_unit.id, 'raced-id')
+        self.assertEqual(new_unit.id, 'new-id')
+        mock_associate.assert_called_once_with(self.repo_id, 't', ['raced-id', 'new-id'])
+        self.assertEqual(1, self.mixin._added_count)
+        self.assertEqual(1, self.mixin._updated_count)
+
+    @mock.patch('pulp.server.managers.content.query.ContentQueryManager.'
+                'get_multiple_units_by_keys_dicts')
+    def test_save_units_with_error(self, mock_get):
+        mock_get.side_effect = Exception()
+
+        self.assertRaises(mixins.ImporterConduitException, self.mixin.save_units,
+                          [Unit('t', {'k': 'v'}, {}, None)])
+
     @mock.patch('pulp.server.managers.content.cud.ContentManager.link_referenced_content_units')
     def test_link_unit(self, mock_link):
         # Setup
@@ -849,6 +962,48 @@ class StatusMixinTests(unittest.TestCase):
         # Test
         self.assertRaises(mixins.ImporterConduitException, self.mixin.set_progress, 'foo')
 
+    @mock.patch('pulp.server.db.model.TaskStatus._get_collection')
+    @mock.patch('pulp.plugins.conduits.mixins.get_current_task_id')
+    def test_update_progress(self, mock_get_task_id, mock_get_collection):
+        mock_get_task_id.return_value = 'test-id'
+        self.mixin = mixins.StatusMixin('test-report', mixins.ImporterConduitException)
+
+        status = [{'state': 'running', 'num_success': 2}]
+        self.mixin.update_progress(status, {'0.num_success': 2})
+
+        self.assertEqual(self.mixin.progress_report, {'test-report': status})
+        mock_get_collection.return_value.update.assert_called_once_with(
+            {'task_id': 'test-id'}, {'$set': {'progress_report.test-report.0.num_success': 2}})
+
+    @mock.patch('pulp.server.db.model.TaskStatus._get_collection')
+    @mock.patch('pulp.plugins.conduits.mixins.get_current_task_id')
+    def test_update_progress_no_changes(self, mock_get_task_id, mock_get_collection):
+        mock_get_task_id.return_value = 'test-id'
+        self.mixin = mixins.StatusMixin('test-report', mixins.ImporterConduitException)
+
+        self.mixin.update_progress('status', {})
+
+        self.assertFalse(mock_get_collection.called)
+
+    @mock.patch('pulp.server.db.model.TaskStatus._get_collection')
+    @mock.patch('pulp.plugins.conduits.mixins.get_current_task_id')
+    def test_update_progress_no_task(self, mock_get_task_id, mock_get_collection):
+        mock_get_task_id.return_value = None
+        self.mixin = mixins.StatusMixin('', mixins.ImporterConduitException)
+
+        self.mixin.update_progress('status', {'0.state': 'running'})
+
+        self.assertFalse(mock_get_collection.called)
+
+    @mock.patch('pulp.server.db.model.TaskStatus._get_collection')
+    def test_update_progress_with_exception(self, mock_get_collection):
+        self.mixin = mixins.StatusMixin('test-report', mixins.ImporterConduitException)
+        self.mixin.task_id = 'test_id'
+        mock_get_collection.return_value.update.side_effect = Exception()
+
+        self.assertRaises(mixins.ImporterConduitException, self.mixin.update_progress, 'foo',
+                          {'0.state': 'running'})
+
 
 class PublishReportMixinTests(unittest.TestCase):
 
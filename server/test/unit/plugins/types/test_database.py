@@ -41,7 +41,8 @@ class TypesDatabaseTests(base.PulpServerTests):
             collection = types_db.type_units_collection(d.id)
             all_indexes = collection.index_information()
 
-            total_index_count = 1 + 1 + len(d.search_indexes)  # _id + unit key + all search
+            # _id + unit key + unit key digest + all search
+            total_index_count = 1 + 1 + 1 + len(d.search_indexes)
             self.assertEqual(total_index_count, len(all_indexes))
 
     def test_update_no_changes(self):
@@ -70,7 +71,8 @@ class TypesDatabaseTests(base.PulpServerTests):
             collection = types_db.type_units_collection(d.id)
             all_indexes = collection.index_information()
 
-            total_index_count = 1 + 1 + len(d.search_indexes)  # _id + unit key + all search
+            # _id + unit key + unit key digest + all search
+            total_index_count = 1 + 1 + 1 + len(d.search_indexes)
             self.assertEqual(total_index_count, len(all_indexes))
 
     def test_update_missing_no_error(self):
@@ -99,7 +101,8 @@ class TypesDatabaseTests(base.PulpServerTests):
             collection = types_db.type_units_collection(d.id)
             all_indexes = collection.index_information()
 
-            total_index_count = 1 + 1 + len(d.search_indexes)  # _id + unit key + all search
+            # _id + unit key + unit key digest + all search
+            total_index_count = 1 + 1 + 1 + len(d.search_indexes)
             self.assertEqual(total_index_count, len(all_indexes))
 
     def test_update_missing_with_error(self):
@@ -364,6 +367,30 @@ class TypesDatabaseTests(base.PulpServerTests):
         self.assertEqual('compound_2', keys[1][0])
         self.assertEqual(types_db.ASCENDING, keys[1][1])
 
+    def test_update_unit_key_digest_index(self):
+        """
+        Tests that the unit key digest is indexed so units can be looked up by it.
+        """
+
+        # Setup
+        type_def = TypeDefinition('rpm', 'RPM', 'RPM Packages', ['compound_1', 'compound_2'],
+                                  None, [])
+
+        # Test
+        types_db._update_unit_key_digest_index(type_def)
+
+        # Verify
+        collection_name = types_db.unit_collection_name(type_def.id)
+        collection = pulp_db.get_collection(collection_name)
+
+        index_dict = collection.index_information()
+
+        self.assertEqual(2, len(index_dict))  # default (_id) + unit key digest
+
+        index = index_dict['_unit_key_digest_1']
+        self.assertFalse(index.get('unique', False))
+        self.assertEqual([('_unit_key_digest', types_db.ASCENDING)], index['key'])
+
     def test_update_search_indexes(self):
         """
         Tests that the unique index creation on a new collection is successful.
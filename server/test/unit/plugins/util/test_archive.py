@@ -0,0 +1,159 @@
+import gzip
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zlib
+from StringIO import StringIO
+
+from mock import Mock, patch
+
+from pulp.plugins.util import archive
+
+
+class TestProgressFile(unittest.TestCase):
+
+    def test_write(self):
+        fileobj = StringIO()
+        listener = Mock()
+        progress_file = archive.ProgressFile(fileobj, listener)
+
+        progress_file.write('abc')
+        progress_file.write('de')
+
+        self.assertEqual(fileobj.getvalue(), 'abcde')
+        self.assertEqual(progress_file.bytes_written, 5)
+        self.assertEqual([c[0][0] for c in listener.call_args_list], [3, 5])
+
+
+class TestBlockCompressor(unittest.TestCase):
+
+    def _members(self, compressed):
+        """
+        Split concatenated gzip members.
+        """
+        members = []
+        while compressed:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            members.append(decompressor.decompress(compressed))
+            compressed = decompressor.unused_data
+        return members
+
+    def test_blocks(self):
+        fileobj = StringIO()
+        compressor = archive.BlockCompressor(fileobj, archive.COMPRESSION_GZIP, block_size=4)
+
+        compressor.write('ab')
+        compressor.write('cdefghij')
+        compressor.write('k')
+        compressor.close()
+
+        self.assertEqual(self._members(fileobj.getvalue()), ['abcd', 'efgh', 'ijk'])
+
+    def test_threads(self):
+        data = os.urandom(1000) * 20
+        fileobj = StringIO()
+        compressor = archive.BlockCompressor(fileobj, archive.COMPRESSION_GZIP, threads=4,
+                                             block_size=1000)
+
+        for offset in xrange(0, len(data), 300):
+            compressor.write(data[offset:offset + 300])
+        compressor.close()
+
+        members = self._members(fileobj.getvalue())
+        self.assertEqual(len(members), 20)
+        self.assertEqual(''.join(members), data)
+        # concatenated members are read as one file
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(fileobj.getvalue())).read(), data)
+
+    def test_unsupported(self):
+        self.assertRaises(ValueError, archive.BlockCompressor, StringIO(), 'zip')
+
+    @patch('pulp.plugins.util.archive.lzma', None)
+    def test_xz_without_lzma(self):
+        self.assertRaises(ValueError, archive.BlockCompressor, StringIO(),
+                          archive.COMPRESSION_XZ)
+
+    @patch('pulp.plugins.util.archive.lzma')
+    def test_xz(self, mock_lzma):
+        mock_lzma.compress.side_effect = lambda data: '<%s>' % data
+        fileobj = StringIO()
+        compressor = archive.BlockCompressor(fileobj, archive.COMPRESSION_XZ, block_size=2)
+
+        compressor.write('abcde')
+        compressor.close()
+
+        self.assertEqual(fileobj.getvalue(), '<ab><cd><e>')
+
+
+class TestWriteTar(unittest.TestCase):
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp(prefix='working_')
+        self.source_dir = os.path.join(self.working_dir, 'source')
+        os.makedirs(os.path.join(self.source_dir, 'dir'))
+        with open(os.path.join(self.source_dir, 'dir', 'file.txt'), 'w') as f:
+            f.write('file contents')
+        os.symlink('dir/file.txt', os.path.join(self.source_dir, 'link.txt'))
+        self.destination_dir = os.path.join(self.working_dir, 'published')
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def _read(self, path):
+        with tarfile.open(path) as tar_file:
+            return dict((m.name, tar_file.extractfile(m).read())
+                        for m in tar_file.getmembers() if m.isfile())
+
+    def test_write_tar(self):
+        destination = os.path.join(self.destination_dir, 'repo.tar')
+        listener = Mock()
+
+        size = archive.write_tar(self.source_dir, destination, listener=listener)
+
+        self.assertEqual(size, os.path.getsize(destination))
+        self.assertEqual(listener.call_args[0][0], size)
+        # symbolic links are followed
+        self.assertEqual(self._read(destination), {'dir/file.txt': 'file contents',
+                                                   'link.txt': 'file contents'})
+        self.assertEqual(os.listdir(self.destination_dir), ['repo.tar'])
+        self.assertEqual(os.stat(destination).st_mode & 0777, archive.ARCHIVE_MODE)
+
+    def test_write_tar_gzip(self):
+        destination = os.path.join(self.destination_dir, 'repo.tar.gz')
+
+        archive.write_tar(self.source_dir, destination, compression=archive.COMPRESSION_GZIP,
+                          threads=2)
+
+        self.assertEqual(self._read(destination), {'dir/file.txt': 'file contents',
+                                                   'link.txt': 'file contents'})
+        self.assertEqual(os.listdir(self.destination_dir), ['repo.tar.gz'])
+
+    def test_write_tar_in_source_dir(self):
+        destination = os.path.join(self.source_dir, 'repo.tar')
+
+        archive.write_tar(self.source_dir, destination)
+
+        self.assertEqual(self._read(destination), {'dir/file.txt': 'file contents',
+                                                   'link.txt': 'file contents'})
+
+    def test_write_tar_replaces_destination(self):
+        destination = os.path.join(self.destination_dir, 'repo.tar')
+        os.makedirs(self.destination_dir)
+        with open(destination, 'w') as f:
+            f.write('old')
+
+        archive.write_tar(self.source_dir, destination)
+
+        self.assertEqual(self._read(destination), {'dir/file.txt': 'file contents',
+                                                   'link.txt': 'file contents'})
+
+    @patch('tarfile.TarFile.add', side_effect=IOError())
+    def test_write_tar_failed(self, mock_add):
+        destination = os.path.join(self.destination_dir, 'repo.tar')
+
+        self.assertRaises(IOError, archive.write_tar, self.source_dir, destination)
+
+        # the partial archive is removed
+        self.assertEqual(os.listdir(self.destination_dir), [])
@@ -0,0 +1,174 @@
+from cStringIO import StringIO
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from pulp.plugins.util import checksums, verification
+
+
+HI_THERE_SHA256 = 'c641344867e9806fadfd219f25b62b97c94db0eed04a1d79e93676533cfb782b'
+
+
+class TestFileChecksum(unittest.TestCase):
+
+    @mock.patch.object(checksums, 'CHUNK_SIZE', 3)
+    def test_file_checksum(self):
+        ret = checksums.file_checksum(StringIO('hi there\n'))
+
+        self.assertEqual(ret, HI_THERE_SHA256)
+
+    def test_invalid_type(self):
+        self.assertRaises(verification.InvalidChecksumType, checksums.file_checksum,
+                          StringIO(), 'fake-type')
+
+
+class ChecksumsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.base_dir = os.path.join(self.working_dir, 'base')
+        os.makedirs(self.base_dir)
+        self.cache_path = os.path.join(self.working_dir, 'cache', 'checksums.json')
+        self.paths = []
+        for name in ('a', 'b', 'c'):
+            path = os.path.join(self.base_dir, name)
+            with open(path, 'w') as f:
+                f.write('hi there\n')
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+
+class TestVerifyPathChecksum(ChecksumsTestCase):
+
+    def test_verified(self):
+        checksums.verify_path_checksum(self.paths[0], verification.TYPE_SHA256, HI_THERE_SHA256)
+
+    def test_mismatch(self):
+        try:
+            checksums.verify_path_checksum(self.paths[0], verification.TYPE_SHA256, 'abc')
+            self.fail('VerificationException not raised')
+        except verification.VerificationException, e:
+            self.assertEqual(e.args[0], HI_THERE_SHA256)
+
+    @mock.patch.object(checksums, 'path_checksum', spec_set=True)
+    def test_cached(self, mock_checksum):
+        cache = checksums.ChecksumCache(self.cache_path, self.base_dir)
+        cache.set(self.paths[0], os.stat(self.paths[0]), verification.TYPE_SHA256,
+                  HI_THERE_SHA256)
+
+        checksums.verify_path_checksum(self.paths[0], verification.TYPE_SHA256, HI_THERE_SHA256,
+                                       cache)
+
+        self.assertEqual(mock_checksum.call_count, 0)
+
+
+class TestChecksumCache(ChecksumsTestCase):
+
+    def test_get(self):
+        cache = checksums.ChecksumCache(self.cache_path, self.base_dir)
+        stat = os.stat(self.paths[0])
+
+        self.assertEqual(cache.get(self.paths[0], stat, 'sha256'), None)
+        cache.set(self.paths[0], stat, 'sha256', 'abc')
+
+        self.assertEqual(cache.get(self.paths[0], stat, 'sha256'), 'abc')
+        self.assertEqual(cache.get(self.paths[0], stat, 'sha1'), None)
+        self.assertEqual(cache.get(self.paths[1], stat, 'sha256'), None)
+        self.assertEqual(cache.hits, 1)
+
+    def test_changed(self):
+        cache = checksums.ChecksumCache(self.cache_path, self.base_dir)
+        cache.set(self.paths[0], os.stat(self.paths[0]), 'sha256', 'abc')
+
+        with open(self.paths[0], 'a') as f:
+            f.write('more')
+
+        self.assertEqual(cache.get(self.paths[0], os.stat(self.paths[0]), 'sha256'), None)
+
+    def test_save(self):
+        cache = checksums.ChecksumCache(self.cache_path, self.base_dir)
+        for path in self.paths:
+            cache.set(path, os.stat(path), 'sha256', 'abc')
+        cache.save()
+
+        cache = checksums.ChecksumCache(self.cache_path, self.base_dir)
+        self.assertEqual(cache.get(self.paths[0], os.stat(self.paths[0]), 'sha256'), 'abc')
+        cache.save()
+
+        # only the entries that were used are saved again
+        with open(self.cache_path) as f:
+            self.assertEqual(json.load(f).keys(), ['sha256:a'])
+        self.assertEqual(os.listdir(os.path.dirname(self.cache_path)), ['checksums.json'])
+
+    @mock.patch('tempfile.mkstemp', spec_set=True)
+    def test_save_unchanged(self, mock_mkstemp):
+        cache = checksums.ChecksumCache(self.cache_path, self.base_dir)
+
+        cache.save()
+
+        self.assertEqual(mock_mkstemp.call_count, 0)
+
+    def test_relative(self):
+        """
+        Entries are found for the same file in another base directory.
+        """
+        cache = checksums.ChecksumCache(self.cache_path, self.base_dir)
+        stat = os.stat(self.paths[0])
+        cache.set(self.paths[0], stat, 'sha256', 'abc')
+        cache.save()
+
+        cache = checksums.ChecksumCache(self.cache_path, '/other')
+        self.assertEqual(cache.get('/other/a', stat, 'sha256'), 'abc')
+
+    def test_corrupt(self):
+        os.makedirs(os.path.dirname(self.cache_path))
+        with open(self.cache_path, 'w') as f:
+            f.write('{not json')
+
+        cache = checksums.ChecksumCache(self.cache_path, self.base_dir)
+
+        self.assertEqual(cache.get(self.paths[0], os.stat(self.paths[0]), 'sha256'), None)
+
+
+class TestChecksumService(ChecksumsTestCase):
+
+    def test_checksums(self):
+        service = checksums.ChecksumService(threads=2)
+
+        ret = service.checksums(self.paths)
+
+        self.assertEqual(ret, dict((path, HI_THERE_SHA256) for path in self.paths))
+
+    def test_checksum(self):
+        service = checksums.ChecksumService(verification.TYPE_SHA1, threads=1)
+
+        ret = service.checksum(self.paths[0])
+
+        self.assertEqual(ret, '279d9035886d4c0427549863c4c2101e4a63e041')
+
+    def test_invalid_type(self):
+        self.assertRaises(verification.InvalidChecksumType, checksums.ChecksumService,
+                          'fake-type')
+
+    @mock.patch.object(checksums, 'path_checksum', spec_set=True)
+    def test_cached(self, mock_checksum):
+        mock_checksum.return_value = HI_THERE_SHA256
+        cache = checksums.ChecksumCache(self.cache_path, self.base_dir)
+        service = checksums.ChecksumService(threads=2, cache=cache)
+        service.checksums(self.paths)
+        self.assertEqual(mock_checksum.call_count, 3)
+
+        os.utime(self.paths[1], (0, 0))
+        ret = service.checksums(self.paths)
+
+        # only the file that changed is hashed again
+        self.assertEqual(mock_checksum.call_count, 4)
+        mock_checksum.assert_called_with(self.paths[1], checksum_type='sha256')
+        self.assertEqual(ret, dict((path, HI_THERE_SHA256) for path in self.paths))
+        self.assertEqual(cache.hits, 2)
@@ -1,10 +1,17 @@
 from cStringIO import StringIO
 import contextlib
+import os
+import shutil
+import tempfile
 import unittest
 
 import mock
 
-from pulp.plugins.util import manifest_writer
+from pulp.common.plugins.distributor_constants import MANIFEST_FILENAME
+from pulp.plugins.util import checksums, manifest_writer
+
+
+HI_THERE_SHA256 = 'c641344867e9806fadfd219f25b62b97c94db0eed04a1d79e93676533cfb782b'
 
 
 @contextlib.contextmanager
@@ -21,13 +28,12 @@ class TestGetSHA256Checksum(unittest.TestCase):
     @mock.patch('__builtin__.open', spec_set=True)
     def test_return_value(self, mock_open):
         fake_file = make_fake_file('hi there\n')
-        expected_checksum = 'c641344867e9806fadfd219f25b62b97c94db0eed04a1d79e93676533cfb782b'
 
         mock_open.return_value = fake_file
 
         ret = manifest_writer.get_sha256_checksum('/foo')
 
-        self.assertEqual(ret, expected_checksum)
+        self.assertEqual(ret, HI_THERE_SHA256)
 
     @mock.patch('__builtin__.open', spec_set=True)
     def test_empty_file(self, mock_open):
@@ -42,53 +48,68 @@ class TestGetSHA256Checksum(unittest.TestCase):
 
 
 class TestMakeManifestForDir(unittest.TestCase):
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.target_dir = os.path.join(self.working_dir, 'target')
+        os.makedirs(os.path.join(self.target_dir, 'a_dir'))
+        for name in ('a', 'b'):
+            with open(os.path.join(self.target_dir, name), 'w') as f:
+                f.write('hi there\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def _manifest(self):
+        with open(os.path.join(self.target_dir, MANIFEST_FILENAME)) as f:
+            return sorted(f.read().splitlines())
+
     @mock.patch('os.listdir', return_value=tuple())
     @mock.patch('__builtin__.open', spec_set=True)
     def test_empty_dir(self, mock_open, mock_listdir):
         fake_file = StringIO()
 
-        mock_open.return_value = giveitback(fake_file)
+        # the checksum cache is opened before the manifest
+        mock_open.side_effect = lambda *args: giveitback(fake_file)
 
         manifest_writer.make_manifest_for_dir('/foo/')
 
         self.assertEqual(fake_file.getvalue(), '')
 
-    @mock.patch('os.path.isfile', return_value=True)
-    @mock.patch('os.path.getsize', return_value=17)
-    @mock.patch('os.listdir', spec_set=True)
-    @mock.patch('__builtin__.open', spec_set=True)
-    @mock.patch.object(manifest_writer, 'get_sha256_checksum', spec_set=True)
-    def test_value(self, mock_checksum, mock_open, mock_listdir, mock_getsize, mock_isfile):
-        mock_listdir.return_value = ['a', 'b']
-        mock_checksum.return_value = 'greatchecksum'
-        fake_file = StringIO()
-        mock_open.return_value = giveitback(fake_file)
+    def test_value(self):
+        manifest_writer.make_manifest_for_dir(self.target_dir)
 
-        manifest_writer.make_manifest_for_dir(('/foo/'))
+        # directories are skipped
+        self.assertEqual(self._manifest(), ['a,%s,9' % HI_THERE_SHA256,
+                                            'b,%s,9' % HI_THERE_SHA256])
 
-        mock_checksum.assert_any_call('/foo/a')
-        mock_checksum.assert_any_call('/foo/b')
+    @mock.patch.object(checksums, 'path_checksum', spec_set=True)
+    def test_checksum_cache(self, mock_checksum):
+        mock_checksum.return_value = HI_THERE_SHA256
+        cache_path = os.path.join(self.working_dir, 'checksums.json')
+
+        manifest_writer.make_manifest_for_dir(self.target_dir, cache_path, threads=1)
         self.assertEqual(mock_checksum.call_count, 2)
 
-        expected = 'a,greatchecksum,17\r\nb,greatchecksum,17\r\n'
+        # only the file that changed is hashed again
+        os.utime(os.path.join(self.target_dir, 'b'), (0, 0))
+        manifest_writer.make_manifest_for_dir(self.target_dir, cache_path, threads=1)
 
-        self.assertEqual(fake_file.getvalue(), expected)
+        self.assertEqual(mock_checksum.call_count, 3)
+        mock_checksum.assert_called_with(os.path.join(self.target_dir, 'b'),
+                                         checksum_type='sha256')
+        self.assertEqual(self._manifest(), ['a,%s,9' % HI_THERE_SHA256,
+                                            'b,%s,9' % HI_THERE_SHA256])
 
-    @mock.patch('os.path.isfile', side_effect=(False, True))
-    @mock.patch('os.path.getsize', return_value=17)
-    @mock.patch('os.listdir', spec_set=True)
-    @mock.patch('__builtin__.open', spec_set=True)
-    @mock.patch.object(manifest_writer, 'get_sha256_checksum', spec_set=True)
-    def test_skip_dirs(self, mock_checksum, mock_open, mock_listdir, mock_getsize, mock_isfile):
-        mock_listdir.return_value = ['a', 'b']
-        mock_checksum.return_value = 'greatchecksum'
-        fake_file = StringIO()
-        mock_open.return_value = giveitback(fake_file)
+    @mock.patch.object(checksums, 'path_checksum', spec_set=True)
+    def test_default_checksum_cache(self, mock_checksum):
+        mock_checksum.return_value = HI_THERE_SHA256
 
-        manifest_writer.make_manifest_for_dir('/foo/')
+        manifest_writer.make_manifest_for_dir(self.target_dir, threads=1)
+        manifest_writer.make_manifest_for_dir(self.target_dir, threads=1)
 
-        mock_checksum.assert_called_once_with('/foo/b')
-
-        expected = 'b,greatchecksum,17'
-
-        self.assertEqual(fake_file.getvalue().strip(), expected)
+        # the second manifest is made from the cache, which is not listed in it
+        self.assertEqual(mock_checksum.call_count, 2)
+        self.assertTrue(os.path.isfile(os.path.join(self.target_dir,
+                                                    manifest_writer.CHECKSUM_CACHE_FILENAME)))
+        self.assertEqual(self._manifest(), ['a,%s,9' % HI_THERE_SHA256,
+                                            'b,%s,9' % HI_THERE_SHA256])
@@ -6,6 +6,7 @@ import shutil
 import tempfile
 
 from mock import patch
+from pulp.common.plugins.distributor_constants import MANIFEST_FILENAME
 from pulp.devel.unit.util import touch
 
 from pulp.plugins.util import misc
@@ -158,6 +159,156 @@ class TestClearDirectory(unittest.TestCase):
         misc.clear_directory(os.path.join(self.working_dir, 'imaginary'))
 
 
+class TestCopytreeLinkingUnchanged(unittest.TestCase):
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp(prefix='working_')
+        self.source_dir = os.path.join(self.working_dir, 'source')
+        self.previous_dir = os.path.join(self.working_dir, 'previous')
+        self.destination_dir = os.path.join(self.working_dir, 'destination')
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def _write(self, path, contents):
+        misc.mkdir(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(contents)
+
+    def _inode(self, *path):
+        return os.stat(os.path.join(*path)).st_ino
+
+    def test_links_unchanged_files(self):
+        self._write(os.path.join(self.source_dir, 'a', 'same.txt'), 'same')
+        self._write(os.path.join(self.source_dir, 'a', 'changed.txt'), 'new contents')
+        self._write(os.path.join(self.source_dir, 'new.txt'), 'new')
+        shutil.copytree(self.source_dir, self.previous_dir, symlinks=True)
+        self._write(os.path.join(self.source_dir, 'a', 'changed.txt'), 'changed')
+
+        linked, copied = misc.copytree_linking_unchanged(self.source_dir, self.destination_dir,
+                                                         self.previous_dir)
+
+        self.assertEqual((linked, copied), (2, 1))
+        self.assertEqual(self._inode(self.destination_dir, 'a', 'same.txt'),
+                         self._inode(self.previous_dir, 'a', 'same.txt'))
+        self.assertNotEqual(self._inode(self.destination_dir, 'a', 'changed.txt'),
+                            self._inode(self.previous_dir, 'a', 'changed.txt'))
+        with open(os.path.join(self.destination_dir, 'a', 'changed.txt')) as f:
+            self.assertEqual(f.read(), 'changed')
+
+    def test_compares_contents(self):
+        """
+        Files with the same contents are linked even if their modification times differ.
+        """
+        self._write(os.path.join(self.source_dir, 'same.txt'), 'same')
+        self._write(os.path.join(self.source_dir, 'other.txt'), 'aaaa')
+        self._write(os.path.join(self.previous_dir, 'same.txt'), 'same')
+        self._write(os.path.join(self.previous_dir, 'other.txt'), 'bbbb')
+        for name in ('same.txt', 'other.txt'):
+            os.utime(os.path.join(self.previous_dir, name), (0, 0))
+
+        linked, copied = misc.copytree_linking_unchanged(self.source_dir, self.destination_dir,
+                                                         self.previous_dir)
+
+        self.assertEqual((linked, copied), (1, 1))
+        self.assertEqual(self._inode(self.destination_dir, 'same.txt'),
+                         self._inode(self.previous_dir, 'same.txt'))
+
+    @patch('filecmp.cmp')
+    def test_compares_manifest_checksums(self, mock_cmp):
+        """
+        Files listed with their checksums in both manifests are compared without reading them.
+        """
+        self._write(os.path.join(self.source_dir, 'same.txt'), 'same')
+        self._write(os.path.join(self.source_dir, 'other.txt'), 'aaaa')
+        self._write(os.path.join(self.source_dir, MANIFEST_FILENAME),
+                    'same.txt,1111,4\nother.txt,2222,4\n')
+        self._write(os.path.join(self.previous_dir, 'same.txt'), 'same')
+        self._write(os.path.join(self.previous_dir, 'other.txt'), 'bbbb')
+        self._write(os.path.join(self.previous_dir, MANIFEST_FILENAME),
+                    'same.txt,1111,4\nother.txt,3333,4\n')
+        for name in ('same.txt', 'other.txt', MANIFEST_FILENAME):
+            os.utime(os.path.join(self.previous_dir, name), (0, 0))
+        mock_cmp.return_value = False
+
+        linked, copied = misc.copytree_linking_unchanged(self.source_dir, self.destination_dir,
+                                                         self.previous_dir)
+
+        self.assertEqual((linked, copied), (1, 2))
+        self.assertEqual(self._inode(self.destination_dir, 'same.txt'),
+                         self._inode(self.previous_dir, 'same.txt'))
+        # only the manifests themselves, which are not listed, are read
+        self.assertEqual([os.path.basename(c[0][0]) for c in mock_cmp.call_args_list],
+                         [MANIFEST_FILENAME])
+
+    def test_invalid_manifest(self):
+        """
+        An unreadable manifest falls back to comparing the contents.
+        """
+        self._write(os.path.join(self.source_dir, 'same.txt'), 'same')
+        self._write(os.path.join(self.source_dir, MANIFEST_FILENAME), 'same.txt,1111\n')
+        self._write(os.path.join(self.previous_dir, 'same.txt'), 'same')
+        self._write(os.path.join(self.previous_dir, MANIFEST_FILENAME), 'same.txt,2222,4\n')
+        os.utime(os.path.join(self.previous_dir, 'same.txt'), (0, 0))
+
+        misc.copytree_linking_unchanged(self.source_dir, self.destination_dir, self.previous_dir)
+
+        self.assertEqual(self._inode(self.destination_dir, 'same.txt'),
+                         self._inode(self.previous_dir, 'same.txt'))
+
+    def test_no_previous_copy(self):
+        self._write(os.path.join(self.source_dir, 'a', 'b', 'c.txt'), 'c')
+
+        linked, copied = misc.copytree_linking_unchanged(self.source_dir, self.destination_dir,
+                                                         self.previous_dir)
+
+        self.assertEqual((linked, copied), (0, 1))
+        self.assertTrue(os.path.isfile(os.path.join(self.destination_dir, 'a', 'b', 'c.txt')))
+
+    def test_symlinks(self):
+        self._write(os.path.join(self.source_dir, 'dir', 'file.txt'), 'file')
+        os.symlink('dir/file.txt', os.path.join(self.source_dir, 'file_link'))
+        os.symlink('dir', os.path.join(self.source_dir, 'dir_link'))
+        shutil.copytree(self.source_dir, self.previous_dir, symlinks=True)
+
+        misc.copytree_linking_unchanged(self.source_dir, self.destination_dir, self.previous_dir)
+
+        for name in ('file_link', 'dir_link'):
+            path = os.path.join(self.destination_dir, name)
+            self.assertTrue(os.path.islink(path))
+            self.assertEqual(os.readlink(path), os.readlink(os.path.join(self.source_dir, name)))
+
+    def test_copies_directory_stats(self):
+        self._write(os.path.join(self.source_dir, 'dir', 'file.txt'), 'file')
+        os.chmod(os.path.join(self.source_dir, 'dir'), 0750)
+        os.utime(os.path.join(self.source_dir, 'dir'), (0, 0))
+
+        misc.copytree_linking_unchanged(self.source_dir, self.destination_dir, self.previous_dir)
+
+        stat = os.stat(os.path.join(self.destination_dir, 'dir'))
+        self.assertEqual(stat.st_mode & 0777, 0750)
+        self.assertEqual(stat.st_mtime, 0)
+
+    @patch('os.link', side_effect=OSError(errno.EXDEV, 'cross-device link'))
+    def test_link_not_permitted(self, mock_link):
+        self._write(os.path.join(self.source_dir, 'same.txt'), 'same')
+        shutil.copytree(self.source_dir, self.previous_dir)
+
+        linked, copied = misc.copytree_linking_unchanged(self.source_dir, self.destination_dir,
+                                                         self.previous_dir)
+
+        self.assertEqual((linked, copied), (0, 1))
+        self.assertTrue(os.path.isfile(os.path.join(self.destination_dir, 'same.txt')))
+
+    @patch('os.link', side_effect=OSError(errno.EIO, 'i/o error'))
+    def test_link_error(self, mock_link):
+        self._write(os.path.join(self.source_dir, 'same.txt'), 'same')
+        shutil.copytree(self.source_dir, self.previous_dir)
+
+        self.assertRaises(OSError, misc.copytree_linking_unchanged, self.source_dir,
+                          self.destination_dir, self.previous_dir)
+
+
 class TestCreateSymlink(unittest.TestCase):
 
     def setUp(self):
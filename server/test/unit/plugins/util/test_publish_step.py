@@ -136,6 +136,121 @@ class StepTests(PublisherBase):
         step.report_progress()
         self.assertFalse(step.status_conduit.report_progress.called)
 
+    def test_report_progress_rate_limited(self):
+        """
+        Test that unforced reports within the interval are coalesced into one write
+        """
+        step = publish_step.Step('foo_step')
+        step.add_child(publish_step.Step('child_step'))
+        step.status_conduit = Mock()
+
+        for i in range(100):
+            step.progress_successes += 1
+            step.report_progress()
+
+        self.assertEquals(1, step.status_conduit.set_progress.call_count)
+        self.assertFalse(step.status_conduit.update_progress.called)
+
+    def test_report_progress_state_change_forces_write(self):
+        """
+        Test that a change of state is written even within the interval
+        """
+        step = publish_step.Step('foo_step')
+        child = publish_step.Step('child_step')
+        step.add_child(child)
+        step.status_conduit = Mock()
+        step.report_progress()
+
+        child.state = reporting_constants.STATE_RUNNING
+        child.report_progress()
+
+        step.status_conduit.update_progress.assert_called_once_with(
+            step.get_progress_report(), {'0.state': reporting_constants.STATE_RUNNING})
+
+
+class ProgressReporterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.step = publish_step.Step('foo_step')
+        self.child = publish_step.Step('child_step')
+        self.grandchild = publish_step.Step('grandchild_step')
+        self.step.add_child(self.child)
+        self.child.add_child(self.grandchild)
+        self.step.status_conduit = Mock()
+        self.conduit = self.step.status_conduit
+
+    def test_first_report_is_complete(self):
+        reporter = publish_step.ProgressReporter()
+
+        reporter.report(self.step)
+
+        self.conduit.set_progress.assert_called_once_with(self.step.get_progress_report())
+        self.assertFalse(self.conduit.update_progress.called)
+
+    def test_interval(self):
+        reporter = publish_step.ProgressReporter(interval=60)
+        reporter.report(self.step)
+
+        self.grandchild.progress_successes = 1
+        reporter.report(self.step)
+
+        self.assertEquals(1, self.conduit.set_progress.call_count)
+        self.assertFalse(self.conduit.update_progress.called)
+
+    def test_only_changes_written(self):
+        reporter = publish_step.ProgressReporter(interval=0)
+        reporter.report(self.step)
+
+        self.grandchild.progress_successes = 1
+        self.grandchild.error_details.append({'error': 'foo', 'traceback': None})
+        reporter.report(self.step)
+
+        self.assertEquals(1, self.conduit.set_progress.call_count)
+        self.conduit.update_progress.assert_called_once_with(self.step.get_progress_report(), {
+            '0.sub_steps.0.num_success': 1,
+            '0.sub_steps.0.num_processed': 1,
+            '0.sub_steps.0.error_details': [{'error': 'foo', 'traceback': None}]})
+
+    def test_nothing_changed(self):
+        reporter = publish_step.ProgressReporter()
+        reporter.report(self.step)
+
+        reporter.report(self.step, force=True)
+
+        self.assertEquals(1, self.conduit.set_progress.call_count)
+        self.assertFalse(self.conduit.update_progress.called)
+
+    def test_steps_added(self):
+        reporter = publish_step.ProgressReporter()
+        reporter.report(self.step)
+
+        self.child.add_child(publish_step.Step('another_step'))
+        reporter.report(self.step, force=True)
+
+        self.assertEquals(2, self.conduit.set_progress.call_count)
+        self.assertFalse(self.conduit.update_progress.called)
+
+    def test_steps_replaced(self):
+        reporter = publish_step.ProgressReporter()
+        reporter.report(self.step)
+
+        self.child.clear_children()
+        self.child.add_child(publish_step.Step('grandchild_step'))
+        reporter.report(self.step, force=True)
+
+        self.assertEquals(2, self.conduit.set_progress.call_count)
+        self.assertFalse(self.conduit.update_progress.called)
+
+    def test_conduit_without_update_progress(self):
+        self.step.status_conduit = Mock(spec=['set_progress'])
+        reporter = publish_step.ProgressReporter(interval=0)
+        reporter.report(self.step)
+
+        self.grandchild.progress_successes = 1
+        reporter.report(self.step)
+
+        self.assertEquals(2, self.step.status_conduit.set_progress.call_count)
+
 
 class PluginStepTests(PluginBase):
     """
@@ -710,6 +825,83 @@ class TestAtomicDirectoryPublishStep(unittest.TestCase):
         self.assertTrue(os.path.exists(existing_file))
         self.assertEquals(1, len(os.listdir(master_dir)))
 
+    def test_process_main_incremental(self):
+        source_dir = os.path.join(self.working_directory, 'source')
+        master_dir = os.path.join(self.working_directory, 'master')
+        publish_dir = os.path.join(self.working_directory, 'publish', 'bar')
+        step = publish_step.AtomicDirectoryPublishStep(source_dir, [('/', publish_dir)],
+                                                       master_dir, incremental=True)
+        touch(os.path.join(source_dir, 'foo', 'same.html'))
+        touch(os.path.join(source_dir, 'foo', 'changed.html'))
+        step.parent = Mock(timestamp='1.0')
+        step.process_main()
+        same_inode = os.stat(os.path.join(publish_dir, 'foo', 'same.html')).st_ino
+        changed_inode = os.stat(os.path.join(publish_dir, 'foo', 'changed.html')).st_ino
+
+        with open(os.path.join(source_dir, 'foo', 'changed.html'), 'w') as changed:
+            changed.write('changed')
+        step.parent = Mock(timestamp='2.0')
+        step.process_main()
+
+        self.assertEqual(os.listdir(master_dir), ['2.0'])
+        self.assertEqual(os.readlink(publish_dir), os.path.join(master_dir, '2.0'))
+        self.assertEqual(os.stat(os.path.join(publish_dir, 'foo', 'same.html')).st_ino,
+                         same_inode)
+        self.assertNotEqual(os.stat(os.path.join(publish_dir, 'foo', 'changed.html')).st_ino,
+                            changed_inode)
+        with open(os.path.join(publish_dir, 'foo', 'changed.html')) as changed:
+            self.assertEqual(changed.read(), 'changed')
+
+    @patch('pulp.plugins.util.publish_step.misc.copytree_linking_unchanged')
+    def test_process_main_incremental_first_publish(self, mock_copytree):
+        source_dir = os.path.join(self.working_directory, 'source')
+        master_dir = os.path.join(self.working_directory, 'master')
+        publish_dir = os.path.join(self.working_directory, 'publish', 'bar')
+        step = publish_step.AtomicDirectoryPublishStep(source_dir, [('/', publish_dir)],
+                                                       master_dir, incremental=True)
+        step.parent = Mock(timestamp='1.0')
+        touch(os.path.join(source_dir, 'foo', 'bar.html'))
+        # directories that are not named after a timestamp are not previous masters
+        os.makedirs(os.path.join(master_dir, 'foo'))
+
+        step.process_main()
+
+        self.assertFalse(mock_copytree.called)
+        self.assertTrue(os.path.exists(os.path.join(publish_dir, 'foo', 'bar.html')))
+
+    # NOTE this test is disabled for normal test runs
+    def _test_process_main_incremental_performance(self):
+        """
+        Compare publishing a large tree in which a few files changed by copying every file with
+        publishing it incrementally.
+        """
+        source_dir = os.path.join(self.working_directory, 'source')
+        master_dir = os.path.join(self.working_directory, 'master')
+        file_count = 20000
+        for i in xrange(file_count):
+            path = os.path.join(source_dir, str(i % 100), '%d.xml' % i)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write('x' * 4096)
+
+        timestamps = iter('%d.0' % i for i in xrange(1, 100))
+        for incremental in (False, True):
+            step = publish_step.AtomicDirectoryPublishStep(
+                source_dir, [('/', os.path.join(self.working_directory, 'publish'))],
+                master_dir, incremental=incremental)
+            step.parent = Mock(timestamp=timestamps.next())
+            step.process_main()
+            for changed in (10, 100, 1000):
+                for i in xrange(changed):
+                    with open(os.path.join(source_dir, str(i % 100), '%d.xml' % i), 'a') as f:
+                        f.write('changed')
+                step.parent = Mock(timestamp=timestamps.next())
+                start = time.time()
+                step.process_main()
+                print 'incremental: %s, %d of %d files changed: %.2f seconds' % (
+                    incremental, changed, file_count, time.time() - start)
+
 
 class TestSaveTarFilePublishStep(unittest.TestCase):
     def setUp(self):
@@ -724,6 +916,7 @@ class TestSaveTarFilePublishStep(unittest.TestCase):
         os.makedirs(source_dir)
         target_file = os.path.join(self.working_directory, 'target', 'target.tar')
         step = publish_step.SaveTarFilePublishStep(source_dir, target_file)
+        step.parent = Mock()
 
         touch(os.path.join(source_dir, 'foo.txt'))
         step.process_main()
@@ -733,6 +926,25 @@ class TestSaveTarFilePublishStep(unittest.TestCase):
             # the first item is either '' or '.' depending on if this is py2.7 or py2.6
             self.assertEquals(names[1:], ['foo.txt'])
 
+    def test_process_main_compressed(self):
+        source_dir = os.path.join(self.working_directory, 'source')
+        os.makedirs(source_dir)
+        target_file = os.path.join(self.working_directory, 'target', 'target.tar.gz')
+        step = publish_step.SaveTarFilePublishStep(source_dir, target_file, compression='gz',
+                                                   compression_threads=2)
+        step.parent = Mock()
+
+        touch(os.path.join(source_dir, 'foo.txt'))
+        step.process_main()
+
+        with contextlib.closing(tarfile.open(target_file, 'r:gz')) as tar_file:
+            self.assertEquals(tar_file.getnames()[1:], ['foo.txt'])
+        # the tar file is not left in the source directory
+        self.assertEquals(os.listdir(source_dir), ['foo.txt'])
+        self.assertEquals(step.progress_details,
+                          '%d bytes written' % os.path.getsize(target_file))
+        self.assertTrue(step.parent.report_progress.called)
+
 
 class TestCopyDirectoryStep(unittest.TestCase):
     def setUp(self):
@@ -1040,7 +1252,6 @@ class DownloadStepTests(unittest.TestCase):
         self.assertTrue(dlstep.downloader.is_canceled)
 
 
-@patch('pulp.plugins.util.publish_step.repo_controller.associate_single_unit')
 @patch('pulp.plugins.util.publish_step.units_controller.find_units')
 class TestGetLocalUnitsStep(unittest.TestCase):
 
@@ -1061,14 +1272,26 @@ class TestGetLocalUnitsStep(unittest.TestCase):
         self.step.conduit = MagicMock()
         self.parent.available_units = []
 
-    def test_no_available_units(self, mock_find_units, mock_associate):
+        # units are associated as the step finds them, so the mock has to consume them
+        self.associated = []
+        patcher = patch('pulp.plugins.util.publish_step.repo_controller.associate_units',
+                        side_effect=self._associate_units)
+        self.mock_associate = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _associate_units(self, repository, units):
+        self.associated.extend(units)
+        return len(self.associated)
+
+    def test_no_available_units(self, mock_find_units):
         self.step.process_main()
 
         self.assertEqual(self.step.conduit.save_unit.call_count, 0)
         self.assertEqual(self.step.units_to_download, [])
+        self.assertEqual(self.associated, [])
 
     @patch('pulp.plugins.util.publish_step.misc.paginate')
-    def test_calls_get_multiple(self, mock_paginate, mock_find_units, mock_associate):
+    def test_calls_get_multiple(self, mock_paginate, mock_find_units):
         """
         ensure that paginate is used
         """
@@ -1076,9 +1299,9 @@ class TestGetLocalUnitsStep(unittest.TestCase):
 
         self.step.process_main()
 
-        mock_paginate.assert_called_once_with(self.step.parent.available_units, 50)
+        mock_paginate.assert_called_once_with(self.step.parent.available_units, 1000)
 
-    def test_saves_unit(self, mock_find_units, mock_associate):
+    def test_saves_unit(self, mock_find_units):
         """
         Test that units which already exist in the database are associated properly
         """
@@ -1090,13 +1313,15 @@ class TestGetLocalUnitsStep(unittest.TestCase):
         mock_find_units.return_value = [existing_demo]
 
         self.step.process_main()
-        mock_associate.assert_called_once_with('fake_repo', existing_demo)
+        self.assertEqual(self.mock_associate.call_count, 1)
+        self.assertEqual(self.mock_associate.call_args[0][0], 'fake_repo')
+        self.assertEqual(self.associated, [existing_demo])
         mock_find_units.assert_called_once_with((demo, ))
 
         # Ensure that the unit was not marked for download
         self.assertEqual(self.step.units_to_download, [])
 
-    def test_populates_units_to_download(self, mock_find_units, mock_associate):
+    def test_populates_units_to_download(self, mock_find_units):
         """
         Test that if a unit does not exist in the database it is added to the
         units_to_download list
@@ -1111,10 +1336,28 @@ class TestGetLocalUnitsStep(unittest.TestCase):
         mock_find_units.assert_called_once_with((demo_1, demo_2))
 
         # The one that exists is associated
-        mock_associate.assert_called_once_with('fake_repo', existing_demo)
+        self.assertEqual(self.associated, [existing_demo])
         # The one that does not exist yet is added to the download list
         self.assertEqual(self.step.units_to_download, [demo_1])
 
+    @patch('pulp.plugins.util.publish_step.misc.paginate')
+    def test_associates_all_pages_at_once(self, mock_paginate, mock_find_units):
+        """
+        Test that the units found in every page are associated with a single call
+        """
+        demo_1 = self.DemoModel(key_field='a')
+        demo_2 = self.DemoModel(key_field='b')
+        mock_paginate.return_value = [(demo_1, ), (demo_2, )]
+        existing_demo_1 = self.DemoModel(key_field='a', id='foo')
+        existing_demo_2 = self.DemoModel(key_field='b', id='bar')
+        mock_find_units.side_effect = [[existing_demo_1], [existing_demo_2]]
+
+        self.step.process_main()
+
+        self.assertEqual(self.mock_associate.call_count, 1)
+        self.assertEqual(self.associated, [existing_demo_1, existing_demo_2])
+        self.assertEqual(self.step.units_to_download, [])
+
 
 class TestSaveUnitsStep(unittest.TestCase):
 
@@ -1134,8 +1377,8 @@ class TestCreateManifestStep(unittest.TestCase):
 
     @patch('pulp.plugins.util.manifest_writer.make_manifest_for_dir', spec_set=True)
     def test_process_main(self, mock_make_manifest):
-        step = publish_step.CreatePulpManifestStep('/foo/')
+        step = publish_step.CreatePulpManifestStep('/foo/', '/cache/foo.json', threads=2)
 
         step.process_main()
 
-        mock_make_manifest.assert_called_once_with('/foo/')
+        mock_make_manifest.assert_called_once_with('/foo/', '/cache/foo.json', 2)
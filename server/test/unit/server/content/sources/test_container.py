@@ -539,9 +539,67 @@ class TestBatch(TestCase):
         self.assertEqual(batch.queues[fake_source.id], fake_queue())
         self.assertEqual(queue, fake_queue())
 
+    @patch('pulp.server.content.sources.container.managers.content_catalog_manager')
+    def test_find_sources(self, fake_manager):
+        primary = Mock()
+        sources = {'source-1': Mock(), 'source-2': Mock()}
+        requests = [Mock(locator='l-1'), Mock(locator='l-2'), Mock(locator='l-1')]
+        entries = [{'source_id': 'source-1'}]
+        fake_manager.return_value.find_all.return_value = {'l-1': entries}
+
+        # test
+        batch = Batch(None, primary, sources, iter(requests), None)
+        batch.find_sources(requests)
+
+        # validation
+        fake_manager.return_value.find_all.assert_called_once_with(set(['l-1', 'l-2']))
+        requests[0].set_sources.assert_called_once_with(primary, sources, entries)
+        requests[1].set_sources.assert_called_once_with(primary, sources, [])
+        requests[2].set_sources.assert_called_once_with(primary, sources, entries)
+
+    @patch('pulp.server.content.sources.container.managers.content_catalog_manager')
+    def test_find_sources_no_alternates(self, fake_manager):
+        primary = Mock()
+        requests = [Mock(locator='l-1'), Mock(locator='l-2')]
+
+        # test
+        batch = Batch(None, primary, {}, iter(requests), None)
+        batch.find_sources(requests)
+
+        # validation
+        self.assertFalse(fake_manager.called)
+        for request in requests:
+            request.set_sources.assert_called_once_with(primary, {}, [])
+
+    @patch('pulp.server.content.sources.container.FIND_SOURCES_WINDOW', 2)
     @patch('pulp.server.content.sources.container.Tracker.wait')
     @patch('pulp.server.content.sources.container.Batch.dispatch')
-    def test_download(self, fake_dispatch, fake_wait):
+    @patch('pulp.server.content.sources.container.Batch.find_sources')
+    def test_download_windows(self, fake_find, fake_dispatch, fake_wait):
+        requests = [Mock(), Mock(), Mock()]
+        calls = []
+        fake_find.side_effect = lambda window: calls.append(('find', list(window)))
+        fake_dispatch.side_effect = lambda request: calls.append(('dispatch', request))
+
+        # test
+        canceled = Mock()
+        canceled.is_set.return_value = False
+        batch = Batch(canceled, Mock(), {}, iter(requests), None)
+        batch.download()
+
+        # validation
+        # requests are dispatched before the sources of the next window are found
+        self.assertEqual(calls, [('find', requests[:2]),
+                                 ('dispatch', requests[0]),
+                                 ('dispatch', requests[1]),
+                                 ('find', requests[2:]),
+                                 ('dispatch', requests[2])])
+        fake_wait.assert_called_with(len(requests))
+
+    @patch('pulp.server.content.sources.container.Tracker.wait')
+    @patch('pulp.server.content.sources.container.Batch.dispatch')
+    @patch('pulp.server.content.sources.container.Batch.find_sources')
+    def test_download(self, fake_find, fake_dispatch, fake_wait):
         primary = Mock()
         sources = [Mock(), Mock()]
         requests = [Mock(), Mock(), Mock()]
@@ -566,8 +624,7 @@ class TestBatch(TestCase):
 
         # validation
         # initial dispatch
-        for request in requests:
-            request.find_sources.assert_called_with(primary, sources)
+        fake_find.assert_called_once_with(tuple(requests))
         calls = fake_dispatch.call_args_list
         self.assertEqual(len(calls), len(requests))
         for i, request in enumerate(requests):
@@ -648,6 +705,7 @@ class TestBatch(TestCase):
 
     @patch('pulp.server.content.sources.container.Tracker.wait')
     @patch('pulp.server.content.sources.container.Batch.dispatch')
+    @patch('pulp.server.content.sources.container.Batch.find_sources', Mock())
     def test_download_with_exception(self, fake_dispatch, fake_wait):
         primary = Mock()
         fake_dispatch.side_effect = ValueError()
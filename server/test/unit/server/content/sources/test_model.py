@@ -10,6 +10,7 @@ from pulp.server.content.sources import constants
 from pulp.server.content.sources.model import Request, PrimarySource, ContentSource, RefreshReport
 from pulp.server.content.sources.model import DownloadDetails, DownloadReport
 from pulp.server.content.sources.descriptor import DEFAULT
+from pulp.server.db.model.content import ContentCatalog
 
 
 TYPE = '1234'
@@ -147,6 +148,31 @@ class TestRequest(TestCase):
         self.assertEqual(request.sources[4][0].id, primary.id)
         self.assertEqual(request.sources[4][1], url)
 
+    def test_locator(self):
+        request = Request('test_1', {'name': 'n'}, 'http://redhat.com', '/tmp/123')
+        self.assertEqual(request.locator, ContentCatalog.get_locator('test_1', {'name': 'n'}))
+
+    @patch('pulp.server.content.sources.container.managers.content_catalog_manager')
+    def test_set_sources(self, fake_manager):
+        url = 'http://redhat.com/repository'
+        primary = PrimarySource(None)
+        alternatives = dict([(s, ContentSource(s, d)) for s, d in DESCRIPTOR])
+
+        # test
+        request = Request('test_1', 1, url, '/tmp/123')
+        request.set_sources(primary, alternatives, CATALOG[:2])
+
+        # validation
+        self.assertFalse(fake_manager.called)
+        request.sources = list(request.sources)
+        self.assertEqual(len(request.sources), 3)
+        self.assertEqual(request.sources[0][0].id, 's-1')
+        self.assertEqual(request.sources[0][1], CATALOG[0][constants.URL])
+        self.assertEqual(request.sources[1][0].id, 's-1')
+        self.assertEqual(request.sources[1][1], CATALOG[1][constants.URL])
+        self.assertEqual(request.sources[2][0].id, primary.id)
+        self.assertEqual(request.sources[2][1], url)
+
     def test_next_source(self):
         sources = [1, 2, 3]
         request = Request('', {}, '', '')
@@ -1,13 +1,15 @@
+from bson.objectid import ObjectId
 from mock import MagicMock, patch
 import mock
 import mongoengine
+from pymongo.errors import BulkWriteError
 
 from pulp.common.compat import unittest
 from pulp.plugins.loader import exceptions as plugin_exceptions
 from pulp.plugins.model import PublishReport
 from pulp.server.controllers import repository as repo_controller
 from pulp.server import exceptions as pulp_exceptions
-from pulp.server.db import model
+from pulp.server.db import connection, model
 
 
 class MockException(Exception):
@@ -21,6 +23,35 @@ class DemoModel(model.ContentUnit):
     unit_type_id = 'demo_model'
 
 
+class RepositoryContentUnitQuerySet(object):
+    """
+    Stands for a query set of associations that supports the calls used to read it a page at a
+    time. The associations are given ids in the order they are passed.
+    """
+
+    def __init__(self, documents, assign_ids=True):
+        if assign_ids:
+            for document in documents:
+                document.id = ObjectId()
+        self.documents = documents
+        self.queries = []
+
+    def order_by(self, *fields):
+        self.queries.append(('order_by', fields))
+        return self
+
+    def filter(self, id__gt):
+        self.queries.append(('filter', id__gt))
+        page_qs = RepositoryContentUnitQuerySet(
+            [document for document in self.documents if document.id > id__gt], False)
+        page_qs.queries = self.queries
+        return page_qs
+
+    def limit(self, limit):
+        self.queries.append(('limit', limit))
+        return iter(self.documents[:limit])
+
+
 @patch('pulp.server.controllers.repository.model.RepositoryContentUnit.objects')
 class FindRepoContentUnitsTest(unittest.TestCase):
 
@@ -45,7 +76,7 @@ class FindRepoContentUnitsTest(unittest.TestCase):
         test_rcu = model.RepositoryContentUnit(repo_id='foo',
                                                unit_type_id='demo_model',
                                                unit_id='bar')
-        mock_rcu_objects.return_value = [test_rcu]
+        mock_rcu_objects.return_value = RepositoryContentUnitQuerySet([test_rcu])
 
         u_filter = mongoengine.Q(key_field='baz')
         u_fields = ['key_field']
@@ -72,7 +103,7 @@ class FindRepoContentUnitsTest(unittest.TestCase):
         test_rcu = model.RepositoryContentUnit(repo_id='foo',
                                                unit_type_id='demo_model',
                                                unit_id='bar')
-        mock_rcu_objects.return_value = [test_rcu]
+        mock_rcu_objects.return_value = RepositoryContentUnitQuerySet([test_rcu])
 
         u_filter = mongoengine.Q(key_field='baz')
         u_fields = ['key_field']
@@ -105,7 +136,7 @@ class FindRepoContentUnitsTest(unittest.TestCase):
             rcu_list.append(rcu)
             unit_list.append(DemoModel(id=unit_id, key_field=unit_key))
 
-        mock_rcu_objects.return_value = rcu_list
+        mock_rcu_objects.return_value = RepositoryContentUnitQuerySet(rcu_list)
 
         mock_get_model.return_value = DemoModel
         mock_demo_objects.return_value = unit_list
@@ -133,7 +164,7 @@ class FindRepoContentUnitsTest(unittest.TestCase):
             rcu_list.append(rcu)
             unit_list.append(DemoModel(id=unit_id, key_field=unit_key))
 
-        mock_rcu_objects.return_value = rcu_list
+        mock_rcu_objects.return_value = RepositoryContentUnitQuerySet(rcu_list)
 
         mock_get_model.return_value = DemoModel
         mock_demo_objects.return_value = unit_list
@@ -143,6 +174,58 @@ class FindRepoContentUnitsTest(unittest.TestCase):
         self.assertEquals(result[0].unit_id, 'bar_5')
         self.assertEquals(result[4].unit_id, 'bar_9')
 
+    @patch('pulp.server.controllers.repository.REPO_CONTENT_UNITS_PAGE_SIZE', 3)
+    @patch.object(DemoModel, 'objects')
+    @patch('pulp.server.controllers.repository.plugin_api.get_unit_model_by_id')
+    def test_pages(self, mock_get_model, mock_demo_objects, mock_rcu_objects):
+        """
+        Test that the associations are joined with their units a page at a time
+        """
+        repo = MagicMock(repo_id='foo')
+        rcu_list = []
+        units = {}
+        for i in range(10):
+            unit_id = 'bar_%i' % i
+            rcu_list.append(model.RepositoryContentUnit(repo_id='foo',
+                                                        unit_type_id='demo_model',
+                                                        unit_id=unit_id))
+            units[unit_id] = DemoModel(id=unit_id, key_field='key_%i' % i)
+
+        def find_units(q_obj, __raw__):
+            return [units[unit_id] for unit_id in sorted(__raw__['_id']['$in'])]
+
+        rcu_qs = RepositoryContentUnitQuerySet(rcu_list)
+        mock_rcu_objects.return_value = rcu_qs
+        mock_get_model.return_value = DemoModel
+        mock_demo_objects.side_effect = find_units
+        result = list(repo_controller.find_repo_content_units(repo, limit=6, skip=2))
+
+        self.assertEquals([rcu.unit_id for rcu in result], ['bar_%i' % i for i in range(2, 8)])
+        self.assertEquals(result[0].unit, units['bar_2'])
+        # the fourth page is never needed
+        self.assertEquals(mock_demo_objects.call_count, 3)
+        for call, page in zip(mock_demo_objects.call_args_list, ([0, 1, 2], [3, 4, 5], [6, 7, 8])):
+            self.assertEquals(sorted(call[1]['__raw__']['_id']['$in']),
+                              ['bar_%i' % i for i in page])
+        # each page is read with its own query, starting after the last id of the previous page
+        self.assertEquals(rcu_qs.queries, [
+            ('order_by', ('id',)), ('limit', 3),
+            ('filter', rcu_list[2].id), ('limit', 3),
+            ('filter', rcu_list[5].id), ('limit', 3)])
+
+    def test_pages_last_page_full(self, mock_rcu_objects):
+        """
+        Test that an empty page ends the associations when the last page is full
+        """
+        rcu_list = [model.RepositoryContentUnit(repo_id='foo', unit_type_id='demo_model',
+                                                unit_id='bar_%i' % i) for i in range(4)]
+        rcu_qs = RepositoryContentUnitQuerySet(rcu_list)
+
+        pages = list(repo_controller._paginate_by_id(rcu_qs, 2))
+
+        self.assertEquals(pages, [rcu_list[:2], rcu_list[2:]])
+        self.assertEquals(rcu_qs.queries[-2:], [('filter', rcu_list[3].id), ('limit', 2)])
+
 
 class UpdateRepoUnitCountsTests(unittest.TestCase):
 
@@ -190,6 +273,106 @@ class AssociateSingleUnitTests(unittest.TestCase):
             upsert=True)
 
 
+@patch('pulp.server.controllers.repository.update_last_unit_added')
+@patch('pulp.server.controllers.repository.update_unit_count')
+@patch('pulp.server.controllers.repository.model.RepositoryContentUnit._get_collection')
+class AssociateUnitsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = MagicMock(repo_id='foo')
+
+    def _bulk_ops(self, mock_get_collection):
+        return mock_get_collection.return_value.initialize_unordered_bulk_op
+
+    @patch('pulp.server.controllers.repository.dateutils.format_iso8601_utc_timestamp')
+    def test_associate_units(self, mock_get_timestamp, mock_get_collection, mock_update_count,
+                             mock_update_last_added):
+        mock_get_timestamp.return_value = 'foo_tstamp'
+        bulk = self._bulk_ops(mock_get_collection).return_value
+        bulk.execute.return_value = {'upserted': [{'index': 1, '_id': 'a'}], 'writeErrors': []}
+        units = [DemoModel(id='bar', key_field='bar'), DemoModel(id='baz', key_field='baz')]
+
+        new_count = repo_controller.associate_units(self.repo, units)
+
+        self.assertEqual(new_count, 1)
+        self.assertEqual(bulk.find.call_args_list, [
+            mock.call({'repo_id': 'foo', 'unit_type_id': 'demo_model', 'unit_id': 'bar'}),
+            mock.call({'repo_id': 'foo', 'unit_type_id': 'demo_model', 'unit_id': 'baz'})])
+        bulk.find.return_value.upsert.return_value.update_one.assert_called_with(
+            {'$setOnInsert': {'created': 'foo_tstamp'}, '$set': {'updated': 'foo_tstamp'}})
+        bulk.execute.assert_called_once_with()
+        mock_update_count.assert_called_once_with('foo', 'demo_model', 1)
+        mock_update_last_added.assert_called_once_with('foo')
+
+    def test_associate_unit_ids_batches(self, mock_get_collection, mock_update_count,
+                                        mock_update_last_added):
+        bulk_ops = self._bulk_ops(mock_get_collection)
+        first_bulk, second_bulk = MagicMock(), MagicMock()
+        bulk_ops.side_effect = [first_bulk, second_bulk]
+        first_bulk.execute.return_value = {'upserted': [{'index': 0, '_id': 'a'},
+                                                        {'index': 1, '_id': 'b'}]}
+        second_bulk.execute.return_value = {'upserted': [{'index': 0, '_id': 'c'}]}
+
+        new_count = repo_controller.associate_unit_ids('foo', 'rpm', ['a', 'b', 'c'],
+                                                       batch_size=2)
+
+        self.assertEqual(new_count, 3)
+        self.assertEqual(first_bulk.find.call_count, 2)
+        self.assertEqual(second_bulk.find.call_count, 1)
+        mock_update_count.assert_called_once_with('foo', 'rpm', 3)
+        mock_update_last_added.assert_called_once_with('foo')
+
+    def test_associate_unit_ids_duplicates(self, mock_get_collection, mock_update_count,
+                                           mock_update_last_added):
+        bulk = self._bulk_ops(mock_get_collection).return_value
+        bulk.execute.return_value = {'upserted': []}
+
+        repo_controller.associate_unit_ids('foo', 'rpm', ['a', 'b', 'a'])
+
+        self.assertEqual(bulk.find.call_count, 2)
+
+    def test_associate_unit_ids_nothing_new(self, mock_get_collection, mock_update_count,
+                                            mock_update_last_added):
+        bulk = self._bulk_ops(mock_get_collection).return_value
+        bulk.execute.return_value = {'upserted': []}
+
+        new_count = repo_controller.associate_unit_ids('foo', 'rpm', ['a', 'b'])
+
+        self.assertEqual(new_count, 0)
+        self.assertFalse(mock_update_count.called)
+        self.assertFalse(mock_update_last_added.called)
+
+    def test_associate_unit_ids_nothing(self, mock_get_collection, mock_update_count,
+                                        mock_update_last_added):
+        new_count = repo_controller.associate_unit_ids('foo', 'rpm', [])
+
+        self.assertEqual(new_count, 0)
+        self.assertFalse(self._bulk_ops(mock_get_collection).called)
+        self.assertFalse(mock_update_count.called)
+
+    def test_associate_unit_ids_concurrent_upsert(self, mock_get_collection, mock_update_count,
+                                                  mock_update_last_added):
+        bulk = self._bulk_ops(mock_get_collection).return_value
+        bulk.execute.side_effect = BulkWriteError({
+            'upserted': [{'index': 0, '_id': 'a'}],
+            'writeErrors': [{'index': 1, 'code': connection.MONGO_DUPLICATE_KEY_ERROR}]})
+
+        new_count = repo_controller.associate_unit_ids('foo', 'rpm', ['a', 'b'])
+
+        self.assertEqual(new_count, 1)
+        mock_update_count.assert_called_once_with('foo', 'rpm', 1)
+
+    def test_associate_unit_ids_write_error(self, mock_get_collection, mock_update_count,
+                                            mock_update_last_added):
+        bulk = self._bulk_ops(mock_get_collection).return_value
+        bulk.execute.side_effect = BulkWriteError({
+            'upserted': [], 'writeErrors': [{'index': 0, 'code': 2}]})
+
+        self.assertRaises(BulkWriteError, repo_controller.associate_unit_ids, 'foo', 'rpm',
+                          ['a'])
+        self.assertFalse(mock_update_count.called)
+
+
 class TestDisassociateUnits(unittest.TestCase):
 
     @patch('pulp.server.controllers.repository.model.RepositoryContentUnit.objects')
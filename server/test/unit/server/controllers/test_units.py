@@ -28,23 +28,50 @@ class FindUnitsTests(unittest.TestCase):
         # turn into list so the generator will be evaluated
         list(units_controller.find_units(units_iterable))
 
-        mock_paginate.assert_called_once_with(units_iterable, 50)
+        mock_paginate.assert_called_once_with(units_iterable, 1000)
 
-    def test_query(self):
+    @patch.object(DemoModel, 'objects')
+    def test_query(self, mock_objects):
         """
         Test that the mongo query generated is the one we expect
         """
         model_1 = DemoModel(key_field='a')
         model_2 = DemoModel(key_field='B')
         units_iterable = (model_1, model_2)
+        mock_objects.return_value.only.return_value.first.return_value = None
 
         # turn into list so the generator will be evaluated
         list(units_controller.find_units(units_iterable))
-        query_dict = DemoModel.objects.call_args[0][0].to_query(DemoModel)
-        expected_result = {'$or': [{'key_field': u'a'}, {'key_field': u'B'}]}
-        self.assertDictEqual(query_dict, expected_result)
+        self.assertEqual(mock_objects.call_count, 2)
+        self.assertEqual(mock_objects.call_args_list[0][1], {
+            'unit_key_digest__in': [model.unit_key_digest({'key_field': u'a'}),
+                                    model.unit_key_digest({'key_field': u'B'})]})
+        # the unit key query is not needed if every unit has a digest
+        self.assertEqual(mock_objects.call_args_list[1][1], {'unit_key_digest': None})
+
+    @patch.object(DemoModel, 'objects')
+    def test_query_undigested_units(self, mock_objects):
+        """
+        Test that units stored without a digest are matched by their unit key
+        """
+        model_1 = DemoModel(key_field='a')
+        model_2 = DemoModel(key_field='B')
+        units_iterable = (model_1, model_2)
+        model_2_defined = DemoModel(key_field='B', id='foo')
+        mock_objects.return_value.__iter__.side_effect = [iter([]), iter([model_2_defined])]
+        mock_objects.return_value.only.return_value.first.return_value = model_2_defined
+
+        result = list(units_controller.find_units(units_iterable))
 
-    def test_results(self):
+        self.assertEqual(result, [model_2_defined])
+        self.assertEqual(mock_objects.call_count, 3)
+        q_object = mock_objects.call_args[0][0]
+        expected_query = {'$or': [{'key_field': u'a'}, {'key_field': u'B'}]}
+        self.assertDictEqual(q_object.to_query(DemoModel), expected_query)
+        self.assertEqual(mock_objects.call_args[1], {'unit_key_digest': None})
+
+    @patch.object(DemoModel, 'objects')
+    def test_results(self, mock_objects):
         """
         Test that the mongo query generated is the one we expect
         """
@@ -52,7 +79,8 @@ class FindUnitsTests(unittest.TestCase):
         model_2 = DemoModel(key_field='B')
         units_iterable = (model_1, model_2)
         model_2_defined = DemoModel(key_field='B', id='foo')
-        DemoModel.objects.return_value = [model_2_defined]
+        mock_objects.return_value.__iter__.return_value = iter([model_2_defined])
+        mock_objects.return_value.only.return_value.first.return_value = None
 
         # turn into list so the generator will be evaluated
         result = list(units_controller.find_units(units_iterable))
@@ -0,0 +1,85 @@
+"""
+This module contains tests for pulp.server.db.migrations.0021_unit_key_digest.py
+"""
+import unittest
+
+from mock import MagicMock, call, patch
+from mongoengine import IntField, StringField
+
+from pulp.server.db import model
+from pulp.server.db.migrate.models import _import_all_the_way
+
+migration = _import_all_the_way('pulp.server.db.migrations.0021_unit_key_digest')
+
+
+class DemoModel(model.ContentUnit):
+    name = StringField()
+    version = IntField(db_field='_version')
+    unit_key_fields = ('name', 'version')
+    unit_type_id = 'demo_model'
+    _ns = StringField(default='units_demo_model')
+
+    meta = {'collection': 'units_demo_model'}
+
+
+class TestMigrate(unittest.TestCase):
+    """
+    Test the migrate() function.
+    """
+
+    @patch.object(migration, '_add_unit_key_digests')
+    @patch.object(migration, 'PluginManager')
+    @patch.object(migration.types_db, 'all_type_definitions')
+    @patch.object(migration.connection, 'get_database')
+    def test_migrate(self, mock_get_database, mock_type_defs, mock_plugin_manager,
+                     mock_add_digests):
+        mock_type_defs.return_value = [{'id': 'old', 'unit_key': ['a', 'b']}]
+        mock_plugin_manager.return_value.unit_models = {'demo_model': DemoModel}
+
+        migration.migrate()
+
+        db = mock_get_database.return_value
+        self.assertEqual(mock_add_digests.call_count, 2)
+        mock_add_digests.assert_any_call(db['units_old'], {'a': 'a', 'b': 'b'})
+        mock_add_digests.assert_any_call(db['units_demo_model'],
+                                         {'name': 'name', 'version': '_version'})
+
+
+class TestAddUnitKeyDigests(unittest.TestCase):
+    """
+    Test the _add_unit_key_digests() function.
+    """
+
+    @patch.object(migration, 'PAGE_SIZE', 1)
+    def test_add_unit_key_digests(self):
+        collection = MagicMock()
+        collection.find.return_value = [{'_id': 'u1', 'name': 'foo', '_version': 1},
+                                        {'_id': 'u2', 'name': 'bar'}]
+        key_fields = {'name': 'name', 'version': '_version'}
+
+        migration._add_unit_key_digests(collection, key_fields)
+
+        collection.find.assert_called_once_with({'_unit_key_digest': {'$exists': False}},
+                                                fields=key_fields.values())
+        bulk = collection.initialize_unordered_bulk_op.return_value
+        self.assertEqual(bulk.find.call_args_list, [call({'_id': 'u1'}), call({'_id': 'u2'})])
+        digests = [c[0][0]['$set']['_unit_key_digest']
+                   for c in bulk.find.return_value.update_one.call_args_list]
+        self.assertEqual(digests, [model.unit_key_digest({'name': 'foo', 'version': 1}),
+                                   model.unit_key_digest({'name': 'bar', 'version': None})])
+        self.assertEqual(bulk.execute.call_count, 2)
+        collection.ensure_index.assert_called_once_with('_unit_key_digest')
+
+    def test_matches_model(self):
+        """
+        The digests added by the migration match the ones of units saved by the model.
+        """
+        collection = MagicMock()
+        collection.find.return_value = [{'_id': 'u1', 'name': u'foo', '_version': 3}]
+
+        migration._add_unit_key_digests(collection, {'name': 'name', 'version': '_version'})
+
+        bulk = collection.initialize_unordered_bulk_op.return_value
+        update = bulk.find.return_value.update_one.call_args[0][0]
+        unit = DemoModel(name='foo', version='3')
+        self.assertEqual(update['$set']['_unit_key_digest'], unit.get_unit_key_digest())
@@ -118,6 +118,25 @@ class TestRepoProfileApplicability(PulpServerTests):
         # Our applicability object should still have the correct _id attribute
         self.assertEqual(applicability._id, document['_id'])
 
+    def test_save_older(self):
+        """
+        Test that save() does not replace data from a regeneration that started later.
+        """
+        applicability = consumer.RepoProfileApplicability(
+            profile_hash='hash', repo_id='repo_id', profile=['a'],
+            applicability={'type_id': ['package a']}, last_regenerated=2)
+        applicability.save()
+        older = consumer.RepoProfileApplicability(
+            profile_hash='hash', repo_id='repo_id', profile=['a'],
+            applicability={'type_id': ['package b']}, _id=applicability._id, last_regenerated=1)
+
+        older.save()
+        older.save_applicability(['type_id'])
+
+        document = self.collection.find_one()
+        self.assertEqual(document['applicability'], {'type_id': ['package a']})
+        self.assertEqual(document['last_regenerated'], 2)
+
     def test_save_new(self):
         """
         Test the save() method with a new object that is not in the DB yet.
@@ -148,6 +167,49 @@ class TestRepoProfileApplicability(PulpServerTests):
         self.assertEqual(applicability._id, document['_id'])
 
 
+class TestRepoApplicabilityRevision(PulpServerTests):
+    """
+    Test the RepoApplicabilityRevision Model.
+    """
+    def setUp(self):
+        self.collection = consumer.RepoApplicabilityRevision.get_collection()
+
+    def tearDown(self):
+        self.collection.drop()
+
+    def test_get_revisions_never_written(self):
+        """
+        Test that repositories whose applicability was never written have no revision.
+        """
+        self.assertEqual(consumer.RepoApplicabilityRevision.get_revisions(['repo_id']), {})
+
+    def test_bump(self):
+        """
+        Test that bump() records a new revision for each given repository only.
+        """
+        consumer.RepoApplicabilityRevision.bump(['repo_1', 'repo_2'])
+        revisions = consumer.RepoApplicabilityRevision.get_revisions(['repo_1', 'repo_2'])
+
+        consumer.RepoApplicabilityRevision.bump(['repo_1', 'repo_1'])
+
+        new_revisions = consumer.RepoApplicabilityRevision.get_revisions(['repo_1', 'repo_2'])
+        self.assertNotEqual(new_revisions['repo_1'], revisions['repo_1'])
+        self.assertEqual(new_revisions['repo_2'], revisions['repo_2'])
+        self.assertEqual(self.collection.find().count(), 2)
+
+    def test_save_bumps_revision(self):
+        """
+        Test that saving applicability data records a new revision for its repository.
+        """
+        applicability = consumer.RepoProfileApplicability('hash', 'repo_id', ['a'], {})
+
+        applicability.save()
+
+        self.assertEqual(consumer.RepoApplicabilityRevision.get_revisions(['repo_id']).keys(),
+                         ['repo_id'])
+        consumer.RepoProfileApplicability.get_collection().drop()
+
+
 class TestUnitProfile(unittest.TestCase):
     """
     Test the UnitProfile class.
@@ -40,6 +40,41 @@ class TestAutoRetryDocument(unittest.TestCase):
         self.assertDictEqual(model.AutoRetryDocument._meta, {'abstract': True})
 
 
+class TestUnitKeyDigest(unittest.TestCase):
+    """
+    Test the unit_key_digest function
+    """
+
+    def test_canonical(self):
+        digest = model.unit_key_digest({'name': 'foo', 'version': '1.0', 'epoch': 0})
+
+        self.assertEquals(digest, model.unit_key_digest({'epoch': 0, 'version': u'1.0',
+                                                         'name': u'foo'}))
+
+    def test_values_differ(self):
+        digest = model.unit_key_digest({'name': 'foo', 'version': '1.0'})
+
+        self.assertNotEquals(digest, model.unit_key_digest({'name': 'foo', 'version': '1.1'}))
+        self.assertNotEquals(digest, model.unit_key_digest({'name': 'foo', 'version': 1.0}))
+        self.assertNotEquals(digest, model.unit_key_digest({'name': 'foo', 'release': '1.0'}))
+
+    def test_numbers(self):
+        # numbers that the database considers equal have the same digest
+        digest = model.unit_key_digest({'name': 'foo', 'epoch': 1, 'sizes': [2, {'a': 3}]})
+
+        self.assertEquals(digest, model.unit_key_digest({'name': 'foo', 'epoch': 1.0,
+                                                         'sizes': [2L, {'a': 3.0}]}))
+        self.assertNotEquals(digest, model.unit_key_digest({'name': 'foo', 'epoch': 1.5,
+                                                            'sizes': [2, {'a': 3}]}))
+        self.assertNotEquals(digest, model.unit_key_digest({'name': 'foo', 'epoch': True,
+                                                            'sizes': [2, {'a': 3}]}))
+
+    def test_non_ascii(self):
+        digest = model.unit_key_digest({'name': u'caf\xe9'})
+
+        self.assertEquals(digest, model.unit_key_digest({'name': 'caf\xc3\xa9'}))
+
+
 class TestContentUnit(unittest.TestCase):
     """
     Test ContentUnit model
@@ -59,6 +94,9 @@ class TestContentUnit(unittest.TestCase):
         self.assertTrue(isinstance(model.ContentUnit.storage_path, StringField))
         self.assertEquals(model.ContentUnit.storage_path.db_field, '_storage_path')
 
+        self.assertTrue(isinstance(model.ContentUnit.unit_key_digest, StringField))
+        self.assertEquals(model.ContentUnit.unit_key_digest.db_field, '_unit_key_digest')
+
         self.assertTrue(isinstance(model.ContentUnit._ns, StringField))
         self.assertTrue(model.ContentUnit._ns)
         self.assertTrue(isinstance(model.ContentUnit.unit_type_id, StringField))
@@ -67,6 +105,9 @@ class TestContentUnit(unittest.TestCase):
     def test_meta_abstract(self):
         self.assertEquals(model.ContentUnit._meta['abstract'], True)
 
+    def test_meta_indexes(self):
+        self.assertEquals(model.ContentUnit._meta['indexes'], ['unit_key_digest'])
+
     @patch('pulp.server.db.model.signals')
     def test_attach_signals(self, mock_signals):
         class ContentUnitHelper(model.ContentUnit):
@@ -112,6 +153,9 @@ class TestContentUnit(unittest.TestCase):
         # make sure the last updated time has been updated
         self.assertEquals(helper.last_updated, 'foo')
 
+        # make sure the unit key digest has been set
+        self.assertEquals(helper.unit_key_digest, model.unit_key_digest({}))
+
     def test_pre_save_signal_leaves_existing_id(self):
         """
         Test the pre_save signal handler leaves an existing id on an object in place
@@ -164,6 +208,19 @@ class TestContentUnit(unittest.TestCase):
 
         self.assertEquals(n_tuple, ContentUnitHelper.NAMED_TUPLE(apple='foo', pear='bar'))
 
+    def test_get_unit_key_digest(self):
+        class ContentUnitHelper(model.ContentUnit):
+            apple = StringField()
+            pear = IntField()
+            unit_key_fields = ('apple', 'pear')
+            unit_type_id = StringField(default='bar')
+
+        helper = ContentUnitHelper(apple='foo', pear='3')
+
+        # the digest is taken of the values as they are stored
+        self.assertEquals(helper.get_unit_key_digest(),
+                          model.unit_key_digest({'apple': u'foo', 'pear': 3}))
+
     def test_id_to_dict(self):
         class ContentUnitHelper(model.ContentUnit):
             apple = StringField()
@@ -119,6 +119,17 @@ class PermissionManagerTests(base.PulpServerTests):
         self.permission_manager.revoke(r, u['login'], [o])
         self.assertFalse(self.user_query_manager.is_authorized(r, u['login'], o))
 
+    def test_role_permission_revoke(self):
+        u = self._create_user()
+        role = self._create_role()
+        r = self._create_resource()
+        o = authorization.READ
+        self.role_manager.add_permissions_to_role(role['id'], r, [o])
+        self.role_manager.add_user_to_role(role['id'], u['login'])
+        self.assertTrue(self.user_query_manager.is_authorized(r, u['login'], o))
+        self.role_manager.remove_user_from_role(role['id'], u['login'])
+        self.assertFalse(self.user_query_manager.is_authorized(r, u['login'], o))
+
     def test_non_existing_user_permission_revoke(self):
         login = 'non-existing-user-login'
         r = self._create_resource()
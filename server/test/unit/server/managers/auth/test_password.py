@@ -1,11 +1,17 @@
+import unittest
+
+import mock
+
 from .... import base
 from pulp.server.managers import factory as manager_factory
+from pulp.server.managers.auth import password
 
 
 class PasswordManagerTests(base.PulpServerTests):
     def setUp(self):
         super(PasswordManagerTests, self).setUp()
         self.password_manager = manager_factory.password_manager()
+        self.password_manager.credential_cache.clear()
 
     def test_unicode_password(self):
         password = u"some password"
@@ -21,3 +27,58 @@ class PasswordManagerTests(base.PulpServerTests):
         password = "some password"
         hashed = self.password_manager.hash_password(password)
         self.assertTrue(self.password_manager.check_password(hashed, password))
+
+    def test_hash_password_format(self):
+        hashed = self.password_manager.hash_password("some password")
+        scheme, iterations, salt, hashed_password = hashed[1:].split('$')
+        self.assertEqual(scheme, password.PBKDF2_SCHEME)
+        self.assertEqual(int(iterations), password.PBKDF2_ITERATIONS)
+        self.assertFalse(self.password_manager.needs_rehash(hashed))
+
+    def test_check_password_wrong_password(self):
+        hashed = self.password_manager.hash_password("some password")
+        self.assertFalse(self.password_manager.check_password(hashed, "other password"))
+
+    def test_check_password_legacy(self):
+        hashed = self.password_manager._hash_password_legacy("some password")
+        self.assertTrue(self.password_manager.check_password(hashed, "some password"))
+        self.assertFalse(self.password_manager.check_password(hashed, "other password"))
+        self.assertTrue(self.password_manager.needs_rehash(hashed))
+
+    def test_check_password_unknown_scheme(self):
+        self.assertFalse(self.password_manager.check_password('$unknown$1$c2FsdA==$aGFzaA==',
+                                                              'some password'))
+
+    @mock.patch('pulp.server.managers.auth.password.pbkdf2_hmac', wraps=password.pbkdf2_hmac)
+    def test_check_password_cached(self, mock_pbkdf2_hmac):
+        hashed = self.password_manager.hash_password("some password")
+        mock_pbkdf2_hmac.reset_mock()
+
+        self.assertTrue(self.password_manager.check_password(hashed, "some password"))
+        self.assertTrue(self.password_manager.check_password(hashed, "some password"))
+
+        # only the first check derives the key, and failed checks are never cached
+        self.assertEqual(mock_pbkdf2_hmac.call_count, 1)
+        self.assertFalse(self.password_manager.check_password(hashed, "other password"))
+        self.assertFalse(self.password_manager.check_password(hashed, "other password"))
+        self.assertEqual(mock_pbkdf2_hmac.call_count, 3)
+
+
+class CredentialCacheTests(unittest.TestCase):
+    def test_expiration(self):
+        cache = password.CredentialCache(ttl=10)
+        with mock.patch('time.time', return_value=100):
+            cache.add('entry', 'password')
+            self.assertTrue(('entry', 'password') in cache)
+            self.assertFalse(('entry', 'other password') in cache)
+            self.assertFalse(('other entry', 'password') in cache)
+        with mock.patch('time.time', return_value=111):
+            self.assertFalse(('entry', 'password') in cache)
+
+    def test_max_size(self):
+        cache = password.CredentialCache(max_size=2)
+        for entry in ['entry-1', 'entry-2', 'entry-3']:
+            cache.add(entry, 'password')
+        self.assertFalse(('entry-1', 'password') in cache)
+        self.assertTrue(('entry-2', 'password') in cache)
+        self.assertTrue(('entry-3', 'password') in cache)
@@ -0,0 +1,71 @@
+import unittest
+
+import mock
+
+from pulp.server.auth import authorization
+from pulp.server.exceptions import MissingResource
+from pulp.server.managers.auth.user.query import UserPermissionTable, UserPermissionTableCache
+
+
+class UserPermissionTableTests(unittest.TestCase):
+    def setUp(self):
+        self.table = UserPermissionTable(False, [
+            ('/v2/repositories/', [authorization.READ]),
+            ('/v2/repositories/zoo/', [authorization.UPDATE, authorization.DELETE]),
+            ('/v2/users', [authorization.CREATE])])
+
+    def test_granted_on_resource(self):
+        self.assertTrue(self.table.is_authorized('/v2/repositories/zoo/',
+                                                 authorization.UPDATE))
+        self.assertFalse(self.table.is_authorized('/v2/repositories/other/',
+                                                  authorization.UPDATE))
+
+    def test_granted_on_parent(self):
+        self.assertTrue(self.table.is_authorized('/v2/repositories/zoo/importers/',
+                                                 authorization.READ))
+        self.assertTrue(self.table.is_authorized('/v2/repositories/zoo/importers/',
+                                                 authorization.DELETE))
+        self.assertFalse(self.table.is_authorized('/v2/', authorization.READ))
+
+    def test_non_canonical_resource_ignored(self):
+        self.assertFalse(self.table.is_authorized('/v2/users/', authorization.CREATE))
+
+    def test_root(self):
+        table = UserPermissionTable(False, [('/', [authorization.EXECUTE])])
+        self.assertTrue(table.is_authorized('/v2/tasks/', authorization.EXECUTE))
+        self.assertFalse(table.is_authorized('/v2/tasks/', authorization.READ))
+
+    def test_superuser(self):
+        table = UserPermissionTable(True, [])
+        self.assertTrue(table.is_authorized('/v2/tasks/', authorization.DELETE))
+
+
+@mock.patch('pulp.server.managers.auth.user.query.AuthorizationGeneration')
+@mock.patch.object(UserPermissionTableCache, '_compile')
+class UserPermissionTableCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = UserPermissionTableCache()
+
+    def test_cached(self, mock_compile, mock_generation):
+        mock_generation.get_generation.return_value = 1
+        self.assertTrue(self.cache.get('admin') is mock_compile.return_value)
+        self.assertTrue(self.cache.get('admin') is mock_compile.return_value)
+        self.cache.get('other')
+        self.assertEqual(mock_compile.call_args_list, [mock.call('admin'), mock.call('other')])
+
+    def test_generation_changed(self, mock_compile, mock_generation):
+        mock_generation.get_generation.side_effect = [1, 2, 2]
+        for i in range(3):
+            self.cache.get('admin')
+        self.assertEqual(mock_compile.call_count, 2)
+
+    def test_clear(self, mock_compile, mock_generation):
+        mock_generation.get_generation.return_value = 1
+        self.cache.get('admin')
+        self.cache.clear()
+        self.cache.get('admin')
+        self.assertEqual(mock_compile.call_count, 2)
+
+    def test_missing_user(self, mock_compile, mock_generation):
+        mock_compile.side_effect = MissingResource('admin')
+        self.assertRaises(MissingResource, self.cache.get, 'admin')
@@ -1,3 +1,5 @@
+import unittest
+
 import mock
 
 from .... import base
@@ -13,7 +15,8 @@ from pulp.server.managers.consumer.applicability import (
     _add_consumers_to_applicability_map, _add_profiles_to_consumer_map_and_get_hashes,
     _add_repo_ids_to_consumer_map, _format_report, _get_applicability_map,
     _get_consumer_applicability_map, DoesNotExist, MultipleObjectsReturned,
-    retrieve_consumer_applicability, ApplicabilityRegenerationManager)
+    retrieve_consumer_applicability, ApplicabilityQueryCache, ApplicabilityRegenerationManager,
+    RepoContentDelta)
 from pulp.server.managers.consumer.bind import BindManager
 from pulp.server.managers.consumer.cud import ConsumerManager
 from pulp.server.managers.consumer.profile import ProfileManager
@@ -159,6 +162,22 @@ class ApplicabilityRegenerationManagerTests(base.PulpServerTests):
             self.assertEqual(applicability['profile'], self.PROFILE1)
             self.assertEqual(applicability['applicability'], expected_applicability)
 
+    @mock.patch('pulp.server.managers.consumer.bind.model.Repository.objects')
+    def test_regenerate_applicability_for_consumers_existing_applicability(self, mock_repo_qs):
+        self.populate_consumers_different_profiles()
+        self.populate_bindings()
+        manager = factory.applicability_regeneration_manager()
+        manager.regenerate_applicability_for_consumers(self.CONSUMER_CRITERIA)
+        yum_profiler, cfg = plugins.get_profiler_by_type('rpm')
+        self.assertEqual(yum_profiler.calculate_applicable_units.call_count, 4)
+        yum_profiler.calculate_applicable_units.reset_mock()
+
+        manager.regenerate_applicability_for_consumers(self.CONSUMER_CRITERIA)
+
+        # the existing applicability is not recalculated
+        self.assertEqual(yum_profiler.calculate_applicable_units.call_count, 0)
+        self.assertEqual(RepoProfileApplicability.get_collection().find().count(), 4)
+
     def test_regenerate_applicability_for_consumer_criteria_no_bindings(self):
         # Setup
         self.populate_consumers()
@@ -282,7 +301,7 @@ class ApplicabilityRegenerationManagerTests(base.PulpServerTests):
 
     @mock.patch('pulp.server.managers.consumer.applicability.model.Repository.objects')
     @mock.patch('pulp.server.db.model.consumer.RepoProfileApplicability.get_collection')
-    def test_regenerate_applicability_for_repos_batch_size(self, mock_get_collection, mock_repo_qs):
+    def test_regenerate_applicability_for_repos_paging(self, mock_get_collection, mock_repo_qs):
 
         factory.initialize()
         applicability_manager = ApplicabilityRegenerationManager()
@@ -291,12 +310,43 @@ class ApplicabilityRegenerationManagerTests(base.PulpServerTests):
         mock_repo = mock.MagicMock()
         mock_repo.repo_id = 'fake-repo'
         mock_repo_qs.find_by_criteria.return_value = [mock_repo]
+        mock_get_collection.return_value.find.side_effect = [[{'_id': 'a'}, {'_id': 'b'}], []]
 
         applicability_manager.regenerate_applicability_for_repos(repo_criteria)
 
-        # validate that batch size of 5 is used
+        # validate that only the ids are read up front, and the documents are read by id
+        self.assertEqual(mock_get_collection.return_value.find.call_args_list, [
+            mock.call({'repo_id': 'fake-repo'}, fields=['_id']),
+            mock.call({'_id': {'$in': ['a', 'b']}})])
 
-        mock_get_collection.return_value.find.return_value.batch_size.assert_called_with(5)
+    @mock.patch('pulp.server.managers.consumer.bind.model.Repository.objects')
+    def test_regenerate_applicability_for_repos_incremental(self, mock_repo_qs):
+        self.populate_consumers()
+        self.populate_bindings()
+        applicability_manager = factory.applicability_regeneration_manager()
+        applicability_manager.regenerate_applicability_for_consumers(self.CONSUMER_CRITERIA)
+        self.assertTrue(all(a['last_regenerated'] is not None
+                            for a in RepoProfileApplicability.get_collection().find()))
+
+        yum_profiler, cfg = plugins.get_profiler_by_type('rpm')
+        yum_profiler.calculate_applicable_units_incremental = mock.Mock(return_value={})
+
+        with mock.patch('pulp.server.managers.consumer.applicability.RepoContentDelta') as m_delta:
+            m_delta.return_value.timestamp = 12345
+            m_delta.return_value.changed_units.return_value = {'rpm': set(['rpm-1', 'rpm-3'])}
+            m_delta.return_value.removed_units.return_value = {'erratum': set(['errata-2'])}
+            applicability_manager.regenerate_applicability_for_repos(self.REPO_CRITERIA.as_dict())
+
+        # the incremental calculation was used instead of the full one
+        self.assertEqual(yum_profiler.calculate_applicable_units.call_count, 2)
+        self.assertEqual(yum_profiler.calculate_applicable_units_incremental.call_count, 2)
+        applicability_list = list(RepoProfileApplicability.get_collection().find())
+        self.assertEqual(len(applicability_list), 2)
+        for applicability in applicability_list:
+            self.assertEqual(applicability['applicability'],
+                             {'rpm': ['rpm-2'], 'erratum': ['errata-1']})
+            self.assertEqual(applicability['profile'], self.PROFILE1)
+            self.assertEqual(applicability['last_regenerated'], 12345)
 
     @mock.patch('pulp.server.managers.consumer.applicability.model.Repository.objects')
     def test_get_existing_repo_content_types_no_repo(self, mock_repo_qs):
@@ -330,6 +380,219 @@ class ApplicabilityRegenerationManagerTests(base.PulpServerTests):
         self.assertListEqual(content_types, ['mock_type_2', 'mock_type_1'])
 
 
+class TestPatchApplicability(unittest.TestCase):
+    """
+    Test the incremental update of existing applicability data.
+    """
+
+    def setUp(self):
+        self.profiler = mock.Mock()
+        self.profiler.metadata.return_value = {'types': ['rpm', 'erratum']}
+        self.repo_delta = mock.Mock(repo_id='repo-1')
+        self.existing_applicability = RepoProfileApplicability(
+            'hash', 'repo-1', 'profile', {'rpm': ['rpm-1', 'rpm-2'], 'erratum': ['errata-1']},
+            last_regenerated=100)
+
+    def _patch(self):
+        return ApplicabilityRegenerationManager._patch_applicability(
+            self.profiler, 'profile', self.existing_applicability, self.repo_delta, 'config',
+            'conduit')
+
+    def test_nothing_changed(self):
+        self.repo_delta.changed_units.return_value = {}
+        self.repo_delta.removed_units.return_value = {}
+
+        changed_types = self._patch()
+
+        self.assertEqual(changed_types, [])
+        self.assertFalse(self.profiler.calculate_applicable_units_incremental.called)
+        self.repo_delta.changed_units.assert_called_once_with(100, ['rpm', 'erratum'])
+
+    def test_removed_units(self):
+        self.repo_delta.changed_units.return_value = {}
+        self.repo_delta.removed_units.return_value = {'rpm': set(['rpm-2'])}
+
+        changed_types = self._patch()
+
+        self.assertEqual(changed_types, ['rpm'])
+        self.assertEqual(self.existing_applicability.applicability,
+                         {'rpm': ['rpm-1'], 'erratum': ['errata-1']})
+
+    def test_changed_units(self):
+        self.repo_delta.changed_units.return_value = {'rpm': set(['rpm-1', 'rpm-3']),
+                                                      'erratum': set(['errata-2'])}
+        self.repo_delta.removed_units.return_value = {}
+        self.profiler.calculate_applicable_units_incremental.return_value = {
+            'rpm': ['rpm-3'], 'erratum': ['errata-2']}
+
+        changed_types = self._patch()
+
+        self.assertEqual(sorted(changed_types), ['erratum', 'rpm'])
+        self.assertEqual(self.existing_applicability.applicability,
+                         {'rpm': ['rpm-2', 'rpm-3'], 'erratum': ['errata-1', 'errata-2']})
+        call_args = self.profiler.calculate_applicable_units_incremental.call_args[0]
+        self.assertEqual(call_args[1], 'repo-1')
+        self.assertEqual(dict((k, sorted(v)) for k, v in call_args[2].items()),
+                         {'rpm': ['rpm-1', 'rpm-3'], 'erratum': ['errata-2']})
+
+    def test_new_type(self):
+        self.repo_delta.changed_units.return_value = {'srpm': set(['srpm-1'])}
+        self.repo_delta.removed_units.return_value = {}
+        self.profiler.calculate_applicable_units_incremental.return_value = {'srpm': ['srpm-1']}
+
+        changed_types = self._patch()
+
+        self.assertEqual(changed_types, ['srpm'])
+        self.assertEqual(self.existing_applicability.applicability['srpm'], ['srpm-1'])
+
+
+class TestRepoContentDelta(unittest.TestCase):
+    """
+    Test the lookup of units that changed in a repository.
+    """
+
+    @mock.patch('pulp.server.managers.consumer.applicability.content_types_db')
+    @mock.patch('pulp.server.managers.consumer.applicability.RepoContentUnit.get_collection')
+    def test_changed_units(self, mock_get_collection, mock_types_db):
+        mock_get_collection.return_value.find.return_value = [
+            {'unit_id': 'new', 'created': '2015-01-02T00:00:00Z',
+             'updated': '2015-01-02T00:00:00Z'},
+            {'unit_id': 'touched', 'created': '2014-01-01T00:00:00Z',
+             'updated': '2015-01-03T00:00:00Z'},
+            {'unit_id': 'old', 'created': '2014-01-01T00:00:00Z',
+             'updated': '2014-01-01T00:00:00Z'},
+            {'unit_id': 'updated', 'created': '2014-01-01T00:00:00Z',
+             'updated': '2014-01-01T00:00:00Z'}]
+        units_collection = mock_types_db.type_units_collection.return_value
+        units_collection.find.return_value = [{'_id': 'updated'}]
+        since = 1420070400  # 2015-01-01T00:00:00Z
+        delta = RepoContentDelta('repo-1')
+
+        changed = delta.changed_units(since, ['rpm'])
+
+        # an association that was only touched by a sync is not a change
+        self.assertEqual(changed, {'rpm': set(['new', 'updated'])})
+        mock_get_collection.return_value.find.assert_called_once_with(
+            {'repo_id': 'repo-1', 'unit_type_id': 'rpm'},
+            fields=['unit_id', 'created'])
+        spec = units_collection.find.call_args[0][0]
+        self.assertEqual(sorted(spec['_id']['$in']), ['old', 'touched', 'updated'])
+        self.assertEqual(spec['_last_updated'], {'$gte': since})
+
+        # the result is cached
+        self.assertTrue(delta.changed_units(since, ['rpm']) is changed)
+        self.assertEqual(mock_get_collection.return_value.find.call_count, 1)
+
+    @mock.patch('pulp.server.managers.consumer.applicability.content_types_db')
+    @mock.patch('pulp.server.managers.consumer.applicability.RepoContentUnit.get_collection')
+    def test_changed_units_unchanged_sync(self, mock_get_collection, mock_types_db):
+        """
+        A sync that re-associates the same units, without changing them, yields no changes.
+        """
+        mock_get_collection.return_value.find.return_value = [
+            {'unit_id': 'rpm-1', 'created': '2014-01-01T00:00:00Z',
+             'updated': '2015-01-02T00:00:00Z'},
+            {'unit_id': 'rpm-2', 'created': '2014-01-01T00:00:00Z',
+             'updated': '2015-01-02T00:00:00Z'}]
+        mock_types_db.type_units_collection.return_value.find.return_value = []
+        since = 1420070400  # 2015-01-01T00:00:00Z
+        delta = RepoContentDelta('repo-1')
+
+        changed = delta.changed_units(since, ['rpm'])
+
+        self.assertEqual(changed, {})
+
+    @mock.patch('pulp.server.managers.consumer.applicability.RepoContentUnit.get_collection')
+    def test_removed_units(self, mock_get_collection):
+        mock_get_collection.return_value.find.return_value = [
+            {'unit_id': 'rpm-1', 'created': '2014-01-01T00:00:00Z',
+             'updated': '2014-01-01T00:00:00Z'}]
+        delta = RepoContentDelta('repo-1')
+
+        removed = delta.removed_units({'rpm': ['rpm-1', 'rpm-2']})
+
+        self.assertEqual(removed, {'rpm': set(['rpm-2'])})
+
+
+class TestShardedRegeneration(unittest.TestCase):
+    """
+    Test the regeneration of repository applicability in parallel shards.
+    """
+
+    @mock.patch('pulp.server.db.model.consumer.RepoProfileApplicability.get_collection')
+    def test_get_profile_hash_shards(self, mock_get_collection):
+        cursor = mock_get_collection.return_value.find.return_value
+        cursor.sort.return_value = [{'profile_hash': h} for h in 'abcde']
+
+        shards = ApplicabilityRegenerationManager._get_profile_hash_shards('repo-1', 2)
+
+        # the outer shards are unbounded, the inner ones are split on the first hash of a page
+        self.assertEqual(shards, [(None, 'c'), ('c', 'e'), ('e', None)])
+        mock_get_collection.return_value.find.assert_called_once_with(
+            {'repo_id': 'repo-1'}, fields=['profile_hash'])
+
+    @mock.patch('pulp.server.db.model.consumer.RepoProfileApplicability.get_collection')
+    def test_get_profile_hash_shards_empty(self, mock_get_collection):
+        mock_get_collection.return_value.find.return_value.sort.return_value = []
+
+        shards = ApplicabilityRegenerationManager._get_profile_hash_shards('repo-1', 2)
+
+        self.assertEqual(shards, [])
+
+    @mock.patch('pulp.server.managers.consumer.applicability.dateutils.now_utc_timestamp',
+                return_value=1420070400)
+    @mock.patch('pulp.server.managers.consumer.applicability.RepoContentUnit.get_collection')
+    @mock.patch('pulp.server.managers.consumer.applicability.config')
+    @mock.patch('pulp.server.managers.consumer.applicability.'
+                'regenerate_applicability_for_repo_shard')
+    @mock.patch.object(ApplicabilityRegenerationManager, '_get_profile_hash_shards')
+    @mock.patch('pulp.server.managers.consumer.applicability.model.Repository.objects')
+    def test_queue_regenerate_applicability_for_repos(self, mock_repo_qs, mock_shards,
+                                                      mock_shard_task, mock_config,
+                                                      mock_rcu_collection, mock_now):
+        mock_repo_qs.find_by_criteria.return_value = [mock.Mock(repo_id='repo-1'),
+                                                      mock.Mock(repo_id='repo-2')]
+        mock_shards.side_effect = [[(None, 'c'), ('c', None)], []]
+        mock_config.getint.return_value = 2
+        repo_criteria = Criteria(filters={'id': 'repo-1'}).as_dict()
+
+        result = ApplicabilityRegenerationManager.queue_regenerate_applicability_for_repos(
+            repo_criteria)
+
+        self.assertEqual(result.return_value, {'repo-1': 2, 'repo-2': 0})
+        self.assertEqual(mock_shards.call_args_list, [mock.call('repo-1', 2),
+                                                      mock.call('repo-2', 2)])
+        dispatch = mock_shard_task.apply_async_with_reservation
+        self.assertEqual(len(result.spawned_tasks), 2)
+        self.assertEqual([c[0][1:3] for c in dispatch.call_args_list],
+                         [('repo-1:0', ('repo-1', None, 'c', 1420070400)),
+                          ('repo-1:1', ('repo-1', 'c', None, 1420070400))])
+        # the shards read the associations themselves, so they are not in the task messages
+        self.assertFalse(mock_rcu_collection.called)
+
+    @mock.patch('pulp.server.managers.consumer.applicability.RepoContentDelta')
+    @mock.patch('pulp.server.db.model.consumer.RepoProfileApplicability.get_collection')
+    def test_regenerate_applicability_for_repo_shard(self, mock_get_collection, mock_delta):
+        mock_get_collection.return_value.find.return_value = []
+
+        ApplicabilityRegenerationManager.regenerate_applicability_for_repo_shard(
+            'repo-1', 'c', 'e', 1420070400)
+
+        mock_get_collection.return_value.find.assert_called_once_with(
+            {'repo_id': 'repo-1', 'profile_hash': {'$gte': 'c', '$lt': 'e'}}, fields=['_id'])
+        mock_delta.assert_called_once_with('repo-1', 1420070400)
+
+    @mock.patch('pulp.server.managers.consumer.applicability.RepoContentUnit.get_collection')
+    def test_repo_content_delta_timestamp(self, mock_get_collection):
+        """
+        A RepoContentDelta keeps the timestamp it is given and reads the associations lazily.
+        """
+        delta = RepoContentDelta('repo-1', 1420070400)
+
+        self.assertEqual(delta.timestamp, 1420070400)
+        self.assertFalse(mock_get_collection.called)
+
+
 class TestRepoProfileApplicabilityManager(base.PulpServerTests):
     """
     Test the RepoProfileApplicabilityManager.
@@ -380,6 +643,56 @@ class TestRepoProfileApplicabilityManager(base.PulpServerTests):
         # Our applicability object should now have the correct _id attribute
         self.assertEqual(applicability._id, document['_id'])
 
+    def test_bulk_upsert(self):
+        """
+        Test that bulk_upsert() inserts new documents and replaces the data of existing ones.
+        """
+        RepoProfileApplicability.objects.create('hash-1', 'repo-1', ['old'], {'rpm': ['a']})
+        applicabilities = [
+            RepoProfileApplicability('hash-1', 'repo-1', ['new'], {'rpm': ['b']},
+                                     last_regenerated=1),
+            RepoProfileApplicability('hash-2', 'repo-1', ['other'], {'rpm': ['c']},
+                                     last_regenerated=1)]
+
+        RepoProfileApplicability.objects.bulk_upsert(applicabilities)
+
+        documents = dict((d['profile_hash'], d) for d in self.collection.find())
+        self.assertEqual(len(documents), 2)
+        for applicability in applicabilities:
+            document = documents[applicability.profile_hash]
+            self.assertEqual(document['repo_id'], 'repo-1')
+            self.assertEqual(document['profile'], applicability.profile)
+            self.assertEqual(document['applicability'], applicability.applicability)
+            self.assertEqual(document['last_regenerated'], 1)
+
+    def test_bulk_upsert_newer(self):
+        """
+        Test that bulk_upsert() keeps existing data from a regeneration that started later.
+        """
+        RepoProfileApplicability.objects.create('hash-1', 'repo-1', ['newer'], {'rpm': ['a']},
+                                                last_regenerated=2)
+        applicabilities = [
+            RepoProfileApplicability('hash-1', 'repo-1', ['older'], {'rpm': ['b']},
+                                     last_regenerated=1),
+            RepoProfileApplicability('hash-2', 'repo-1', ['other'], {'rpm': ['c']},
+                                     last_regenerated=1)]
+
+        RepoProfileApplicability.objects.bulk_upsert(applicabilities)
+
+        documents = dict((d['profile_hash'], d) for d in self.collection.find())
+        self.assertEqual(len(documents), 2)
+        self.assertEqual(documents['hash-1']['applicability'], {'rpm': ['a']})
+        self.assertEqual(documents['hash-1']['last_regenerated'], 2)
+        self.assertEqual(documents['hash-2']['applicability'], {'rpm': ['c']})
+
+    def test_bulk_upsert_nothing(self):
+        """
+        Test that bulk_upsert() does nothing when given no objects.
+        """
+        RepoProfileApplicability.objects.bulk_upsert([])
+
+        self.assertEqual(self.collection.find().count(), 0)
+
     def test_filter(self):
         """
         Test the filter() method.
@@ -1084,6 +1397,77 @@ class TestRetrieveConsumerApplicability(base.PulpServerTests,
         self.assert_equal_ignoring_list_order(applicability, expected_applicability)
 
 
+class TestApplicabilityQueryCache(unittest.TestCase):
+    """
+    Test the cache of consumer applicability query results.
+    """
+
+    def setUp(self):
+        self.cache = ApplicabilityQueryCache(max_size=2)
+        self.applicability_map = {
+            ('hash-1', 'repo-1'): {'applicability': {'rpm': ['rpm-1']}, 'consumers': []}}
+
+    @mock.patch('pulp.server.managers.consumer.applicability._get_applicability_map')
+    @mock.patch('pulp.server.managers.consumer.applicability.RepoApplicabilityRevision')
+    def test_repeated_query(self, mock_revision, mock_get_map):
+        mock_revision.get_revisions.return_value = {'repo-1': 1}
+        mock_get_map.return_value = self.applicability_map
+
+        first = self.cache.get_applicability_map(['hash-1'], set(['repo-1']), ['rpm'])
+        first[('hash-1', 'repo-1')]['consumers'].append('consumer-1')
+        second = self.cache.get_applicability_map(['hash-1'], set(['repo-1']), ['rpm'])
+
+        # the applicability data is only read once, and changes to a result do not leak
+        mock_get_map.assert_called_once_with(['hash-1'], frozenset(['rpm']), repo_ids=['repo-1'])
+        self.assertEqual(second, {
+            ('hash-1', 'repo-1'): {'applicability': {'rpm': ['rpm-1']}, 'consumers': []}})
+
+    @mock.patch('pulp.server.managers.consumer.applicability._get_applicability_map')
+    @mock.patch('pulp.server.managers.consumer.applicability.RepoApplicabilityRevision')
+    def test_revision_changed(self, mock_revision, mock_get_map):
+        mock_revision.get_revisions.side_effect = [{}, {'repo-1': 1}, {'repo-1': 1}]
+        mock_get_map.return_value = self.applicability_map
+
+        for i in range(3):
+            self.cache.get_applicability_map(['hash-1'], set(['repo-1']), None)
+
+        self.assertEqual(mock_get_map.call_count, 2)
+
+    @mock.patch('pulp.server.managers.consumer.applicability._get_applicability_map')
+    @mock.patch('pulp.server.managers.consumer.applicability.RepoApplicabilityRevision')
+    def test_different_queries(self, mock_revision, mock_get_map):
+        mock_revision.get_revisions.return_value = {}
+        mock_get_map.return_value = {}
+
+        self.cache.get_applicability_map(['hash-1'], set(['repo-1']), None)
+        self.cache.get_applicability_map(['hash-1'], set(['repo-1']), ['rpm'])
+        self.cache.get_applicability_map(['hash-2'], set(['repo-1']), None)
+        self.cache.get_applicability_map(['hash-1'], set(['repo-1', 'repo-2']), None)
+
+        self.assertEqual(mock_get_map.call_count, 4)
+
+    @mock.patch('pulp.server.managers.consumer.applicability._get_applicability_map')
+    @mock.patch('pulp.server.managers.consumer.applicability.RepoApplicabilityRevision')
+    def test_least_recently_used_evicted(self, mock_revision, mock_get_map):
+        mock_revision.get_revisions.return_value = {}
+        mock_get_map.return_value = {}
+
+        for profile_hash in ['hash-1', 'hash-2', 'hash-1', 'hash-3', 'hash-1', 'hash-2']:
+            self.cache.get_applicability_map([profile_hash], set(['repo-1']), None)
+
+        # hash-2 was evicted by hash-3, hash-1 was kept since it was used more recently
+        self.assertEqual([c[0][0] for c in mock_get_map.call_args_list],
+                         [['hash-1'], ['hash-2'], ['hash-3'], ['hash-2']])
+
+    @mock.patch('pulp.server.managers.consumer.applicability._get_applicability_map')
+    @mock.patch('pulp.server.managers.consumer.applicability.RepoApplicabilityRevision')
+    def test_no_repos(self, mock_revision, mock_get_map):
+        self.assertEqual(self.cache.get_applicability_map(['hash-1'], set(), None), {})
+
+        self.assertFalse(mock_revision.get_revisions.called)
+        self.assertFalse(mock_get_map.called)
+
+
 class TestAddConsumersToApplicabilityMap(base.PulpServerTests,
                                          base.RecursiveUnorderedListComparisonMixin):
     """
@@ -171,6 +171,38 @@ class TestCatalogManager(PulpServerTests):
             self.assertEqual(entry['unit_key'], unit_key)
             self.assertEqual(entry['url'], url)
 
+    def test_find_all(self):
+        units = self.units(0, 10)
+        manager = ContentCatalogManager()
+        for unit_key, url in units:
+            manager.add_entry(SOURCE_ID, EXPIRATION, TYPE_ID, unit_key, url)
+        # a newer entry from the same source replaces the older one
+        newer_url = 'file://redhat.com/newer'
+        manager.add_entry(SOURCE_ID, EXPIRATION, TYPE_ID, units[0][0], newer_url)
+        manager.add_entry('other', EXPIRATION, TYPE_ID, units[1][0], units[1][1])
+        locators = [ContentCatalog.get_locator(TYPE_ID, unit_key) for unit_key, url in units[:5]]
+        missing = ContentCatalog.get_locator(TYPE_ID, {'name': 'missing'})
+
+        found = manager.find_all(locators + [missing])
+
+        self.assertEqual(sorted(found), sorted(locators))
+        self.assertEqual([e['url'] for e in found[locators[0]]], [newer_url])
+        self.assertEqual(sorted(e['source_id'] for e in found[locators[1]]), ['other', SOURCE_ID])
+        for (unit_key, url), locator in zip(units[2:5], locators[2:]):
+            entries = found[locator]
+            self.assertEqual(len(entries), 1)
+            self.assertEqual(entries[0]['unit_key'], unit_key)
+            self.assertEqual(entries[0]['url'], url)
+
+    def test_find_all_expired(self):
+        units = self.units(0, 10)
+        manager = ContentCatalogManager()
+        for unit_key, url in units:
+            manager.add_entry(SOURCE_ID, -1, TYPE_ID, unit_key, url)
+        locators = [ContentCatalog.get_locator(TYPE_ID, unit_key) for unit_key, url in units]
+
+        self.assertEqual(manager.find_all(locators), {})
+
     def test_expired(self):
         units = self.units(0, 10)
         manager = ContentCatalogManager()
@@ -1,5 +1,6 @@
 from .... import base
 from pulp.plugins.types import database, model
+from pulp.server.db.model import unit_key_digest
 from pulp.server.managers.content.cud import ContentManager
 from pulp.server.managers.content.query import ContentQueryManager
 
@@ -52,6 +53,7 @@ class PulpContentCUDTests(PulpContentTests):
         units = self.query_manager.list_content_units(TYPE_1_DEF.id)
         self.assertEqual(len(units), 1)
         self.assertTrue('_last_updated' in units[0])
+        self.assertEqual(units[0]['_unit_key_digest'], unit_key_digest({'key-1': 'A'}))
 
     def test_update_content_unit(self):
         unit_id = self.cud_manager.add_content_unit(TYPE_1_DEF.id, None, TYPE_1_UNITS[0])
@@ -62,6 +64,37 @@ class PulpContentCUDTests(PulpContentTests):
         self.assertTrue(unit['search-1'] == 'two')
         self.assertTrue('_last_updated' in unit)
 
+    def test_add_content_units(self):
+        unit_ids = self.cud_manager.add_content_units(TYPE_1_DEF.id, TYPE_1_UNITS[:2])
+        self.assertEqual(len(unit_ids), 2)
+        self.assertFalse(None in unit_ids)
+        units = self.query_manager.get_multiple_units_by_ids(TYPE_1_DEF.id, unit_ids)
+        self.assertEqual(sorted(u['key-1'] for u in units), ['A', 'B'])
+        self.assertTrue(all('_last_updated' in u for u in units))
+        for unit in units:
+            self.assertEqual(unit['_unit_key_digest'], unit_key_digest({'key-1': unit['key-1']}))
+
+    def test_add_content_units_existing(self):
+        self.cud_manager.add_content_unit(TYPE_1_DEF.id, None, TYPE_1_UNITS[1])
+        unit_ids = self.cud_manager.add_content_units(TYPE_1_DEF.id, TYPE_1_UNITS)
+        self.assertNotEqual(unit_ids[0], None)
+        self.assertEqual(unit_ids[1], None)
+        self.assertNotEqual(unit_ids[2], None)
+        units = self.query_manager.list_content_units(TYPE_1_DEF.id)
+        self.assertEqual(len(units), 3)
+
+    def test_add_content_units_nothing(self):
+        self.assertEqual(self.cud_manager.add_content_units(TYPE_1_DEF.id, []), [])
+
+    def test_update_content_units(self):
+        unit_ids = self.cud_manager.add_content_units(TYPE_1_DEF.id, TYPE_1_UNITS)
+        self.cud_manager.update_content_units(TYPE_1_DEF.id, {unit_ids[0]: {'search-1': 'two'},
+                                                              unit_ids[2]: {'search-1': 'three'}})
+        units = self.query_manager.get_multiple_units_by_ids(TYPE_1_DEF.id, unit_ids)
+        searches = dict((u['_id'], u['search-1']) for u in units)
+        self.assertEqual(searches, {unit_ids[0]: 'two', unit_ids[1]: 'one',
+                                    unit_ids[2]: 'three'})
+
     def test_delete_content_unit(self):
         unit_id = self.cud_manager.add_content_unit(TYPE_1_DEF.id, None, TYPE_1_UNITS[0])
         units = self.query_manager.list_content_units(TYPE_1_DEF.id)
@@ -7,7 +7,7 @@ import string
 import tempfile
 import traceback
 
-from mock import patch
+from mock import Mock, patch
 
 from .... import base
 from pulp.plugins.types import database as content_type_db
@@ -16,7 +16,8 @@ from pulp.server import exceptions as pulp_exceptions
 from pulp.server.db import model
 from pulp.server.db.model.repository import RepoContentUnit
 from pulp.server.managers import factory as manager_factory
-from pulp.server.managers.content.orphan import OrphanManager
+from pulp.server.managers.content.orphan import (DeleteOrphansStep, OrphanManager,
+                                                 ORPHAN_PAGE_SIZE)
 
 
 PHONY_TYPE_1 = TypeDefinition('phony_type_1', 'Phony Type 1', None, 'name', [], [])
@@ -246,6 +247,46 @@ class OrphanManagerGeneratorTests(OrphanManagerTests):
         self.orphan_manager.delete_all_orphans()
         self.assertEqual(self.number_of_files_in_content_root(), 0)
 
+    def test_orphans_count_by_type_query_count(self):
+        """
+        Assert that counting orphans makes one association query per page of units, not one
+        per unit.
+        """
+        distinct_calls = []
+        real_objects = model.RepositoryContentUnit.objects
+
+        def counting_objects(*args, **kwargs):
+            distinct_calls.append(kwargs)
+            return real_objects(*args, **kwargs)
+
+        num_units = 2 * ORPHAN_PAGE_SIZE + 1
+        gen_buttload_of_content_units(PHONY_TYPE_1.id, self.content_root, num_units)
+
+        with patch.object(model.RepositoryContentUnit, 'objects', counting_objects):
+            count = self.orphan_manager.orphans_count_by_type(PHONY_TYPE_1.id)
+
+        self.assertEqual(count, num_units)
+        self.assertEqual(len(distinct_calls), 3)
+
+    def test_orphans_count_by_type(self):
+        unit = gen_content_unit(PHONY_TYPE_1.id, self.content_root)
+        gen_content_unit(PHONY_TYPE_1.id, self.content_root)
+        gen_content_unit(PHONY_TYPE_2.id, self.content_root)
+        associate_content_unit_with_repo(unit)
+
+        self.assertEqual(self.orphan_manager.orphans_count_by_type(PHONY_TYPE_1.id), 1)
+        self.assertEqual(self.orphan_manager.orphans_count_by_type(PHONY_TYPE_2.id), 1)
+
+    def test_orphans_summary(self):
+        unit = gen_content_unit(PHONY_TYPE_1.id, self.content_root)
+        gen_content_unit(PHONY_TYPE_2.id, self.content_root)
+        associate_content_unit_with_repo(unit)
+
+        summary = self.orphan_manager.orphans_summary()
+
+        self.assertEqual(summary[PHONY_TYPE_1.id], 0)
+        self.assertEqual(summary[PHONY_TYPE_2.id], 1)
+
     def test_delete_by_type_using_generators(self):
         unit_1 = gen_content_unit(PHONY_TYPE_1.id, self.content_root)
         unit_2 = gen_content_unit(PHONY_TYPE_2.id, self.content_root)
@@ -269,25 +310,150 @@ class OrphanManagerGeneratorTests(OrphanManagerTests):
         self.assertEqual(len(orphans), 0)
         self.assertEqual(self.number_of_files_in_content_root(), 0)
 
+    def test_delete_by_id_ignores_other_units(self):
+        unit_1 = gen_content_unit(PHONY_TYPE_1.id, self.content_root)
+        unit_2 = gen_content_unit(PHONY_TYPE_1.id, self.content_root)
+
+        json_obj = {'content_type_id': unit_1['_content_type_id'],
+                    'unit_id': unit_1['_id']}
+        self.orphan_manager.delete_orphans_by_id([json_obj])
+
+        orphans = list(self.orphan_manager.generate_all_orphans())
+        self.assertEqual(len(orphans), 1)
+        self.assertEqual(orphans[0]['_id'], unit_2['_id'])
+        self.assertFalse(os.path.exists(unit_1['_storage_path']))
+        self.assertTrue(os.path.exists(unit_2['_storage_path']))
+
     @patch('pulp.server.managers.content.orphan.OrphanManager.delete_orphaned_file')
     @patch('pulp.server.managers.content.orphan.model.RepositoryContentUnit.objects')
     @patch('pulp.server.managers.content.orphan.plugin_api.get_unit_model_by_id')
     def test_delete_content_unit_by_type(
             self, m_get_model, m_rcu_objects, m_del_orphan):
 
-        class TestUnit(model.FileContentUnit):
-            pass
-        orphan = TestUnit(storage_path='test_foo_path', id='orphan')
-        non_orphan = TestUnit(storage_path='test_foo_path', id='non_orphan')
-
-        m_get_model.return_value.objects.return_value.only.return_value = [orphan, non_orphan]
+        collection = m_get_model.return_value._get_collection.return_value
+        orphan = {'_id': 'orphan', '_storage_path': 'test_foo_path'}
+        non_orphan = {'_id': 'non_orphan', '_storage_path': 'test_foo_path'}
+        collection.find.return_value = [orphan, non_orphan]
         m_rcu_objects.return_value.distinct.return_value = ['non_orphan']
 
         self.orphan_manager.delete_orphan_content_units_by_type('foo_type')
 
+        collection.remove.assert_called_once_with({'_id': {'$in': ['orphan']}})
         m_del_orphan.assert_called_once_with('test_foo_path')
 
 
+class TestGenerateOrphanPages(TestCase):
+
+    @patch('pulp.server.managers.content.orphan.model.RepositoryContentUnit.objects')
+    def test_filters_associated_units(self, m_rcu_objects):
+        units = [{'_id': 'a'}, {'_id': 'b'}, {'_id': 'c'}]
+        m_rcu_objects.return_value.distinct.return_value = ['b']
+
+        pages = list(OrphanManager.generate_orphan_pages(units, lambda unit: unit['_id']))
+
+        self.assertEqual(pages, [[{'_id': 'a'}, {'_id': 'c'}]])
+        m_rcu_objects.assert_called_once_with(unit_id__in=['a', 'b', 'c'])
+        m_rcu_objects.return_value.distinct.assert_called_once_with('unit_id')
+
+    @patch('pulp.server.managers.content.orphan.model.RepositoryContentUnit.objects')
+    def test_one_query_per_page(self, m_rcu_objects):
+        units = [{'_id': str(i)} for i in range(25)]
+        m_rcu_objects.return_value.distinct.return_value = []
+
+        pages = list(OrphanManager.generate_orphan_pages(units, lambda unit: unit['_id'],
+                                                         page_size=10))
+
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(m_rcu_objects.call_count, 3)
+
+    @patch('pulp.server.managers.content.orphan.model.RepositoryContentUnit.objects')
+    def test_skips_pages_without_orphans(self, m_rcu_objects):
+        units = [{'_id': 'a'}, {'_id': 'b'}]
+        m_rcu_objects.return_value.distinct.side_effect = [['a'], []]
+
+        pages = list(OrphanManager.generate_orphan_pages(units, lambda unit: unit['_id'],
+                                                         page_size=1))
+
+        self.assertEqual(pages, [[{'_id': 'b'}]])
+
+
+class TestDeleteOrphansStep(TestCase):
+
+    def setUp(self):
+        self.collection = Mock()
+        self.collection.find.return_value = [
+            {'_id': 'a', '_storage_path': '/storage/a'},
+            {'_id': 'b', '_storage_path': '/storage/b'},
+            {'_id': 'c'},
+        ]
+        self.collection.count.return_value = 3
+
+    @patch('pulp.server.managers.content.orphan.model.RepositoryContentUnit.objects')
+    def test_get_total(self, m_rcu_objects):
+        step = DeleteOrphansStep('phony', self.collection)
+
+        self.assertEqual(step.get_total(), 3)
+        # the associations are only resolved on the deletion pass
+        self.assertFalse(self.collection.find.called)
+        self.assertFalse(m_rcu_objects.called)
+
+    def test_get_total_unit_ids(self):
+        step = DeleteOrphansStep('phony', self.collection, content_unit_ids=['a', 'a', 'b'])
+
+        self.assertEqual(step.get_total(), 2)
+        self.assertFalse(self.collection.count.called)
+
+    @patch('pulp.server.managers.content.orphan.OrphanManager.delete_orphaned_file')
+    @patch('pulp.server.managers.content.orphan.model.RepositoryContentUnit.objects')
+    def test_process_total(self, m_rcu_objects, m_del_orphan):
+        m_rcu_objects.return_value.distinct.return_value = ['b']
+        step = DeleteOrphansStep('phony', self.collection, status_conduit=Mock())
+
+        step.process_lifecycle()
+
+        self.collection.remove.assert_called_once_with({'_id': {'$in': ['a', 'c']}})
+        self.assertEqual(self.collection.find.call_count, 1)
+        self.assertEqual(step.progress_successes, 2)
+        self.assertEqual(step.total_units, 2)
+
+    @patch('pulp.server.managers.content.orphan.model.RepositoryContentUnit.objects')
+    def test_unit_ids_filter(self, m_rcu_objects):
+        m_rcu_objects.return_value.distinct.return_value = []
+        step = DeleteOrphansStep('phony', self.collection, content_unit_ids=['a', 'a'])
+
+        list(step.get_iterator())
+
+        self.collection.find.assert_called_once_with({'_id': {'$in': ['a']}},
+                                                     fields=['_id', '_storage_path'])
+
+    @patch('pulp.server.managers.content.orphan.OrphanManager.delete_orphaned_file')
+    @patch('pulp.server.managers.content.orphan.model.RepositoryContentUnit.objects')
+    def test_process(self, m_rcu_objects, m_del_orphan):
+        m_rcu_objects.return_value.distinct.return_value = []
+        conduit = Mock()
+        step = DeleteOrphansStep('phony', self.collection, status_conduit=conduit)
+
+        step.process_lifecycle()
+
+        self.collection.remove.assert_called_once_with({'_id': {'$in': ['a', 'b', 'c']}})
+        self.assertEqual(sorted(c[0][0] for c in m_del_orphan.call_args_list),
+                         ['/storage/a', '/storage/b'])
+        self.assertEqual(step.progress_successes, 3)
+        self.assertEqual(step.total_units, 3)
+        self.assertTrue(conduit.set_progress.called)
+        self.assertTrue(step.pool is None)
+
+    @patch('pulp.server.managers.content.orphan.OrphanManager.delete_orphaned_file')
+    @patch('pulp.server.managers.content.orphan.model.RepositoryContentUnit.objects')
+    def test_process_file_error(self, m_rcu_objects, m_del_orphan):
+        m_rcu_objects.return_value.distinct.return_value = []
+        m_del_orphan.side_effect = ValueError
+        step = DeleteOrphansStep('phony', self.collection, status_conduit=Mock())
+
+        self.assertRaises(ValueError, step.process_lifecycle)
+        self.assertTrue(step.pool is None)
+
+
 class TestDelete(TestCase):
 
     @patch('shutil.rmtree')
@@ -6,6 +6,7 @@ import unittest
 import mock
 
 from pulp.server.db.connection import PulpCollection
+from pulp.server.db.model import unit_key_digest
 from pulp.server.db.model.criteria import Criteria
 from pulp.server.managers.content.query import ContentQueryManager
 from test_cud import PulpContentTests, TYPE_1_DEF, TYPE_1_UNITS, TYPE_2_DEF, TYPE_2_UNITS
@@ -80,6 +81,25 @@ class PulpContentQueryTests(PulpContentTests):
         units = list(self.query_manager.get_multiple_units_by_keys_dicts(TYPE_2_DEF.id, key_dicts))
         self.assertEqual(len(units), len(self.type_2_ids))
 
+    def test_multi_key_dicts_pages(self):
+        ids, key_dicts = self.query_manager.get_content_unit_keys(TYPE_2_DEF.id, self.type_2_ids)
+        units = list(self.query_manager.get_multiple_units_by_keys_dicts(TYPE_2_DEF.id, key_dicts,
+                                                                         page_size=1))
+        self.assertEqual(sorted(u['_id'] for u in units), sorted(self.type_2_ids))
+
+    def test_multi_key_dicts_missing(self):
+        key_dicts = [{'key-2a': 'missing', 'key-2b': 'missing'}]
+        units = list(self.query_manager.get_multiple_units_by_keys_dicts(TYPE_2_DEF.id, key_dicts))
+        self.assertEqual(units, [])
+
+    def test_multi_key_dicts_undigested(self):
+        # a unit stored without going through the content manager has no digest
+        collection = self.query_manager.get_content_unit_collection(TYPE_2_DEF.id)
+        collection.insert({'_id': 'undigested', 'key-2a': 'Z', 'key-2b': 'Z'})
+        key_dicts = [{'key-2a': 'Z', 'key-2b': 'Z'}]
+        units = list(self.query_manager.get_multiple_units_by_keys_dicts(TYPE_2_DEF.id, key_dicts))
+        self.assertEqual([u['_id'] for u in units], ['undigested'])
+
     def __test_keys_dicts_query(self):
         # XXX this test proves my multi-dict query wrong, need to fix it
         new_unit = {'key-2a': 'B', 'key-2b': 'B'}
@@ -131,6 +151,7 @@ class TestGetContentUnitIDs(unittest.TestCase):
 
     def test_returns_ids(self, mock_type_collection, mock_type_unit_key):
         mock_type_unit_key.return_value = ('a',)
+        mock_type_collection.return_value.find_one.return_value = None
         mock_type_collection.return_value.find.return_value = [{'_id': 'abc'}, {'_id': 'def'}]
 
         ret = self.manager.get_content_unit_ids('fake_type', [{'a': 'foo'}, {'a': 'bar'}])
@@ -139,6 +160,7 @@ class TestGetContentUnitIDs(unittest.TestCase):
 
     def test_calls_find(self, mock_type_collection, mock_type_unit_key):
         mock_type_unit_key.return_value = ('a',)
+        mock_type_collection.return_value.find_one.return_value = None
         mock_find = mock_type_collection.return_value.find
         mock_find.return_value = [{'_id': 'abc'}, {'_id': 'def'}]
 
@@ -146,5 +168,21 @@ class TestGetContentUnitIDs(unittest.TestCase):
 
         # evaluate the generator so the code actually runs
         list(ret)
-        expected_spec = {'$or': ({'a': 'foo'}, {'a': 'bar'})}
+        expected_spec = {'_unit_key_digest': {'$in': [unit_key_digest({'a': 'foo'}),
+                                                      unit_key_digest({'a': 'bar'})]}}
         mock_find.assert_called_once_with(expected_spec, fields=['_id'])
+
+    def test_calls_find_undigested_units(self, mock_type_collection, mock_type_unit_key):
+        mock_type_unit_key.return_value = ('a',)
+        mock_type_collection.return_value.find_one.return_value = {'_id': 'def'}
+        mock_find = mock_type_collection.return_value.find
+        mock_find.side_effect = [[{'_id': 'abc'}], [{'_id': 'def'}]]
+
+        ret = self.manager.get_content_unit_ids('fake_type', [{'a': 'foo'}, {'a': 'bar'}])
+
+        self.assertEqual(list(ret), ['abc', 'def'])
+        mock_type_collection.return_value.find_one.assert_called_once_with(
+            {'_unit_key_digest': None}, fields=['_id'])
+        # units stored without a digest are found by their unit key
+        self.assertEqual(mock_find.call_args_list[1], mock.call(
+            {'_unit_key_digest': None, '$or': ({'a': 'foo'}, {'a': 'bar'})}, fields=['_id']))
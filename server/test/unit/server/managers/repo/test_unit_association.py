@@ -107,9 +107,9 @@ class RepoUnitAssociationManagerTests(base.PulpServerTests):
         self.assertEqual(1, len(repo_units))
         self.assertEqual('unit-1', repo_units[0]['unit_id'])
 
-    @mock.patch('pulp.server.managers.repo.unit_association.model.Repository.objects')
-    @mock.patch('pulp.server.managers.repo.unit_association.repo_controller')
-    def test_associate_all(self, mock_ctrl, mock_repo_qs):
+    @mock.patch('pulp.server.controllers.repository.update_last_unit_added')
+    @mock.patch('pulp.server.controllers.repository.update_unit_count')
+    def test_associate_all(self, mock_update_count, mock_update_last_added):
         """
         Tests making multiple associations in a single call.
         """
@@ -304,12 +304,32 @@ class RepoUnitAssociationManagerTests(base.PulpServerTests):
         self.manager.associate_unit_by_id(self.repo_id, 'type-1', 'unit-1')
         self.assertEqual(mock_ctrl.update_unit_count.call_count, 1)  # only from first associate
 
-    @mock.patch('pulp.server.managers.repo.unit_association.model.Repository.objects')
-    @mock.patch('pulp.server.managers.repo.unit_association.repo_controller')
-    def test_associate_all_by_ids_calls_update_unit_count(self, mock_ctrl, mock_repo_qs):
+    @mock.patch('pulp.server.controllers.repository.update_last_unit_added')
+    @mock.patch('pulp.server.controllers.repository.update_unit_count')
+    def test_associate_all_by_ids_calls_update_unit_count(self, mock_update_count,
+                                                          mock_update_last_added):
         IDS = ('foo', 'bar', 'baz')
         self.manager.associate_all_by_ids(self.repo_id, 'type-1', IDS)
-        mock_ctrl.update_unit_count.assert_called_once_with(self.repo_id, 'type-1', len(IDS))
+        mock_update_count.assert_called_once_with(self.repo_id, 'type-1', len(IDS))
+        mock_update_last_added.assert_called_once_with(self.repo_id)
+
+    @mock.patch('pulp.server.controllers.repository.update_last_unit_added')
+    @mock.patch('pulp.server.controllers.repository.update_unit_count')
+    def test_associate_all_existing(self, mock_update_count, mock_update_last_added):
+        """
+        Makes sure associations that already exist are not counted again.
+        """
+        self.manager.associate_all_by_ids(self.repo_id, 'type-1', ('foo', 'bar'))
+        mock_update_count.reset_mock()
+        mock_update_last_added.reset_mock()
+
+        ret = self.manager.associate_all_by_ids(self.repo_id, 'type-1', ('foo', 'bar', 'baz'))
+
+        self.assertEqual(ret, 1)
+        mock_update_count.assert_called_once_with(self.repo_id, 'type-1', 1)
+        mock_update_last_added.assert_called_once_with(self.repo_id)
+        repo_units = list(RepoContentUnit.get_collection().find({'repo_id': self.repo_id}))
+        self.assertEqual(3, len(repo_units))
 
     @mock.patch('pulp.server.managers.repo.unit_association.model.Repository.objects')
     @mock.patch('pulp.server.managers.repo.unit_association.repo_controller')
@@ -317,9 +337,9 @@ class RepoUnitAssociationManagerTests(base.PulpServerTests):
         self.manager.associate_unit_by_id(self.repo_id, 'type-1', 'unit-1')
         mock_ctrl.update_last_unit_added.assert_called_once_with(self.repo_id)
 
-    @mock.patch('pulp.server.managers.repo.unit_association.model.Repository.objects')
-    @mock.patch('pulp.server.managers.repo.unit_association.repo_controller')
-    def test_associate_all_non_unique(self, mock_ctrl, mock_repo_qs):
+    @mock.patch('pulp.server.controllers.repository.update_last_unit_added')
+    @mock.patch('pulp.server.controllers.repository.update_unit_count')
+    def test_associate_all_non_unique(self, mock_update_count, mock_update_last_added):
         """
         Makes sure when two identical associations are requested, they only
         get counted once.
@@ -327,7 +347,7 @@ class RepoUnitAssociationManagerTests(base.PulpServerTests):
         IDS = ('foo', 'bar', 'foo')
 
         self.manager.associate_all_by_ids(self.repo_id, 'type-1', IDS)
-        mock_ctrl.update_unit_count.assert_called_once_with(self.repo_id, 'type-1', 2)
+        mock_update_count.assert_called_once_with(self.repo_id, 'type-1', 2)
 
     @mock.patch('pulp.server.managers.repo.unit_association.model.Repository.objects')
     @mock.patch('pulp.server.managers.repo.unit_association.repo_controller')
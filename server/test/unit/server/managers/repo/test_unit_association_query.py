@@ -566,6 +566,70 @@ class UnitAssociationQueryTests(base.PulpServerTests):
         for u in units:
             self.assertTrue(u['metadata']['key_1'] != 'aardvark')
 
+    def _unit_ids(self, units):
+        return [(u['unit_type_id'], u['unit_id']) for u in units]
+
+    def test_get_units_as_generator(self):
+        units = self.manager.get_units('repo-1', as_generator=True)
+
+        # streamed units are ordered by type and id
+        expected = sorted(self._unit_ids(self.manager.get_units('repo-1')))
+        self.assertEqual(self._unit_ids(units), expected)
+
+    @mock.patch('pulp.server.managers.repo.unit_association_query.ASSOCIATION_PAGE_SIZE', 2)
+    def test_get_units_as_generator_pages(self):
+        units = list(self.manager.get_units('repo-1', as_generator=True))
+
+        expected = sorted(self._unit_ids(self.manager.get_units('repo-1')))
+        self.assertEqual(self._unit_ids(units), expected)
+        for unit in units:
+            self.assertEqual(unit['unit_id'], unit['metadata']['_id'])
+            self.assertEqual(unit['unit_type_id'], unit['metadata']['_content_type_id'])
+            self.assertEqual(unit['repo_id'], 'repo-1')
+
+    @mock.patch('pulp.server.managers.repo.unit_association_query.ASSOCIATION_PAGE_SIZE', 2)
+    def test_get_units_as_generator_skip_and_limit(self):
+        criteria = UnitAssociationCriteria(skip=2, limit=4)
+        units = list(self.manager.get_units('repo-1', criteria, as_generator=True))
+
+        all_units = list(self.manager.get_units('repo-1', as_generator=True))
+        self.assertEqual(self._unit_ids(units), self._unit_ids(all_units[2:6]))
+
+    @mock.patch('pulp.server.managers.repo.unit_association_query.ASSOCIATION_PAGE_SIZE', 2)
+    def test_get_units_as_generator_unit_filters(self):
+        criteria = UnitAssociationCriteria(unit_filters={'md_2': 0})
+        units = list(self.manager.get_units('repo-1', criteria, as_generator=True))
+
+        expected = sorted(self._unit_ids(self.manager.get_units('repo-1', criteria)))
+        self.assertEqual(self._unit_ids(units), expected)
+        self.assertTrue(all(u['metadata']['md_2'] == 0 for u in units))
+
+    def test_get_units_as_generator_index_order(self):
+        criteria = UnitAssociationCriteria()
+        cursor = self.manager._unit_associations_cursor('repo-1', criteria)
+        cursor.sort(association_manager._PAGED_UNITS_SORT)
+
+        explain = cursor.explain()
+
+        # the associations are read in index order instead of being sorted in memory
+        self.assertFalse(explain.get('scanAndOrder', False))
+        self.assertFalse("'SORT'" in str(explain.get('queryPlanner', {})))
+
+    def test_get_units_as_generator_remove_duplicates(self):
+        criteria = UnitAssociationCriteria(remove_duplicates=True)
+        units = list(self.manager.get_units('repo-1', criteria, as_generator=True))
+
+        self.assertEqual(self.repo_1_count, len(units))
+
+    @mock.patch('pulp.server.managers.repo.unit_association_query.'
+                'RepoUnitAssociationQueryManager._paged_units')
+    def test_get_units_as_generator_sorted(self, mock_paged_units):
+        criteria = UnitAssociationCriteria(
+            unit_sort=[('md_1', association_manager.SORT_DESCENDING)])
+        self.manager.get_units('repo-1', criteria, as_generator=True)
+
+        self.assertFalse(mock_paged_units.called)
+
     def test_criteria_str(self):
         # Setup
         c1 = UnitAssociationCriteria()
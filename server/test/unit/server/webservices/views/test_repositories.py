@@ -1643,7 +1643,8 @@ class TestContentApplicabilityRegenerationView(unittest.TestCase):
 
     @mock.patch('pulp.server.webservices.views.decorators._verify_auth',
                 new=assert_auth_CREATE())
-    @mock.patch('pulp.server.webservices.views.repositories.regenerate_applicability_for_repos')
+    @mock.patch('pulp.server.webservices.views.repositories.'
+                'queue_regenerate_applicability_for_repos')
     @mock.patch('pulp.server.webservices.views.repositories.tags')
     @mock.patch('pulp.server.webservices.views.repositories.Criteria.from_client_input')
     def test_post_with_expected_content(self, mock_crit, mock_tags, mock_regen):
@@ -1691,7 +1692,8 @@ class TestContentApplicabilityRegenerationView(unittest.TestCase):
 
     @mock.patch('pulp.server.webservices.views.decorators._verify_auth',
                 new=assert_auth_CREATE())
-    @mock.patch('pulp.server.webservices.views.repositories.regenerate_applicability_for_repos')
+    @mock.patch('pulp.server.webservices.views.repositories.'
+                'queue_regenerate_applicability_for_repos')
     def test_post_without_repo_criteria(self, mock_crit):
         """
         Test regenerate content applicability with missing repo_criteria.